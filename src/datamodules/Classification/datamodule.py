@@ -1,7 +1,8 @@
+from functools import partial
 from pathlib import Path
 from typing import Union, List, Optional, Dict, Callable
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torchvision import transforms
 from torchvision.datasets import ImageFolder
 
@@ -9,6 +10,7 @@ from src.datamodules.Classification.utils.image_analytics import get_analytics_d
 from src.datamodules.Classification.utils.misc import validate_path_for_classification
 from src.datamodules.base_datamodule import AbstractDatamodule
 from src.datamodules.utils.misc import get_image_dims
+from src.datamodules.utils.shards import classification_sample
 from src.utils import utils
 
 log = utils.get_logger(__name__)
@@ -68,16 +70,29 @@ class ClassificationDatamodule(AbstractDatamodule):
     :type shuffle: bool
     :param drop_last: Whether to drop the last batch if it is smaller than the batch size.
     :type drop_last: bool
+    :param train_shards: Path to the index of the shards of the train split written with ``tools/pack_shards.py``.
+        The train samples are then streamed from the shards (see :class:`src.datamodules.utils.shards.ShardDataset`).
+    :type train_shards: Optional[str]
+    :param shuffle_buffer_size: Number of samples in the shuffle buffer of every worker when streaming the shards.
+    :type shuffle_buffer_size: int
+    :param scratch_dir: Local folder to stage the dataset in (see :meth:`AbstractDatamodule.stage`). None to read
+        it from ``data_dir``.
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: Maximal size of all the datasets in the scratch folder in GB. None for no limit.
+    :type scratch_budget_gb: Optional[float]
     """
     def __init__(self, data_dir: str,
                  selection_train: Optional[Union[int, List[str]]] = None,
                  selection_val: Optional[Union[int, List[str]]] = None,
                  num_workers: int = 4, batch_size: int = 8,
-                 shuffle: bool = True, drop_last: bool = True):
+                 shuffle: bool = True, drop_last: bool = True,
+                 train_shards: Optional[str] = None, shuffle_buffer_size: int = 1000,
+                 scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         """
         Constructor method for the ClassificationDatamodule class.
         """
-        super().__init__()
+        super().__init__(scratch_dir=scratch_dir, scratch_budget_gb=scratch_budget_gb)
+        data_dir = self.stage(data_dir)
 
         analytics_data = get_analytics_data_image_folder(input_path=Path(data_dir))
 
@@ -95,12 +110,17 @@ class ClassificationDatamodule(AbstractDatamodule):
         self.shuffle = shuffle
         self.drop_last = drop_last
 
+        self.train_shards = train_shards
+        self.shuffle_buffer_size = shuffle_buffer_size
+
         self.data_dir = validate_path_for_classification(data_dir=data_dir)
 
         self.selection_train = selection_train
         self.selection_val = selection_val
 
+        # the train set is reused in setup, so the folder is scanned just once
         train_set = ImageFolder(**self._create_dataset_parameters('train'))
+        self._train_set = train_set
         self.classes = train_set.classes
         self.num_classes = len(self.classes)
 
@@ -118,7 +138,16 @@ class ClassificationDatamodule(AbstractDatamodule):
     def setup(self, stage: Optional[str] = None):
         super().setup()
         if stage == 'fit' or stage is None:
-            self.train = ImageFolder(**self._create_dataset_parameters('train'))
+            if self.train_shards is not None:
+                self.train = self._get_shard_dataset(process=partial(classification_sample,
+                                                                     transform=self.image_transform),
+                                                     layouts=('classification',))
+                if self.train.classes != self.classes:
+                    msg = f'The classes of the shards {self.train.classes} do not match the classes {self.classes}'
+                    log.error(msg)
+                    raise ValueError(msg)
+            else:
+                self.train = self._train_set
             log.info(f'Initialized train dataset with {len(self.train)} samples.')
             self.check_min_num_samples(self.trainer.num_devices, self.batch_size, num_samples=len(self.train),
                                        data_split='train',
@@ -137,7 +166,8 @@ class ClassificationDatamodule(AbstractDatamodule):
         return DataLoader(self.train,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          shuffle=self.shuffle,
+                          # the streaming dataset shuffles the shards itself
+                          shuffle=self.shuffle and not isinstance(self.train, IterableDataset),
                           drop_last=self.drop_last,
                           pin_memory=True)
 
@@ -1,16 +1,18 @@
 from pathlib import Path
 from typing import Any, Dict
 
-from src.datamodules.utils.misc import check_missing_analytics, save_json
-from src.datamodules.utils.image_analytics import compute_mean_std
+from src.datamodules.utils.misc import check_missing_analytics, save_json, dataset_lock
+from src.datamodules.utils.image_analytics import compute_statistics
 
 
-def get_analytics_data_image_folder(input_path: Path) -> Dict[str, Any]:
+def get_analytics_data_image_folder(input_path: Path, workers: int = 8) -> Dict[str, Any]:
     """
     Computes mean and std of the images in the input_path folder.
 
     :param input_path: Path to the root of the dataset
     :type input_path: Path
+    :param workers: Number of workers to analyse the images
+    :type workers: int
     :return: Dictionary with mean and std
     :rtype: Dict[str, Any]
     """
@@ -18,18 +20,20 @@ def get_analytics_data_image_folder(input_path: Path) -> Dict[str, Any]:
 
     analytics_path_data = input_path / 'analytics.data.train.json'
 
-    analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
+    # one process computes the analytics, the others (e.g. DDP ranks) wait and load the saved files
+    with dataset_lock(input_path):
+        analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
 
-    if not missing_analytics_data:
-        return analytics_data
+        if not missing_analytics_data:
+            return analytics_data
 
-    train_path = input_path / 'train'
-    gt_data_path_list = list(train_path.glob('**/*.png'))
+        train_path = input_path / 'train'
+        gt_data_path_list = list(train_path.glob('**/*.png'))
 
-    mean, std = compute_mean_std(file_names=gt_data_path_list)
-    analytics_data = {'mean': mean.tolist(),
-                      'std': std.tolist()}
-    # save json
-    save_json(analytics_data, analytics_path_data)
+        statistics = compute_statistics(data_paths=gt_data_path_list, workers=workers)
+        analytics_data = {'mean': statistics.mean.tolist(),
+                          'std': statistics.std.tolist()}
+        # save json
+        save_json(analytics_data, analytics_path_data)
 
-    return analytics_data
+        return analytics_data
@@ -11,6 +11,7 @@ from torch import is_tensor
 from torchvision.transforms import ToTensor
 
 from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.utils.label_cache import decode_labels, decode_boundary_mask
 from src.utils import utils
 
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm')
@@ -59,6 +60,11 @@ class CroppedHisDBDataset(CroppedDatasetRGB):
     :type target_transform: callable
     :param twin_transform: transformation that is applied to both image and target
     :type twin_transform: callable
+    :param label_cache: if given, the labels and the boundary mask are read from this cache (in the 'hisdb' format)
+        instead of decoding the gt images and the target transformation is not used
+    :type label_cache: Optional[LabelCache]
+    :param crop_container: if given, the crops are read from this container of the split instead of the crop files
+    :type crop_container: Optional[CropContainer]
     """
 
     def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
@@ -102,6 +108,10 @@ class CroppedHisDBDataset(CroppedDatasetRGB):
 
         if not is_tensor(img):
             img = ToTensor()(img)
+
+        if self.label_cache is not None:
+            return img, decode_labels(gt), decode_boundary_mask(gt)
+
         if not is_tensor(gt):
             gt = ToTensor()(gt)
 
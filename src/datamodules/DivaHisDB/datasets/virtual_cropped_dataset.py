@@ -0,0 +1,75 @@
+"""
+Load a dataset of historic documents by specifying the folder where its located.
+The crops are not read from disk but computed on the fly from the full pages.
+"""
+
+# Utils
+from pathlib import Path
+from typing import List, Union, Optional
+
+from src.datamodules.DivaHisDB.datasets.cropped_dataset import CroppedHisDBDataset
+from src.datamodules.RGB.datasets.virtual_cropped_dataset import VirtualCroppedDatasetRGB
+from src.datamodules.utils.label_cache import LabelCache
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+class VirtualCroppedHisDBDataset(CroppedHisDBDataset, VirtualCroppedDatasetRGB):
+    """Dataset used for the `DivaHisDB dataset<https://ieeexplore.ieee.org/abstract/document/7814109>`_ in a cropped
+    setup, where the crops are taken on the fly from the full pages (see :class:`VirtualCroppedDatasetRGB`).
+    This class represents one split of the whole dataset.
+
+    The structure of the folder should be as follows::
+
+        path
+        ├── data_folder_name
+        │   ├── original_image_name_1.jpg
+        │   ├── ...
+        │   └── original_image_name_N.jpg
+        └── gt_folder_name
+            ├── original_image_name_1.png
+            ├── ...
+            └── original_image_name_N.png
+
+    :param path: Path to the dataset
+    :type path: Path
+    :param data_folder_name: name of the folder that contains the original images
+    :type data_folder_name: str
+    :param gt_folder_name: name of the folder that contains the ground truth images
+    :type gt_folder_name: str
+    :param selection: filtering of the pages, can be an integer or a list of strings
+    :type selection: Union[int, List[str], None]
+    :param is_test: if True, :meth:`__getitem__` will return the index of the image
+    :type is_test: bool
+    :param image_transform: transformation that is applied to the image
+    :type image_transform: callable
+    :param target_transform: transformation that is applied to the target
+    :type target_transform: callable
+    :param twin_transform: transformation that is applied to both image and target
+    :type twin_transform: callable
+    :param crop_size: size of the (square) crops
+    :type crop_size: int
+    :param overlap: overlap of the crops (between 0-1)
+    :type overlap: float
+    :param leading_zeros_length: amount of leading zeros to encode the coordinates in the crop name
+    :type leading_zeros_length: int
+    :param max_cached_pages: maximal number of decoded pages kept in memory (per worker), None for all pages
+    :type max_cached_pages: Optional[int]
+    :param label_cache: if given, the labels and the boundary mask are read from this cache (in the 'hisdb' format)
+        instead of cropping the decoded gt pages
+    :type label_cache: Optional[LabelCache]
+    """
+
+    def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
+                 selection: Optional[Union[int, List[str]]] = None,
+                 is_test=False, image_transform=None, target_transform=None, twin_transform=None,
+                 crop_size: int = 256, overlap: float = 0.5, leading_zeros_length: int = 4,
+                 max_cached_pages: Optional[int] = None, label_cache: Optional[LabelCache] = None):
+        """
+        Constructor method for the VirtualCroppedHisDBDataset class.
+        """
+        super().__init__(path, data_folder_name, gt_folder_name, selection, is_test, image_transform, target_transform,
+                         twin_transform, crop_size=crop_size, overlap=overlap,
+                         leading_zeros_length=leading_zeros_length, max_cached_pages=max_cached_pages,
+                         label_cache=label_cache)
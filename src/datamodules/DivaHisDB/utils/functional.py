@@ -2,8 +2,7 @@ from typing import List
 
 import numpy as np
 import torch
-
-from sklearn.preprocessing import OneHotEncoder
+from torch.nn.functional import one_hot
 
 
 def gt_to_int_encoding(matrix: torch.Tensor, class_encodings: List[int]) -> torch.Tensor:
@@ -36,7 +35,8 @@ def gt_to_int_encoding(matrix: torch.Tensor, class_encodings: List[int]) -> torc
 
 def gt_to_one_hot(matrix: torch.Tensor, class_encodings: List[int]):
     """
-    Convert ground truth tensor or numpy matrix to one-hot encoded matrix
+    Convert ground truth tensor or numpy matrix to one-hot encoded matrix.
+    The blue channel values are mapped to the class indices with a lookup table, so there is no per-pixel Python code.
 
     :param matrix: float tensor from to_tensor() or numpy array
         shape (C x H x W) in the range [0.0, 1.0] or shape (H x W x C) BGR
@@ -55,20 +55,19 @@ def gt_to_one_hot(matrix: torch.Tensor, class_encodings: List[int]):
     border_mask = np_array[0, :, :].astype(np.uint8) != 0
     im_np[border_mask] = 1
 
-    integer_encoded = np.array([i for i in range(num_classes)])
-    onehot_encoder = OneHotEncoder(sparse=False, categories='auto')
-    integer_encoded = integer_encoded.reshape(len(integer_encoded), 1)
-    onehot_encoded = onehot_encoder.fit_transform(integer_encoded).astype(np.int8)
-
     np.place(im_np, im_np == 0,
              1)  # needed to deal with 0 fillers at the borders during testing (replace with background)
-    replace_dict = {k: v for k, v in zip(class_encodings, onehot_encoded)}
 
-    # create the one hot matrix
-    one_hot_matrix = np.asanyarray(
-        [[replace_dict[im_np[i, j]] for j in range(im_np.shape[1])] for i in range(im_np.shape[0])]).astype(
-        np.uint8)
+    # lookup table from the blue channel value to the class index (-1 for unknown values)
+    class_lut = np.full(shape=256, fill_value=-1, dtype=np.int64)
+    for index, encoding in enumerate(class_encodings):
+        class_lut[encoding] = index
 
-    return torch.LongTensor(one_hot_matrix.transpose((2, 0, 1)))
+    integer_encoded = class_lut[im_np]
+    if (integer_encoded < 0).any():
+        unknown_values = np.unique(im_np[integer_encoded < 0]).tolist()
+        raise KeyError(f'Blue channel values {unknown_values} are not in the class encodings {class_encodings}')
 
+    one_hot_matrix = one_hot(torch.from_numpy(integer_encoded), num_classes=num_classes)
 
+    return one_hot_matrix.permute(2, 0, 1).contiguous()
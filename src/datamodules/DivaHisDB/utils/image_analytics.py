@@ -2,24 +2,25 @@
 import logging
 import os
 from pathlib import Path
-from typing import Tuple, Any, Dict, List, Union
+from typing import Tuple, Any, Dict, List, Optional
 
 import numpy as np
 # Torch related stuff
 import torch
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
-from PIL import Image
-from numpy import ndarray, dtype
 
-from src.datamodules.utils.misc import save_json, check_missing_analytics
-from src.datamodules.utils.image_analytics import compute_mean_std
+from src.datamodules.utils.misc import save_json, check_missing_analytics, dataset_lock
+from src.datamodules.utils.image_analytics import compute_statistics, get_statistics, ImageStatistics
 
 
-def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str, get_gt_data_paths_func) \
+def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str, get_gt_data_paths_func,
+                  workers: int = 8, estimation: Optional[Dict[str, Any]] = None) \
         -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
     Get the analytics for the dataset. If the analytics file is not present, it will be computed and saved.
+    With ``estimation`` the analytics are estimated on a sample of the training images and the error bounds are
+    saved under the key 'estimate'. Estimated analytics are computed again if no estimation is requested.
 
     :param input_path: Path to the root of the dataset
     :type input_path: Path
@@ -29,6 +30,11 @@ def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str,
     :type gt_folder_name: str
     :param get_gt_data_paths_func: Function to get the paths to the data and ground truth
     :type get_gt_data_paths_func: Callable
+    :param workers: Number of workers to analyse the images
+    :type workers: int
+    :param estimation: keyword arguments of :func:`src.datamodules.utils.image_analytics.estimate_statistics` or
+        None to compute the analytics exactly
+    :type estimation: Optional[Dict[str, Any]]
     :return: Tuple of analytics for the data and ground truth
     :rtype: Tuple[Dict[str, Any], Dict[str, Any]]
     """
@@ -38,38 +44,49 @@ def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str,
     analytics_path_data = input_path / f'analytics.data.{data_folder_name}.json'
     analytics_path_gt = input_path / f'analytics.gt.hisDB.{gt_folder_name}.json'
 
-    analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
-
-    analytics_gt, missing_analytics_gt = check_missing_analytics(analytics_path_gt, expected_keys_gt)
+    # one process computes the analytics, the others (e.g. DDP ranks) wait and load the saved files
+    with dataset_lock(input_path):
+        analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data,
+                                                                         allow_estimate=estimation is not None)
+
+        analytics_gt, missing_analytics_gt = check_missing_analytics(analytics_path_gt, expected_keys_gt,
+                                                                     allow_estimate=estimation is not None)
+
+        if not (missing_analytics_data or missing_analytics_gt):
+            return analytics_data, analytics_gt
+
+        train_path = input_path / 'train'
+        gt_data_path_list = get_gt_data_paths_func(train_path, data_folder_name=data_folder_name,
+                                                   gt_folder_name=gt_folder_name)
+        file_names_data = [str(item[0]) for item in gt_data_path_list]
+        file_names_gt = [str(item[1]) for item in gt_data_path_list]
+
+        # data and gt are analysed in the same pass
+        statistics, estimate = get_statistics(data_paths=file_names_data if missing_analytics_data else None,
+                                              gt_paths=file_names_gt if missing_analytics_gt else None,
+                                              gt_format='hisdb', workers=workers, estimation=estimation)
+
+        if missing_analytics_data:
+            analytics_data = {'mean': statistics.mean.tolist(),
+                              'std': statistics.std.tolist()}
+            if estimate is not None:
+                analytics_data['estimate'] = estimate.data_analytics()
+            # save json
+            save_json(analytics_data, analytics_path_data)
+
+        if missing_analytics_gt:
+            # Measure weights for class balancing
+            logging.info('Measuring class weights')
+            class_weights, class_encodings = _get_class_weights_encodings_hisdb(statistics=statistics)
+            analytics_gt = {'class_weights': class_weights.tolist(),
+                            'class_encodings': class_encodings.tolist()}
+            if estimate is not None:
+                analytics_gt['estimate'] = estimate.gt_analytics(statistics.classes)
+            # save json
+            save_json(analytics_gt, analytics_path_gt)
 
-    if not (missing_analytics_data or missing_analytics_gt):
         return analytics_data, analytics_gt
 
-    train_path = input_path / 'train'
-    gt_data_path_list = get_gt_data_paths_func(train_path, data_folder_name=data_folder_name,
-                                               gt_folder_name=gt_folder_name)
-    file_names_data = np.asarray([str(item[0]) for item in gt_data_path_list])
-    file_names_gt = np.asarray([str(item[1]) for item in gt_data_path_list])
-
-    if missing_analytics_data:
-        mean, std = compute_mean_std(file_names=file_names_data,inmem=True)
-        analytics_data = {'mean': mean.tolist(),
-                          'std': std.tolist()}
-        # save json
-        save_json(analytics_data, analytics_path_data)
-
-    if missing_analytics_gt:
-        # Measure weights for class balancing
-        logging.info('Measuring class weights')
-        # create a list with all gt file paths
-        class_weights, class_encodings = _get_class_frequencies_weights_segmentation_hisdb(gt_images=file_names_gt)
-        analytics_gt = {'class_weights': class_weights.tolist(),
-                        'class_encodings': class_encodings.tolist()}
-        # save json
-        save_json(analytics_gt, analytics_path_gt)
-
-    return analytics_data, analytics_gt
-
 
 def get_class_weights(input_folder, workers=4) -> List[float]:
     """
@@ -119,31 +136,36 @@ def get_class_weights(input_folder, workers=4) -> List[float]:
     return class_weights
 
 
-def _get_class_frequencies_weights_segmentation_hisdb(gt_images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+def _get_class_frequencies_weights_segmentation_hisdb(gt_images: np.ndarray, workers: int = 8) \
+        -> Tuple[np.ndarray, np.ndarray]:
     """
     Get the weights proportional to the inverse of their class frequencies.
     The vector sums up to 1
 
     :param gt_images: Path to all ground truth images, which contain the pixel-wise label
     :type gt_images: np.ndarray
-    :return: The weights vector as a 1D array normalized (sum up to 1)
-    :rtype: Tuple[Union[Union[ndarray[Any, dtype[floating[Any]]], ndarray[Any, dtype[complexfloating[Any, Any]]]], Any], ndarray]
+    :param workers: Number of workers to read the gt images
+    :type workers: int
+    :return: The class weights and the class encodings
+    :rtype: Tuple[np.ndarray, np.ndarray]
     """
-    logging.info('Begin computing class frequencies weights')
+    statistics = compute_statistics(gt_paths=list(gt_images), gt_format='hisdb', workers=workers)
+    return _get_class_weights_encodings_hisdb(statistics=statistics)
 
-    total_num_pixels = 0
-    label_counter = {}
 
-    for path in gt_images:
-        img = np.array(Image.open(path))[:, :, 2].flatten()
-        total_num_pixels += len(img)
-        for i, j in zip(*np.unique(img, return_counts=True)):
-            label_counter[i] = label_counter.get(i, 0) + j
+def _get_class_weights_encodings_hisdb(statistics: ImageStatistics) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the weights proportional to the inverse of their class frequencies out of the statistics of the gt images.
+    The vector sums up to 1
 
-    classes = np.array(sorted(label_counter.keys()))
-    num_samples_per_class = np.array([label_counter[k] for k in classes])
-    class_frequencies = (num_samples_per_class / total_num_pixels)
-    logging.info('Finished computing class frequencies weights')
+    :param statistics: statistics of the gt images in the 'hisdb' format
+    :type statistics: ImageStatistics
+    :return: The class weights and the class encodings (values of the blue channel)
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    classes = np.array(statistics.classes)
+    num_samples_per_class = statistics.num_samples_per_class
+    class_frequencies = (num_samples_per_class / num_samples_per_class.sum())
     logging.info(f'Class frequencies (rounded): {np.around(class_frequencies * 100, decimals=2)}')
     # Normalize vector to sum up to 1.0 (in case the Loss function does not do it)
     return (1 / num_samples_per_class) / ((1 / num_samples_per_class).sum()), classes
@@ -10,12 +10,14 @@ import numpy as np
 import torch
 import torch.utils.data as data
 from PIL import Image
-from omegaconf import ListConfig
 from torch import is_tensor
-from torchvision.datasets.folder import pil_loader, has_file_allowed_extension
+from torchvision.datasets.folder import pil_loader
 from torchvision.transforms import ToTensor
 
-from src.datamodules.utils.misc import ImageDimensions, selection_validation, pil_loader_gif, get_output_file_list
+from src.datamodules.utils.label_cache import LabelCache, decode_labels
+from src.datamodules.utils.manifest import get_manifest
+from src.datamodules.utils.misc import ImageDimensions, pil_loader_gif, get_output_file_list
+from src.datamodules.utils.page_store import PageStore
 from src.utils import utils
 
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
@@ -51,12 +53,18 @@ class DatasetIndexed(data.Dataset):
         :type selection: Optional[Union[int, List[str]]]
         :param image_transform: Transformations that are applied to the image
         :type image_transform: Optional[Callable]
+        :param label_cache: if given, the labels are read from this cache (in the 'index' format) instead of decoding
+            the gt images
+        :type label_cache: Optional[LabelCache]
+        :param page_store: if given, the pages are read from this store instead of decoding the data images
+        :type page_store: Optional[PageStore]
     """
 
     def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
                  image_dims: ImageDimensions, is_test=False,
                  selection: Optional[Union[int, List[str]]] = None,
-                 image_transform=None) -> None:
+                 image_transform=None, label_cache: Optional[LabelCache] = None,
+                 page_store: Optional[PageStore] = None) -> None:
         """
          Constructor method for the DatasetIndexed class.
         """
@@ -70,6 +78,8 @@ class DatasetIndexed(data.Dataset):
 
         # transformations
         self.image_transform = image_transform
+        self.label_cache = label_cache
+        self.page_store = page_store
 
         self.is_test = is_test
 
@@ -86,6 +96,11 @@ class DatasetIndexed(data.Dataset):
                                f"Supported image extensions are: {' '.join(IMG_EXTENSIONS)}\n"
                                f"Supported ground truth extensions are: {' '.join(GT_EXTENSION)}")
 
+        if self.page_store is not None:
+            self.page_store.compile([paths[0] for paths in self.img_gt_path_list])
+        if self.label_cache is not None:
+            self.label_cache.compile([paths[1] for paths in self.img_gt_path_list])
+
     def __len__(self):
         """
         This function returns the length of an epoch so the data loader knows when to stop.
@@ -104,24 +119,35 @@ class DatasetIndexed(data.Dataset):
         else:
             return img, gt
 
-    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Image.Image]:
+    def _load_data_and_gt(self, index: int) \
+            -> Tuple[Union[Image.Image, np.ndarray], Union[Image.Image, torch.Tensor]]:
         """
-        Load the data and the ground truth.
+        Load the data and the ground truth. With a page store the data is the uint8 array of the store and with a
+        label cache the ground truth are the encoded labels of the cache.
 
         :param index: Index of the image
         :type index: int
         :return: Data and ground truth as PIL Image
-        :rtype: Tuple[Image.Image, Image.Image]
+        :rtype: Tuple[Union[Image.Image, np.ndarray], Union[Image.Image, torch.Tensor]]
         """
-        data_img = pil_loader(str(self.img_gt_path_list[index][0]))
-        gt_img = pil_loader_gif(self.img_gt_path_list[index][1])
+        if self.page_store is not None:
+            data_img = self.page_store.load(self.img_gt_path_list[index][0])
+        else:
+            data_img = pil_loader(str(self.img_gt_path_list[index][0]))
+            assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+
+        if self.label_cache is not None:
+            gt_img = self.label_cache.load(self.img_gt_path_list[index][1])
+            assert gt_img.shape == (self.image_dims.height, self.image_dims.width)
+            return data_img, gt_img
 
-        assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+        gt_img = pil_loader_gif(self.img_gt_path_list[index][1])
         assert gt_img.height == self.image_dims.height and gt_img.width == self.image_dims.width
 
         return data_img, gt_img
 
-    def _apply_transformation(self, img: Image, gt: Image) -> Tuple[torch.Tensor, torch.Tensor]:
+    def _apply_transformation(self, img: Image, gt: Union[Image.Image, torch.Tensor]) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Apply transformations to the image and the ground truth.
 
@@ -139,6 +165,9 @@ class DatasetIndexed(data.Dataset):
         if not is_tensor(img):
             img = ToTensor()(img)
 
+        if self.label_cache is not None:
+            return img, decode_labels(gt)
+
         # remove first dim s.t. gt is just w x h
         gt_np = np.asarray(gt)
         if len(gt_np.shape) == 3:
@@ -170,39 +199,11 @@ class DatasetIndexed(data.Dataset):
 
         :raises ValueError: If the folder data or gt is not found in the directory
         """
-        paths = []
         directory = directory.expanduser()
-
-        path_data_root = directory / data_folder_name
-        path_gt_root = directory / gt_folder_name
-
-        if not (path_data_root.is_dir() or path_gt_root.is_dir()):
+        if not ((directory / data_folder_name).is_dir() or (directory / gt_folder_name).is_dir()):
             raise ValueError("folder data or gt not found in " + str(directory))
 
-        # get all files sorted
-        files_in_data_root = sorted(path_data_root.iterdir())
-
-        # check the selection parameter
-        if selection:
-            selection = selection_validation(files_in_data_root, selection, full_page=True)
-
-        counter = 0  # Counter for subdirectories, needed for selection parameter
-
-        for path_data_file, path_gt_file in zip(sorted(files_in_data_root), sorted(path_gt_root.iterdir())):
-            counter += 1
-
-            if selection:
-                if isinstance(selection, int) and counter > selection:
-                    break
-
-                elif isinstance(selection, ListConfig) or isinstance(selection, list):
-                    if path_data_file.stem not in selection:
-                        continue
-
-            assert has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) == \
-                   has_file_allowed_extension(path_gt_file.name, GT_EXTENSION), \
-                'get_img_gt_path_list(): image file aligned with non-image file'
-
-            paths.append((path_data_file, path_gt_file))
-
-        return paths
+        manifest = get_manifest(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name,
+                                cropped=False, gt_extensions=GT_EXTENSION)
+        return [(directory / manifest.data_paths[i], directory / manifest.gt_paths[i])
+                for i in manifest.select(selection)]
@@ -1,8 +1,9 @@
+from functools import partial
 from pathlib import Path
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Dict, Any
 
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torchvision import transforms
 
 from src.datamodules.RGB.datasets.full_page_dataset import DatasetRGB
@@ -10,7 +11,10 @@ from src.datamodules.RGB.utils.image_analytics import get_analytics
 from src.datamodules.RGB.utils.single_transform import IntegerEncoding
 from src.datamodules.base_datamodule import AbstractDatamodule
 from src.datamodules.utils.dataset_predict import DatasetPredict
+from src.datamodules.utils.label_cache import LabelCache
 from src.datamodules.utils.misc import validate_path_for_segmentation, ImageDimensions
+from src.datamodules.utils.page_store import PageStore
+from src.datamodules.utils.shards import segmentation_sample, FULL_PAGE_LAYOUTS
 from src.datamodules.utils.wrapper_transforms import OnlyImage, OnlyTarget
 from src.utils import utils
 
@@ -82,6 +86,34 @@ class DataModuleRGB(AbstractDatamodule):
     :type shuffle: bool
     :param drop_last: drop the last batch if it is smaller than the batch size
     :type drop_last: bool
+    :param analytics_estimation: if given, the analytics are estimated on a random sample of the training images
+        with these keyword arguments of :func:`src.datamodules.utils.image_analytics.estimate_statistics`
+        (e.g. ``{'tolerance': 0.005}``), otherwise they are computed exactly
+    :type analytics_estimation: Optional[Dict[str, Any]]
+    :param cache_labels: compile the gt once into a memory mapped label cache in the data folder (see
+        :class:`src.datamodules.utils.label_cache.LabelCache`) instead of decoding and encoding it for every sample
+    :type cache_labels: bool
+    :param store_pages: decode the pages once into a memory mapped page store in the data folder (see
+        :class:`src.datamodules.utils.page_store.PageStore`) that the dataloader workers share, the labels are cached
+        as with ``cache_labels``
+    :type store_pages: bool
+    :param train_shards: path to the index of the shards of the training split written with
+        ``tools/pack_shards.py``, the training samples are then streamed from the shards (see
+        :class:`src.datamodules.utils.shards.ShardDataset`)
+    :type train_shards: Optional[str]
+    :param shuffle_buffer_size: number of samples in the shuffle buffer of every worker when streaming the shards
+    :type shuffle_buffer_size: int
+    :param predict_any_size: the images to predict can have any size, they are batched as lists with
+        :func:`src.datamodules.utils.dataset_predict.collate_pages` (e.g. for the sliding window inference of the task)
+    :type predict_any_size: bool
+    :param predict_bucket_stride: batch the images to predict by size and pad them to a multiple of this stride
+        (the downsampling factor of the model), the task crops the prediction back to the original size
+    :type predict_bucket_stride: Optional[int]
+    :param scratch_dir: local folder to stage the dataset in (see :meth:`AbstractDatamodule.stage`), None to read
+        it from ``data_dir``
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: maximal size of all the datasets in the scratch folder in GB, None for no limit
+    :type scratch_budget_gb: Optional[float]
     """
 
     def __init__(self, data_dir: str, data_folder_name: str, gt_folder_name: str,
@@ -91,11 +123,16 @@ class DataModuleRGB(AbstractDatamodule):
                  selection_val: Optional[Union[int, List[str]]] = None,
                  selection_test: Optional[Union[int, List[str]]] = None,
                  num_workers: int = 4, batch_size: int = 8,
-                 shuffle: bool = True, drop_last: bool = True):
+                 shuffle: bool = True, drop_last: bool = True,
+                 analytics_estimation: Optional[Dict[str, Any]] = None, cache_labels: bool = False,
+                 store_pages: bool = False, train_shards: Optional[str] = None, shuffle_buffer_size: int = 1000,
+                 predict_any_size: bool = False, predict_bucket_stride: Optional[int] = None,
+                 scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         """
         Constructor of the class: `DataModuleRGB`.
         """
-        super().__init__()
+        super().__init__(scratch_dir=scratch_dir, scratch_budget_gb=scratch_budget_gb)
+        data_dir = self.stage(data_dir)
 
         self.train_folder_name = train_folder_name
         self.val_folder_name = val_folder_name
@@ -110,7 +147,8 @@ class DataModuleRGB(AbstractDatamodule):
                                                      data_folder_name=self.data_folder_name,
                                                      gt_folder_name=self.gt_folder_name,
                                                      train_folder_name=self.train_folder_name,
-                                                     get_img_gt_path_list_func=DatasetRGB.get_img_gt_path_list)
+                                                     get_img_gt_path_list_func=DatasetRGB.get_img_gt_path_list,
+                                                     estimation=analytics_estimation)
 
         self.image_dims = ImageDimensions(width=analytics_data['width'], height=analytics_data['height'])
         self.dims = (3, self.image_dims.height, self.image_dims.width)
@@ -139,6 +177,13 @@ class DataModuleRGB(AbstractDatamodule):
         self.selection_val = selection_val
         self.selection_test = selection_test
 
+        self.cache_labels = cache_labels
+        self.store_pages = store_pages
+        self.predict_any_size = predict_any_size
+        self.predict_bucket_stride = predict_bucket_stride
+        self.train_shards = train_shards
+        self.shuffle_buffer_size = shuffle_buffer_size
+
         # Check default attributes using base_datamodule function
         self._check_attributes()
 
@@ -158,11 +203,20 @@ class DataModuleRGB(AbstractDatamodule):
                                                            data_folder_name=self.data_folder_name,
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.train_folder_name)
-            self.train = DatasetRGB(path=self.data_dir / self.train_folder_name,
-                                    selection=self.selection_train,
-                                    is_test=False,
-                                    **dataset_kwargs,
-                                    **common_kwargs)
+            if self.train_shards is not None:
+                self.train = self._get_shard_dataset(process=partial(segmentation_sample,
+                                                                     twin_transform=self.twin_transform,
+                                                                     image_transform=self.image_transform,
+                                                                     target_transform=self.target_transform),
+                                                     layouts=FULL_PAGE_LAYOUTS)
+            else:
+                self.train = DatasetRGB(path=self.data_dir / self.train_folder_name,
+                                        label_cache=self._get_label_cache(self.train_folder_name),
+                                        page_store=self._get_page_store(self.train_folder_name),
+                                        selection=self.selection_train,
+                                        is_test=False,
+                                        **dataset_kwargs,
+                                        **common_kwargs)
             log.info(f'Initialized train dataset with {len(self.train)} samples.')
             self.check_min_num_samples(self.trainer.num_devices, self.batch_size, num_samples=len(self.train),
                                        data_split=self.train_folder_name,
@@ -173,6 +227,8 @@ class DataModuleRGB(AbstractDatamodule):
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.val_folder_name)
             self.val = DatasetRGB(path=self.data_dir / self.val_folder_name,
+                                  label_cache=self._get_label_cache(self.val_folder_name),
+                                  page_store=self._get_page_store(self.val_folder_name),
                                   selection=self.selection_val,
                                   is_test=False,
                                   **dataset_kwargs,
@@ -188,6 +244,8 @@ class DataModuleRGB(AbstractDatamodule):
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.test_folder_name)
             self.test = DatasetRGB(path=self.data_dir / self.test_folder_name,
+                                   label_cache=self._get_label_cache(self.test_folder_name),
+                                   page_store=self._get_page_store(self.test_folder_name),
                                    selection=self.selection_test,
                                    is_test=True,
                                    **dataset_kwargs,
@@ -195,15 +253,46 @@ class DataModuleRGB(AbstractDatamodule):
             log.info(f'Initialized test dataset with {len(self.test)} samples.')
 
         if stage == 'predict':
+            if self.predict_any_size or self.predict_bucket_stride is not None:
+                common_kwargs['image_dims'] = None
             self.predict = DatasetPredict(image_path_list=self.pred_file_path_list,
                                           **common_kwargs)
             log.info(f'Initialized predict dataset with {len(self.predict)} samples.')
 
+    def _get_label_cache(self, split_name: str) -> Optional[LabelCache]:
+        """
+        Returns the label cache of the split if the labels are cached.
+
+        :param split_name: name of the split folder
+        :type split_name: str
+        :return: the label cache or None
+        :rtype: Optional[LabelCache]
+        """
+        if not self.cache_labels and not self.store_pages:
+            return None
+        return LabelCache(directory=Path(self.data_dir), name=f'{self.gt_folder_name}.{split_name}',
+                          gt_format='rgb', class_encodings=self.class_encodings)
+
+    def _get_page_store(self, split_name: str) -> Optional[PageStore]:
+        """
+        Returns the page store of the split if the pages are stored.
+
+        :param split_name: name of the split folder
+        :type split_name: str
+        :return: the page store or None
+        :rtype: Optional[PageStore]
+        """
+        if not self.store_pages:
+            return None
+        return PageStore(directory=Path(self.data_dir), name=f'{self.data_folder_name}.{split_name}',
+                         image_dims=self.image_dims)
+
     def train_dataloader(self, *args, **kwargs) -> DataLoader:
         return DataLoader(self.train,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          shuffle=self.shuffle,
+                          # the streaming dataset shuffles the shards itself
+                          shuffle=self.shuffle and not isinstance(self.train, IterableDataset),
                           drop_last=self.drop_last,
                           pin_memory=True)
 
@@ -225,11 +314,11 @@ class DataModuleRGB(AbstractDatamodule):
 
     def predict_dataloader(self) -> Union[DataLoader, List[DataLoader]]:
         return DataLoader(self.predict,
-                          batch_size=self.batch_size,
                           num_workers=self.num_workers,
                           shuffle=False,
                           drop_last=False,
-                          pin_memory=True)
+                          pin_memory=True,
+                          **self._get_predict_batching())
 
     def get_output_filename_test(self, index: int) -> str:
         """
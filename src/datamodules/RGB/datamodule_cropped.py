@@ -1,15 +1,20 @@
+from functools import partial
 from pathlib import Path
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Dict, Any
 
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torchvision import transforms
 
 from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.RGB.datasets.virtual_cropped_dataset import VirtualCroppedDatasetRGB
 from src.datamodules.RGB.utils.image_analytics import get_analytics
 from src.datamodules.RGB.utils.single_transform import IntegerEncoding
 from src.datamodules.base_datamodule import AbstractDatamodule
+from src.datamodules.utils.crop_container import CropContainer, get_container_path
+from src.datamodules.utils.label_cache import LabelCache
 from src.datamodules.utils.misc import validate_path_for_segmentation
+from src.datamodules.utils.shards import segmentation_sample, SEGMENTATION_LAYOUTS
 from src.datamodules.utils.twin_transforms import TwinRandomCrop
 from src.datamodules.utils.wrapper_transforms import OnlyImage, OnlyTarget
 from src.utils import utils
@@ -24,6 +29,8 @@ class DataModuleCroppedRGB(AbstractDatamodule):
     class: `tools/generate_cropped_dataset.py`. If you do not use the script, make sure that the images are cropped
     and named in the same way as the script does.
     If you want to work with un-cropped images use class: `DataModuleRGB`.
+    With `virtual_crops` the crops are not read from disk but computed on the fly from the full pages
+    (see class: `VirtualCroppedDatasetRGB`). In this case `data_dir` has the structure of class: `DataModuleRGB`.
 
     The structure of the folder should be as follows::
 
@@ -93,6 +100,37 @@ class DataModuleCroppedRGB(AbstractDatamodule):
     :type shuffle: bool
     :param drop_last: drop the last batch if it is smaller than the batch size
     :type drop_last: bool
+    :param virtual_crops: compute the crops on the fly from the full pages instead of reading crop files
+    :type virtual_crops: bool
+    :param virtual_crop_size: size of the virtual crops for train and val (defaults to crop_size),
+        the virtual test crops have the size crop_size
+    :type virtual_crop_size: Optional[int]
+    :param virtual_crop_overlap: overlap of the virtual crops (between 0-1)
+    :type virtual_crop_overlap: float
+    :param virtual_max_cached_pages: maximal number of decoded pages per dataset and worker, None for all pages
+    :type virtual_max_cached_pages: Optional[int]
+    :param analytics_estimation: if given, the analytics are estimated on a random sample of the training images
+        with these keyword arguments of :func:`src.datamodules.utils.image_analytics.estimate_statistics`
+        (e.g. ``{'tolerance': 0.005}``), otherwise they are computed exactly
+    :type analytics_estimation: Optional[Dict[str, Any]]
+    :param cache_labels: compile the gt once into a memory mapped label cache in the data folder (see
+        :class:`src.datamodules.utils.label_cache.LabelCache`) instead of decoding and encoding it for every sample
+    :type cache_labels: bool
+    :param crop_container: read the crops of every split from its crop container (written with
+        ``tools/convert_crops_to_container.py``, see :class:`src.datamodules.utils.crop_container.CropContainer`)
+        instead of opening one file per crop
+    :type crop_container: bool
+    :param train_shards: path to the index of the shards of the training split written with
+        ``tools/pack_shards.py``, the training samples are then streamed from the shards (see
+        :class:`src.datamodules.utils.shards.ShardDataset`)
+    :type train_shards: Optional[str]
+    :param shuffle_buffer_size: number of samples in the shuffle buffer of every worker when streaming the shards
+    :type shuffle_buffer_size: int
+    :param scratch_dir: local folder to stage the dataset in (see :meth:`AbstractDatamodule.stage`), None to read
+        it from ``data_dir``
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: maximal size of all the datasets in the scratch folder in GB, None for no limit
+    :type scratch_budget_gb: Optional[float]
     """
     def __init__(self, data_dir: str, data_folder_name: str, gt_folder_name: str,
                  train_folder_name: str = 'train', val_folder_name: str = 'val', test_folder_name: str = 'test',
@@ -100,11 +138,18 @@ class DataModuleCroppedRGB(AbstractDatamodule):
                  selection_val: Optional[Union[int, List[str]]] = None,
                  selection_test: Optional[Union[int, List[str]]] = None,
                  crop_size: int = 256, num_workers: int = 4, batch_size: int = 8,
-                 shuffle: bool = True, drop_last: bool = True):
+                 shuffle: bool = True, drop_last: bool = True,
+                 virtual_crops: bool = False, virtual_crop_size: Optional[int] = None,
+                 virtual_crop_overlap: float = 0.5, virtual_max_cached_pages: Optional[int] = None,
+                 analytics_estimation: Optional[Dict[str, Any]] = None, cache_labels: bool = False,
+                 train_shards: Optional[str] = None, shuffle_buffer_size: int = 1000,
+                 crop_container: bool = False,
+                 scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         """
         Constructor method for the class: `DataModuleCroppedRGB`.
         """
-        super().__init__()
+        super().__init__(scratch_dir=scratch_dir, scratch_budget_gb=scratch_budget_gb)
+        data_dir = self.stage(data_dir)
 
         self.train_folder_name = train_folder_name
         self.val_folder_name = val_folder_name
@@ -112,11 +157,31 @@ class DataModuleCroppedRGB(AbstractDatamodule):
         self.data_folder_name = data_folder_name
         self.gt_folder_name = gt_folder_name
 
+        self.virtual_crops = virtual_crops
+        self.virtual_crop_size = virtual_crop_size if virtual_crop_size is not None else crop_size
+        self.virtual_crop_overlap = virtual_crop_overlap
+        self.virtual_max_cached_pages = virtual_max_cached_pages
+        self.cache_labels = cache_labels
+        if crop_container and (virtual_crops or cache_labels):
+            msg = 'crop_container can not be combined with virtual_crops or cache_labels'
+            log.error(msg)
+            raise ValueError(msg)
+        self.crop_container = crop_container
+        self.train_shards = train_shards
+        self.shuffle_buffer_size = shuffle_buffer_size
+        if self.virtual_crops:
+            self.dataset_class = VirtualCroppedDatasetRGB
+            get_img_gt_path_list_func = VirtualCroppedDatasetRGB.get_page_paths
+        else:
+            self.dataset_class = CroppedDatasetRGB
+            get_img_gt_path_list_func = CroppedDatasetRGB.get_gt_data_paths
+
         analytics_data, analytics_gt = get_analytics(input_path=Path(data_dir),
                                                      data_folder_name=self.data_folder_name,
                                                      gt_folder_name=self.gt_folder_name,
                                                      train_folder_name=self.train_folder_name,
-                                                     get_img_gt_path_list_func=CroppedDatasetRGB.get_gt_data_paths)
+                                                     get_img_gt_path_list_func=get_img_gt_path_list_func,
+                                                     estimation=analytics_estimation)
 
         self.mean = analytics_data['mean']
         self.std = analytics_data['std']
@@ -142,6 +207,7 @@ class DataModuleCroppedRGB(AbstractDatamodule):
         self.selection_val = selection_val
         self.selection_test = selection_test
 
+        self.crop_size = crop_size
         self.dims = (3, crop_size, crop_size)
 
         # Check default attributes using base_datamodule function
@@ -154,8 +220,15 @@ class DataModuleCroppedRGB(AbstractDatamodule):
                                                            data_folder_name=self.data_folder_name,
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.train_folder_name)
-            self.train = CroppedDatasetRGB(**self._create_dataset_parameters(self.train_folder_name),
-                                           selection=self.selection_train)
+            if self.train_shards is not None:
+                self.train = self._get_shard_dataset(process=partial(segmentation_sample,
+                                                                     twin_transform=self.twin_transform,
+                                                                     image_transform=self.image_transform,
+                                                                     target_transform=self.target_transform),
+                                                     layouts=SEGMENTATION_LAYOUTS)
+            else:
+                self.train = self.dataset_class(**self._create_dataset_parameters(self.train_folder_name),
+                                                selection=self.selection_train)
             log.info(f'Initialized train dataset with {len(self.train)} samples.')
             self.check_min_num_samples(self.trainer.num_devices, self.batch_size, num_samples=len(self.train),
                                        data_split=self.train_folder_name,
@@ -165,8 +238,8 @@ class DataModuleCroppedRGB(AbstractDatamodule):
                                                            data_folder_name=self.data_folder_name,
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.val_folder_name)
-            self.val = CroppedDatasetRGB(**self._create_dataset_parameters(self.val_folder_name),
-                                         selection=self.selection_val)
+            self.val = self.dataset_class(**self._create_dataset_parameters(self.val_folder_name),
+                                          selection=self.selection_val)
             log.info(f'Initialized val dataset with {len(self.val)} samples.')
             self.check_min_num_samples(self.trainer.num_devices, self.batch_size, num_samples=len(self.val),
                                        data_split=self.val_folder_name,
@@ -177,8 +250,8 @@ class DataModuleCroppedRGB(AbstractDatamodule):
                                                            data_folder_name=self.data_folder_name,
                                                            gt_folder_name=self.gt_folder_name,
                                                            split_name=self.test_folder_name)
-            self.test = CroppedDatasetRGB(**self._create_dataset_parameters(self.test_folder_name),
-                                          selection=self.selection_test)
+            self.test = self.dataset_class(**self._create_dataset_parameters(self.test_folder_name),
+                                           selection=self.selection_test)
             log.info(f'Initialized test dataset with {len(self.test)} samples.')
             # self._check_min_num_samples(num_samples=len(self.test), data_split='test',
             #                             drop_last=False)
@@ -187,7 +260,8 @@ class DataModuleCroppedRGB(AbstractDatamodule):
         return DataLoader(self.train,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          shuffle=self.shuffle,
+                          # the streaming dataset shuffles the shards itself
+                          shuffle=self.shuffle and not isinstance(self.train, IterableDataset),
                           drop_last=self.drop_last,
                           pin_memory=True)
 
@@ -209,13 +283,26 @@ class DataModuleCroppedRGB(AbstractDatamodule):
 
     def _create_dataset_parameters(self, dataset_type: str = 'train'):
         is_test = dataset_type == 'test'
-        return {'path': self.data_dir / dataset_type,
-                'data_folder_name': self.data_folder_name,
-                'gt_folder_name': self.gt_folder_name,
-                'image_transform': self.image_transform,
-                'target_transform': self.target_transform,
-                'twin_transform': self.twin_transform,
-                'is_test': is_test}
+        parameters = {'path': self.data_dir / dataset_type,
+                      'data_folder_name': self.data_folder_name,
+                      'gt_folder_name': self.gt_folder_name,
+                      'image_transform': self.image_transform,
+                      'target_transform': self.target_transform,
+                      'twin_transform': self.twin_transform,
+                      'is_test': is_test}
+        if self.virtual_crops:
+            parameters['crop_size'] = self.crop_size if is_test else self.virtual_crop_size
+            parameters['overlap'] = self.virtual_crop_overlap
+            parameters['max_cached_pages'] = self.virtual_max_cached_pages
+        if self.cache_labels:
+            parameters['label_cache'] = LabelCache(directory=Path(self.data_dir),
+                                                   name=f'{self.gt_folder_name}.{dataset_type}',
+                                                   gt_format='rgb', class_encodings=self.class_encodings)
+        if self.crop_container:
+            parameters['crop_container'] = CropContainer(get_container_path(self.data_dir / dataset_type,
+                                                                            data_folder_name=self.data_folder_name,
+                                                                            gt_folder_name=self.gt_folder_name))
+        return parameters
 
     def get_img_name_coordinates(self, index: int):
         """
@@ -9,12 +9,14 @@ from typing import List, Tuple, Union, Optional, Any
 
 import torch.utils.data as data
 from PIL import Image
-from omegaconf import ListConfig
 from torch import is_tensor, Tensor
-from torchvision.datasets.folder import pil_loader, has_file_allowed_extension
+from torchvision.datasets.folder import pil_loader
 from torchvision.transforms import ToTensor
 
-from src.datamodules.utils.misc import selection_validation
+from src.datamodules.utils.crop_container import CropContainer
+from src.datamodules.utils.label_cache import LabelCache, decode_labels
+from src.datamodules.utils.manifest import get_manifest
+from src.datamodules.utils.shards import decode_image
 from src.utils import utils
 
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.gif')
@@ -63,13 +65,20 @@ class CroppedDatasetRGB(data.Dataset):
         :type target_transform: callable, optional
         :param twin_transform: twin transformation, defaults to None
         :type twin_transform: callable, optional
+        :param label_cache: if given, the labels are read from this cache instead of decoding the gt images and
+            the target transformation is not used, defaults to None
+        :type label_cache: Optional[LabelCache], optional
+        :param crop_container: if given, the crops are read from this container of the split instead of the crop
+            files, defaults to None
+        :type crop_container: Optional[CropContainer], optional
 
     """
 
     def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
                  selection: Optional[Union[int, List[str]]] = None,
                  is_test: bool = False, image_transform: callable = None, target_transform: callable = None,
-                 twin_transform: callable = None):
+                 twin_transform: callable = None, label_cache: Optional[LabelCache] = None,
+                 crop_container: Optional[CropContainer] = None):
         """
         Constructor method for the class: `CroppedDatasetRGB`.
         """
@@ -83,18 +92,28 @@ class CroppedDatasetRGB(data.Dataset):
         self.image_transform = image_transform
         self.target_transform = target_transform
         self.twin_transform = twin_transform
+        self.label_cache = label_cache
+        self.crop_container = crop_container
 
         self.is_test = is_test
 
         # List of tuples that contain the path to the gt and image that belong together
-        self.img_paths_per_page = self.get_gt_data_paths(path, data_folder_name=self.data_folder_name,
-                                                         gt_folder_name=self.gt_folder_name, selection=self.selection)
+        if self.crop_container is not None:
+            self.crop_indices = self.crop_container.select(self.selection)
+            self.img_paths_per_page = [self.crop_container.get_paths(i) for i in self.crop_indices]
+        else:
+            self.img_paths_per_page = self.get_gt_data_paths(path, data_folder_name=self.data_folder_name,
+                                                             gt_folder_name=self.gt_folder_name,
+                                                             selection=self.selection)
 
         self.num_samples = len(self.img_paths_per_page)
         if self.num_samples == 0:
             raise RuntimeError("Found 0 images in subfolders of: {} \n Supported image extensions are: {}".format(
                 path, ",".join(IMG_EXTENSIONS)))
 
+        if self.label_cache is not None:
+            self.label_cache.compile([paths[1] for paths in self.img_paths_per_page])
+
     def __len__(self):
         """
         This function returns the length of an epoch so the data loader knows when to stop.
@@ -137,17 +156,25 @@ class CroppedDatasetRGB(data.Dataset):
         img, gt = self._apply_transformation(data_img, gt_img)
         return img, gt, index
 
-    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Image.Image]:
+    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Union[Image.Image, Tensor]]:
         """
-        Loads the image and the ground truth image at the given index.
+        Loads the image and the ground truth image at the given index. With a label cache the ground truth are the
+        encoded labels of the cache, with a crop container both are read from the container.
 
         :param index: index of the image to return
         :type index: int
         :return: The image and the corresponding ground truth image
-        :rtype: Tuple[Image.Image, Image.Image]
+        :rtype: Tuple[Image.Image, Union[Image.Image, Tensor]]
         """
+        if self.crop_container is not None:
+            data, gt = self.crop_container.read(self.crop_indices[index])
+            return decode_image(data), decode_image(gt)
+
         data_img = pil_loader(self.img_paths_per_page[index][0])
-        gt_img = pil_loader(self.img_paths_per_page[index][1])
+        if self.label_cache is not None:
+            gt_img = self.label_cache.load(self.img_paths_per_page[index][1])
+        else:
+            gt_img = pil_loader(self.img_paths_per_page[index][1])
 
         return data_img, gt_img
 
@@ -173,6 +200,10 @@ class CroppedDatasetRGB(data.Dataset):
 
         if not is_tensor(img):
             img = ToTensor()(img)
+
+        if self.label_cache is not None:
+            return img, decode_labels(gt)
+
         if not is_tensor(gt):
             gt = ToTensor()(gt)
 
@@ -204,54 +235,9 @@ class CroppedDatasetRGB(data.Dataset):
         :return: List of tuples that contain the path to the gt and image that belong together
         :rtype: List[Tuple[Any, Any, str, Any]]
         """
-        paths = []
         directory = directory.expanduser()
-
-        path_data_root = directory / data_folder_name
-        path_gt_root = directory / gt_folder_name
-
-        if not (path_data_root.is_dir() or path_gt_root.is_dir()):
-            log.error("folder data or gt not found in " + str(directory))
-
-        # get all subitems (and files) sorted
-        subitems = sorted(path_data_root.iterdir())
-
-        # check the selection parameter
-        if selection:
-            selection = selection_validation(subitems, selection, full_page=False)
-
-        counter = 0  # Counter for subdirectories, needed for selection parameter
-
-        for path_data_subdir in subitems:
-            if not path_data_subdir.is_dir():
-                if has_file_allowed_extension(path_data_subdir.name, IMG_EXTENSIONS):
-                    log.warning("image file found in data root: " + str(path_data_subdir))
-                continue
-
-            counter += 1
-
-            if selection:
-                if isinstance(selection, int):
-                    if counter > selection:
-                        break
-
-                elif isinstance(selection, ListConfig) or isinstance(selection, list):
-                    if path_data_subdir.name not in selection:
-                        continue
-
-            path_gt_subdir = path_gt_root / path_data_subdir.stem
-            assert path_gt_subdir.is_dir()
-
-            for path_data_file, path_gt_file in zip(sorted(path_data_subdir.iterdir()),
-                                                    sorted(path_gt_subdir.iterdir())):
-                assert has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) == \
-                       has_file_allowed_extension(path_gt_file.name, IMG_EXTENSIONS), \
-                    'get_img_gt_path_list(): image file aligned with non-image file'
-
-                if has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) and \
-                        has_file_allowed_extension(path_gt_file.name, IMG_EXTENSIONS):
-                    assert path_data_file.stem == path_gt_file.stem, \
-                        'get_img_gt_path_list(): mismatch between data filename and gt filename'
-                    paths.append((path_data_file, path_gt_file, path_data_subdir.stem, path_data_file.stem))
-
-        return paths
+        manifest = get_manifest(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name,
+                                cropped=True)
+        names = manifest.names
+        return [(directory / manifest.data_paths[i], directory / manifest.gt_paths[i], manifest.pages[i], names[i])
+                for i in manifest.select(selection)]
@@ -7,14 +7,17 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Tuple, Union, Optional, Any
 
+import numpy as np
 import torch.utils.data as data
-from omegaconf import ListConfig
 from PIL import Image
 from torch import is_tensor, Tensor
-from torchvision.datasets.folder import pil_loader, has_file_allowed_extension
+from torchvision.datasets.folder import pil_loader
 from torchvision.transforms import ToTensor
 
-from src.datamodules.utils.misc import ImageDimensions, get_output_file_list, selection_validation
+from src.datamodules.utils.label_cache import LabelCache, decode_labels
+from src.datamodules.utils.manifest import get_manifest
+from src.datamodules.utils.misc import ImageDimensions, get_output_file_list
+from src.datamodules.utils.page_store import PageStore
 from src.utils import utils
 
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.gif')
@@ -51,14 +54,19 @@ class DatasetRGB(data.Dataset):
         :type target_transform: callable, optional
         :param twin_transform: twin transformation
         :type twin_transform: callable, optional
+        :param label_cache: if given, the labels are read from this cache instead of decoding the gt images and
+            the target transformation is not used
+        :type label_cache: Optional[LabelCache], optional
+        :param page_store: if given, the pages are read from this store instead of decoding the data images
+        :type page_store: Optional[PageStore], optional
     """
 
     def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
                  image_dims: ImageDimensions,
                  selection: Optional[Union[int, List[str]]] = None,
                  is_test: bool = False, image_transform: callable = None, target_transform: callable = None,
-                 twin_transform: callable = None,
-                 **kwargs):
+                 twin_transform: callable = None, label_cache: Optional[LabelCache] = None,
+                 page_store: Optional[PageStore] = None, **kwargs):
         """
 
 
@@ -75,6 +83,8 @@ class DatasetRGB(data.Dataset):
         self.image_transform = image_transform
         self.target_transform = target_transform
         self.twin_transform = twin_transform
+        self.label_cache = label_cache
+        self.page_store = page_store
 
         self.is_test = is_test
 
@@ -91,6 +101,11 @@ class DatasetRGB(data.Dataset):
             raise RuntimeError("Found 0 images in: {} \n Supported image extensions are: {}".format(
                 path, ",".join(IMG_EXTENSIONS)))
 
+        if self.page_store is not None:
+            self.page_store.compile([paths[0] for paths in self.img_gt_path_list])
+        if self.label_cache is not None:
+            self.label_cache.compile([paths[1] for paths in self.img_gt_path_list])
+
     def __len__(self):
         """
         This function returns the length of an epoch so the data loader knows when to stop.
@@ -145,19 +160,28 @@ class DatasetRGB(data.Dataset):
 
         return img, gt, index
 
-    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Image.Image]:
+    def _load_data_and_gt(self, index: int) -> Tuple[Union[Image.Image, np.ndarray], Union[Image.Image, Tensor]]:
         """
-        This function loads the data and the ground truth for a given index.
+        This function loads the data and the ground truth for a given index. With a page store the data is the uint8
+        array of the store and with a label cache the ground truth are the encoded labels of the cache.
 
         :param index: index of the image
         :type index: int
         :return: the item at the given index
-        :rtype: Tuple[Image.Image, Image.Image]
+        :rtype: Tuple[Union[Image.Image, np.ndarray], Union[Image.Image, Tensor]]
         """
-        data_img = pil_loader(self.img_gt_path_list[index][0])
-        gt_img = pil_loader(self.img_gt_path_list[index][1])
+        if self.page_store is not None:
+            data_img = self.page_store.load(self.img_gt_path_list[index][0])
+        else:
+            data_img = pil_loader(self.img_gt_path_list[index][0])
+            assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
 
-        assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+        if self.label_cache is not None:
+            gt_img = self.label_cache.load(self.img_gt_path_list[index][1])
+            assert gt_img.shape == (self.image_dims.height, self.image_dims.width)
+            return data_img, gt_img
+
+        gt_img = pil_loader(self.img_gt_path_list[index][1])
         assert gt_img.height == self.image_dims.height and gt_img.width == self.image_dims.width
 
         return data_img, gt_img
@@ -184,6 +208,10 @@ class DatasetRGB(data.Dataset):
 
         if not is_tensor(img):
             img = ToTensor()(img)
+
+        if self.label_cache is not None:
+            return img, decode_labels(gt)
+
         if not is_tensor(gt) and gt is not None:
             gt = ToTensor()(gt)
 
@@ -215,40 +243,8 @@ class DatasetRGB(data.Dataset):
         :return: List of tuples that contain the path to the gt and image that belong together
         :rtype: List[Tuple[Any, Any, str, Any]]
         """
-        paths = []
         directory = directory.expanduser()
-
-        path_data_root = directory / data_folder_name
-        path_gt_root = directory / gt_folder_name
-
-        if not (path_data_root.is_dir() or path_gt_root.is_dir()):
-            log.error("folder data or gt not found in " + str(directory))
-
-        # get all files sorted
-        files_in_data_root = sorted(path_data_root.iterdir())
-
-        # check the selection parameter
-        if selection:
-            selection = selection_validation(files_in_data_root, selection, full_page=True)
-
-        counter = 0  # Counter for subdirectories, needed for selection parameter
-
-        for path_data_file, path_gt_file in zip(sorted(files_in_data_root), sorted(path_gt_root.iterdir())):
-            counter += 1
-
-            if selection:
-                if isinstance(selection, int):
-                    if counter > selection:
-                        break
-
-                elif isinstance(selection, ListConfig) or isinstance(selection, list):
-                    if path_data_file.stem not in selection:
-                        continue
-
-            assert has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) == \
-                   has_file_allowed_extension(path_gt_file.name, IMG_EXTENSIONS), \
-                'get_img_gt_path_list(): image file aligned with non-image file'
-
-            paths.append((path_data_file, path_gt_file, path_data_file.stem))
-
-        return paths
+        manifest = get_manifest(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name,
+                                cropped=False)
+        return [(directory / manifest.data_paths[i], directory / manifest.gt_paths[i], manifest.pages[i])
+                for i in manifest.select(selection)]
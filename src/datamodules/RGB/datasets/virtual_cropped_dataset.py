@@ -0,0 +1,215 @@
+"""
+Load a dataset of historic documents by specifying the folder where its located.
+The crops are not read from disk but computed on the fly from the full pages.
+"""
+
+# Utils
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Tuple, Union, Optional, Any
+
+from PIL import Image
+from torch import Tensor
+from torchvision.datasets.folder import pil_loader
+
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.RGB.datasets.full_page_dataset import DatasetRGB
+from src.datamodules.utils.label_cache import LabelCache
+from src.datamodules.utils.misc import ImageDimensions, get_crop_coordinates
+from src.utils import utils
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.gif')
+
+log = utils.get_logger(__name__)
+
+
+class VirtualCroppedDatasetRGB(CroppedDatasetRGB):
+    """A cropped dataset that works directly on the full pages. The images are arranged in this way: ::
+
+        path
+        ├── data_folder_name
+        │   ├── original_image_name_1.png
+        │   ├── ...
+        │   └── original_image_name_N.png
+        └── gt_folder_name
+            ├── original_image_name_1.png
+            ├── ...
+            └── original_image_name_N.png
+
+    The crops are placed on the same grid as in `tools/generate_cropped_dataset.py` and get the same names
+    (e.g. ``original_image_name_1_x0000_y0150``), so :attr:`img_paths_per_page` has the same structure as in
+    :class:`CroppedDatasetRGB`. The pages are decoded once and kept in a cache, so no crop files are needed.
+
+        :param path: Path to dataset folder (train / val / test)
+        :type path: Path
+        :param data_folder_name: name of the folder that contains the data
+        :type data_folder_name: str
+        :param gt_folder_name: name of the folder that contains the ground truth
+        :type gt_folder_name: str
+        :param selection: selection of the pages, defaults to None
+        :type selection: Optional[Union[int, List[str]]], optional
+        :param is_test: flag to indicate if the dataset is used for testing, defaults to False
+        :type is_test: bool, optional
+        :param image_transform: image transformation, defaults to None
+        :type image_transform: callable, optional
+        :param target_transform: target transformation, defaults to None
+        :type target_transform: callable, optional
+        :param twin_transform: twin transformation, defaults to None
+        :type twin_transform: callable, optional
+        :param crop_size: size of the (square) crops
+        :type crop_size: int
+        :param overlap: overlap of the crops (between 0-1), defaults to 0.5
+        :type overlap: float, optional
+        :param leading_zeros_length: amount of leading zeros to encode the coordinates in the crop name
+        :type leading_zeros_length: int, optional
+        :param max_cached_pages: maximal number of decoded pages kept in memory (per worker), None for all pages
+        :type max_cached_pages: Optional[int], optional
+        :param label_cache: if given, the labels of the crops are read from this cache instead of cropping the decoded
+            gt pages and the target transformation is not used
+        :type label_cache: Optional[LabelCache], optional
+    """
+
+    def __init__(self, path: Path, data_folder_name: str, gt_folder_name: str,
+                 selection: Optional[Union[int, List[str]]] = None,
+                 is_test: bool = False, image_transform: callable = None, target_transform: callable = None,
+                 twin_transform: callable = None, crop_size: int = 256, overlap: float = 0.5,
+                 leading_zeros_length: int = 4, max_cached_pages: Optional[int] = None,
+                 label_cache: Optional[LabelCache] = None):
+        """
+        Constructor method for the class: `VirtualCroppedDatasetRGB`.
+        """
+
+        self.path = path
+        self.data_folder_name = data_folder_name
+        self.gt_folder_name = gt_folder_name
+        self.selection = selection
+
+        self.crop_size = crop_size
+        self.overlap = overlap
+        self.leading_zeros_length = leading_zeros_length
+        self.max_cached_pages = max_cached_pages
+
+        # transformations
+        self.image_transform = image_transform
+        self.target_transform = target_transform
+        self.twin_transform = twin_transform
+        self.label_cache = label_cache
+
+        self.is_test = is_test
+
+        # List of tuples (data path, gt path, page name) of the full pages
+        self.page_paths = self.get_page_paths(path, data_folder_name=self.data_folder_name,
+                                              gt_folder_name=self.gt_folder_name, selection=self.selection)
+
+        # List of tuples (page index, x, y) and the crop info in the same format as CroppedDatasetRGB
+        self.crop_list, self.img_paths_per_page = self._get_crop_list()
+
+        self.num_samples = len(self.img_paths_per_page)
+        if self.num_samples == 0:
+            raise RuntimeError("Found 0 images in: {} \n Supported image extensions are: {}".format(
+                path, ",".join(IMG_EXTENSIONS)))
+
+        if self.label_cache is not None:
+            self.label_cache.compile([paths[1] for paths in self.page_paths])
+
+        self._page_cache = OrderedDict()
+
+    def __getstate__(self):
+        # do not send the decoded pages to the dataloader workers
+        state = self.__dict__.copy()
+        state['_page_cache'] = OrderedDict()
+        return state
+
+    def _get_crop_list(self) -> Tuple[List[Tuple[int, int, int]], List[Tuple[Path, Path, str, str]]]:
+        """
+        Computes the coordinates of all crops of all pages. Just the header of the pages is read.
+
+        :return: List of tuples (page index, x, y) and list of tuples (data path, gt path, page name, crop name)
+        :rtype: Tuple[List[Tuple[int, int, int]], List[Tuple[Path, Path, str, str]]]
+        """
+        crop_list = []
+        img_paths_per_page = []
+        for page_index, (path_data_file, path_gt_file, page_name) in enumerate(self.page_paths):
+            with Image.open(path_data_file) as img:
+                image_dims = ImageDimensions(width=img.width, height=img.height)
+
+            for x, y in get_crop_coordinates(image_dims=image_dims, crop_size=self.crop_size, overlap=self.overlap):
+                crop_name = f'{page_name}_x{x:0{self.leading_zeros_length}d}_y{y:0{self.leading_zeros_length}d}'
+                crop_list.append((page_index, x, y))
+                img_paths_per_page.append((path_data_file, path_gt_file, page_name, crop_name))
+
+        return crop_list, img_paths_per_page
+
+    def _load_page(self, page_index: int) -> Tuple[Image.Image, Optional[Image.Image]]:
+        """
+        Returns the decoded page and ground truth page. The pages are decoded once and then kept in the cache.
+        With a label cache just the page is decoded and the ground truth page is None.
+
+        :param page_index: index of the page
+        :type page_index: int
+        :return: The page and the corresponding ground truth page
+        :rtype: Tuple[Image.Image, Optional[Image.Image]]
+        """
+        if page_index in self._page_cache:
+            self._page_cache.move_to_end(page_index)
+            return self._page_cache[page_index]
+
+        data_page = pil_loader(self.page_paths[page_index][0])
+        if self.label_cache is not None:
+            gt_page = None
+            gt_size = self.label_cache.size(self.page_paths[page_index][1])
+        else:
+            gt_page = pil_loader(self.page_paths[page_index][1])
+            gt_size = gt_page.size
+        assert data_page.size == gt_size, \
+            f'_load_page(): size mismatch between data and gt of {self.page_paths[page_index][2]}'
+
+        pages = (data_page, gt_page)
+        self._page_cache[page_index] = pages
+        if self.max_cached_pages is not None and len(self._page_cache) > self.max_cached_pages:
+            self._page_cache.popitem(last=False)
+
+        return pages
+
+    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Union[Image.Image, Tensor]]:
+        """
+        Crops the image and the ground truth image at the given index out of the cached pages. With a label cache
+        the ground truth is the slice of the encoded labels.
+
+        :param index: index of the crop to return
+        :type index: int
+        :return: The image and the corresponding ground truth image
+        :rtype: Tuple[Image.Image, Union[Image.Image, Tensor]]
+        """
+        page_index, x, y = self.crop_list[index]
+        data_page, gt_page = self._load_page(page_index=page_index)
+
+        box = (x, y, x + self.crop_size, y + self.crop_size)
+        if self.label_cache is not None:
+            return data_page.crop(box), self.label_cache.load(self.page_paths[page_index][1], box=box)
+        return data_page.crop(box), gt_page.crop(box)
+
+    @staticmethod
+    def get_page_paths(directory: Path, data_folder_name: str, gt_folder_name: str,
+                       selection: Optional[Union[int, List[str]]] = None) -> List[Tuple[Any, Any, str]]:
+        """
+        Returns a list of tuples that contain the path to the full page image and gt that belong together.
+
+        Structure of the folder
+
+        directory/data/ORIGINAL_FILENAME.png
+        directory/gt/ORIGINAL_FILENAME.png
+
+        :param directory: Path to dataset folder (train / val / test)
+        :type directory: Path
+        :param data_folder_name: name of the folder that contains the data
+        :type data_folder_name: str
+        :param gt_folder_name: name of the folder that contains the ground truth
+        :type gt_folder_name: str
+        :param selection: selection of the pages, defaults to None
+        :type selection: Optional[Union[int, List[str]]], optional
+        :return: List of tuples that contain the path to the gt and image that belong together and the page name
+        :rtype: List[Tuple[Any, Any, str]]
+        """
+        return DatasetRGB.get_img_gt_path_list(directory=directory, data_folder_name=data_folder_name,
+                                               gt_folder_name=gt_folder_name, selection=selection)
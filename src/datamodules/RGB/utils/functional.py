@@ -4,24 +4,59 @@ import torch
 from torch.nn.functional import one_hot
 
 
+def _to_uint8(matrix: torch.Tensor) -> torch.Tensor:
+    """
+    Converts a float tensor in the range [0.0, 1.0] (e.g. from to_tensor()) or an integer tensor in the range
+    [0, 255] to a uint8 tensor.
+
+    :param matrix: float tensor in the range [0.0, 1.0] or integer tensor in the range [0, 255]
+    :type matrix: torch.Tensor
+    :return: uint8 tensor with the same shape
+    :rtype: torch.Tensor
+    """
+    if matrix.is_floating_point():
+        return matrix.mul(255).round_().to(torch.uint8)
+    return matrix.to(torch.uint8)
+
+
+def pack_rgb(matrix: torch.Tensor, dim: int = 0) -> torch.Tensor:
+    """
+    Packs the three colour channels into a single integer per pixel (R << 16 | G << 8 | B).
+
+    :param matrix: float tensor in the range [0.0, 1.0] or integer tensor in the range [0, 255]
+    :type matrix: torch.Tensor
+    :param dim: dimension of the colour channels
+    :type dim: int
+    :return: int32 tensor without the channel dimension
+    :rtype: torch.Tensor
+    """
+    first, second, third = _to_uint8(matrix).to(torch.int32).unbind(dim=dim)
+    return (first << 16) | (second << 8) | third
+
+
 def gt_to_int_encoding(matrix: torch.Tensor, class_encodings: torch.Tensor):
     """
-    Convert ground truth tensor or numpy matrix to one-hot encoded matrix
+    Convert ground truth tensor or numpy matrix to integer encoded matrix. The colours of the pixels and the class
+    encodings are packed into one integer each and the class indices are looked up with a single searchsorted pass.
+    Colours that are not in the class encodings are mapped to -1.
 
-    :param matrix: Image as a tensor of size [C x H x W] (BGR)
+    :param matrix: Image as a tensor of size [C x H x W], either uint8 or float in the range [0.0, 1.0]
     :type matrix: torch.Tensor
-    :param class_encodings: class encoding so which class (index) has what value (element)
-    :type class_encodings: List[int]
-    :return: integer encoded matrix of size [#C x H x W]
+    :param class_encodings: class encoding so which class (index) has what value (element), size [#C x 3]
+    :type class_encodings: torch.Tensor
+    :return: integer encoded matrix of size [H x W]
     :rtype: torch.Tensor
     """
-    integer_encoded = torch.full(size=matrix[0].shape, fill_value=-1, dtype=torch.long)
-    for index, encoding in enumerate(class_encodings):
-        mask = torch.logical_and(torch.logical_and(
-            torch.where(matrix[0] == encoding[0], True, False),
-            torch.where(matrix[1] == encoding[1], True, False)),
-            torch.where(matrix[2] == encoding[2], True, False))
-        integer_encoded[mask] = index
+    packed_matrix = pack_rgb(torch.as_tensor(matrix), dim=0)
+    packed_encodings = pack_rgb(torch.as_tensor(class_encodings), dim=-1)
+
+    # stable sort, so duplicated encodings keep the highest class index (same as the former per-class loop)
+    sorted_encodings, class_indices = torch.sort(packed_encodings, stable=True)
+    positions = torch.searchsorted(sorted_encodings, packed_matrix, right=True) - 1
+    positions.clamp_(min=0)
+
+    found = sorted_encodings[positions] == packed_matrix
+    integer_encoded = torch.where(found, class_indices[positions], torch.full_like(positions, fill_value=-1))
 
     return integer_encoded
 
@@ -2,29 +2,29 @@
 import logging
 import os
 from pathlib import Path
-from typing import Tuple, Dict, Any, List, Union
+from typing import Tuple, Dict, Any, List, Union, Optional
 
 import numpy as np
 # Torch related stuff
 import torch
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
-from PIL import Image
-from torchvision.datasets.folder import pil_loader
 
-from src.datamodules.utils.misc import check_missing_analytics, save_json
-from src.datamodules.utils.image_analytics import compute_mean_std
+from src.datamodules.utils.misc import check_missing_analytics, save_json, dataset_lock
+from src.datamodules.utils.image_analytics import compute_statistics, get_statistics, ImageStatistics, unpack_rgb
 
 
 def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str, train_folder_name: str,
-                  get_img_gt_path_list_func: callable, inmem: bool = False, workers: int = 8) \
-        -> Tuple[Dict[str, Any], Dict[str, Any]]:
+                  get_img_gt_path_list_func: callable, inmem: bool = False, workers: int = 8,
+                  estimation: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
     Get the analytics for the dataset. If the analytics file is not complete, it will be computed and saved.
+    With ``estimation`` the analytics are estimated on a sample of the training images and the error bounds are
+    saved under the key 'estimate'. Estimated analytics are computed again if no estimation is requested.
 
     :param workers: The amount of workers to use for the mean/std computation
     :type workers: int
-    :param inmem: If the dataset should be loaded fully into memory
+    :param inmem: not used anymore, the images are analysed in one streaming pass
     :type inmem: bool
     :param input_path: Path to the dataset folder
     :type input_path: Path
@@ -36,6 +36,9 @@ def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str,
     :type train_folder_name: str
     :param get_img_gt_path_list_func: Function that returns a list of tuples with the image and gt path
     :type get_img_gt_path_list_func: callable
+    :param estimation: keyword arguments of :func:`src.datamodules.utils.image_analytics.estimate_statistics` or
+        None to compute the analytics exactly
+    :type estimation: Optional[Dict[str, Any]]
     :return:
     """
 
@@ -45,41 +48,50 @@ def get_analytics(input_path: Path, data_folder_name: str, gt_folder_name: str,
     analytics_path_data = input_path / f'analytics.data.{data_folder_name}.{train_folder_name}.json'
     analytics_path_gt = input_path / f'analytics.gt.{gt_folder_name}.{train_folder_name}.json'
 
-    analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
-    analytics_gt, missing_analytics_gt = check_missing_analytics(analytics_path_gt, expected_keys_gt)
+    # one process computes the analytics, the others (e.g. DDP ranks) wait and load the saved files
+    with dataset_lock(input_path):
+        analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data,
+                                                                         allow_estimate=estimation is not None)
+        analytics_gt, missing_analytics_gt = check_missing_analytics(analytics_path_gt, expected_keys_gt,
+                                                                     allow_estimate=estimation is not None)
+
+        if not (missing_analytics_data or missing_analytics_gt):
+            return analytics_data, analytics_gt
+
+        train_path = input_path / train_folder_name
+        img_gt_path_list = get_img_gt_path_list_func(train_path, data_folder_name=data_folder_name,
+                                                     gt_folder_name=gt_folder_name)
+        file_names_data = [str(item[0]) for item in img_gt_path_list]
+        file_names_gt = [str(item[1]) for item in img_gt_path_list]
+
+        # data and gt are analysed in the same pass
+        statistics, estimate = get_statistics(data_paths=file_names_data if missing_analytics_data else None,
+                                              gt_paths=file_names_gt if missing_analytics_gt else None,
+                                              gt_format='rgb', workers=workers, estimation=estimation)
+
+        if missing_analytics_data:
+            analytics_data = {'mean': statistics.mean.tolist(),
+                              'std': statistics.std.tolist(),
+                              'width': statistics.width,
+                              'height': statistics.height}
+            if estimate is not None:
+                analytics_data['estimate'] = estimate.data_analytics()
+            # save json
+            save_json(analytics_data, analytics_path_data)
+
+        if missing_analytics_gt:
+            # Measure weights for class balancing
+            logging.info('Measuring class weights')
+            class_weights, class_encodings = _get_class_weights_encodings_segmentation(statistics=statistics)
+            analytics_gt = {'class_weights': class_weights,
+                            'class_encodings': class_encodings}
+            if estimate is not None:
+                analytics_gt['estimate'] = estimate.gt_analytics(statistics.classes)
+            # save json
+            save_json(analytics_gt, analytics_path_gt)
 
-    if not (missing_analytics_data or missing_analytics_gt):
         return analytics_data, analytics_gt
 
-    train_path = input_path / train_folder_name
-    img_gt_path_list = get_img_gt_path_list_func(train_path, data_folder_name=data_folder_name,
-                                                 gt_folder_name=gt_folder_name)
-    file_names_data = np.asarray([str(item[0]) for item in img_gt_path_list])
-    file_names_gt = np.asarray([str(item[1]) for item in img_gt_path_list])
-
-    if missing_analytics_data:
-        mean, std = compute_mean_std(file_names=file_names_data, inmem=inmem, workers=workers)
-        img = Image.open(file_names_data[0]).convert('RGB')
-
-        analytics_data = {'mean': mean.tolist(),
-                          'std': std.tolist(),
-                          'width': img.width,
-                          'height': img.height}
-        # save json
-        save_json(analytics_data, analytics_path_data)
-
-    if missing_analytics_gt:
-        # Measure weights for class balancing
-        logging.info('Measuring class weights')
-        # create a list with all gt file paths
-        class_weights, class_encodings = _get_class_frequencies_weights_segmentation(gt_images=file_names_gt)
-        analytics_gt = {'class_weights': class_weights,
-                        'class_encodings': class_encodings}
-        # save json
-        save_json(analytics_gt, analytics_path_gt)
-
-    return analytics_data, analytics_gt
-
 
 def get_class_weights(input_folder: Path, workers=4) -> np.ndarray:
     """
@@ -130,30 +142,35 @@ def get_class_weights(input_folder: Path, workers=4) -> np.ndarray:
     return class_weights
 
 
-def _get_class_frequencies_weights_segmentation(gt_images: Union[np.ndarray, List[str]]) -> Tuple[np.ndarray, List[int]]:
+def _get_class_frequencies_weights_segmentation(gt_images: Union[np.ndarray, List[str]], workers: int = 8) \
+        -> Tuple[List[float], List[Tuple[int, int, int]]]:
     """
     Get the weights proportional to the inverse of their class frequencies.
     The vector sums up to 1
 
     :param gt_images: Path to all ground truth images, which contain the pixel-wise label
     :type gt_images: List[str]
+    :param workers: Number of workers to read the gt images
+    :type workers: int
     :return: The weights vector as a 1D array normalized (sum up to 1)
-    :rtype: Tuple[np.ndarray, List[int]]
+    :rtype: Tuple[List[float], List[Tuple[int, int, int]]]
     """
-    logging.info('Begin computing class frequencies weights')
-
-    label_counter = {}
+    statistics = compute_statistics(gt_paths=list(gt_images), gt_format='rgb', workers=workers)
+    return _get_class_weights_encodings_segmentation(statistics=statistics)
 
-    for path in gt_images:
-        img_raw = pil_loader(path)
-        colors = img_raw.getcolors()
 
-        for count, color in colors:
-            label_counter[color] = label_counter.get(color, 0) + count
+def _get_class_weights_encodings_segmentation(statistics: ImageStatistics) \
+        -> Tuple[List[float], List[Tuple[int, int, int]]]:
+    """
+    Get the weights proportional to the inverse of their class frequencies out of the statistics of the gt images.
 
-    classes = sorted(label_counter.keys())
-    num_samples_per_class = np.asarray([label_counter[k] for k in classes])
-    logging.info('Finished computing class frequencies weights')
+    :param statistics: statistics of the gt images in the 'rgb' format
+    :type statistics: ImageStatistics
+    :return: The class weights and the class encodings (colours)
+    :rtype: Tuple[List[float], List[Tuple[int, int, int]]]
+    """
+    classes = [unpack_rgb(key) for key in statistics.classes]
+    num_samples_per_class = statistics.num_samples_per_class
     # Normalize vector to sum up to 1.0 (in case the Loss function does not do it)
     class_weights = (1 / num_samples_per_class)  # / ((1 / num_samples_per_class).sum())
     return class_weights.tolist(), classes
@@ -8,7 +8,9 @@ from PIL import Image
 def save_output_page_image(image_name: str, output_image: np.ndarray, output_folder: Path,
                            class_encoding: List[Tuple[int]]) -> None:
     """
-    Helper function to save the output during testing in the DIVAHisDB format
+    Helper function to save the output during testing in the DIVAHisDB format.
+    The prediction is saved as palette image (mode P) with the class encodings as palette, so no RGB image has to be
+    created and the GIF encoder does not need to quantize the image.
 
     :param image_name: name of the image that is saved
     :type image_name: str
@@ -20,15 +22,49 @@ def save_output_page_image(image_name: str, output_image: np.ndarray, output_fol
     :type class_encoding: List[Tuple[int]]
 
     """
+    if len(class_encoding) > 256:
+        raise ValueError(f'A palette image can encode at most 256 classes (got {len(class_encoding)})')
 
-    output_encoded = output_to_class_encodings(output_image, class_encoding)
+    integer_encoded = output_to_class_index(output_image)
 
     dest_folder = output_folder
     dest_folder.mkdir(parents=True, exist_ok=True)
     dest_filename = dest_folder / image_name
 
+    # create output image and put palette
+    img = Image.fromarray(integer_encoded, mode='P')
+    img.putpalette(get_palette(class_encoding))
     # Save the output
-    Image.fromarray(output_encoded.astype(np.uint8)).save(str(dest_filename))
+    img.save(str(dest_filename))
+
+
+def output_to_class_index(output: np.ndarray) -> np.ndarray:
+    """
+    This function converts the output prediction matrix to a matrix with the class index of each pixel
+
+    :param output: output prediction of the network for a full-size image [#C x H x W], where #C is the number of classes
+    :type output: np.ndarray
+
+    :return: numpy array of size [H x W] with the class index of each pixel
+    :rtype: np.ndarray
+    """
+    return np.argmax(np.asarray(output), axis=0).astype(np.uint8)
+
+
+def get_palette(class_encodings: List[Tuple[int]]) -> List[int]:
+    """
+    Creates the palette of a palette image (mode P) where the colour of index i is the encoding of class i.
+
+    :param class_encodings: Contains the range of encoded classes
+    :type class_encodings: List[Tuple[int]]
+
+    :return: flat list with 768 entries (256 RGB colours)
+    :rtype: List[int]
+    """
+    palette = np.zeros(768, dtype=np.uint8)
+    class_encodings_np = np.asarray(class_encodings, dtype=np.uint8).flatten()
+    palette[0:len(class_encodings_np)] = class_encodings_np
+    return palette.tolist()
 
 
 def output_to_class_encodings(output: np.ndarray, class_encodings: List[Tuple[int]]) -> np.ndarray:
@@ -1,15 +1,20 @@
-from typing import Union, List, Optional, Dict
+from functools import partial
+from pathlib import Path
+from typing import Union, List, Optional, Dict, Any
 
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torchvision import transforms
 
 from src.datamodules.RGB.utils.single_transform import IntegerEncoding
 from src.datamodules.RolfFormat.datasets.dataset import DatasetRolfFormat, DatasetSpecs
-from src.datamodules.RolfFormat.utils.image_analytics import get_analytics_data, get_analytics_gt
+from src.datamodules.RolfFormat.utils.image_analytics import get_analytics, get_analytics_data, get_analytics_gt
 from src.datamodules.base_datamodule import AbstractDatamodule
 from src.datamodules.utils.dataset_predict import DatasetPredict
+from src.datamodules.utils.label_cache import LabelCache
 from src.datamodules.utils.misc import ImageDimensions, get_image_dims
+from src.datamodules.utils.page_store import PageStore
+from src.datamodules.utils.shards import segmentation_sample, FULL_PAGE_LAYOUTS
 from src.datamodules.utils.wrapper_transforms import OnlyImage, OnlyTarget
 from src.utils import utils
 
@@ -45,6 +50,25 @@ class DataModuleRolfFormat(AbstractDatamodule):
     :type shuffle: bool
     :param drop_last: Whether to drop the last batch if it is smaller than the batch size.
     :type drop_last: bool
+    :param store_pages: Decode the pages and the ground truth once into a memory mapped page store and label cache in
+        the data root (see :class:`src.datamodules.utils.page_store.PageStore`) that the dataloader workers share.
+    :type store_pages: bool
+    :param train_shards: Path to the index of the shards of the train split written with ``tools/pack_shards.py``.
+        The train samples are then streamed from the shards (see :class:`src.datamodules.utils.shards.ShardDataset`).
+    :type train_shards: Optional[str]
+    :param shuffle_buffer_size: Number of samples in the shuffle buffer of every worker when streaming the shards.
+    :type shuffle_buffer_size: int
+    :param predict_any_size: The images to predict can have any size. They are batched as lists with
+        :func:`src.datamodules.utils.dataset_predict.collate_pages` (e.g. for the sliding window inference of the task).
+    :type predict_any_size: bool
+    :param predict_bucket_stride: Batch the images to predict by size and pad them to a multiple of this stride
+        (the downsampling factor of the model). The task crops the prediction back to the original size.
+    :type predict_bucket_stride: Optional[int]
+    :param scratch_dir: Local folder to stage the dataset in (see :meth:`AbstractDatamodule.stage`). None to read
+        it from ``data_root``.
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: Maximal size of all the datasets in the scratch folder in GB. None for no limit.
+    :type scratch_budget_gb: Optional[float]
     """
 
     def __init__(self, data_root: str,
@@ -52,11 +76,22 @@ class DataModuleRolfFormat(AbstractDatamodule):
                  pred_file_path_list: List[str] = None,
                  image_analytics: Dict = None, classes: Dict = None, image_dims: ImageDimensions = None,
                  num_workers: int = 4, batch_size: int = 8,
-                 shuffle: bool = True, drop_last: bool = True):
+                 shuffle: bool = True, drop_last: bool = True, store_pages: bool = False,
+                 train_shards: Optional[str] = None, shuffle_buffer_size: int = 1000,
+                 predict_any_size: bool = False, predict_bucket_stride: Optional[int] = None,
+                 scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         """
         Constructor method for the `DataModuleRolfFormat` class.
         """
-        super().__init__()
+        super().__init__(scratch_dir=scratch_dir, scratch_budget_gb=scratch_budget_gb)
+        data_root = self.stage(data_root)
+
+        self.data_root = data_root
+        self.store_pages = store_pages
+        self.predict_any_size = predict_any_size
+        self.predict_bucket_stride = predict_bucket_stride
+        self.train_shards = train_shards
+        self.shuffle_buffer_size = shuffle_buffer_size
 
         if train_specs is not None:
             self.train_dataset_specs = [DatasetSpecs(data_root=data_root, **v) for k, v in train_specs.items()]
@@ -74,8 +109,15 @@ class DataModuleRolfFormat(AbstractDatamodule):
             image_dims = get_image_dims(data_gt_path_list=train_paths_data_gt)
             self._print_image_dims(image_dims=image_dims)
 
-        if image_analytics is None:
+        if image_analytics is None and classes is None:
+            # data and gt are analysed in the same pass
+            analytics_data, analytics_gt = get_analytics(img_gt_path_list=train_paths_data_gt)
+        elif image_analytics is None:
             analytics_data = get_analytics_data(img_gt_path_list=train_paths_data_gt)
+        elif classes is None:
+            analytics_gt = get_analytics_gt(img_gt_path_list=train_paths_data_gt)
+
+        if image_analytics is None:
             self._print_analytics_data(analytics_data=analytics_data)
         else:
             analytics_data = {'mean': [image_analytics['mean']['R'],
@@ -86,7 +128,6 @@ class DataModuleRolfFormat(AbstractDatamodule):
                                       image_analytics['std']['B']]}
 
         if classes is None:
-            analytics_gt = get_analytics_gt(img_gt_path_list=train_paths_data_gt)
             self._print_analytics_gt(analytics_gt=analytics_gt)
         else:
             analytics_gt = {'class_encodings': [],
@@ -181,14 +222,23 @@ class DataModuleRolfFormat(AbstractDatamodule):
                          'twin_transform': self.twin_transform}
 
         if stage == 'fit' or stage is None:
-            self.train = DatasetRolfFormat(dataset_specs=self.train_dataset_specs,
-                                           is_test=False,
-                                           **common_kwargs)
+            if self.train_shards is not None:
+                self.train = self._get_shard_dataset(process=partial(segmentation_sample,
+                                                                     twin_transform=self.twin_transform,
+                                                                     image_transform=self.image_transform,
+                                                                     target_transform=self.target_transform),
+                                                     layouts=FULL_PAGE_LAYOUTS)
+            else:
+                self.train = DatasetRolfFormat(dataset_specs=self.train_dataset_specs,
+                                               **self._get_stores('train'),
+                                               is_test=False,
+                                               **common_kwargs)
             log.info(f'Initialized train dataset with {len(self.train)} samples.')
             self.check_min_num_samples(self.trainer.num_devices, self.batch_size, num_samples=len(self.train),
                                        data_split='train', drop_last=self.drop_last)
 
             self.val = DatasetRolfFormat(dataset_specs=self.val_dataset_specs,
+                                         **self._get_stores('val'),
                                          is_test=False,
                                          **common_kwargs)
             log.info(f'Initialized val dataset with {len(self.val)} samples.')
@@ -197,22 +247,42 @@ class DataModuleRolfFormat(AbstractDatamodule):
 
         if stage == 'test':
             self.test = DatasetRolfFormat(dataset_specs=self.test_dataset_specs,
+                                          **self._get_stores('test'),
                                           is_test=True,
                                           **common_kwargs)
             log.info(f'Initialized test dataset with {len(self.test)} samples.')
             # self._check_min_num_samples(num_samples=len(self.test), data_split='test', drop_last=False)
 
         if stage == 'predict':
+            if self.predict_any_size or self.predict_bucket_stride is not None:
+                common_kwargs['image_dims'] = None
             self.predict = DatasetPredict(image_path_list=self.pred_file_path_list,
                                           **common_kwargs)
             log.info(f'Initialized predict dataset with {len(self.predict)} samples.')
             # self._check_min_num_samples(num_samples=len(self.test), data_split='test', drop_last=False)
 
+    def _get_stores(self, split_name: str) -> Dict[str, Any]:
+        """
+        Returns the page store and the label cache of the split as keyword arguments for the dataset if the pages
+        are stored.
+
+        :param split_name: name of the split
+        :type split_name: str
+        :return: the keyword arguments (empty if the pages are not stored)
+        :rtype: Dict[str, Any]
+        """
+        if not self.store_pages:
+            return {}
+        return {'page_store': PageStore(directory=Path(self.data_root), name=split_name, image_dims=self.image_dims),
+                'label_cache': LabelCache(directory=Path(self.data_root), name=split_name, gt_format='rgb',
+                                          class_encodings=self.class_encodings)}
+
     def train_dataloader(self, *args, **kwargs) -> DataLoader:
         return DataLoader(self.train,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          shuffle=self.shuffle,
+                          # the streaming dataset shuffles the shards itself
+                          shuffle=self.shuffle and not isinstance(self.train, IterableDataset),
                           drop_last=self.drop_last,
                           pin_memory=True)
 
@@ -234,11 +304,11 @@ class DataModuleRolfFormat(AbstractDatamodule):
 
     def predict_dataloader(self) -> Union[DataLoader, List[DataLoader]]:
         return DataLoader(self.predict,
-                          batch_size=self.batch_size,
                           num_workers=self.num_workers,
                           shuffle=False,
                           drop_last=False,
-                          pin_memory=True)
+                          pin_memory=True,
+                          **self._get_predict_batching())
 
     def get_output_filename_test(self, index: int) -> str:
         """
@@ -6,15 +6,18 @@ Load a dataset of historic documents by specifying the folder where its located.
 import re
 from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import List, Tuple, Union, Optional
 
+import numpy as np
 import torch.utils.data as data
-from torch import is_tensor
+from torch import is_tensor, Tensor
 from PIL import Image
 from torchvision.datasets.folder import pil_loader
 from torchvision.transforms import ToTensor
 
+from src.datamodules.utils.label_cache import LabelCache, decode_labels
 from src.datamodules.utils.misc import ImageDimensions, get_output_file_list
+from src.datamodules.utils.page_store import PageStore
 from src.utils import utils
 
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.gif')
@@ -56,11 +59,17 @@ class DatasetRolfFormat(data.Dataset):
     :type target_transform: callable
     :param twin_transform: Transformations that should be applied to both the image and the ground truth.
     :type twin_transform: callable
+    :param label_cache: If given, the labels are read from this cache instead of decoding the ground truth images and
+        the target transformation is not used.
+    :type label_cache: Optional[LabelCache]
+    :param page_store: If given, the pages are read from this store instead of decoding the images.
+    :type page_store: Optional[PageStore]
     """
 
     def __init__(self, dataset_specs: List[DatasetSpecs], image_dims: ImageDimensions,
                  is_test: bool = False, image_transform: callable = None, target_transform: callable = None,
-                 twin_transform: callable = None):
+                 twin_transform: callable = None, label_cache: Optional[LabelCache] = None,
+                 page_store: Optional[PageStore] = None):
         """
         Constructor method for the DatasetRolfFormat class.
         """
@@ -73,6 +82,8 @@ class DatasetRolfFormat(data.Dataset):
         self.image_transform = image_transform
         self.target_transform = target_transform
         self.twin_transform = twin_transform
+        self.label_cache = label_cache
+        self.page_store = page_store
 
         self.is_test = is_test
 
@@ -87,6 +98,11 @@ class DatasetRolfFormat(data.Dataset):
 
         assert self.num_samples > 0
 
+        if self.page_store is not None:
+            self.page_store.compile([paths[0] for paths in self.img_gt_path_list])
+        if self.label_cache is not None:
+            self.label_cache.compile([paths[1] for paths in self.img_gt_path_list])
+
     def __len__(self):
         """
         This function returns the length of an epoch so the data loader knows when to stop.
@@ -136,19 +152,29 @@ class DatasetRolfFormat(data.Dataset):
         img, gt = self._apply_transformation(data_img, gt_img)
         return img, gt, index
 
-    def _load_data_and_gt(self, index: int) -> Tuple[Image.Image, Image.Image]:
+    def _load_data_and_gt(self, index: int) \
+            -> Tuple[Union[Image.Image, np.ndarray], Union[Image.Image, Tensor]]:
         """
-        This function loads the image and the ground truth for a given index.
+        This function loads the image and the ground truth for a given index. With a page store the image is the
+        uint8 array of the store and with a label cache the ground truth are the encoded labels of the cache.
 
         :param index: The index of the sample that should be returned.
         :type index: int
         :return: The image and the ground truth for the given index.
         :rtype: tuple
         """
-        data_img = pil_loader(str(self.img_gt_path_list[index][0]))
-        gt_img = pil_loader(str(self.img_gt_path_list[index][1]))
+        if self.page_store is not None:
+            data_img = self.page_store.load(self.img_gt_path_list[index][0])
+        else:
+            data_img = pil_loader(str(self.img_gt_path_list[index][0]))
+            assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+
+        if self.label_cache is not None:
+            gt_img = self.label_cache.load(self.img_gt_path_list[index][1])
+            assert gt_img.shape == (self.image_dims.height, self.image_dims.width)
+            return data_img, gt_img
 
-        assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+        gt_img = pil_loader(str(self.img_gt_path_list[index][1]))
         assert gt_img.height == self.image_dims.height and gt_img.width == self.image_dims.width
 
         return data_img, gt_img
@@ -174,6 +200,10 @@ class DatasetRolfFormat(data.Dataset):
 
         if not is_tensor(img):
             img = ToTensor()(img)
+
+        if self.label_cache is not None:
+            return img, decode_labels(gt)
+
         if not is_tensor(gt):
             gt = ToTensor()(gt)
 
@@ -108,17 +108,24 @@ class RotNetDivaHisDBDataModuleCropped(AbstractDatamodule):
     :type shuffle: bool
     :param drop_last: Whether to drop the last batch
     :type drop_last: bool
+    :param scratch_dir: local folder to stage the dataset in (see :meth:`AbstractDatamodule.stage`), None to read
+        it from ``data_dir``
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: maximal size of all the datasets in the scratch folder in GB, None for no limit
+    :type scratch_budget_gb: Optional[float]
     """
     def __init__(self, data_dir: str, data_folder_name: str,
                  selection_train: Optional[Union[int, List[str]]] = None,
                  selection_val: Optional[Union[int, List[str]]] = None,
                  selection_test: Optional[Union[int, List[str]]] = None,
                  crop_size: int = 256, num_workers: int = 4, batch_size: int = 8,
-                 shuffle: bool = True, drop_last: bool = True, ):
+                 shuffle: bool = True, drop_last: bool = True,
+                 scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         """
         Constructor method for the RotNetDivaHisDBDataModuleCropped class.
         """
-        super().__init__()
+        super().__init__(scratch_dir=scratch_dir, scratch_budget_gb=scratch_budget_gb)
+        data_dir = self.stage(data_dir)
 
         self.data_folder_name = data_folder_name
         analytics_data = get_analytics_data(input_path=Path(data_dir), data_folder_name=self.data_folder_name,
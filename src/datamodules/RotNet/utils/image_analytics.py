@@ -4,7 +4,7 @@ from typing import Any, Dict
 
 import numpy as np
 
-from src.datamodules.utils.misc import check_missing_analytics, save_json
+from src.datamodules.utils.misc import check_missing_analytics, save_json, dataset_lock
 from src.datamodules.utils.image_analytics import compute_mean_std
 
 
@@ -31,17 +31,19 @@ def get_analytics_data(input_path: Path, data_folder_name: str, get_gt_data_path
 
     analytics_path_data = input_path / f'analytics.data.{data_folder_name}.json'
 
-    analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
+    # one process computes the analytics, the others (e.g. DDP ranks) wait and load the saved files
+    with dataset_lock(input_path):
+        analytics_data, missing_analytics_data = check_missing_analytics(analytics_path_data, expected_keys_data)
 
-    if not missing_analytics_data:
-        return analytics_data
-    train_path = input_path / 'train'
-    gt_data_path_list = get_gt_data_paths_func(train_path, data_folder_name=data_folder_name, gt_folder_name=None)
+        if not missing_analytics_data:
+            return analytics_data
+        train_path = input_path / 'train'
+        gt_data_path_list = get_gt_data_paths_func(train_path, data_folder_name=data_folder_name, gt_folder_name=None)
 
-    mean, std = compute_mean_std(file_names=gt_data_path_list, inmem=inmem, workers=workers)
-    analytics_data = {'mean': mean.tolist(),
-                      'std': std.tolist()}
-    # save json
-    save_json(analytics_data, analytics_path_data)
+        mean, std = compute_mean_std(file_names=gt_data_path_list, inmem=inmem, workers=workers)
+        analytics_data = {'mean': mean.tolist(),
+                          'std': std.tolist()}
+        # save json
+        save_json(analytics_data, analytics_path_data)
 
-    return analytics_data
+        return analytics_data
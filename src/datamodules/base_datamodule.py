@@ -1,9 +1,16 @@
-from typing import Optional
+from functools import partial
+from pathlib import Path
+from typing import Optional, Callable, Sequence, Dict, Any, Union
 
 import pytorch_lightning as pl
 import torch
 from omegaconf import OmegaConf
+from torch.utils.data import SequentialSampler
 
+from src.datamodules.utils.dataset_predict import collate_pages
+from src.datamodules.utils.shards import ShardDataset
+from src.datamodules.utils.size_buckets import SizeBucketBatchSampler, collate_padded
+from src.datamodules.utils.staging import stage_directory
 from src.utils import utils
 
 log = utils.get_logger(__name__)
@@ -15,10 +22,19 @@ class AbstractDatamodule(pl.LightningDataModule):
     It provides some basic functionality like checking the number of samples and the number of classes.
     Also, it provides a resolver for the datamodule object itself, so that it can be used in the config.
     The class variable `dims` must be set in the subclass.
+
+    :param scratch_dir: local folder to stage the dataset in, the dataset is copied there once and read from the
+        copy (see :func:`src.datamodules.utils.staging.stage_directory`), None to read it from its source
+    :type scratch_dir: Optional[str]
+    :param scratch_budget_gb: maximal size of all the datasets in the scratch folder in GB, the least recently used
+        ones are removed to make room, None for no limit
+    :type scratch_budget_gb: Optional[float]
     """
 
-    def __init__(self):
+    def __init__(self, scratch_dir: Optional[str] = None, scratch_budget_gb: Optional[float] = None):
         super().__init__()
+        self.scratch_dir = scratch_dir
+        self.scratch_budget_gb = scratch_budget_gb
         self.num_classes = -1
         self.class_weights = None
         resolver_name = 'datamodule'
@@ -44,6 +60,54 @@ class AbstractDatamodule(pl.LightningDataModule):
             assert len(self.class_weights) == self.num_classes
             assert torch.is_tensor(self.class_weights)
 
+    def stage(self, path: Union[str, Path]) -> Union[str, Path]:
+        """
+        Returns the path of the local copy of the dataset folder if a scratch folder is set, otherwise the path itself.
+
+        :param path: path of the dataset folder
+        :type path: Union[str, Path]
+        :return: the path the dataset is read from
+        :rtype: Union[str, Path]
+        """
+        if self.scratch_dir is None:
+            return path
+        budget_bytes = int(self.scratch_budget_gb * 2 ** 30) if self.scratch_budget_gb is not None else None
+        return stage_directory(path, scratch_dir=self.scratch_dir, budget_bytes=budget_bytes)
+
+    def _get_shard_dataset(self, process: Callable[[Dict[str, Any]], Any], layouts: Sequence[str]) -> ShardDataset:
+        """
+        Creates the streaming train dataset of the shards in ``self.train_shards`` (see
+        :class:`src.datamodules.utils.shards.ShardDataset`).
+
+        :param process: turns a record of the shards into a sample
+        :type process: Callable[[Dict[str, Any]], Any]
+        :param layouts: the layouts of the shards the datamodule can use
+        :type layouts: Sequence[str]
+        :return: the streaming dataset
+        :rtype: ShardDataset
+        """
+        return ShardDataset(index_path=self.train_shards, process=process, layouts=layouts, shuffle=self.shuffle,
+                            buffer_size=self.shuffle_buffer_size, batch_size=self.batch_size,
+                            num_workers=self.num_workers)
+
+    def _get_predict_batching(self) -> Dict[str, Any]:
+        """
+        Keyword arguments of the predict dataloader for the batching of the pages of ``self.predict``. With
+        ``self.predict_bucket_stride`` the pages are batched by size (see
+        :class:`src.datamodules.utils.size_buckets.SizeBucketBatchSampler`), with ``self.predict_any_size`` they are
+        batched as lists, otherwise they are stacked.
+
+        :return: the batch size or batch sampler and the collate function
+        :rtype: Dict[str, Any]
+        """
+        if self.predict_bucket_stride is not None:
+            batch_sampler = SizeBucketBatchSampler(SequentialSampler(self.predict), batch_size=self.batch_size,
+                                                   drop_last=False, sizes=self.predict.get_image_sizes(),
+                                                   stride=self.predict_bucket_stride)
+            return {'batch_sampler': batch_sampler, 'collate_fn': partial(collate_padded,
+                                                                          stride=self.predict_bucket_stride)}
+        return {'batch_size': self.batch_size, 'collate_fn': collate_pages if self.predict_any_size else None}
+
     @staticmethod
     def check_min_num_samples(num_devices: int, batch_size_input: int, num_samples: int, data_split: str,
                               drop_last: bool):
@@ -0,0 +1,223 @@
+"""
+All the crops of a cropped dataset split in one file with random access by index.
+
+A cropped split has one data and one gt file per crop, which are hundreds of thousands of files for a large dataset.
+Opening them costs a lookup on the file system for every sample. :func:`write_crop_container` concatenates the
+encoded crops into one file (``{data_folder_name}.{gt_folder_name}.crops`` in the split folder) and the datasets
+read a crop with :class:`CropContainer` with a single ``pread`` at an offset of the memory mapped offset table.
+
+The file is structured as follows::
+
+    header      magic, version, number of crops and the offsets of the table and the meta data
+    crops       the encoded data file followed by the encoded gt file of every crop
+    table       uint64 array [N x 4] with the offset and length of the data and of the gt of every crop
+    meta data   json with the relative paths of the files and the pages of the crops (like the manifest)
+
+The crops are stored as they are, so the pixels are not changed.
+"""
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple, Union, List
+
+import numpy as np
+from omegaconf import ListConfig
+
+from src.datamodules.utils.manifest import get_manifest
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+CROP_CONTAINER_MAGIC = b'DIVACROP'
+CROP_CONTAINER_VERSION = 1
+# magic, version, number of crops, offset of the table, offset and length of the meta data
+HEADER = struct.Struct('<8sIQQQQ')
+# number of threads and files read in one go when the container is written
+NUM_THREADS_READ = 16
+CHUNK_SIZE = 256
+
+
+def get_container_path(directory: Path, data_folder_name: str, gt_folder_name: str) -> Path:
+    """
+    :param directory: the split folder
+    :type directory: Path
+    :param data_folder_name: name of the folder that contains the data
+    :type data_folder_name: str
+    :param gt_folder_name: name of the folder that contains the ground truth
+    :type gt_folder_name: str
+    :return: path of the crop container of the split
+    :rtype: Path
+    """
+    return directory / f'{data_folder_name}.{gt_folder_name}.crops'
+
+
+def write_crop_container(directory: Path, data_folder_name: str, gt_folder_name: str) -> Path:
+    """
+    Writes the crops of a split (``directory/data/<page>/<page>_xNNNN_yNNNN.png``) into a crop container next to the
+    data folder.
+
+    :param directory: the split folder (train / val / test)
+    :type directory: Path
+    :param data_folder_name: name of the folder that contains the data
+    :type data_folder_name: str
+    :param gt_folder_name: name of the folder that contains the ground truth
+    :type gt_folder_name: str
+    :return: path of the crop container
+    :rtype: Path
+    """
+    directory = Path(directory).expanduser()
+    manifest = get_manifest(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name,
+                            cropped=True)
+    container_path = get_container_path(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name)
+    tmp_path = container_path.with_name(f'.{container_path.name}.tmp')
+
+    table = np.zeros((len(manifest), 4), dtype='<u8')
+    with tmp_path.open('wb') as f, ThreadPoolExecutor(max_workers=NUM_THREADS_READ) as executor:
+        f.write(HEADER.pack(CROP_CONTAINER_MAGIC, CROP_CONTAINER_VERSION, len(manifest), 0, 0, 0))
+        for start in range(0, len(manifest), CHUNK_SIZE):
+            paths = [(directory / data_path, directory / gt_path)
+                     for data_path, gt_path in zip(manifest.data_paths[start:start + CHUNK_SIZE],
+                                                   manifest.gt_paths[start:start + CHUNK_SIZE])]
+            for i, (data, gt) in enumerate(executor.map(_read_files, paths), start=start):
+                # the gt follows the data, so a crop is read with one call
+                table[i] = [f.tell(), len(data), f.tell() + len(data), len(gt)]
+                f.write(data)
+                f.write(gt)
+        table_offset = f.tell()
+        f.write(table.tobytes())
+        meta_offset = f.tell()
+        meta = json.dumps({'data': manifest.data_paths, 'gt': manifest.gt_paths, 'pages': manifest.pages}).encode()
+        f.write(meta)
+        f.seek(0)
+        f.write(HEADER.pack(CROP_CONTAINER_MAGIC, CROP_CONTAINER_VERSION, len(manifest), table_offset, meta_offset,
+                            len(meta)))
+    tmp_path.replace(container_path)
+    log.info(f'Wrote {len(manifest)} crops into {container_path}')
+    return container_path
+
+
+def _read_files(paths: Tuple[Path, Path]) -> Tuple[bytes, bytes]:
+    return paths[0].read_bytes(), paths[1].read_bytes()
+
+
+class CropContainer:
+    """
+    Random access to the crops of a crop container written by :func:`write_crop_container`. The file is opened lazily
+    in every process.
+
+    :param path: path of the crop container
+    :type path: Path
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if not self.path.is_file():
+            msg = f'Crop container not found ("{self.path}"), write it with tools/convert_crops_to_container.py'
+            log.error(msg)
+            raise ValueError(msg)
+
+        with self.path.open('rb') as f:
+            magic, version, num_crops, table_offset, meta_offset, meta_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != CROP_CONTAINER_MAGIC or version != CROP_CONTAINER_VERSION:
+                msg = f'"{self.path}" is not a crop container of version {CROP_CONTAINER_VERSION}'
+                log.error(msg)
+                raise ValueError(msg)
+            f.seek(meta_offset)
+            meta = json.loads(f.read(meta_length))
+
+        self.num_crops = num_crops
+        self.table_offset = table_offset
+        self.data_paths: List[str] = meta['data']
+        self.gt_paths: List[str] = meta['gt']
+        self.pages: List[str] = meta['pages']
+
+        self._fd = None
+        self._table = None
+
+    def __getstate__(self):
+        # every dataloader worker opens the file itself
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_table'] = None
+        return state
+
+    def __del__(self):
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+
+    def __len__(self) -> int:
+        return self.num_crops
+
+    @property
+    def directory(self) -> Path:
+        return self.path.parent
+
+    @property
+    def page_names(self) -> List[str]:
+        """
+        Names of the pages in the order of the container, without duplicates.
+        """
+        return list(dict.fromkeys(self.pages))
+
+    def select(self, selection: Optional[Union[int, List[str], ListConfig]]) -> List[int]:
+        """
+        Indices of the crops of the selected pages. An integer selects the first n pages, a list selects the pages by
+        name.
+
+        :param selection: selection of the pages, None or 0 for all pages
+        :type selection: Optional[Union[int, List[str], ListConfig]]
+        :return: indices of the selected crops
+        :rtype: List[int]
+        """
+        if not selection:
+            return list(range(len(self)))
+        page_names = self.page_names
+        if isinstance(selection, int):
+            if selection < 0 or selection > len(page_names):
+                msg = f'Parameter "selection" ({selection}) is not between 0 and the number of pages ' \
+                      f'({len(page_names)}).'
+                log.error(msg)
+                raise ValueError(msg)
+            selected_pages = set(page_names[:selection])
+        elif isinstance(selection, (list, ListConfig)):
+            if not all(page in page_names for page in selection):
+                msg = 'Parameter "selection" contains a non-existing page.'
+                log.error(msg)
+                raise ValueError(msg)
+            selected_pages = set(selection)
+        else:
+            msg = f'Parameter "selection" exists, but it is of unsupported type ({type(selection)})'
+            log.error(msg)
+            raise TypeError(msg)
+        return [i for i, page in enumerate(self.pages) if page in selected_pages]
+
+    def get_paths(self, index: int) -> Tuple[Path, Path, str, str]:
+        """
+        The paths of a crop like :meth:`CroppedDatasetRGB.get_gt_data_paths` returns them.
+
+        :param index: index of the crop in the container
+        :type index: int
+        :return: path of the data file, path of the gt file, name of the page and name of the crop
+        :rtype: Tuple[Path, Path, str, str]
+        """
+        data_path = self.directory / self.data_paths[index]
+        return data_path, self.directory / self.gt_paths[index], self.pages[index], data_path.stem
+
+    def read(self, index: int) -> Tuple[bytes, bytes]:
+        """
+        Reads the encoded data and gt of a crop.
+
+        :param index: index of the crop in the container
+        :type index: int
+        :return: the encoded data and gt files
+        :rtype: Tuple[bytes, bytes]
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._table = np.memmap(self.path, dtype='<u8', mode='r', offset=self.table_offset,
+                                    shape=(self.num_crops, 4))
+        data_offset, data_length, _, gt_length = (int(v) for v in self._table[index])
+        crop = os.pread(self._fd, data_length + gt_length, data_offset)
+        return crop[:data_length], crop[data_length:]
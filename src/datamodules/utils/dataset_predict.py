@@ -1,7 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
+import torch
 import torch.utils.data as data
 from torch import is_tensor, Tensor
 from torchvision.datasets.folder import pil_loader
@@ -20,8 +22,8 @@ class DatasetPredict(data.Dataset):
 
     :param image_path_list: list of image paths
     :type image_path_list: List[str]
-    :param image_dims: image dimensions
-    :type image_dims: ImageDimensions
+    :param image_dims: image dimensions, None for images of any size (batch them with :func:`collate_pages`)
+    :type image_dims: Optional[ImageDimensions]
     :param image_transform: image transformation
     :type image_transform: Callable
     :param target_transform: target transformation
@@ -30,7 +32,7 @@ class DatasetPredict(data.Dataset):
     :type twin_transform: Callable
     """
 
-    def __init__(self, image_path_list: List[str], image_dims: ImageDimensions,
+    def __init__(self, image_path_list: List[str], image_dims: Optional[ImageDimensions],
                  image_transform=None, target_transform=None, twin_transform=None):
         """
         Constructor method for the DatasetPredict class.
@@ -87,7 +89,8 @@ class DatasetPredict(data.Dataset):
         """
         data_img = pil_loader(self.image_path_list[index])
 
-        assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
+        if self.image_dims is not None:
+            assert data_img.height == self.image_dims.height and data_img.width == self.image_dims.width
 
         return data_img
 
@@ -110,6 +113,18 @@ class DatasetPredict(data.Dataset):
 
         return img
 
+    def get_image_sizes(self, num_threads: int = 16) -> List[Tuple[int, int]]:
+        """
+        Reads the height and width of every image from its header, the pixels are not decoded.
+
+        :param num_threads: number of threads that read the headers
+        :type num_threads: int
+        :returns: height and width of every image
+        :rtype: List[Tuple[int, int]]
+        """
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return list(executor.map(_read_image_size, self.image_path_list))
+
     @staticmethod
     def expend_glob_path_list(glob_path_list: List[str]) -> List[Path]:
         """
@@ -121,9 +136,30 @@ class DatasetPredict(data.Dataset):
         :rtype: List[Path]
         """
         output_list = []
+        seen = set()
         for glob_path in glob_path_list:
             for s in sorted(glob(glob_path)):
                 path = Path(s)
-                if path not in output_list:
-                    output_list.append(Path(s))
+                if path not in seen:
+                    seen.add(path)
+                    output_list.append(path)
         return output_list
+
+
+def _read_image_size(path: Path) -> Tuple[int, int]:
+    with Image.open(path) as img:
+        return img.height, img.width
+
+
+def collate_pages(batch: List[Tuple[Tensor, int]]) -> Tuple[List[Tensor], Tensor]:
+    """
+    Collate function for the predict dataloader if the pages have different sizes. The pages are not stacked but
+    returned as a list (e.g. for :class:`src.tasks.utils.tiled_inference.SlidingWindowInference`).
+
+    :param batch: the samples of :class:`DatasetPredict`
+    :type batch: List[Tuple[Tensor, int]]
+    :return: the pages and their indices
+    :rtype: Tuple[List[Tensor], Tensor]
+    """
+    pages, indices = zip(*batch)
+    return list(pages), torch.tensor(indices)
@@ -1,124 +1,710 @@
+import hashlib
+import itertools
+import json
 import logging
+import os
+import time
+from dataclasses import dataclass, field
 from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Tuple, Any, Union
+from statistics import NormalDist
+from typing import List, Tuple, Union, Optional, Dict, Sequence, Any, Set, Iterable
 
 import numpy as np
 from PIL import Image
-from numpy import ndarray, dtype, floating
 
+from src.datamodules.utils.misc import pil_loader_gif
 
-def compute_mean_std(file_names: Union[np.ndarray, List[Path]], inmem: bool = False, workers: int = 8) -> Tuple[float, float]:
+# how the classes are read from the gt images
+#   'rgb': every colour is a class, the key is the packed colour (R << 16 | G << 8 | B)
+#   'hisdb': the blue channel is the class (DIVA-HisDB format)
+#   'index': the palette index is the class (e.g. gif)
+GT_FORMATS = ('rgb', 'hisdb', 'index')
+
+# environment variable to change the directory of the AnalyticsCache (default ~/.cache/diva_daf/analytics)
+ANALYTICS_CACHE_DIR_ENV = 'DIVA_DAF_ANALYTICS_CACHE'
+
+
+@dataclass
+class ImageStatistics:
     """
-    Computes mean and std of all images present at target folder.
+    Statistics of one or several images. The sums are kept as integers of the 8-bit pixel values, so merging
+    statistics (:meth:`merge`) is exact and does not depend on the order.
 
-    :param file_names: List of the file names of the images
-    :type file_names: Union[np.ndarray[str], List[Path]]
-    :param inmem: Specifies whether is should be computed i nan online of offline fashion.
-    :type inmem: bool
-    :param workers: Number of workers to use for the mean/std computation
-    :type workers: int
-    :return: mean and std
-    :rtype: Tuple[float, float]
+    :param pixel_count: number of pixels of the data images
+    :type pixel_count: int
+    :param channel_sum: sum of the pixel values per channel (RGB)
+    :type channel_sum: np.ndarray
+    :param channel_square_sum: sum of the squared pixel values per channel (RGB)
+    :type channel_square_sum: np.ndarray
+    :param width: width of the first image
+    :type width: Optional[int]
+    :param height: height of the first image
+    :type height: Optional[int]
+    :param class_counts: number of pixels per class of the gt images
+    :type class_counts: Dict[int, int]
+    :param palette: palette of the gt image with the most classes (just for the 'index' format)
+    :type palette: Optional[List[int]]
+    :param palette_num_colors: number of classes of the image of the palette
+    :type palette_num_colors: int
     """
-    file_names_np = np.array(list(map(str, file_names)))
-    # Compute mean and std
-    mean, std = _cms_inmem(file_names_np) if inmem else _cms_online(file_names_np, workers)
-    return mean, std
+    pixel_count: int = 0
+    channel_sum: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.int64))
+    channel_square_sum: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.int64))
+    width: Optional[int] = None
+    height: Optional[int] = None
+    class_counts: Dict[int, int] = field(default_factory=dict)
+    palette: Optional[List[int]] = None
+    palette_num_colors: int = 0
+
+    def merge(self, other: 'ImageStatistics') -> 'ImageStatistics':
+        """
+        Adds the statistics of other images to these statistics. The dimensions of the first image are kept.
 
+        :param other: the statistics to add
+        :type other: ImageStatistics
+        :return: self
+        :rtype: ImageStatistics
+        """
+        self.pixel_count += other.pixel_count
+        self.channel_sum = self.channel_sum + other.channel_sum
+        self.channel_square_sum = self.channel_square_sum + other.channel_square_sum
+        if self.width is None:
+            self.width, self.height = other.width, other.height
+        for key, count in other.class_counts.items():
+            self.class_counts[key] = self.class_counts.get(key, 0) + count
+        if other.palette_num_colors > self.palette_num_colors:
+            self.palette = other.palette
+            self.palette_num_colors = other.palette_num_colors
+        return self
 
-def _cms_online(file_names: Union[np.ndarray, List[Path]], workers=4) -> Tuple[float, float]:
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Converts the statistics into a json serializable dictionary. Empty fields are left out.
+
+        :return: the statistics as dictionary
+        :rtype: Dict[str, Any]
+        """
+        result = {}
+        if self.pixel_count:
+            result.update(pixel_count=self.pixel_count, channel_sum=self.channel_sum.tolist(),
+                          channel_square_sum=self.channel_square_sum.tolist(), width=self.width, height=self.height)
+        if self.class_counts:
+            result['class_counts'] = {str(k): v for k, v in self.class_counts.items()}
+        if self.palette is not None:
+            result.update(palette=self.palette, palette_num_colors=self.palette_num_colors)
+        return result
+
+    @classmethod
+    def from_dict(cls, statistics: Dict[str, Any]) -> 'ImageStatistics':
+        """
+        Creates the statistics out of a dictionary of :meth:`to_dict`.
+
+        :param statistics: the statistics as dictionary
+        :type statistics: Dict[str, Any]
+        :return: the statistics
+        :rtype: ImageStatistics
+        """
+        result = cls(pixel_count=statistics.get('pixel_count', 0),
+                     width=statistics.get('width'), height=statistics.get('height'),
+                     class_counts={int(k): v for k, v in statistics.get('class_counts', {}).items()},
+                     palette=statistics.get('palette'), palette_num_colors=statistics.get('palette_num_colors', 0))
+        if 'channel_sum' in statistics:
+            result.channel_sum = np.asarray(statistics['channel_sum'], dtype=np.int64)
+            result.channel_square_sum = np.asarray(statistics['channel_square_sum'], dtype=np.int64)
+        return result
+
+    @property
+    def mean(self) -> np.ndarray:
+        """
+        Mean per channel in the range [0, 1].
+        """
+        return self.channel_sum / self.pixel_count / 255.0
+
+    @property
+    def std(self) -> np.ndarray:
+        """
+        Standard deviation per channel in the range [0, 1].
+        """
+        # n^2 * var = n * sum(x^2) - sum(x)^2 is exact with python integers
+        n = self.pixel_count
+        variance = np.array([(n * int(sq) - int(s) ** 2) / n ** 2
+                             for s, sq in zip(self.channel_sum, self.channel_square_sum)])
+        return np.sqrt(variance) / 255.0
+
+    @property
+    def classes(self) -> List[int]:
+        """
+        Sorted keys of the classes that occur in the gt images.
+        """
+        return sorted(self.class_counts.keys())
+
+    @property
+    def num_samples_per_class(self) -> np.ndarray:
+        """
+        Number of pixels per class in the order of :attr:`classes`.
+        """
+        return np.asarray([self.class_counts[k] for k in self.classes])
+
+
+class AnalyticsCache:
     """
-    Computes mean and image_classification deviation in an online fashion.
-    This is useful when the dataset is too big to be allocated in memory.
+    Keeps the statistics of single files, so that the statistics of a set of files just have to be computed for the
+    files that are new or changed. The cache directory holds one sidecar file per image directory, next to a small
+    file with the path of the image directory. Symlinks are resolved, so all the splits of a dataset share the same
+    entries. An entry is valid as long as the size and the modification time of the file do not change. The
+    modification time of the directory file is the last use of the sidecar. Nothing is removed automatically, the
+    cache directory is usually shared by all the nodes of a cluster, which do not see the same image directories.
+    Use :meth:`prune` (or ``tools/prune_analytics_cache.py``) to remove the sidecars of deleted directories.
 
-    :param file_names: List of file names of the dataset
-    :type file_names: Union[np.ndarray[str], List[Path]]
-    :param workers: Number of workers to use for the mean/std computation
-    :type workers: int
+    :param cache_dir: directory of the sidecar files, default is the environment variable
+        :data:`ANALYTICS_CACHE_DIR_ENV` or ``~/.cache/diva_daf/analytics``
+    :type cache_dir: Optional[Union[str, Path]]
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        if cache_dir is None:
+            cache_dir = os.environ.get(ANALYTICS_CACHE_DIR_ENV, Path('~/.cache/diva_daf/analytics'))
+        self.cache_dir = Path(cache_dir).expanduser()
+        self._sidecars: Dict[Path, Dict[str, Any]] = {}
+        self._changed: Set[Path] = set()
+
+    def get(self, path: Union[str, Path], kind: str) -> Optional[ImageStatistics]:
+        """
+        Returns the cached statistics of the file.
+
+        :param path: path to the file
+        :type path: Union[str, Path]
+        :param kind: kind of the statistics ('data' or 'gt.<gt_format>')
+        :type kind: str
+        :return: the statistics or None if they are not cached or outdated
+        :rtype: Optional[ImageStatistics]
+        """
+        real_path, file_stat = _get_real_path_and_stat(path)
+        entry = self._get_sidecar(real_path.parent).get(real_path.name)
+        if entry is None or entry['size'] != file_stat.st_size or entry['mtime_ns'] != file_stat.st_mtime_ns \
+                or kind not in entry['statistics']:
+            return None
+        return ImageStatistics.from_dict(entry['statistics'][kind])
+
+    def put(self, path: Union[str, Path], kind: str, statistics: ImageStatistics) -> None:
+        """
+        Adds the statistics of a file to the cache.
+
+        :param path: path to the file
+        :type path: Union[str, Path]
+        :param kind: kind of the statistics ('data' or 'gt.<gt_format>')
+        :type kind: str
+        :param statistics: statistics of the file
+        :type statistics: ImageStatistics
+        """
+        real_path, file_stat = _get_real_path_and_stat(path)
+        sidecar = self._get_sidecar(real_path.parent)
+        entry = sidecar.get(real_path.name)
+        if entry is None or entry['size'] != file_stat.st_size or entry['mtime_ns'] != file_stat.st_mtime_ns:
+            entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'statistics': {}}
+            sidecar[real_path.name] = entry
+        entry['statistics'][kind] = statistics.to_dict()
+        self._changed.add(real_path.parent)
+
+    def save(self) -> None:
+        """
+        Writes the changed sidecar files.
+        """
+        for directory in self._changed:
+            sidecar_path = self._get_sidecar_path(directory)
+            tmp_path = sidecar_path.with_name(f'{sidecar_path.name}.{os.getpid()}.tmp')
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                # the directory is written first, so prune never sees a new sidecar without it
+                sidecar_path.with_suffix('.dir').write_text(str(directory))
+                with tmp_path.open(mode='w') as f:
+                    json.dump(obj=self._sidecars[directory], fp=f, separators=(',', ':'))
+                # replace is atomic, so a reader never sees a partially written file
+                os.replace(tmp_path, sidecar_path)
+            except OSError:
+                logging.warning(f'Could not write the analytics cache ({sidecar_path})')
+        self._changed.clear()
+
+    def prune(self, min_age_days: float = 30.) -> int:
+        """
+        Removes the sidecar files of image directories that do not exist on this machine and that have not been used
+        for ``min_age_days``. Directories that are just mounted on other nodes are kept as long as they are used.
+
+        :param min_age_days: minimal number of days since the last use of a sidecar that is removed
+        :type min_age_days: float
+        :return: number of removed sidecar files
+        :rtype: int
+        """
+        min_last_use = time.time() - min_age_days * 24 * 60 * 60
+        num_removed = 0
+        for sidecar_path in self.cache_dir.glob('*.json'):
+            directory_path = sidecar_path.with_suffix('.dir')
+            try:
+                # sidecars without the directory file are from an older version of the cache
+                last_use_path = directory_path if directory_path.exists() else sidecar_path
+                if last_use_path.stat().st_mtime > min_last_use or \
+                        (directory_path.exists() and Path(directory_path.read_text()).is_dir()):
+                    continue
+                sidecar_path.unlink(missing_ok=True)
+                directory_path.unlink(missing_ok=True)
+                num_removed += 1
+            except OSError:
+                logging.warning(f'Could not prune the analytics cache ({sidecar_path})')
+        return num_removed
 
-    :returns: mean and std
-    :rtype: Tuple[float, float]
+    def _get_sidecar_path(self, directory: Path) -> Path:
+        return self.cache_dir / f'{hashlib.sha1(str(directory).encode()).hexdigest()}.json'
+
+    def _get_sidecar(self, directory: Path) -> Dict[str, Any]:
+        if directory not in self._sidecars:
+            sidecar_path = self._get_sidecar_path(directory)
+            sidecar = {}
+            if sidecar_path.exists():
+                try:
+                    with sidecar_path.open(mode='r') as f:
+                        sidecar = json.load(fp=f)
+                except (OSError, ValueError):
+                    logging.warning(f'Could not read the analytics cache ({sidecar_path}), it will be rebuilt')
+                # marks the last use for prune
+                _touch(sidecar_path.with_suffix('.dir'))
+            self._sidecars[directory] = sidecar
+        return self._sidecars[directory]
+
+
+def compute_statistics(data_paths: Optional[Sequence[Union[str, Path]]] = None,
+                       gt_paths: Optional[Sequence[Union[str, Path]]] = None,
+                       gt_format: str = 'rgb', workers: int = 8, use_cache: bool = True) -> ImageStatistics:
+    """
+    Computes the statistics of the data images (mean, std, dimensions) and the gt images (pixels per class) in one
+    parallel pass. Every image is decoded just once. With ``use_cache`` the statistics of every single file are kept
+    in an :class:`AnalyticsCache`, so only new or changed files are decoded.
+
+    :param data_paths: paths to the data images, None to skip the data statistics
+    :type data_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_paths: paths to the gt images, None to skip the gt statistics
+    :type gt_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_format: how the classes are read from the gt images (one of :data:`GT_FORMATS`)
+    :type gt_format: str
+    :param workers: number of processes, with 1 or less the images are processed in the current process
+    :type workers: int
+    :param use_cache: if True, the statistics of the single files are read from and written to the cache
+    :type use_cache: bool
+    :return: the statistics of all images
+    :rtype: ImageStatistics
     """
-    logging.info('Begin computing the mean')
+    data_paths, gt_paths = _check_paths(data_paths=data_paths, gt_paths=gt_paths, gt_format=gt_format)
+    num_files = len(data_paths)
+
+    gt_kind = f'gt.{gt_format}'
+    cache = AnalyticsCache() if use_cache else None
+    data_statistics = [None] * num_files
+    gt_statistics = [None] * num_files
+    if cache is not None:
+        for i, (data_path, gt_path) in enumerate(zip(data_paths, gt_paths)):
+            if data_path is not None:
+                data_statistics[i] = cache.get(data_path, kind='data')
+            if gt_path is not None:
+                gt_statistics[i] = cache.get(gt_path, kind=gt_kind)
 
-    # Set up a pool of workers
-    pool = Pool(workers + 1)
+    # just decode the files that are not in the cache
+    tasks = [(i, data_path if data_statistics[i] is None else None, gt_path if gt_statistics[i] is None else None,
+              gt_format)
+             for i, (data_path, gt_path) in enumerate(zip(data_paths, gt_paths))]
+    tasks = [task for task in tasks if task[1] is not None or task[2] is not None]
+    logging.info(f'Begin computing the statistics of {len(tasks)} of {num_files} images')
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_get_image_statistics_task, tasks)
+        _collect_results(results, data_statistics, gt_statistics, data_paths, gt_paths, gt_kind, cache)
+    else:
+        with Pool(min(workers, len(tasks))) as pool:
+            results = pool.imap_unordered(_get_image_statistics_task, tasks,
+                                          chunksize=max(1, len(tasks) // (4 * workers)))
+            _collect_results(results, data_statistics, gt_statistics, data_paths, gt_paths, gt_kind, cache)
+    if cache is not None:
+        cache.save()
 
-    # Online mean
-    results = pool.map(_return_mean, file_names)
-    mean_sum = np.sum(np.array(results), axis=0)
+    # merge in the order of the files, so the dimensions are the ones of the first image
+    statistics = ImageStatistics()
+    for file_statistics in itertools.chain(data_statistics, gt_statistics):
+        if file_statistics is not None:
+            statistics.merge(file_statistics)
+    logging.info('Finished computing the statistics')
+    return statistics
 
-    # Divide by number of samples in train set
-    mean = mean_sum / file_names.size
 
-    logging.info('Finished computing the mean')
-    logging.info('Begin computing the std')
+@dataclass
+class StatisticsEstimate:
+    """
+    Error bounds of statistics that are estimated on a sample of the images (see :func:`estimate_statistics`).
+    The errors are the half widths of the confidence intervals, in the range [0, 1] like the mean, std and the
+    class frequencies.
+
+    :param num_pages: number of sampled images
+    :type num_pages: int
+    :param num_pages_total: number of images
+    :type num_pages_total: int
+    :param pixels_per_page: maximal number of sampled pixels per data image
+    :type pixels_per_page: int
+    :param confidence: confidence level of the intervals
+    :type confidence: float
+    :param mean_error: error of the mean per channel
+    :type mean_error: Optional[np.ndarray]
+    :param std_error: error of the standard deviation per channel
+    :type std_error: Optional[np.ndarray]
+    :param class_frequency_error: error of the frequency per class
+    :type class_frequency_error: Dict[int, float]
+    """
+    num_pages: int
+    num_pages_total: int
+    pixels_per_page: int
+    confidence: float
+    mean_error: Optional[np.ndarray] = None
+    std_error: Optional[np.ndarray] = None
+    class_frequency_error: Dict[int, float] = field(default_factory=dict)
 
-    # Online image_classification deviation
-    results = pool.starmap(_return_std, [[item, mean] for item in file_names])
-    std_sum = np.sum(np.array([item[0] for item in results]), axis=0)
-    total_pixel_count = np.sum(np.array([item[1] for item in results]))
-    std = np.sqrt(std_sum / total_pixel_count)
-    logging.info('Finished computing the std')
+    @property
+    def max_error(self) -> float:
+        """
+        Largest error of all the estimated values.
+        """
+        errors = list(self.class_frequency_error.values())
+        if self.mean_error is not None:
+            errors += self.mean_error.tolist() + self.std_error.tolist()
+        return max(errors, default=0.)
 
-    # Shut down the pool
-    pool.close()
+    def data_analytics(self) -> Dict[str, Any]:
+        """
+        :return: the error bounds of the data statistics to store in the analytics file
+        :rtype: Dict[str, Any]
+        """
+        return {'num_pages': self.num_pages, 'num_pages_total': self.num_pages_total,
+                'pixels_per_page': self.pixels_per_page, 'confidence': self.confidence,
+                'mean_error': self.mean_error.tolist(), 'std_error': self.std_error.tolist()}
 
-    return mean, std
+    def gt_analytics(self, classes: List[int]) -> Dict[str, Any]:
+        """
+        :param classes: keys of the classes in the order of the class encodings
+        :type classes: List[int]
+        :return: the error bounds of the gt statistics to store in the analytics file
+        :rtype: Dict[str, Any]
+        """
+        return {'num_pages': self.num_pages, 'num_pages_total': self.num_pages_total,
+                'confidence': self.confidence,
+                'class_frequency_error': [self.class_frequency_error[c] for c in classes]}
 
 
-def _return_mean(image_path: str) -> ndarray:
+def estimate_statistics(data_paths: Optional[Sequence[Union[str, Path]]] = None,
+                        gt_paths: Optional[Sequence[Union[str, Path]]] = None,
+                        gt_format: str = 'rgb', tolerance: float = 0.005, confidence: float = 0.95,
+                        pixels_per_page: int = 10000, min_pages: int = 10, seed: int = 0,
+                        workers: int = 8) -> Tuple[ImageStatistics, StatisticsEstimate]:
     """
-    Computes mean of a single image
+    Estimates the statistics of :func:`compute_statistics` on a random sample of the images. The images are
+    analysed in a random order until the confidence intervals of the mean, the std and the class frequencies are
+    all smaller than ``tolerance`` (or all images are analysed). Of every data image ``pixels_per_page`` random
+    pixels are used. The gt images are always counted completely, so all the classes of a sampled image are found,
+    but classes that just occur on images that are not sampled are missing.
 
-    :param image_path: Path to the image
-    :type image_path: str
-    :returns: mean
-    :rtype: float
+    The intervals treat the images as clusters of pixels (ratio estimator), so the correlation of the pixels within
+    an image is taken into account. The class counts are scaled up to the number of images.
+
+    :param data_paths: paths to the data images, None to skip the data statistics
+    :type data_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_paths: paths to the gt images, None to skip the gt statistics
+    :type gt_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_format: how the classes are read from the gt images (one of :data:`GT_FORMATS`)
+    :type gt_format: str
+    :param tolerance: maximal half width of the confidence intervals (the values are in the range [0, 1])
+    :type tolerance: float
+    :param confidence: confidence level of the intervals
+    :type confidence: float
+    :param pixels_per_page: number of sampled pixels per data image
+    :type pixels_per_page: int
+    :param min_pages: minimal number of sampled images
+    :type min_pages: int
+    :param seed: seed of the random sampling
+    :type seed: int
+    :param workers: number of processes, with 1 or less the images are processed in the current process
+    :type workers: int
+    :return: the estimated statistics and their error bounds
+    :rtype: Tuple[ImageStatistics, StatisticsEstimate]
     """
-    img = np.array(Image.open(image_path).convert('RGB'))
-    mean = np.array([np.mean(img[:, :, 0]), np.mean(img[:, :, 1]), np.mean(img[:, :, 2])]) / 255.0
-    return mean
+    data_paths, gt_paths = _check_paths(data_paths=data_paths, gt_paths=gt_paths, gt_format=gt_format)
+    num_files = len(data_paths)
+    if not 0 < confidence < 1:
+        msg = f'confidence has to be in (0, 1) (got {confidence})'
+        logging.error(msg)
+        raise ValueError(msg)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    if not num_files:
+        return ImageStatistics(), StatisticsEstimate(num_pages=0, num_pages_total=0, pixels_per_page=pixels_per_page,
+                                                     confidence=confidence)
+
+    order = np.random.default_rng(seed).permutation(num_files)
+    tasks = [(i, data_paths[i], gt_paths[i], gt_format, pixels_per_page, seed) for i in order]
+    # check the convergence after every round of the workers
+    check_interval = max(1, workers)
+    data_statistics = []
+    gt_statistics = []
+
+    def _sample(results: Iterable[Tuple[int, Optional[ImageStatistics], Optional[ImageStatistics]]]) \
+            -> StatisticsEstimate:
+        for num_pages, (_, data_result, gt_result) in enumerate(results, start=1):
+            if data_result is not None:
+                data_statistics.append(data_result)
+            if gt_result is not None:
+                gt_statistics.append(gt_result)
+            if num_pages == num_files or (num_pages >= min_pages and num_pages % check_interval == 0):
+                page_estimate = _get_estimate(data_statistics, gt_statistics, z=z, num_pages_total=num_files,
+                                              pixels_per_page=pixels_per_page, confidence=confidence)
+                if num_pages == num_files or page_estimate.max_error <= tolerance:
+                    return page_estimate
+
+    logging.info(f'Begin estimating the statistics of {num_files} images (tolerance {tolerance})')
+    if workers <= 1 or num_files <= 1:
+        estimate = _sample(map(_estimate_image_statistics_task, tasks))
+    else:
+        with Pool(min(workers, num_files)) as pool:
+            # ordered, so the sample does not depend on the number of workers
+            estimate = _sample(pool.imap(_estimate_image_statistics_task, tasks))
+
+    statistics = ImageStatistics()
+    if num_files and data_paths[0] is not None:
+        with Image.open(data_paths[0]) as img:
+            statistics.width, statistics.height = img.size
+    for file_statistics in itertools.chain(data_statistics, gt_statistics):
+        statistics.merge(file_statistics)
+    scale = num_files / estimate.num_pages
+    statistics.class_counts = {k: max(1, round(v * scale)) for k, v in statistics.class_counts.items()}
+    logging.info(f'Finished estimating the statistics on {estimate.num_pages} of {num_files} images '
+                 f'(max error {estimate.max_error:.4f})')
+    return statistics, estimate
 
 
-def _return_std(image_path: str, mean: ndarray) -> Tuple[ndarray, float]:
+def get_statistics(data_paths: Optional[Sequence[Union[str, Path]]] = None,
+                   gt_paths: Optional[Sequence[Union[str, Path]]] = None,
+                   gt_format: str = 'rgb', workers: int = 8, estimation: Optional[Dict[str, Any]] = None) \
+        -> Tuple[ImageStatistics, Optional[StatisticsEstimate]]:
     """
-    Computes image_classification deviation of a single image
+    Computes the statistics exactly (:func:`compute_statistics`) or, if ``estimation`` is given, estimates them on
+    a sample of the images (:func:`estimate_statistics`).
 
-    :param image_path: Path to the image
-    :type image_path: str
-    :param mean: Mean value of all pixels of the image
-    :type mean: ndarray[Any, dtype[floating[Any]]]
+    :param data_paths: paths to the data images, None to skip the data statistics
+    :type data_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_paths: paths to the gt images, None to skip the gt statistics
+    :type gt_paths: Optional[Sequence[Union[str, Path]]]
+    :param gt_format: how the classes are read from the gt images (one of :data:`GT_FORMATS`)
+    :type gt_format: str
+    :param workers: number of processes
+    :type workers: int
+    :param estimation: keyword arguments of :func:`estimate_statistics` (e.g. ``{'tolerance': 0.005}``) or None
+    :type estimation: Optional[Dict[str, Any]]
+    :return: the statistics and the error bounds (None if the statistics are exact)
+    :rtype: Tuple[ImageStatistics, Optional[StatisticsEstimate]]
+    """
+    if estimation is None:
+        return compute_statistics(data_paths=data_paths, gt_paths=gt_paths, gt_format=gt_format,
+                                  workers=workers), None
+    return estimate_statistics(data_paths=data_paths, gt_paths=gt_paths, gt_format=gt_format, workers=workers,
+                               **estimation)
+
+
+def get_image_statistics(data_path: Optional[str], gt_path: Optional[str], gt_format: str = 'rgb') -> ImageStatistics:
+    """
+    Computes the statistics of one data image and its gt image.
 
-    :returns: Standard deviation of all pixels of the image
-    :rtype: Tuple[ndarray[Any, dtype[floating[Any]]], float]
+    :param data_path: path to the data image or None
+    :type data_path: Optional[str]
+    :param gt_path: path to the gt image or None
+    :type gt_path: Optional[str]
+    :param gt_format: how the classes are read from the gt image (one of :data:`GT_FORMATS`)
+    :type gt_format: str
+    :return: the statistics of the image
+    :rtype: ImageStatistics
     """
-    img = np.array(Image.open(image_path).convert('RGB')) / 255.0
-    m2 = np.square(np.array([img[:, :, 0] - mean[0], img[:, :, 1] - mean[1], img[:, :, 2] - mean[2]]))
-    return np.sum(np.sum(m2, axis=1), 1), m2.size / 3.0
+    statistics = ImageStatistics()
+    if data_path is not None:
+        statistics.merge(_get_data_statistics(data_path))
+    if gt_path is not None:
+        statistics.merge(_get_gt_statistics(gt_path, gt_format=gt_format))
+    return statistics
 
 
-def _cms_inmem(file_names: np.ndarray) -> Tuple[ndarray, ndarray]:
+def _get_data_statistics(data_path: str, num_pixels: Optional[int] = None,
+                         rng: Optional[np.random.Generator] = None) -> ImageStatistics:
+    statistics = ImageStatistics()
+    with Image.open(data_path) as img:
+        statistics.width, statistics.height = img.size
+        img = np.asarray(img.convert('RGB')).reshape(-1, 3)
+    if num_pixels is not None and num_pixels < img.shape[0]:
+        img = img[rng.integers(0, img.shape[0], size=num_pixels)]
+    statistics.pixel_count = img.shape[0]
+    statistics.channel_sum = img.sum(axis=0, dtype=np.int64)
+    img = img.astype(np.int64)
+    statistics.channel_square_sum = np.einsum('ij,ij->j', img, img)
+    return statistics
+
+
+def _get_gt_statistics(gt_path: str, gt_format: str) -> ImageStatistics:
+    statistics = ImageStatistics()
+    if gt_format == 'rgb':
+        with Image.open(gt_path) as gt:
+            gt = np.asarray(gt.convert('RGB')).astype(np.int64)
+        keys, counts = np.unique((gt[:, :, 0] << 16) | (gt[:, :, 1] << 8) | gt[:, :, 2], return_counts=True)
+    elif gt_format == 'hisdb':
+        with Image.open(gt_path) as gt:
+            gt = np.asarray(gt)[:, :, 2]
+        counts = np.bincount(gt.ravel(), minlength=256)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        gt = pil_loader_gif(gt_path)
+        statistics.palette = gt.getpalette()
+        counts = np.bincount(np.asarray(gt).ravel(), minlength=256)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+        statistics.palette_num_colors = len(keys)
+    statistics.class_counts = dict(zip(keys.tolist(), counts.tolist()))
+    return statistics
+
+
+def unpack_rgb(key: int) -> Tuple[int, int, int]:
     """
-    Computes mean and image_classification deviation in an offline fashion. This is possible only when the dataset can
-    be allocated in memory.
+    Converts a class key of the 'rgb' gt format back into the colour.
 
+    :param key: the packed colour (R << 16 | G << 8 | B)
+    :type key: int
+    :return: the colour (R, G, B)
+    :rtype: Tuple[int, int, int]
+    """
+    return (key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF
 
-    :param file_names: List of file names of the dataset
-    :type file_names: np.ndarray[str]
 
-    :returns: Mean value of all pixels of the images in the input folder and the
-    standard deviation of all pixels of the images in the input folder
-    :rtype: Tuple[ndarray[Any, dtype[floating[Any]]], ndarray[Any, dtype[floating[Any]]]]
+def compute_mean_std(file_names: Union[np.ndarray, List[Path]], inmem: bool = False, workers: int = 8) \
+        -> Tuple[np.ndarray, np.ndarray]:
     """
-    img = np.zeros([file_names.size] + list(np.array(Image.open(file_names[0]).convert('RGB')).shape))
+    Computes mean and std of all images present at target folder.
+
+    :param file_names: List of the file names of the images
+    :type file_names: Union[np.ndarray[str], List[Path]]
+    :param inmem: not used anymore, the statistics are always computed in one streaming pass
+    :type inmem: bool
+    :param workers: Number of workers to use for the mean/std computation
+    :type workers: int
+    :return: mean and std
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    statistics = compute_statistics(data_paths=list(file_names), workers=workers)
+    return statistics.mean, statistics.std
+
+
+def _get_image_statistics_task(task: Tuple[int, Optional[str], Optional[str], str]) \
+        -> Tuple[int, Optional[ImageStatistics], Optional[ImageStatistics]]:
+    index, data_path, gt_path, gt_format = task
+    data_statistics = _get_data_statistics(data_path) if data_path is not None else None
+    gt_statistics = _get_gt_statistics(gt_path, gt_format=gt_format) if gt_path is not None else None
+    return index, data_statistics, gt_statistics
+
+
+def _estimate_image_statistics_task(task: Tuple[int, Optional[str], Optional[str], str, int, int]) \
+        -> Tuple[int, Optional[ImageStatistics], Optional[ImageStatistics]]:
+    index, data_path, gt_path, gt_format, pixels_per_page, seed = task
+    # one generator per image, so the sampled pixels do not depend on the order of the workers
+    rng = np.random.default_rng([seed, index])
+    data_statistics = _get_data_statistics(data_path, num_pixels=pixels_per_page, rng=rng) \
+        if data_path is not None else None
+    gt_statistics = _get_gt_statistics(gt_path, gt_format=gt_format) if gt_path is not None else None
+    return index, data_statistics, gt_statistics
+
+
+def _get_estimate(data_statistics: List[ImageStatistics], gt_statistics: List[ImageStatistics], z: float,
+                  num_pages_total: int, pixels_per_page: int, confidence: float) -> StatisticsEstimate:
+    num_pages = max(len(data_statistics), len(gt_statistics))
+    estimate = StatisticsEstimate(num_pages=num_pages, num_pages_total=num_pages_total,
+                                  pixels_per_page=pixels_per_page, confidence=confidence)
+    if data_statistics:
+        counts = np.asarray([s.pixel_count for s in data_statistics], dtype=np.float64)
+        sums = np.stack([s.channel_sum for s in data_statistics]).astype(np.float64)
+        square_sums = np.stack([s.channel_square_sum for s in data_statistics]).astype(np.float64)
+        mean, mean_se = _ratio_estimate(sums, counts)
+        square_mean, _ = _ratio_estimate(square_sums, counts)
+        std = np.sqrt(np.maximum(square_mean - mean ** 2, 0))
+        # delta method: linearization of the variance around the estimate
+        variance_residuals = (square_sums - square_mean * counts[:, None]) \
+            - 2 * mean * (sums - mean * counts[:, None])
+        variance_se = _standard_error(variance_residuals, counts)
+        std_se = np.where(std > 0, variance_se / (2 * np.maximum(std, 1e-12)), np.sqrt(variance_se))
+        estimate.mean_error = z * mean_se / 255.0
+        estimate.std_error = z * std_se / 255.0
+    if gt_statistics:
+        classes = sorted(set(itertools.chain.from_iterable(s.class_counts.keys() for s in gt_statistics)))
+        class_counts = np.asarray([[s.class_counts.get(c, 0) for c in classes] for s in gt_statistics],
+                                  dtype=np.float64)
+        _, frequency_se = _ratio_estimate(class_counts, class_counts.sum(axis=1))
+        # the gt images are counted completely, so the finite population correction applies
+        frequency_se *= np.sqrt(1 - num_pages / num_pages_total)
+        estimate.class_frequency_error = dict(zip(classes, (z * frequency_se).tolist()))
+    # no error bounds as long as there are not enough images for the variance, except all images are analysed
+    if num_pages < 2 and num_pages < num_pages_total:
+        if estimate.mean_error is not None:
+            estimate.mean_error = np.full(3, np.inf)
+            estimate.std_error = np.full(3, np.inf)
+        estimate.class_frequency_error = {c: float('inf') for c in estimate.class_frequency_error}
+    return estimate
+
+
+def _ratio_estimate(values: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    estimate = values.sum(axis=0) / counts.sum()
+    return estimate, _standard_error(values - np.outer(counts, estimate), counts)
+
+
+def _standard_error(residuals: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    k = residuals.shape[0]
+    if k < 2:
+        return np.zeros(residuals.shape[1:])
+    return np.sqrt((residuals ** 2).sum(axis=0) / (k * (k - 1))) / counts.mean()
+
+
+def _check_paths(data_paths: Optional[Sequence[Union[str, Path]]], gt_paths: Optional[Sequence[Union[str, Path]]],
+                 gt_format: str) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+    if gt_format not in GT_FORMATS:
+        msg = f'gt_format has to be one of {GT_FORMATS} (got {gt_format})'
+        logging.error(msg)
+        raise ValueError(msg)
+
+    num_files = len(data_paths) if data_paths is not None else len(gt_paths) if gt_paths is not None else 0
+    data_paths = [None] * num_files if data_paths is None else list(map(str, data_paths))
+    gt_paths = [None] * num_files if gt_paths is None else list(map(str, gt_paths))
+    if len(data_paths) != len(gt_paths):
+        msg = f'Got {len(data_paths)} data images but {len(gt_paths)} gt images'
+        logging.error(msg)
+        raise ValueError(msg)
+    return data_paths, gt_paths
+
+
+def _collect_results(results: Iterable[Tuple[int, Optional[ImageStatistics], Optional[ImageStatistics]]],
+                     data_statistics: List[Optional[ImageStatistics]], gt_statistics: List[Optional[ImageStatistics]],
+                     data_paths: List[Optional[str]], gt_paths: List[Optional[str]], gt_kind: str,
+                     cache: Optional[AnalyticsCache]) -> None:
+    for index, data_result, gt_result in results:
+        if data_result is not None:
+            data_statistics[index] = data_result
+            if cache is not None:
+                cache.put(data_paths[index], kind='data', statistics=data_result)
+        if gt_result is not None:
+            gt_statistics[index] = gt_result
+            if cache is not None:
+                cache.put(gt_paths[index], kind=gt_kind, statistics=gt_result)
+
 
-    # Load all samples
-    for i, sample in enumerate(file_names):
-        img[i] = np.array(Image.open(sample).convert('RGB'))
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
 
-    mean = np.array([np.mean(img[:, :, :, 0]), np.mean(img[:, :, :, 1]), np.mean(img[:, :, :, 2])]) / 255.0
-    std = np.array([np.std(img[:, :, :, 0]), np.std(img[:, :, :, 1]), np.std(img[:, :, :, 2])]) / 255.0
 
-    return mean, std
+def _get_real_path_and_stat(path: Union[str, Path]) -> Tuple[Path, os.stat_result]:
+    real_path = Path(os.path.realpath(path))
+    return real_path, real_path.stat()
@@ -0,0 +1,226 @@
+"""
+One-time compilation of the ground truth into class index maps.
+
+Without the cache every sample decodes the gt image, converts it to a float tensor and compares the colours with the
+class encodings. :class:`LabelCache` does this once per gt file and stores the class indices as uint8 maps one after
+the other in a flat file next to the analytics of the dataset (``labels.{name}.{token}.bin``). The datasets read the
+labels from a memory map of this file, so the label of a sample is just a slice of the map.
+
+The index ``labels.{name}.json`` holds the gt format, the class encodings and for every gt file its offset and shape
+in the flat file together with the size and modification time of the file. The index, the lock and the update of the
+flat file are the ones of :class:`src.datamodules.utils.memmap_store.MemmapStore`.
+
+Each value is the class index in the lower 7 bits (:data:`IGNORE_LABEL` for colours that are not in the class
+encodings) and the boundary flag of the DIVA-HisDB format in the highest bit (:data:`BOUNDARY_BIT`).
+"""
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple, Dict, Any, Union, Set
+
+import numpy as np
+import torch
+from PIL import Image
+from torch import Tensor
+
+from src.datamodules.utils.memmap_store import MemmapStore
+from src.datamodules.utils.misc import pil_loader_gif
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+LABEL_CACHE_VERSION = 1
+GT_FORMATS = ('rgb', 'hisdb', 'index')
+
+IGNORE_LABEL = 0x7F
+BOUNDARY_BIT = 0x80
+
+# the 'hisdb' encoding of the background, the boundary pixels get this class
+HISDB_BACKGROUND = 0x1
+
+
+class LabelCache(MemmapStore):
+    """
+    Memory mapped class index maps of the gt files of one dataset split. Call :meth:`compile` with the gt files of
+    the dataset before reading them with :meth:`load`.
+
+    :param directory: folder of the cache files (the root of the dataset, like the analytics)
+    :type directory: Path
+    :param name: name of the cache (e.g. ``gt.train``)
+    :type name: str
+    :param gt_format: format of the gt, one of 'rgb' (a colour per class), 'hisdb' (the classes are in the blue
+        channel and the boundaries in the red channel) or 'index' (palette indices)
+    :type gt_format: str
+    :param class_encodings: the class encodings of the analytics ([R, G, B] for 'rgb', the blue value for 'hisdb'),
+        not used for 'index'
+    :type class_encodings: Optional[List[Any]]
+    :param workers: number of processes to compile the gt files
+    :type workers: int
+    """
+    prefix = 'labels'
+    suffix = '.bin'
+    version = LABEL_CACHE_VERSION
+
+    def __init__(self, directory: Path, name: str, gt_format: str, class_encodings: Optional[List[Any]] = None,
+                 workers: int = 8):
+        if gt_format not in GT_FORMATS:
+            msg = f'Unknown gt format {gt_format}, use one of {GT_FORMATS}'
+            log.error(msg)
+            raise ValueError(msg)
+        if class_encodings is not None and len(class_encodings) >= IGNORE_LABEL:
+            msg = f'The label cache supports at most {IGNORE_LABEL - 1} classes, got {len(class_encodings)}'
+            log.error(msg)
+            raise ValueError(msg)
+
+        super().__init__(directory=directory, name=name, workers=workers)
+        self.gt_format = gt_format
+        self.class_encodings = _to_list(class_encodings)
+
+    def load(self, gt_path: Union[str, Path], box: Optional[Tuple[int, int, int, int]] = None) -> Tensor:
+        """
+        Reads the encoded labels of a gt file (see :func:`decode_labels` and :func:`decode_boundary_mask`).
+
+        :param gt_path: path to the gt file
+        :type gt_path: Union[str, Path]
+        :param box: region (left, upper, right, lower) like :meth:`PIL.Image.Image.crop`, None for the whole image
+        :type box: Optional[Tuple[int, int, int, int]]
+        :return: uint8 tensor of size [H x W]
+        :rtype: Tensor
+        """
+        offset, height, width = self._entries[self._key(gt_path)][:3]
+        labels = self._get_memmap()[offset:offset + height * width].reshape(height, width)
+        if box is not None:
+            left, upper, right, lower = box
+            labels = labels[upper:lower, left:right]
+        return torch.from_numpy(np.array(labels))
+
+    def size(self, gt_path: Union[str, Path]) -> Tuple[int, int]:
+        """
+        Size of a compiled gt file like :attr:`PIL.Image.Image.size`.
+
+        :param gt_path: path to the gt file
+        :type gt_path: Union[str, Path]
+        :return: width and height
+        :rtype: Tuple[int, int]
+        """
+        height, width = self._entries[self._key(gt_path)][1:3]
+        return width, height
+
+    def _get_settings(self) -> Dict[str, Any]:
+        return {'gt_format': self.gt_format, 'class_encodings': self.class_encodings}
+
+    def _open_memmap(self, data_path: Path) -> np.ndarray:
+        return np.memmap(data_path, dtype=np.uint8, mode='r')
+
+    def _write_data(self, data_path: Path, paths: Dict[str, Union[str, Path]], reused: Set[str],
+                    old_entries: Dict[str, List[int]], old_data_path: Optional[Path]) -> Dict[str, List[int]]:
+        tasks = [(key, str(path), self.gt_format, self.class_encodings)
+                 for key, path in paths.items() if key not in reused and Path(path).exists()]
+        log.info(f'Compiling the labels of {len(tasks)} of {len(paths)} gt files into {self.directory}')
+
+        entries = {}
+        offset = 0
+        with open(data_path, 'wb') as f:
+            if reused:
+                old_data = np.memmap(old_data_path, dtype=np.uint8, mode='r')
+                for key in sorted(reused):
+                    old_offset, height, width, size, mtime_ns = old_entries[key]
+                    f.write(old_data[old_offset:old_offset + height * width].tobytes())
+                    entries[key] = [offset, height, width, size, mtime_ns]
+                    offset += height * width
+                del old_data
+
+            for key, labels, size, mtime_ns in self._map(_compile_labels_task, tasks):
+                f.write(np.ascontiguousarray(labels).tobytes())
+                height, width = labels.shape
+                entries[key] = [offset, height, width, size, mtime_ns]
+                offset += height * width
+        log.info(f'Finished compiling the labels ({offset / 2 ** 20:.1f} MiB)')
+        return entries
+
+
+def encode_labels(gt: Image.Image, gt_format: str, class_encodings: Optional[List[Any]] = None) -> np.ndarray:
+    """
+    Encodes a gt image into the class indices of the label cache. The class indices are the same as the ones of the
+    ``IntegerEncoding`` of the data modules.
+
+    :param gt: the gt image
+    :type gt: Image.Image
+    :param gt_format: one of 'rgb', 'hisdb' or 'index'
+    :type gt_format: str
+    :param class_encodings: the class encodings of the analytics, not used for 'index'
+    :type class_encodings: Optional[List[Any]]
+    :return: uint8 array of size [H x W]
+    :rtype: np.ndarray
+    """
+    if gt_format == 'index':
+        labels = np.asarray(gt.convert('P'))
+        if labels.size and labels.max() >= IGNORE_LABEL:
+            raise ValueError(f'The label cache supports palette indices up to {IGNORE_LABEL - 1}')
+        return labels.astype(np.uint8)
+
+    gt = np.asarray(gt.convert('RGB'))
+    if gt_format == 'hisdb':
+        keys = gt[:, :, 2].astype(np.int64)
+        boundary = gt[:, :, 0] != 0
+        keys[boundary] = HISDB_BACKGROUND
+        encodings = [int(e) for e in class_encodings]
+    else:
+        keys = (gt[:, :, 0].astype(np.int64) << 16) | (gt[:, :, 1].astype(np.int64) << 8) | gt[:, :, 2]
+        boundary = None
+        encodings = [(int(r) << 16) | (int(g) << 8) | int(b) for r, g, b in class_encodings]
+
+    # duplicated encodings keep the highest class index like the IntegerEncoding
+    lookup = {encoding: index for index, encoding in enumerate(encodings)}
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_labels = np.array([lookup.get(key, IGNORE_LABEL) for key in unique_keys.tolist()], dtype=np.uint8)
+    labels = unique_labels[inverse].reshape(keys.shape)
+    if boundary is not None:
+        labels[boundary] |= BOUNDARY_BIT
+    return labels
+
+
+def decode_labels(labels: Tensor) -> Tensor:
+    """
+    Class indices of the encoded labels of the cache, -1 for the colours that are not in the class encodings.
+
+    :param labels: uint8 tensor from :meth:`LabelCache.load`
+    :type labels: Tensor
+    :return: long tensor of the same size
+    :rtype: Tensor
+    """
+    labels = (labels & IGNORE_LABEL).long()
+    labels[labels == IGNORE_LABEL] = -1
+    return labels
+
+
+def decode_boundary_mask(labels: Tensor) -> Tensor:
+    """
+    Boundary pixels of the encoded labels of the cache (only set for the 'hisdb' format).
+
+    :param labels: uint8 tensor from :meth:`LabelCache.load`
+    :type labels: Tensor
+    :return: bool tensor of the same size
+    :rtype: Tensor
+    """
+    return (labels & BOUNDARY_BIT) != 0
+
+
+def _compile_labels_task(task: Tuple[str, str, str, Optional[List[Any]]]) -> Tuple[str, np.ndarray, int, int]:
+    key, gt_path, gt_format, class_encodings = task
+    stat = os.stat(gt_path)
+    if gt_format == 'index':
+        gt = pil_loader_gif(Path(gt_path))
+    else:
+        with Image.open(gt_path) as gt:
+            gt.load()
+    return key, encode_labels(gt, gt_format=gt_format, class_encodings=class_encodings), stat.st_size, \
+        stat.st_mtime_ns
+
+
+def _to_list(class_encodings: Optional[List[Any]]) -> Optional[List[Any]]:
+    # the encodings are compared with the ones in the json file (e.g. tuples and ListConfig become lists)
+    if class_encodings is None:
+        return None
+    return json.loads(json.dumps([list(e) if not isinstance(e, (int, np.integer)) else int(e)
+                                  for e in class_encodings]))
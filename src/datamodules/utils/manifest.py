@@ -0,0 +1,305 @@
+"""
+Persistent index of the files of a dataset split, so the directory tree does not have to be walked and sorted on
+every run (listing hundreds of thousands of crops on a network file system takes minutes).
+
+The manifest is a json file in the split folder (e.g. ``train/.manifest.data.gt.json``) with the relative paths of
+the data and gt files, the page name, the crop coordinates (cropped datasets) and the image size of every file.
+It is valid as long as the modification times of the scanned directories do not change, which is the case as
+long as no file is added, removed or renamed. Checking this costs one ``stat`` per directory.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple, Dict, Union, Sequence
+
+from PIL import Image
+from omegaconf import ListConfig
+from torchvision.datasets.folder import has_file_allowed_extension
+
+from src.datamodules.utils.misc import save_json, dataset_lock, selection_validation
+from src.datamodules.utils.output_merger import PATCH_COORDINATES
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+MANIFEST_VERSION = 1
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.gif')
+
+# number of threads to read the image sizes (the headers) when the manifest is built
+NUM_THREADS_IMAGE_SIZE = 16
+
+
+@dataclass
+class DatasetManifest:
+    """
+    Index of the data and gt files of a split. All lists have one element per file pair, the paths are relative to
+    the split folder.
+
+    :param root: the split folder
+    :type root: Path
+    :param cropped: if True, the files are crops in one sub folder per page
+    :type cropped: bool
+    :param data_paths: relative paths of the data files
+    :type data_paths: List[str]
+    :param gt_paths: relative paths of the gt files
+    :type gt_paths: List[str]
+    :param pages: name of the page of each file (the sub folder for crops, the file name for full pages)
+    :type pages: List[str]
+    :param sizes: width and height of each data image (None if the file is not an image)
+    :type sizes: List[Optional[Tuple[int, int]]]
+    :param directory_mtimes: modification time of the scanned directories (relative path to mtime in ns)
+    :type directory_mtimes: Dict[str, int]
+    """
+    root: Path
+    cropped: bool
+    data_paths: List[str] = field(default_factory=list)
+    gt_paths: List[str] = field(default_factory=list)
+    pages: List[str] = field(default_factory=list)
+    sizes: List[Optional[Tuple[int, int]]] = field(default_factory=list)
+    directory_mtimes: Dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.data_paths)
+
+    @property
+    def names(self) -> List[str]:
+        """
+        File names without extension.
+        """
+        return [Path(p).stem for p in self.data_paths]
+
+    @property
+    def coordinates(self) -> List[Optional[Tuple[int, int]]]:
+        """
+        Top left coordinates of the crops (None for files without coordinates in the name).
+        """
+        coordinates = []
+        for name in self.names:
+            m = PATCH_COORDINATES.match(name)
+            coordinates.append((int(m.group(1)), int(m.group(2))) if m is not None else None)
+        return coordinates
+
+    @property
+    def page_names(self) -> List[str]:
+        """
+        Names of the pages in the order of the manifest, without duplicates.
+        """
+        return list(dict.fromkeys(self.pages))
+
+    def is_valid(self) -> bool:
+        """
+        Checks if the scanned directories are unchanged.
+
+        :return: True if no directory was modified since the manifest was built
+        :rtype: bool
+        """
+        try:
+            return all((self.root / d).stat().st_mtime_ns == mtime for d, mtime in self.directory_mtimes.items())
+        except OSError:
+            return False
+
+    def select(self, selection: Optional[Union[int, List[str], ListConfig]]) -> List[int]:
+        """
+        Indices of the files of the selected pages. The selection works like in the datasets: an integer selects
+        the first n pages, a list selects the pages by name.
+
+        :param selection: selection of the pages, None or 0 for all pages
+        :type selection: Optional[Union[int, List[str], ListConfig]]
+        :return: indices of the selected files
+        :rtype: List[int]
+        """
+        if not selection:
+            return list(range(len(self)))
+        data_root = self.root / Path(self.data_paths[0]).parts[0] if len(self) else self.root
+        if self.cropped:
+            selection = selection_validation([data_root / p for p in self.page_names], selection, full_page=False)
+        else:
+            selection = selection_validation([self.root / p for p in self.data_paths], selection, full_page=True)
+        if not selection:
+            return list(range(len(self)))
+        if isinstance(selection, int):
+            selected_pages = set(self.page_names[:selection])
+        else:
+            selected_pages = set(selection)
+        return [i for i, page in enumerate(self.pages) if page in selected_pages]
+
+    def to_dict(self) -> Dict:
+        return {'version': MANIFEST_VERSION, 'cropped': self.cropped, 'directories': self.directory_mtimes,
+                'data': self.data_paths, 'gt': self.gt_paths, 'pages': self.pages,
+                'sizes': [list(s) if s is not None else None for s in self.sizes]}
+
+    @classmethod
+    def from_dict(cls, root: Path, manifest: Dict) -> 'DatasetManifest':
+        return cls(root=root, cropped=manifest['cropped'], data_paths=manifest['data'], gt_paths=manifest['gt'],
+                   pages=manifest['pages'], sizes=[tuple(s) if s is not None else None for s in manifest['sizes']],
+                   directory_mtimes=manifest['directories'])
+
+
+def get_manifest_path(directory: Path, data_folder_name: str, gt_folder_name: str) -> Path:
+    """
+    :param directory: the split folder
+    :type directory: Path
+    :param data_folder_name: name of the folder that contains the data
+    :type data_folder_name: str
+    :param gt_folder_name: name of the folder that contains the ground truth
+    :type gt_folder_name: str
+    :return: path of the manifest file of the split
+    :rtype: Path
+    """
+    return directory / f'.manifest.{data_folder_name}.{gt_folder_name}.json'
+
+
+def get_manifest(directory: Path, data_folder_name: str, gt_folder_name: str, cropped: bool,
+                 gt_extensions: Union[str, Sequence[str]] = IMG_EXTENSIONS) -> DatasetManifest:
+    """
+    Loads the manifest of the split or builds and saves it if it is missing or outdated. The manifest is built by
+    one process, the others (e.g. DDP ranks) wait and load it.
+
+    Structure of the folder for cropped datasets::
+
+        directory/data/ORIGINAL_FILENAME/FILE_NAME_X_Y.png
+        directory/gt/ORIGINAL_FILENAME/FILE_NAME_X_Y.png
+
+    and for full pages::
+
+        directory/data/FILE_NAME.png
+        directory/gt/FILE_NAME.png
+
+    :param directory: the split folder (train / val / test)
+    :type directory: Path
+    :param data_folder_name: name of the folder that contains the data
+    :type data_folder_name: str
+    :param gt_folder_name: name of the folder that contains the ground truth
+    :type gt_folder_name: str
+    :param cropped: if True, the data and gt folders contain one sub folder with crops per page
+    :type cropped: bool
+    :param gt_extensions: file extensions of the gt images
+    :type gt_extensions: Union[str, Sequence[str]]
+    :return: the manifest
+    :rtype: DatasetManifest
+    """
+    directory = directory.expanduser()
+    manifest_path = get_manifest_path(directory, data_folder_name=data_folder_name, gt_folder_name=gt_folder_name)
+
+    manifest = _load_manifest(directory, manifest_path=manifest_path, cropped=cropped)
+    if manifest is not None:
+        return manifest
+
+    with dataset_lock(directory, name='manifest'):
+        # another process could have built the manifest while we waited for the lock
+        manifest = _load_manifest(directory, manifest_path=manifest_path, cropped=cropped)
+        if manifest is not None:
+            return manifest
+        log.info(f'Building the manifest of {directory}')
+        if cropped:
+            manifest = _build_cropped_manifest(directory, data_folder_name=data_folder_name,
+                                               gt_folder_name=gt_folder_name)
+        else:
+            manifest = _build_full_page_manifest(directory, data_folder_name=data_folder_name,
+                                                 gt_folder_name=gt_folder_name, gt_extensions=gt_extensions)
+        save_json(manifest.to_dict(), manifest_path)
+    return manifest
+
+
+def _load_manifest(directory: Path, manifest_path: Path, cropped: bool) -> Optional[DatasetManifest]:
+    if not manifest_path.exists():
+        return None
+    try:
+        with manifest_path.open(mode='r') as f:
+            manifest_dict = json.load(fp=f)
+    except (OSError, ValueError):
+        log.warning(f'Could not read the manifest {manifest_path}, it will be rebuilt')
+        return None
+    if manifest_dict.get('version') != MANIFEST_VERSION or manifest_dict.get('cropped') != cropped:
+        return None
+    manifest = DatasetManifest.from_dict(root=directory, manifest=manifest_dict)
+    if not manifest.is_valid():
+        log.info(f'The manifest of {directory} is outdated')
+        return None
+    return manifest
+
+
+def _build_cropped_manifest(directory: Path, data_folder_name: str, gt_folder_name: str) -> DatasetManifest:
+    manifest = DatasetManifest(root=directory, cropped=True)
+    path_data_root = directory / data_folder_name
+    path_gt_root = directory / gt_folder_name
+
+    if not (path_data_root.is_dir() or path_gt_root.is_dir()):
+        log.error("folder data or gt not found in " + str(directory))
+
+    _add_directory_mtime(manifest, path_data_root)
+    _add_directory_mtime(manifest, path_gt_root)
+    for path_data_subdir in sorted(path_data_root.iterdir()):
+        if not path_data_subdir.is_dir():
+            if has_file_allowed_extension(path_data_subdir.name, IMG_EXTENSIONS):
+                log.warning("image file found in data root: " + str(path_data_subdir))
+            continue
+
+        path_gt_subdir = path_gt_root / path_data_subdir.stem
+        assert path_gt_subdir.is_dir()
+        _add_directory_mtime(manifest, path_data_subdir)
+        _add_directory_mtime(manifest, path_gt_subdir)
+
+        for path_data_file, path_gt_file in zip(sorted(path_data_subdir.iterdir()),
+                                                sorted(path_gt_subdir.iterdir())):
+            assert has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) == \
+                   has_file_allowed_extension(path_gt_file.name, IMG_EXTENSIONS), \
+                'get_img_gt_path_list(): image file aligned with non-image file'
+
+            if has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) and \
+                    has_file_allowed_extension(path_gt_file.name, IMG_EXTENSIONS):
+                assert path_data_file.stem == path_gt_file.stem, \
+                    'get_img_gt_path_list(): mismatch between data filename and gt filename'
+                _add_file(manifest, path_data_file, path_gt_file, page=path_data_subdir.stem)
+
+    manifest.sizes = _get_image_sizes(manifest)
+    return manifest
+
+
+def _build_full_page_manifest(directory: Path, data_folder_name: str, gt_folder_name: str,
+                              gt_extensions: Union[str, Sequence[str]]) -> DatasetManifest:
+    manifest = DatasetManifest(root=directory, cropped=False)
+    path_data_root = directory / data_folder_name
+    path_gt_root = directory / gt_folder_name
+
+    if not (path_data_root.is_dir() or path_gt_root.is_dir()):
+        log.error("folder data or gt not found in " + str(directory))
+
+    _add_directory_mtime(manifest, path_data_root)
+    _add_directory_mtime(manifest, path_gt_root)
+    for path_data_file, path_gt_file in zip(sorted(path_data_root.iterdir()), sorted(path_gt_root.iterdir())):
+        assert has_file_allowed_extension(path_data_file.name, IMG_EXTENSIONS) == \
+               has_file_allowed_extension(path_gt_file.name, gt_extensions), \
+            'get_img_gt_path_list(): image file aligned with non-image file'
+        _add_file(manifest, path_data_file, path_gt_file, page=path_data_file.stem)
+
+    manifest.sizes = _get_image_sizes(manifest)
+    return manifest
+
+
+def _add_directory_mtime(manifest: DatasetManifest, path: Path) -> None:
+    if path.is_dir():
+        manifest.directory_mtimes[path.relative_to(manifest.root).as_posix()] = path.stat().st_mtime_ns
+
+
+def _add_file(manifest: DatasetManifest, path_data_file: Path, path_gt_file: Path, page: str) -> None:
+    manifest.data_paths.append(path_data_file.relative_to(manifest.root).as_posix())
+    manifest.gt_paths.append(path_gt_file.relative_to(manifest.root).as_posix())
+    manifest.pages.append(page)
+
+
+def _get_image_sizes(manifest: DatasetManifest) -> List[Optional[Tuple[int, int]]]:
+    # just the headers are read, which is dominated by the latency of the file system
+    with ThreadPoolExecutor(max_workers=NUM_THREADS_IMAGE_SIZE) as executor:
+        return list(executor.map(_get_image_size, (manifest.root / p for p in manifest.data_paths)))
+
+
+def _get_image_size(path: Path) -> Optional[Tuple[int, int]]:
+    if not has_file_allowed_extension(path.name, IMG_EXTENSIONS):
+        return None
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except OSError:
+        return None
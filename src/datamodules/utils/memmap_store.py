@@ -0,0 +1,194 @@
+"""
+Base of the memory mapped caches of a dataset split (:class:`src.datamodules.utils.label_cache.LabelCache` and
+:class:`src.datamodules.utils.page_store.PageStore`).
+
+A store compiles the files of a split once into a flat data file (``{prefix}.{name}.{token}{suffix}``) next to the
+analytics of the dataset and the datasets read the samples from a memory map of it. The index
+``{prefix}.{name}.json`` holds the version, the settings of the store, the name of the data file and for every
+source file its entry, which ends with the size and modification time of the file. Files that are new or changed are
+compiled again, the others are copied from the old data file. The new data file gets a new token and replaces the old
+one atomically with the index, so readers never see a partially written file.
+"""
+import json
+import os
+import uuid
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional, Dict, Any, Sequence, Union, List, Callable, Iterator, Set
+
+import numpy as np
+
+from src.datamodules.utils.misc import save_json, dataset_lock
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+class MemmapStore:
+    """
+    Memory mapped store of the files of one dataset split. Subclasses define the settings of the store, how the data
+    file is opened and how it is written. Call :meth:`compile` with the files of the dataset before reading them.
+
+    :param directory: folder of the store files (the root of the dataset, like the analytics)
+    :type directory: Path
+    :param name: name of the store (e.g. ``gt.train``)
+    :type name: str
+    :param workers: number of processes to compile the files
+    :type workers: int
+    """
+    # file names of the store and version of the index, set by the subclasses
+    prefix = ''
+    suffix = ''
+    version = 1
+
+    def __init__(self, directory: Path, name: str, workers: int = 8):
+        self.directory = Path(directory)
+        self.name = name
+        self.workers = workers
+
+        self.index_path = self.directory / f'{self.prefix}.{name}.json'
+        self._data_file = None
+        self._entries = {}
+        self._memmap = None
+
+    def __getstate__(self):
+        # every dataloader worker opens its own memory map
+        state = self.__dict__.copy()
+        state['_memmap'] = None
+        return state
+
+    @property
+    def data_path(self) -> Optional[Path]:
+        return self.directory / self._data_file if self._data_file is not None else None
+
+    def compile(self, paths: Sequence[Union[str, Path]]) -> None:
+        """
+        Makes sure that all the given files are in the store. Missing or changed files are compiled under the dataset
+        lock, so the ranks of a DDP run compile them just once.
+
+        :param paths: paths to the files
+        :type paths: Sequence[Union[str, Path]]
+        """
+        if self._load_index(paths):
+            return
+        with dataset_lock(self.directory, name=self.prefix):
+            if self._load_index(paths):
+                return
+            self._build(paths)
+
+    def _get_settings(self) -> Dict[str, Any]:
+        """
+        Settings of the store that are written to the index. An index with other settings is rebuilt.
+        """
+        return {}
+
+    def _open_memmap(self, data_path: Path) -> np.ndarray:
+        raise NotImplementedError
+
+    def _write_data(self, data_path: Path, paths: Dict[str, Union[str, Path]], reused: Set[str],
+                    old_entries: Dict[str, List[int]], old_data_path: Optional[Path]) -> Dict[str, List[int]]:
+        """
+        Writes the data file of the store.
+
+        :param data_path: path of the new data file
+        :type data_path: Path
+        :param paths: path of every file of the store by its key
+        :type paths: Dict[str, Union[str, Path]]
+        :param reused: keys of the files that are copied from the old data file
+        :type reused: Set[str]
+        :param old_entries: entries of the old index
+        :type old_entries: Dict[str, List[int]]
+        :param old_data_path: path of the old data file, None if there is none
+        :type old_data_path: Optional[Path]
+        :return: the entry of every file, ending with its size and modification time
+        :rtype: Dict[str, List[int]]
+        """
+        raise NotImplementedError
+
+    def _get_memmap(self) -> np.ndarray:
+        if self._memmap is None:
+            self._memmap = self._open_memmap(self.data_path)
+        return self._memmap
+
+    def _key(self, path: Union[str, Path]) -> str:
+        return Path(os.path.relpath(path, self.directory)).as_posix()
+
+    def _read_index_file(self) -> Optional[Dict[str, Any]]:
+        try:
+            with self.index_path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read_index(self) -> Optional[Dict[str, Any]]:
+        index = self._read_index_file()
+        if index is None or index.get('version') != self.version \
+                or any(index.get(key) != value for key, value in self._get_settings().items()) \
+                or not (self.directory / index.get('data', '')).is_file():
+            return None
+        return index
+
+    def _load_index(self, paths: Sequence[Union[str, Path]]) -> bool:
+        index = self._read_index()
+        if index is None or any(not is_up_to_date(index['entries'].get(self._key(p)), p) for p in paths):
+            return False
+        self._data_file = index['data']
+        self._entries = index['entries']
+        self._memmap = None
+        return True
+
+    def _build(self, paths: Sequence[Union[str, Path]]) -> None:
+        # the data file of an outdated index (other version or settings) is replaced as well
+        old_data_file = (self._read_index_file() or {}).get('data')
+        index = self._read_index()
+        old_entries = index['entries'] if index is not None else {}
+
+        # keep the entries of other selections of the split
+        all_paths = {self._key(p): p for p in paths}
+        for key in old_entries:
+            if key not in all_paths and (self.directory / key).exists():
+                all_paths[key] = self.directory / key
+        reused = {key for key, path in all_paths.items() if is_up_to_date(old_entries.get(key), path)}
+
+        data_file = f'{self.prefix}.{self.name}.{uuid.uuid4().hex[:8]}{self.suffix}'
+        entries = self._write_data(self.directory / data_file, paths=all_paths, reused=reused,
+                                   old_entries=old_entries,
+                                   old_data_path=self.directory / index['data'] if index is not None else None)
+
+        save_json({'version': self.version, **self._get_settings(), 'data': data_file, 'entries': entries},
+                  self.index_path)
+        if old_data_file and old_data_file != data_file:
+            # processes that still map the old file keep reading it until they close it
+            (self.directory / old_data_file).unlink(missing_ok=True)
+
+        self._data_file = data_file
+        self._entries = entries
+        self._memmap = None
+
+    def _map(self, function: Callable, tasks: List[Any]) -> Iterator[Any]:
+        # the results are unordered, the tasks carry where their result is written
+        if self.workers <= 1 or len(tasks) <= 1:
+            yield from map(function, tasks)
+        else:
+            with Pool(min(self.workers, len(tasks))) as pool:
+                yield from pool.imap_unordered(function, tasks, chunksize=max(1, len(tasks) // (4 * self.workers)))
+
+
+def is_up_to_date(entry: Optional[List[int]], path: Union[str, Path]) -> bool:
+    """
+    Checks if an entry of a store is still valid for the file.
+
+    :param entry: the entry of the index, ending with the size and modification time of the file, or None
+    :type entry: Optional[List[int]]
+    :param path: path to the file
+    :type path: Union[str, Path]
+    :return: True if the file exists and its size and modification time did not change
+    :rtype: bool
+    """
+    if entry is None:
+        return False
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return entry[-2] == stat.st_size and entry[-1] == stat.st_mtime_ns
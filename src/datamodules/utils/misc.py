@@ -1,11 +1,16 @@
+import itertools
 import json
+import math
+import os
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Union, List, Dict, Tuple, Any
+from typing import Union, List, Dict, Tuple, Any, Iterator, Set
 
 import numpy as np
 import torch
 from PIL import Image
+from filelock import FileLock, Timeout
 from omegaconf import ListConfig
 
 from src.datamodules.utils.exceptions import PathNone, PathNotDir, PathMissingSplitDir, PathMissingDirinSplitDir
@@ -13,6 +18,9 @@ from src.utils import utils
 
 log = utils.get_logger(__name__)
 
+# environment variables with the global rank of the process (DDP, torchrun, SLURM)
+RANK_ENV_VARIABLES = ('RANK', 'SLURM_PROCID', 'LOCAL_RANK')
+
 
 @dataclass
 class ImageDimensions:
@@ -118,16 +126,19 @@ def get_output_file_list(image_path_list: List[Path]) -> List[str]:
 
     duplicate_filenames = []
     output_list = []
+    # the set is used for the membership tests, so the list is built in O(n)
+    output_set = set()
     for p in image_path_list:
         filename = p.stem
-        if filename not in output_list:
-            output_list.append(filename)
+        if filename not in output_set:
+            new_filename = filename
         else:
             duplicate_filenames.append(filename)
-            new_filename = find_new_filename(filename=filename, current_list=output_list)
+            new_filename = find_new_filename(filename=filename, current_list=output_set)
             assert new_filename is not None and len(new_filename) > 0
-            assert new_filename not in output_list
-            output_list.append(new_filename)
+            assert new_filename not in output_set
+        output_list.append(new_filename)
+        output_set.add(new_filename)
 
     assert len(image_path_list) == len(output_list)
 
@@ -139,7 +150,7 @@ def get_output_file_list(image_path_list: List[Path]) -> List[str]:
     return output_list
 
 
-def find_new_filename(filename: str, current_list: List[str]) -> str:
+def find_new_filename(filename: str, current_list: Union[List[str], Set[str]]) -> str:
     """
     Finds a new filename that is not in the current list.
     If the filename is not in the list, it is returned.
@@ -147,16 +158,17 @@ def find_new_filename(filename: str, current_list: List[str]) -> str:
 
     :param filename: Filename to check
     :type filename: str
-    :param current_list: List of filenames to check against
-    :type current_list: List[str]
+    :param current_list: Filenames to check against (a set makes the membership tests O(1))
+    :type current_list: Union[List[str], Set[str]]
     :returns: New filename that is not in the current list
     :rtype: str
     """
-    if filename not in current_list:
+    current_set = current_list if isinstance(current_list, (set, frozenset)) else set(current_list)
+    if filename not in current_set:
         return filename
-    for i in range(len(current_list)):
+    for i in range(len(current_set)):
         new_filename = f'{filename}_{i}'
-        if new_filename not in current_list:
+        if new_filename not in current_set:
             return new_filename
 
     log.error('Unexpected error: Did not find new filename that is not a duplicate!')
@@ -182,7 +194,7 @@ def selection_validation(files_in_data_root: List[Path], selection: Union[int, L
     :rtype: Union[int, List[str], ListConfig]
     """
     if not full_page:
-        subdirectories = [x.name for x in files_in_data_root if x.is_dir()]
+        subdirectories = {x.name for x in files_in_data_root if x.is_dir()}
 
     if isinstance(selection, int):
 
@@ -203,7 +215,8 @@ def selection_validation(files_in_data_root: List[Path], selection: Union[int, L
 
     elif isinstance(selection, ListConfig) or isinstance(selection, list):
         if full_page:
-            if not all(x in [f.stem for f in files_in_data_root] for x in selection):
+            file_stems = {f.stem for f in files_in_data_root}
+            if not all(x in file_stems for x in selection):
                 msg = 'Parameter "selection" contains a non-existing file names.)'
                 log.error(msg)
                 raise ValueError(msg)
@@ -240,6 +253,41 @@ def get_image_dims(data_gt_path_list) -> ImageDimensions:
     return image_dims
 
 
+def get_crop_coordinates(image_dims: ImageDimensions, crop_size: int, overlap: float = 0.5) -> List[Tuple[int, int]]:
+    """
+    Returns the top left coordinates of all crops of a page. The grid is the same as the one used by
+    `tools/generate_cropped_dataset.py`, so the last crop of a row (column) is aligned with the right (bottom)
+    border of the page. The coordinates are ordered column by column (x first, then y).
+
+    :param image_dims: Dimensions of the page
+    :type image_dims: ImageDimensions
+    :param crop_size: Size of the (square) crops
+    :type crop_size: int
+    :param overlap: Overlap of two neighbouring crops (between 0-1)
+    :type overlap: float
+    :returns: List of (x, y) coordinates
+    :rtype: List[Tuple[int, int]]
+    """
+    if image_dims.width < crop_size or image_dims.height < crop_size:
+        msg = f'Page ({image_dims.width}x{image_dims.height}) is smaller than the crop size ({crop_size})'
+        log.error(msg)
+        raise ValueError(msg)
+
+    step_size = int(crop_size * (1 - overlap))
+    if step_size <= 0:
+        msg = f'Parameter "overlap" ({overlap}) leads to a step size of {step_size}'
+        log.error(msg)
+        raise ValueError(msg)
+
+    num_horiz_crops = math.ceil((image_dims.width - crop_size) / step_size + 1)
+    num_vert_crops = math.ceil((image_dims.height - crop_size) / step_size + 1)
+
+    x_positions = [step_size * i for i in range(num_horiz_crops - 1)] + [image_dims.width - crop_size]
+    y_positions = [step_size * i for i in range(num_vert_crops - 1)] + [image_dims.height - crop_size]
+
+    return list(itertools.product(x_positions, y_positions))
+
+
 def pil_loader_gif(path: Path) -> Image:
     """
     Loads a gif image using PIL.
@@ -264,14 +312,18 @@ def save_json(analytics: Dict, analytics_path: Path):
     :type analytics_path: Path
     """
 
+    tmp_path = analytics_path.with_name(f'{analytics_path.name}.{os.getpid()}.tmp')
     try:
-        with analytics_path.open(mode='w') as f:
+        with tmp_path.open(mode='w') as f:
             json.dump(obj=analytics, fp=f)
+        # replace is atomic, so other processes never read a partially written file
+        os.replace(tmp_path, analytics_path)
     except IOError:
         print(f'WARNING: No permissions to write analytics file ({analytics_path})')
 
 
-def check_missing_analytics(analytics_path_gt: Path, expected_keys_gt: List[str]) -> Tuple[Dict[str, Any], bool]:
+def check_missing_analytics(analytics_path_gt: Path, expected_keys_gt: List[str],
+                            allow_estimate: bool = True) -> Tuple[Dict[str, Any], bool]:
     """
     Check if the analytics file for the ground truth is missing and if it is complete. If its is present, it will be
     loaded and the contained keys checked for completeness.
@@ -280,6 +332,8 @@ def check_missing_analytics(analytics_path_gt: Path, expected_keys_gt: List[str]
     :type analytics_path_gt: Path
     :param expected_keys_gt: List of expected keys in the analytics file
     :type expected_keys_gt: List[str]
+    :param allow_estimate: if False, estimated analytics (with the key 'estimate') count as missing
+    :type allow_estimate: bool
     :return: Tuple of the loaded analytics and a boolean indicating if the analytics file is missing
     :rtype: Tuple[Dict[str, Any], bool]
     """
@@ -292,4 +346,49 @@ def check_missing_analytics(analytics_path_gt: Path, expected_keys_gt: List[str]
         # check if analytics file is complete
         if all(k in analytics for k in expected_keys_gt):
             missing_analytics = False
+        if not allow_estimate and 'estimate' in analytics:
+            missing_analytics = True
     return analytics, missing_analytics
+
+
+def get_global_rank() -> int:
+    """
+    Returns the global rank of the process out of the environment variables of the launcher. The datamodules are
+    created before the trainer sets up the process group, so torch.distributed can not be used.
+
+    :return: the global rank or 0 if the process is not part of a distributed run
+    :rtype: int
+    """
+    for env_variable in RANK_ENV_VARIABLES:
+        if env_variable in os.environ:
+            return int(os.environ[env_variable])
+    return 0
+
+
+@contextmanager
+def dataset_lock(input_path: Path, name: str = 'analytics') -> Iterator[None]:
+    """
+    Exclusive lock on a dataset folder (a file ``.<name>.lock`` in the folder) to compute and save files like the
+    analytics just once. The ranks of a DDP run and independent runs on the same dataset wait for the process that
+    holds the lock and read its results afterwards. If the folder is not writable, no lock is used.
+
+    :param input_path: Path to the root of the dataset
+    :type input_path: Path
+    :param name: name of the lock
+    :type name: str
+    """
+    lock = FileLock(str(Path(input_path) / f'.{name}.lock'))
+    try:
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            log.info(f'Rank {get_global_rank()} waits for another process to finish the {name} of {input_path}')
+            lock.acquire()
+    except OSError:
+        log.warning(f'Could not create the {name} lock in {input_path}, continue without lock')
+        yield
+        return
+    try:
+        yield
+    finally:
+        lock.release()
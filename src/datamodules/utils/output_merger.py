@@ -0,0 +1,423 @@
+"""
+Merges the predicted patches of a cropped test set back into full page predictions.
+Used by the merge tools (``tools/merge_cropped_output_*.py``) and the in-process merging of the cropped tasks.
+"""
+import copy
+import re
+import shutil
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Tuple, List, Dict, Optional, Callable, Any
+
+import numpy as np
+from PIL import Image
+from torchvision.datasets.folder import pil_loader
+from tqdm import tqdm
+
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+REDUCERS = ('max', 'mean', 'distance')
+
+PATCH_COORDINATES = re.compile(r'.+_x(\d+)_y(\d+)$')
+
+# the merger of a worker process of CroppedOutputMerger.merge_all, set by the pool initializer
+_WORKER_MERGER: Optional['CroppedOutputMerger'] = None
+
+
+def get_patch_coordinates(patch_name: str) -> Tuple[int, int]:
+    """
+    Extracts the top left coordinates of a patch from its name (e.g. ``page_name_x0128_y0256``).
+
+    :param patch_name: name of the patch
+    :type patch_name: str
+    :return: x and y coordinate of the patch
+    :rtype: Tuple[int, int]
+    """
+    m = PATCH_COORDINATES.match(patch_name)
+    if m is None:
+        raise ValueError(f'Patch name "{patch_name}" does not contain the coordinates (_x<int>_y<int>)')
+    return int(m.group(1)), int(m.group(2))
+
+
+@lru_cache(maxsize=8)
+def _get_distance_weights(height: int, width: int) -> np.ndarray:
+    """
+    Weight of each pixel of a patch for the distance-weighted reducer. The weight is the distance to the closest
+    border of the patch (1 at the border), so the pixels in the center of a patch get the most weight.
+
+    :param height: height of the patch
+    :type height: int
+    :param width: width of the patch
+    :type width: int
+    :return: weights of size [H x W]
+    :rtype: np.ndarray
+    """
+    y = np.minimum(np.arange(1, height + 1), np.arange(height, 0, -1))
+    x = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1))
+    weights = np.minimum(y[:, None], x[None, :]).astype(np.float32)
+    weights.setflags(write=False)
+    return weights
+
+
+class PageAccumulator:
+    """
+    Accumulates the predicted patches of one page. Next to the accumulated values, a coverage map keeps track of
+    which pixels got at least one prediction.
+
+    The reducer defines how overlapping predictions are combined:
+        - ``max``: maximum of the predictions (like :func:`merge_patches`)
+        - ``mean``: mean of the predictions
+        - ``distance``: mean weighted by the distance to the border of the patch
+
+    :param num_classes: number of classes (channels of the prediction)
+    :type num_classes: int
+    :param height: height of the page
+    :type height: int
+    :param width: width of the page
+    :type width: int
+    :param reducer: how overlapping predictions are combined (max, mean, distance)
+    :type reducer: str
+    :param dtype: data type of the accumulator (e.g. np.float32 or np.float16)
+    :type dtype: Any
+    """
+
+    def __init__(self, num_classes: int, height: int, width: int, reducer: str = 'max', dtype: Any = np.float32):
+        if reducer not in REDUCERS:
+            msg = f'Unknown reducer "{reducer}" (available: {", ".join(REDUCERS)})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.reducer = reducer
+        self.dtype = np.dtype(dtype)
+
+        if reducer == 'max':
+            self.values = np.full((num_classes, height, width), fill_value=-np.inf, dtype=self.dtype)
+            self.weights = None
+        else:
+            self.values = np.zeros((num_classes, height, width), dtype=self.dtype)
+            self.weights = np.zeros((height, width), dtype=np.float32)
+        self.coverage = np.zeros((height, width), dtype=bool)
+
+    @property
+    def is_complete(self) -> bool:
+        return bool(self.coverage.all())
+
+    def add_patch(self, patch: np.ndarray, coordinates: Tuple[int, int]) -> None:
+        """
+        Adds the prediction of a patch to the page.
+
+        :param patch: prediction of the patch [#C x crop_height x crop_width]
+        :type patch: np.ndarray
+        :param coordinates: top left coordinates (x, y) of the patch within the page
+        :type coordinates: Tuple[int, int]
+        """
+        x1, y1 = coordinates
+        x2, y2 = x1 + patch.shape[2], y1 + patch.shape[1]
+
+        if patch.shape[0] != self.values.shape[0] or x2 > self.values.shape[2] or y2 > self.values.shape[1]:
+            msg = f'Patch of size {patch.shape} at {coordinates} does not fit into the page {self.values.shape}'
+            log.error(msg)
+            raise ValueError(msg)
+
+        values = self.values[:, y1:y2, x1:x2]
+        if self.reducer == 'max':
+            np.maximum(values, patch, out=values, casting='same_kind')
+        elif self.reducer == 'mean':
+            np.add(values, patch, out=values, casting='same_kind')
+            self.weights[y1:y2, x1:x2] += 1
+        else:
+            patch_weights = _get_distance_weights(height=patch.shape[1], width=patch.shape[2])
+            np.add(values, patch * patch_weights, out=values, casting='same_kind')
+            self.weights[y1:y2, x1:x2] += patch_weights
+
+        self.coverage[y1:y2, x1:x2] = True
+
+    def get_result(self) -> np.ndarray:
+        """
+        Returns the merged prediction of the page. Pixels without any prediction are -inf (max) or NaN (mean, distance).
+
+        :return: merged prediction [#C x H x W]
+        :rtype: np.ndarray
+        """
+        if self.reducer == 'max':
+            return self.values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.values / self.weights[None, :, :]).astype(self.dtype, copy=False)
+
+
+class CroppedOutputMerger:
+    """
+    Merges the predicted patches (``.npy`` files written during the test of a cropped task) into full pages.
+    The pages are merged in a process pool, each process holds just the accumulator of the page it is working on and
+    reads the patches memory-mapped, so the memory usage does not depend on the number of pages.
+
+    The folder structure of the output is::
+
+        output_path
+        ├── img
+        ├── gt
+        └── pred
+
+    :param img_paths_per_page: crops of the test set, tuples of (data path, gt path, page name, crop name)
+    :type img_paths_per_page: List[Tuple[Path, Path, str, str]]
+    :param prediction_path: folder with one sub-folder of patch predictions per page
+    :type prediction_path: Path
+    :param output_path: folder where the merged pages are saved
+    :type output_path: Path
+    :param class_encodings: class encodings of the dataset
+    :type class_encodings: List
+    :param save_output_page_image: function that saves the merged prediction of a page
+        (image_name, output_image, output_folder, class_encoding)
+    :type save_output_page_image: Callable
+    :param pred_extension: file extension of the merged predictions
+    :type pred_extension: str
+    :param gt_extension: file extension of the merged ground truth
+    :type gt_extension: str
+    :param num_processes: number of processes that merge pages in parallel
+    :type num_processes: int
+    :param reducer: how overlapping predictions are combined (max, mean, distance)
+    :type reducer: str
+    :param dtype: data type of the accumulator (e.g. float32 or float16)
+    :type dtype: Any
+    :param full_page_path: folder with the data and gt folder of the full pages (e.g. the test split of the original
+        dataset). If given, the original pages are copied instead of pasting the crops together.
+    :type full_page_path: Optional[Path]
+    :param data_folder_name: name of the data folder in ``full_page_path``
+    :type data_folder_name: str
+    :param gt_folder_name: name of the gt folder in ``full_page_path``
+    :type gt_folder_name: str
+    :param on_page_saved: function that is called with the page name and the output path after a page has been saved
+    :type on_page_saved: Optional[Callable[[str, Path], None]]
+    """
+
+    def __init__(self, img_paths_per_page: List[Tuple[Path, Path, str, str]], prediction_path: Path,
+                 output_path: Path, class_encodings: List, save_output_page_image: Callable,
+                 pred_extension: str = 'png', gt_extension: str = 'png', num_processes: int = 10,
+                 reducer: str = 'max', dtype: Any = np.float32, full_page_path: Optional[Path] = None,
+                 data_folder_name: str = 'data', gt_folder_name: str = 'gt',
+                 on_page_saved: Optional[Callable[[str, Path], None]] = None):
+        if reducer not in REDUCERS:
+            msg = f'Unknown reducer "{reducer}" (available: {", ".join(REDUCERS)})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.prediction_path = prediction_path
+        self.output_path = output_path
+        self.class_encodings = class_encodings
+        self.num_classes = len(class_encodings)
+        self.save_output_page_image = save_output_page_image
+        self.pred_extension = pred_extension
+        self.gt_extension = gt_extension
+        self.reducer = reducer
+        self.dtype = np.dtype(dtype)
+        self.full_page_path = full_page_path
+        self.data_folder_name = data_folder_name
+        self.gt_folder_name = gt_folder_name
+        self.on_page_saved = on_page_saved
+
+        self.crops_per_page: Dict[str, List[Tuple[Path, Path, str, int, int]]] = defaultdict(list)
+        for img_path, gt_path, img_name, crop_name in img_paths_per_page:
+            x, y = get_patch_coordinates(crop_name)
+            self.crops_per_page[img_name].append((img_path, gt_path, crop_name, x, y))
+
+        self.img_name_list = sorted([str(n.name) for n in prediction_path.iterdir() if n.is_dir()])
+
+        # check if all images from the dataset are found in the prediction output
+        if sorted(self.crops_per_page.keys()) != self.img_name_list:
+            msg = f'The pages in the prediction folder ({prediction_path}) do not match the pages of the dataset'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.num_pages = len(self.img_name_list)
+        if self.num_pages == 0:
+            msg = f'No predictions found in {prediction_path}'
+            log.error(msg)
+            raise ValueError(msg)
+        self.num_processes = max(1, min(num_processes, self.num_pages))
+
+    def merge_all(self, info_name: str = 'merge_cropped_output') -> List[str]:
+        """
+        Merges all pages and writes an info file to the output folder.
+
+        :param info_name: name of the tool that is written in the info file
+        :type info_name: str
+        :return: names of the pages that could not be merged completely
+        :rtype: List[str]
+        """
+        start_time = datetime.now()
+        info_list = [f'Running {info_name}:',
+                     f'- start_time:                    \t{start_time:%Y-%m-%d_%H-%M-%S}',
+                     f'- prediction_path:               \t{self.prediction_path}',
+                     f'- output_path:                   \t{self.output_path}',
+                     f'- num_pages:                     \t{self.num_pages}',
+                     f'- num_processes:                 \t{self.num_processes}',
+                     f'- reducer:                       \t{self.reducer}',
+                     f'- dtype:                         \t{self.dtype}',
+                     f'- full_page_path:                \t{self.full_page_path}',
+                     '']  # empty string to get linebreak at the end when using join
+        info_str = '\n'.join(info_list)
+        print(info_str, flush=True)
+
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        info_file = self.output_path / 'info_merge_cropped_output.txt'
+        with info_file.open('a') as f:
+            f.write(info_str)
+
+        incomplete_pages = []
+        with tqdm(total=self.num_pages, desc='Merging pages') as pbar:
+            if self.num_processes == 1:
+                results = map(self.merge_page, self.img_name_list)
+                for img_name, complete in results:
+                    if not complete:
+                        incomplete_pages.append(img_name)
+                    pbar.update()
+            else:
+                # the settings are sent once per process, the tasks only contain the crops of their page
+                with Pool(self.num_processes, initializer=_init_merge_worker,
+                          initargs=(self._get_worker_merger(),)) as pool:
+                    tasks = ((img_name, self.crops_per_page[img_name]) for img_name in self.img_name_list)
+                    for img_name, complete in pool.imap_unordered(_merge_page_worker, tasks):
+                        if not complete:
+                            incomplete_pages.append(img_name)
+                        pbar.update()
+
+        duration = datetime.now() - start_time
+        info_list = [f'- end_time:                      \t{datetime.now():%Y-%m-%d_%H-%M-%S}',
+                     f'- duration:                      \t{duration}',
+                     f'- incomplete_pages:              \t{sorted(incomplete_pages)}',
+                     '']  # empty string to get linebreak at the end when using join
+        info_str = '\n'.join(info_list)
+        print('\n' + info_str)
+
+        with info_file.open('a') as f:
+            f.write(info_str)
+            f.write('\n')
+
+        return sorted(incomplete_pages)
+
+    def merge_page(self, img_name: str,
+                   crop_list: Optional[List[Tuple[Path, Path, str, int, int]]] = None) -> Tuple[str, bool]:
+        """
+        Merges the patches of one page and saves the merged prediction, image and ground truth.
+
+        :param img_name: name of the page
+        :type img_name: str
+        :param crop_list: crops of the page (data path, gt path, crop name, x, y), None to take them from the dataset
+        :type crop_list: Optional[List[Tuple[Path, Path, str, int, int]]]
+        :return: the page name and if the page was complete (and the prediction was saved)
+        :rtype: Tuple[str, bool]
+        """
+        pred_list = self._get_pred_list(img_name=img_name)
+        if crop_list is None:
+            crop_list = self.crops_per_page[img_name]
+        crop_list = sorted(crop_list, key=lambda v: (v[4], v[3]))
+
+        # The number of patches in the prediction should be equal to number of patches in dataset
+        if [(x, y) for x, y, _ in pred_list] != [(x, y) for _, _, _, x, y in crop_list]:
+            msg = f'The predicted patches of {img_name} do not match the crops of the dataset'
+            log.error(msg)
+            raise ValueError(msg)
+
+        first_patch = np.load(str(pred_list[0][2]), mmap_mode='r')
+        crop_height, crop_width = first_patch.shape[1:]
+        page_width = max(x for x, _, _ in pred_list) + crop_width
+        page_height = max(y for _, y, _ in pred_list) + crop_height
+
+        accumulator = PageAccumulator(num_classes=first_patch.shape[0], height=page_height, width=page_width,
+                                      reducer=self.reducer, dtype=self.dtype)
+        for x, y, pred_path in pred_list:
+            accumulator.add_patch(patch=np.load(str(pred_path), mmap_mode='r'), coordinates=(x, y))
+
+        self._save_img_and_gt(img_name=img_name, crop_list=crop_list, page_size=(page_width, page_height))
+
+        complete = accumulator.is_complete
+        if complete:
+            self.save_output_page_image(image_name=f'{img_name}.{self.pred_extension}',
+                                        output_image=accumulator.get_result(),
+                                        output_folder=self.output_path / 'pred',
+                                        class_encoding=self.class_encodings)
+        else:
+            log.warning(f'Test image {img_name} was not written! Not all pixels are covered by a patch.')
+
+        if self.on_page_saved is not None:
+            self.on_page_saved(img_name, self.output_path)
+
+        return img_name, complete
+
+    def _get_worker_merger(self) -> 'CroppedOutputMerger':
+        # a copy without the crops of all the pages, which would be pickled for every worker otherwise
+        merger = copy.copy(self)
+        merger.crops_per_page = {}
+        merger.img_name_list = []
+        return merger
+
+    def _get_pred_list(self, img_name: str) -> List[Tuple[int, int, Path]]:
+        pred_list = []
+        for pred_path in (self.prediction_path / img_name).glob(f'{img_name}*.npy'):
+            try:
+                x, y = get_patch_coordinates(pred_path.stem)
+            except ValueError:
+                continue
+            pred_list.append((x, y, pred_path))
+        return sorted(pred_list, key=lambda v: (v[1], v[0]))
+
+    def _save_img_and_gt(self, img_name: str, crop_list: List[Tuple[Path, Path, str, int, int]],
+                         page_size: Tuple[int, int]) -> None:
+        outdir_img = self.output_path / 'img'
+        outdir_gt = self.output_path / 'gt'
+        outdir_img.mkdir(parents=True, exist_ok=True)
+        outdir_gt.mkdir(parents=True, exist_ok=True)
+
+        if self.full_page_path is not None:
+            _copy_page(src_folder=self.full_page_path / self.data_folder_name, img_name=img_name,
+                       dest_filename=outdir_img / f'{img_name}.png')
+            _copy_page(src_folder=self.full_page_path / self.gt_folder_name, img_name=img_name,
+                       dest_filename=outdir_gt / f'{img_name}.{self.gt_extension}')
+            return
+
+        img_canvas = Image.new(mode='RGB', size=page_size)
+        gt_canvas = Image.new(mode='RGB', size=page_size)
+        for img_path, gt_path, _, x, y in crop_list:
+            img_canvas.paste(pil_loader(img_path), (x, y))
+            gt_canvas.paste(pil_loader(gt_path), (x, y))
+        img_canvas.save(fp=outdir_img / f'{img_name}.png')
+        gt_canvas.save(fp=outdir_gt / f'{img_name}.{self.gt_extension}')
+
+
+def _init_merge_worker(merger: CroppedOutputMerger) -> None:
+    global _WORKER_MERGER
+    _WORKER_MERGER = merger
+
+
+def _merge_page_worker(task: Tuple[str, List[Tuple[Path, Path, str, int, int]]]) -> Tuple[str, bool]:
+    img_name, crop_list = task
+    return _WORKER_MERGER.merge_page(img_name=img_name, crop_list=crop_list)
+
+
+def _copy_page(src_folder: Path, img_name: str, dest_filename: Path) -> None:
+    """
+    Copies the full page with the given name to the destination. If the file extensions differ, the page is converted.
+
+    :param src_folder: folder with the full pages
+    :type src_folder: Path
+    :param img_name: name of the page (without extension)
+    :type img_name: str
+    :param dest_filename: path of the copy
+    :type dest_filename: Path
+    """
+    src_files = sorted(p for p in src_folder.glob(f'{img_name}.*') if p.stem == img_name)
+    if len(src_files) == 0:
+        msg = f'Full page {img_name} not found in {src_folder}'
+        log.error(msg)
+        raise FileNotFoundError(msg)
+
+    src_filename = src_files[0]
+    if src_filename.suffix.lower() == dest_filename.suffix.lower():
+        shutil.copyfile(src_filename, dest_filename)
+    else:
+        pil_loader(src_filename).save(fp=dest_filename)
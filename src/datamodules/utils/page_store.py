@@ -0,0 +1,105 @@
+"""
+Decoded pages of a full page dataset split in one memory mapped array.
+
+The datasets of pages with a fixed size (see ``image_dims``) decode a PNG or JPEG for every sample in every epoch.
+:class:`PageStore` decodes every page once and stores all of them in a uint8 array of size [N x H x W x 3]
+(``pages.{name}.{token}.npy``) next to the analytics of the dataset. The datasets read a page as a view of the
+memory map, so the dataloader workers of a node share the pages in the page cache of the operating system instead of
+holding decoded copies each. The labels of the pages are stored in the
+:class:`src.datamodules.utils.label_cache.LabelCache`.
+
+The index ``pages.{name}.json`` holds the size of the pages and for every file its row in the array together with
+the size and modification time of the file, so new and changed files are decoded again. The index, the lock and the
+update of the array are the ones of :class:`src.datamodules.utils.memmap_store.MemmapStore`.
+"""
+import os
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Any, Union, List, Set
+
+import numpy as np
+from torchvision.datasets.folder import pil_loader
+
+from src.datamodules.utils.memmap_store import MemmapStore
+from src.datamodules.utils.misc import ImageDimensions
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+PAGE_STORE_VERSION = 1
+
+
+class PageStore(MemmapStore):
+    """
+    Memory mapped RGB pages of one dataset split. Call :meth:`compile` with the data files of the dataset before
+    reading them with :meth:`load`.
+
+    :param directory: folder of the store files (the root of the dataset, like the analytics)
+    :type directory: Path
+    :param name: name of the store (e.g. ``data.train``)
+    :type name: str
+    :param image_dims: size of the pages, all pages must have this size
+    :type image_dims: ImageDimensions
+    :param workers: number of processes to decode the pages
+    :type workers: int
+    """
+    prefix = 'pages'
+    suffix = '.npy'
+    version = PAGE_STORE_VERSION
+
+    def __init__(self, directory: Path, name: str, image_dims: ImageDimensions, workers: int = 8):
+        super().__init__(directory=directory, name=name, workers=workers)
+        self.image_dims = image_dims
+
+    def load(self, data_path: Union[str, Path]) -> np.ndarray:
+        """
+        Reads a page without copying it. The array can be passed to ``ToTensor`` like a PIL image.
+
+        :param data_path: path to the data file
+        :type data_path: Union[str, Path]
+        :return: uint8 array of size [H x W x 3]
+        :rtype: np.ndarray
+        """
+        return self._get_memmap()[self._entries[self._key(data_path)][0]]
+
+    def _get_settings(self) -> Dict[str, Any]:
+        return {'size': [self.image_dims.height, self.image_dims.width]}
+
+    def _open_memmap(self, data_path: Path) -> np.ndarray:
+        # copy-on-write, so torch.from_numpy accepts the array without copying the file
+        return np.load(data_path, mmap_mode='c')
+
+    def _write_data(self, data_path: Path, paths: Dict[str, Union[str, Path]], reused: Set[str],
+                    old_entries: Dict[str, List[int]], old_data_path: Optional[Path]) -> Dict[str, List[int]]:
+        keys = sorted(paths)
+        tasks = [(row, str(paths[key]), self.image_dims.height, self.image_dims.width)
+                 for row, key in enumerate(keys) if key not in reused]
+        log.info(f'Decoding {len(tasks)} of {len(keys)} pages into {self.directory}')
+
+        pages = np.lib.format.open_memmap(data_path, mode='w+', dtype=np.uint8,
+                                          shape=(len(keys), self.image_dims.height, self.image_dims.width, 3))
+        entries = {}
+        if reused:
+            old_pages = np.load(old_data_path, mmap_mode='r')
+            for row, key in enumerate(keys):
+                if key in reused:
+                    pages[row] = old_pages[old_entries[key][0]]
+                    entries[key] = [row] + old_entries[key][1:]
+            del old_pages
+
+        for row, page, size, mtime_ns in self._map(_decode_page_task, tasks):
+            pages[row] = page
+            entries[keys[row]] = [row, size, mtime_ns]
+        pages.flush()
+        del pages
+        log.info('Finished decoding the pages')
+        return entries
+
+
+def _decode_page_task(task: Tuple[int, str, int, int]) -> Tuple[int, np.ndarray, int, int]:
+    row, data_path, height, width = task
+    stat = os.stat(data_path)
+    page = np.asarray(pil_loader(data_path))
+    if page.shape != (height, width, 3):
+        raise ValueError(f'The page {data_path} has the size {page.shape[1]}x{page.shape[0]} '
+                         f'instead of {width}x{height}')
+    return row, page, stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,396 @@
+"""
+Sequential shards of a dataset split for streaming training.
+
+Reading thousands of small files from a network storage is bound by the latency of the storage and not by its
+bandwidth. :func:`write_shards` packs the samples of a split into a few large tar files (``{name}-00000.tar``, ...)
+and :class:`ShardDataset` streams them sequentially. Every sample is a record of consecutive tar members with the
+same key::
+
+    00000042.data.png    the original encoded image
+    00000042.gt.png      the original encoded ground truth (segmentation layouts)
+    00000042.json        the meta data of the sample (name of the files, page, class index)
+
+The files are stored as they are, so the records are as large as the original dataset and the pixels are not
+changed. The index ``{name}.json`` holds the layout of the split, the number of samples of every shard and the classes
+of a classification split. The shards can be written with ``tools/pack_shards.py``.
+"""
+import io
+import json
+import random
+import tarfile
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Any, Sequence, Union, List, Callable, Iterator
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from PIL import Image
+from torch import is_tensor
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.transforms import ToTensor
+
+from src.datamodules.utils.misc import save_json
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+SHARD_INDEX_VERSION = 1
+SHARD_LAYOUTS = ('cropped', 'full_page', 'indexed', 'rolf', 'classification')
+SEGMENTATION_LAYOUTS = ('cropped', 'full_page', 'rolf')
+FULL_PAGE_LAYOUTS = ('full_page', 'rolf')
+
+
+def write_shards(samples: Sequence[Dict[str, Any]], output_path: Path, name: str, layout: str,
+                 samples_per_shard: int = 1000, classes: Optional[List[str]] = None) -> Path:
+    """
+    Packs the samples into shards with at most ``samples_per_shard`` records each and writes the index of the shards.
+
+    :param samples: the samples in the order of the shards, every sample is a dict with the path of the ``data`` file,
+        optionally the path of the ``gt`` file and its ``meta`` data
+    :type samples: Sequence[Dict[str, Any]]
+    :param output_path: folder of the shards
+    :type output_path: Path
+    :param name: name of the shards (e.g. ``train``)
+    :type name: str
+    :param layout: layout of the split, one of ``SHARD_LAYOUTS``
+    :type layout: str
+    :param samples_per_shard: maximal number of samples in a shard
+    :type samples_per_shard: int
+    :param classes: the class names of a classification split
+    :type classes: Optional[List[str]]
+    :return: path to the index of the shards
+    :rtype: Path
+    """
+    if layout not in SHARD_LAYOUTS:
+        msg = f'Unknown shard layout "{layout}" (expected one of {SHARD_LAYOUTS})'
+        log.error(msg)
+        raise ValueError(msg)
+    if samples_per_shard < 1:
+        msg = f'samples_per_shard has to be positive (got {samples_per_shard})'
+        log.error(msg)
+        raise ValueError(msg)
+
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    shards = []
+    for shard_index, start in enumerate(range(0, len(samples), samples_per_shard)):
+        shard_file = f'{name}-{shard_index:05d}.tar'
+        shard_samples = samples[start:start + samples_per_shard]
+        tmp_path = output_path / f'.{shard_file}.tmp'
+        with tarfile.open(tmp_path, mode='w') as tar:
+            for i, sample in enumerate(shard_samples, start=start):
+                key = f'{i:08d}'
+                for field in ('data', 'gt'):
+                    if sample.get(field) is not None:
+                        file_path = Path(sample[field])
+                        tar.add(str(file_path), arcname=f'{key}.{field}{file_path.suffix.lower()}', recursive=False)
+                _add_bytes(tar, f'{key}.json', json.dumps(sample.get('meta', {})).encode())
+        tmp_path.replace(output_path / shard_file)
+        shards.append({'file': shard_file, 'num_samples': len(shard_samples)})
+
+    index_path = output_path / f'{name}.json'
+    index = {'version': SHARD_INDEX_VERSION, 'layout': layout, 'shards': shards}
+    if classes is not None:
+        index['classes'] = list(classes)
+    save_json(index, index_path)
+    log.info(f'Wrote {len(samples)} samples into {len(shards)} shards in {output_path}')
+    return index_path
+
+
+def _add_bytes(tar: tarfile.TarFile, arcname: str, data: bytes) -> None:
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def read_shard_index(index_path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Reads the index of shards written by :func:`write_shards`.
+
+    :param index_path: path to the index
+    :type index_path: Union[str, Path]
+    :return: the index with the absolute paths of the shards
+    :rtype: Dict[str, Any]
+    """
+    index_path = Path(index_path)
+    if not index_path.is_file():
+        msg = f'Shard index not found ("{index_path}")'
+        log.error(msg)
+        raise ValueError(msg)
+    with index_path.open() as f:
+        index = json.load(f)
+    if index.get('version') != SHARD_INDEX_VERSION:
+        msg = f'Unsupported version of the shard index "{index_path}" (expected {SHARD_INDEX_VERSION})'
+        log.error(msg)
+        raise ValueError(msg)
+    for shard in index['shards']:
+        shard['path'] = index_path.parent / shard['file']
+    return index
+
+
+def iter_shard(shard_path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the records of a shard sequentially.
+
+    :param shard_path: path to the shard
+    :type shard_path: Union[str, Path]
+    :return: the records as dicts with the ``key``, the ``meta`` data and the encoded ``data`` and ``gt`` files
+    :rtype: Iterator[Dict[str, Any]]
+    """
+    record = None
+    # stream mode, the shard is read front to back without seeking
+    with tarfile.open(shard_path, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, field = member.name.split('.')[:2]
+            if record is not None and record['key'] != key:
+                yield record
+                record = None
+            if record is None:
+                record = {'key': key}
+            data = tar.extractfile(member).read()
+            if field == 'json':
+                record['meta'] = json.loads(data)
+            else:
+                record[field] = data
+    if record is not None:
+        yield record
+
+
+def decode_image(data: bytes, mode: str = 'RGB') -> Image.Image:
+    """
+    Decodes an encoded image of a record.
+
+    :param data: the encoded image
+    :type data: bytes
+    :param mode: PIL mode of the image (``RGB`` or ``P`` for an indexed gt)
+    :type mode: str
+    :return: the image
+    :rtype: Image.Image
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        return img.convert(mode)
+
+
+def segmentation_sample(record: Dict[str, Any], twin_transform: Optional[Callable] = None,
+                        image_transform: Optional[Callable] = None, target_transform: Optional[Callable] = None,
+                        boundary_mask: bool = False) -> Tuple[torch.Tensor, ...]:
+    """
+    Turns a record with an RGB gt into a training sample like the map-style RGB and HisDB datasets do.
+
+    :param record: the record of the shard
+    :type record: Dict[str, Any]
+    :param twin_transform: transformation of the image and the gt
+    :type twin_transform: Optional[Callable]
+    :param image_transform: transformation of the image
+    :type image_transform: Optional[Callable]
+    :param target_transform: transformation of the gt
+    :type target_transform: Optional[Callable]
+    :param boundary_mask: return the boundary mask of the HisDB gt as third element
+    :type boundary_mask: bool
+    :return: image and gt (and boundary mask)
+    :rtype: Tuple[torch.Tensor, ...]
+    """
+    img, gt = decode_image(record['data']), decode_image(record['gt'])
+    if twin_transform is not None:
+        img, gt = twin_transform(img, gt)
+    if image_transform is not None:
+        img, gt = image_transform(img, gt)
+    if not is_tensor(img):
+        img = ToTensor()(img)
+    if not is_tensor(gt):
+        gt = ToTensor()(gt)
+
+    border_mask = gt[0, :, :] != 0
+    if target_transform is not None:
+        img, gt = target_transform(img, gt)
+
+    if boundary_mask:
+        return img, gt, border_mask
+    return img, gt
+
+
+def indexed_sample(record: Dict[str, Any], image_transform: Optional[Callable] = None) \
+        -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Turns a record with an indexed gt into a training sample like :class:`DatasetIndexed` does.
+
+    :param record: the record of the shard
+    :type record: Dict[str, Any]
+    :param image_transform: transformation of the image
+    :type image_transform: Optional[Callable]
+    :return: image and the class indices of the gt
+    :rtype: Tuple[torch.Tensor, torch.Tensor]
+    """
+    img, gt = decode_image(record['data']), decode_image(record['gt'], mode='P')
+    if image_transform is not None:
+        img, _ = image_transform(img, gt)
+    if not is_tensor(img):
+        img = ToTensor()(img)
+    return img, torch.tensor(np.asarray(gt), dtype=torch.long)
+
+
+def classification_sample(record: Dict[str, Any], transform: Optional[Callable] = None) -> Tuple[Any, int]:
+    """
+    Turns a record of a classification split into a training sample like ``ImageFolder`` does.
+
+    :param record: the record of the shard
+    :type record: Dict[str, Any]
+    :param transform: transformation of the image
+    :type transform: Optional[Callable]
+    :return: image and class index
+    :rtype: Tuple[Any, int]
+    """
+    img = decode_image(record['data'])
+    if transform is not None:
+        img = transform(img)
+    return img, record['meta']['target']
+
+
+class ShardDataset(IterableDataset):
+    """
+    Streams the samples of a split packed with :func:`write_shards`.
+
+    The shards are assigned to the ranks once, balanced by their number of samples. In every epoch, the shards of a rank
+    are shuffled (see :meth:`set_epoch`) and split between the dataloader workers, which read them sequentially and
+    shuffle the samples in a buffer of ``buffer_size`` samples. Every worker yields full batches and all the ranks
+    yield the same number of batches, the samples that do not fit are skipped in this epoch.
+
+    :param index_path: path to the index of the shards
+    :type index_path: Union[str, Path]
+    :param process: turns a record into a sample (e.g. :func:`segmentation_sample`)
+    :type process: Callable[[Dict[str, Any]], Any]
+    :param layouts: the layouts the process can handle, defaults to all
+    :type layouts: Optional[Sequence[str]]
+    :param shuffle: shuffle the shards and the samples
+    :type shuffle: bool
+    :param buffer_size: number of samples in the shuffle buffer of a worker
+    :type buffer_size: int
+    :param batch_size: batch size of the dataloader
+    :type batch_size: int
+    :param num_workers: number of workers of the dataloader, just used by :meth:`__len__`
+    :type num_workers: int
+    :param seed: seed of the shuffling, the same on all ranks
+    :type seed: int
+    """
+
+    def __init__(self, index_path: Union[str, Path], process: Callable[[Dict[str, Any]], Any],
+                 layouts: Optional[Sequence[str]] = None, shuffle: bool = True, buffer_size: int = 1000,
+                 batch_size: int = 1, num_workers: int = 0, seed: int = 0):
+        super().__init__()
+        index = read_shard_index(index_path)
+        if layouts is not None and index['layout'] not in layouts:
+            msg = f'The shards "{index_path}" have the layout "{index["layout"]}" (expected one of {tuple(layouts)})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.index_path = Path(index_path)
+        self.layout = index['layout']
+        self.classes = index.get('classes')
+        self.shard_paths = [shard['path'] for shard in index['shards']]
+        self.shard_sizes = [shard['num_samples'] for shard in index['shards']]
+        self.num_samples = sum(self.shard_sizes)
+        if self.num_samples == 0:
+            msg = f'Found 0 samples in the shards "{index_path}"'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.process = process
+        self.shuffle = shuffle
+        self.buffer_size = max(1, buffer_size)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Sets the epoch of the next iteration, the shards are shuffled differently in every epoch.
+
+        :param epoch: the epoch
+        :type epoch: int
+        """
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        rank, world_size = _get_rank_and_world_size()
+        plan = self._plan(world_size, max(1, self.num_workers))
+        num_samples = sum(num_samples for _, num_samples in plan[rank])
+        if num_samples * world_size < self.num_samples:
+            log.warning(f'{self.num_samples - num_samples * world_size} of {self.num_samples} samples of the shards '
+                        f'"{self.index_path}" are skipped in every epoch, pack the split into more shards of the '
+                        f'same size to use all of them')
+        return num_samples
+
+    def __iter__(self) -> Iterator[Any]:
+        rank, world_size = _get_rank_and_world_size()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        shards, num_samples = self._plan(world_size, num_workers)[rank][worker_id]
+        rng = random.Random(hash((self.seed, self.epoch, rank, worker_id)))
+        records = self._iter_records(shards)
+        if self.shuffle:
+            records = _shuffle_buffer(records, self.buffer_size, rng)
+        for _, record in zip(range(num_samples), records):
+            yield self.process(record)
+
+    def _iter_records(self, shards: List[int]) -> Iterator[Dict[str, Any]]:
+        for shard in shards:
+            yield from iter_shard(self.shard_paths[shard])
+
+    def _plan(self, world_size: int, num_workers: int) -> List[List[Tuple[List[int], int]]]:
+        """
+        Computes the shards and the number of samples of every worker of every rank in this epoch. Every rank and worker
+        computes the same plan.
+        """
+        # balanced assignment of the shards, fixed over the epochs
+        rank_shards = [[] for _ in range(world_size)]
+        rank_sizes = [0] * world_size
+        for shard in sorted(range(len(self.shard_sizes)), key=lambda s: (-self.shard_sizes[s], s)):
+            rank = rank_sizes.index(min(rank_sizes))
+            rank_shards[rank].append(shard)
+            rank_sizes[rank] += self.shard_sizes[shard]
+
+        plan = []
+        for rank, shards in enumerate(rank_shards):
+            shards = sorted(shards)
+            if self.shuffle:
+                random.Random(hash((self.seed, self.epoch, rank))).shuffle(shards)
+            workers = [shards[worker::num_workers] for worker in range(num_workers)]
+            batches = [sum(self.shard_sizes[s] for s in worker) // self.batch_size for worker in workers]
+            plan.append((workers, batches))
+
+        # all ranks have to run the same number of steps
+        num_batches = min(sum(batches) for _, batches in plan)
+        result = []
+        for workers, batches in plan:
+            excess = sum(batches) - num_batches
+            for worker in reversed(range(num_workers)):
+                removed = min(excess, batches[worker])
+                batches[worker] -= removed
+                excess -= removed
+            result.append([(shards, worker_batches * self.batch_size)
+                           for shards, worker_batches in zip(workers, batches)])
+        return result
+
+
+def _shuffle_buffer(records: Iterator[Dict[str, Any]], buffer_size: int, rng: random.Random) \
+        -> Iterator[Dict[str, Any]]:
+    buffer = []
+    for record in records:
+        if len(buffer) < buffer_size:
+            buffer.append(record)
+            continue
+        index = rng.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = record
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def _get_rank_and_world_size() -> Tuple[int, int]:
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
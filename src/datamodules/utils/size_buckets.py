@@ -0,0 +1,105 @@
+"""
+Batches of pages with similar sizes for the prediction of pages of any size.
+
+The pages of a batch have to be padded to the same size. :class:`SizeBucketBatchSampler` groups the pages into
+buckets of the same size (rounded up to the stride of the network, read from the image headers) and fills the batches
+bucket by bucket, so the padding is at most the rounding to the stride for all batches but the mixed ones of the
+leftover pages. :func:`collate_padded` pads the pages of a batch and returns their original size, with which the task
+crops the prediction before it is written.
+"""
+import math
+from collections import defaultdict
+from typing import List, Tuple, Sequence, Iterator, Iterable
+
+import torch
+from torch import Tensor
+from torch.nn import functional as F
+from torch.utils.data import BatchSampler
+
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+def get_padded_size(size: Tuple[int, int], stride: int) -> Tuple[int, int]:
+    """
+    :param size: height and width of a page
+    :type size: Tuple[int, int]
+    :param stride: the padded height and width are multiples of it
+    :type stride: int
+    :return: the padded height and width
+    :rtype: Tuple[int, int]
+    """
+    return math.ceil(size[0] / stride) * stride, math.ceil(size[1] / stride) * stride
+
+
+class SizeBucketBatchSampler(BatchSampler):
+    """
+    Batch sampler that puts pages of the same padded size into the same batch. The batches of every bucket are filled
+    first, the leftover pages of all the buckets are batched in the order of their size. The indices are taken from
+    the sampler, so Lightning can replace it with a distributed sampler.
+
+    :param sampler: sampler of the indices of the dataset
+    :type sampler: Iterable[int]
+    :param batch_size: number of pages per batch
+    :type batch_size: int
+    :param drop_last: drop the last leftover batch if it is smaller than the batch size
+    :type drop_last: bool
+    :param sizes: height and width of every page of the dataset
+    :type sizes: Sequence[Tuple[int, int]]
+    :param stride: the pages are padded to a multiple of it (the downsampling factor of the network)
+    :type stride: int
+    """
+
+    def __init__(self, sampler: Iterable[int], batch_size: int, drop_last: bool,
+                 sizes: Sequence[Tuple[int, int]], stride: int = 1):
+        super().__init__(sampler=sampler, batch_size=batch_size, drop_last=drop_last)
+        if stride < 1:
+            msg = f'Parameter "stride" has to be at least 1 (got {stride})'
+            log.error(msg)
+            raise ValueError(msg)
+        self.sizes = [tuple(size) for size in sizes]
+        self.stride = stride
+
+    def _get_batches(self) -> List[List[int]]:
+        buckets = defaultdict(list)
+        for index in self.sampler:
+            buckets[get_padded_size(self.sizes[index], stride=self.stride)].append(index)
+
+        batches, leftovers = [], []
+        for size in sorted(buckets):
+            indices = buckets[size]
+            num_full = len(indices) - len(indices) % self.batch_size
+            batches.extend(indices[i:i + self.batch_size] for i in range(0, num_full, self.batch_size))
+            leftovers.extend(indices[num_full:])
+        # the leftovers are sorted by size, so neighbouring pages need little padding
+        for i in range(0, len(leftovers), self.batch_size):
+            batch = leftovers[i:i + self.batch_size]
+            if len(batch) == self.batch_size or not self.drop_last:
+                batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._get_batches())
+
+    def __len__(self) -> int:
+        return len(self._get_batches())
+
+
+def collate_padded(batch: List[Tuple[Tensor, int]], stride: int = 1) -> Tuple[Tensor, Tensor, Tensor]:
+    """
+    Collate function for the batches of :class:`SizeBucketBatchSampler`. The pages are zero padded at the bottom and
+    on the right to the largest page of the batch, rounded up to the stride.
+
+    :param batch: the samples of :class:`src.datamodules.utils.dataset_predict.DatasetPredict`
+    :type batch: List[Tuple[Tensor, int]]
+    :param stride: the padded height and width are multiples of it
+    :type stride: int
+    :return: the padded pages [B x C x H x W], their indices and their original height and width [B x 2]
+    :rtype: Tuple[Tensor, Tensor, Tensor]
+    """
+    pages, indices = zip(*batch)
+    sizes = [tuple(page.shape[-2:]) for page in pages]
+    height, width = get_padded_size((max(h for h, _ in sizes), max(w for _, w in sizes)), stride=stride)
+    padded = torch.stack([F.pad(page, [0, width - page.shape[-1], 0, height - page.shape[-2]]) for page in pages])
+    return padded, torch.tensor(indices), torch.tensor(sizes)
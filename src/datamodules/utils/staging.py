@@ -0,0 +1,221 @@
+"""
+Copies of datasets on a local scratch disk.
+
+The datasets of the experiments are on a network file system, so every epoch of every run reads the same files over
+the network. :func:`stage_directory` copies a dataset folder once to a local scratch folder and the datamodules read
+the copy instead. The copy is checked against the source on every run: files with a different size or modification
+time are copied again and files that were removed from the source are removed from the copy. Files that only exist
+in the copy (the analytics, manifests and caches the datamodules write into the dataset folder) are kept.
+
+The scratch folder is shared by all the runs on a machine::
+
+    scratch_dir
+    ├── staging.json                    registry with the source, size and last use of every copy
+    ├── .staging.lock                   lock of the registry, held while a copy is checked or updated
+    ├── <key>                           the copy of a dataset folder
+    ├── <key>.files.json                the files copied from the source
+    └── <key>.inuse                     every run that reads the copy holds a shared lock on this file
+
+With a budget, the least recently used copies that no run reads are removed to make room for a new one. A dataset
+that does not fit into the budget is read from the source. The size of a copy is measured on the scratch disk, so the
+caches the datamodules write into the copy (e.g. the label cache and the page store) count towards the budget. On
+platforms without ``fcntl`` the in use locks are not available and no copy is removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Tuple, Union
+
+from src.datamodules.utils.misc import save_json, dataset_lock
+from src.utils import utils
+
+try:
+    import fcntl
+except ImportError:
+    # the datamodules import this module also on platforms without fcntl, where staging just can not free space
+    fcntl = None
+
+log = utils.get_logger(__name__)
+
+STAGING_VERSION = 1
+# number of threads to stat and copy the files of the source
+NUM_THREADS_STAGING = 16
+
+# file descriptors of the in use locks of this process, they are released when the process ends
+_IN_USE: Dict[str, int] = {}
+
+
+def stage_directory(source: Union[str, Path], scratch_dir: Union[str, Path],
+                    budget_bytes: Optional[int] = None) -> Path:
+    """
+    Returns the path of an up-to-date copy of the source folder in the scratch folder. The copy is created or updated
+    if necessary. If the source does not fit into the budget, the source itself is returned.
+
+    :param source: the dataset folder
+    :type source: Union[str, Path]
+    :param scratch_dir: the local scratch folder
+    :type scratch_dir: Union[str, Path]
+    :param budget_bytes: maximal size of all the copies in the scratch folder, None for no limit
+    :type budget_bytes: Optional[int]
+    :return: the path of the copy or the source
+    :rtype: Path
+    """
+    source = Path(source).expanduser().resolve()
+    scratch_dir = Path(scratch_dir).expanduser()
+    if not source.is_dir():
+        msg = f'The folder to stage does not exist ("{source}")'
+        log.error(msg)
+        raise ValueError(msg)
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    key = f'{source.name}-{hashlib.sha1(str(source).encode()).hexdigest()[:12]}'
+
+    with dataset_lock(scratch_dir, name='staging'):
+        source_files = _scan(source)
+        size = sum(file_size for file_size, _ in source_files.values())
+        registry = _read_registry(scratch_dir)
+        entries = registry['entries']
+
+        if budget_bytes is not None and not _make_room(scratch_dir, entries, key=key, size=size,
+                                                       budget_bytes=budget_bytes):
+            log.warning(f'{source} ({size / 2 ** 30:.2f} GB) does not fit into the scratch budget of '
+                        f'{budget_bytes / 2 ** 30:.2f} GB, the dataset is read from the source')
+            save_json(registry, scratch_dir / 'staging.json')
+            return source
+
+        target = scratch_dir / key
+        copied = _update_copy(source, target, source_files, files_path=scratch_dir / f'{key}.files.json')
+        entries[key] = {'source': str(source), 'bytes': get_directory_size(target), 'last_used': time.time()}
+        save_json(registry, scratch_dir / 'staging.json')
+        _acquire_in_use(scratch_dir, key)
+
+    if copied:
+        log.info(f'Staged {copied} files of {source} to {target}')
+    else:
+        log.info(f'Using the staged copy {target} of {source}')
+    return target
+
+
+def _scan(source: Path) -> Dict[str, Tuple[int, int]]:
+    paths = []
+    for root, dirs, files in os.walk(source):
+        # hidden files are locks and manifests that are only valid in their own folder
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        paths.extend(Path(root) / file for file in files if not file.startswith('.'))
+    # the stat calls are dominated by the latency of the network file system
+    with ThreadPoolExecutor(max_workers=NUM_THREADS_STAGING) as executor:
+        stats = executor.map(os.stat, paths)
+        return {p.relative_to(source).as_posix(): (s.st_size, s.st_mtime_ns) for p, s in zip(paths, stats)}
+
+
+def _read_registry(scratch_dir: Path) -> Dict:
+    try:
+        with (scratch_dir / 'staging.json').open() as f:
+            registry = json.load(f)
+        if registry.get('version') == STAGING_VERSION:
+            return registry
+    except (OSError, ValueError):
+        pass
+    return {'version': STAGING_VERSION, 'entries': {}}
+
+
+def get_directory_size(path: Path) -> int:
+    """
+    Size of all the files in a folder and its sub-folders.
+
+    :param path: the folder
+    :type path: Path
+    :return: the size in bytes, 0 if the folder does not exist
+    :rtype: int
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                # removed while walking (e.g. the old data file of a store)
+                pass
+    return size
+
+
+def _make_room(scratch_dir: Path, entries: Dict[str, Dict], key: str, size: int, budget_bytes: int) -> bool:
+    # an existing copy also holds the caches the datamodules wrote into it
+    size = max(size, get_directory_size(scratch_dir / key))
+    if size > budget_bytes:
+        return False
+    # the copies grow after they are staged, so their size is measured again
+    for k, entry in entries.items():
+        if k != key:
+            entry['bytes'] = get_directory_size(scratch_dir / k)
+    used = sum(entry['bytes'] for k, entry in entries.items() if k != key)
+    for other_key in sorted((k for k in entries if k != key), key=lambda k: entries[k]['last_used']):
+        if used + size <= budget_bytes:
+            break
+        if not _is_unused(scratch_dir, other_key):
+            continue
+        log.info(f'Removing the staged copy of {entries[other_key]["source"]} to free scratch space')
+        shutil.rmtree(scratch_dir / other_key, ignore_errors=True)
+        (scratch_dir / f'{other_key}.files.json').unlink(missing_ok=True)
+        (scratch_dir / f'{other_key}.inuse').unlink(missing_ok=True)
+        used -= entries.pop(other_key)['bytes']
+    return used + size <= budget_bytes
+
+
+def _update_copy(source: Path, target: Path, source_files: Dict[str, Tuple[int, int]], files_path: Path) -> int:
+    try:
+        with files_path.open() as f:
+            previous_files = set(json.load(f))
+    except (OSError, ValueError):
+        previous_files = set()
+
+    # files removed from the source, the files the datamodules wrote into the copy are kept
+    for name in previous_files - source_files.keys():
+        (target / name).unlink(missing_ok=True)
+
+    outdated = [name for name, stat in source_files.items() if _get_stat(target / name) != stat]
+    with ThreadPoolExecutor(max_workers=NUM_THREADS_STAGING) as executor:
+        list(executor.map(lambda name: _copy_file(source / name, target / name), outdated))
+    save_json(sorted(source_files), files_path)
+    return len(outdated)
+
+
+def _get_stat(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _copy_file(source: Path, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f'.{target.name}.staging')
+    # copy2 keeps the modification time, which is compared with the source in the next run
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def _acquire_in_use(scratch_dir: Path, key: str) -> None:
+    if key in _IN_USE or fcntl is None:
+        return
+    fd = os.open(scratch_dir / f'{key}.inuse', os.O_RDWR | os.O_CREAT, 0o666)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    _IN_USE[key] = fd
+
+
+def _is_unused(scratch_dir: Path, key: str) -> bool:
+    if key in _IN_USE or fcntl is None:
+        return False
+    fd = os.open(scratch_dir / f'{key}.inuse', os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+    return True
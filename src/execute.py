@@ -15,6 +15,7 @@ from pytorch_lightning.loggers import LightningLoggerBase
 from pytorch_lightning.utilities import rank_zero_only
 from torchmetrics import MetricCollection
 
+from src.metrics.confusion_matrix import share_confusion_matrix
 from src.models.backbone_header_model import BackboneHeaderModel
 from src.utils import utils
 
@@ -64,12 +65,9 @@ def execute(config: DictConfig) -> Optional[float]:
     metric_test = None
     if 'metric' in config:
         log.info(f"Instantiating metrics")
-        metric_train = MetricCollection(
-            {metric_name: hydra.utils.instantiate(metric) for metric_name, metric in config.metric.items()})
-        metric_val = MetricCollection(
-            {metric_name: hydra.utils.instantiate(metric) for metric_name, metric in config.metric.items()})
-        metric_test = MetricCollection(
-            {metric_name: hydra.utils.instantiate(metric) for metric_name, metric in config.metric.items()})
+        metric_train = _instantiate_metrics(config=config)
+        metric_val = _instantiate_metrics(config=config)
+        metric_test = _instantiate_metrics(config=config)
 
     # Init the task as lightning module
     log.info(f"Instantiating model <{config.task._target_}>")
@@ -155,7 +153,7 @@ def execute(config: DictConfig) -> Optional[float]:
 
     if config.predict:
         log.info("Starting prediction!")
-        trainer.predict(model=task, datamodule=datamodule)
+        trainer.predict(model=task, datamodule=datamodule, return_predictions=False)
         # Write current run dir into outputs/run_dir_paths.txt
         _write_current_run_dir(config=config)
 
@@ -268,6 +266,18 @@ def _load_model_part(config: DictConfig, part_name: str):
     return part
 
 
+def _instantiate_metrics(config: DictConfig) -> MetricCollection:
+    """
+    Instantiates the metrics of the config. All the metrics that can be computed from the confusion matrix share one
+    confusion matrix (see :func:`src.metrics.confusion_matrix.share_confusion_matrix`).
+
+    :param config: the hydra config
+    :returns: MetricCollection: the metrics of one stage
+    """
+    return MetricCollection(share_confusion_matrix(
+        {metric_name: hydra.utils.instantiate(metric) for metric_name, metric in config.metric.items()}))
+
+
 def _clean_up_checkpoints(trainer: Trainer):
     """
     Clean up checkpoints that are not the best checkpoint.
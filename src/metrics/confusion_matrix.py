@@ -0,0 +1,270 @@
+"""
+One confusion matrix per stage from which all the configured segmentation metrics are derived.
+
+Each metric of a :class:`torchmetrics.MetricCollection` keeps its own state and goes over all the pixels of every
+batch. All the metrics we use for segmentation can be computed from the confusion matrix, so
+:class:`ConfusionMatrixMetrics` accumulates just this matrix (one bincount per step) and reduces it into the metrics.
+"""
+from functools import partial
+from typing import Any, Optional, Callable, Dict, Tuple
+
+import torch
+from torch import Tensor
+from torchmetrics import Metric
+from torchmetrics.classification import MulticlassAccuracy, MulticlassPrecision, MulticlassRecall, \
+    MulticlassF1Score, MulticlassJaccardIndex
+
+from src.metrics.divahisdb import HisDBIoU
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+AVERAGES = ('micro', 'macro', 'weighted', 'none', None)
+
+# a reducer gets the confusion matrix and the boundary counts (see ConfusionMatrixMetrics.update)
+Reducer = Callable[[Tensor, Tensor], Tensor]
+
+
+def get_confusion_matrix(preds: Tensor, target: Tensor, num_classes: int,
+                         ignore_index: Optional[int] = None) -> Tensor:
+    """
+    Computes the confusion matrix of a batch in one bincount. Pixels with a target outside of [0, num_classes) or
+    equal to the ignore index are not counted.
+
+    :param preds: predicted classes of size [N x H x W] or the class scores of size [N x C x H x W]
+    :type preds: Tensor
+    :param target: gt classes of size [N x H x W]
+    :type target: Tensor
+    :param num_classes: number of classes
+    :type num_classes: int
+    :param ignore_index: class of the target that is ignored
+    :type ignore_index: Optional[int]
+    :return: matrix of size [num_classes x num_classes] (rows target, columns prediction)
+    :rtype: Tensor
+    """
+    preds, target = _format_input(preds=preds, target=target)
+    valid = _get_valid(target=target, num_classes=num_classes, ignore_index=ignore_index)
+    hist = torch.bincount(num_classes * target[valid] + preds[valid], minlength=num_classes ** 2)
+    return hist.reshape(num_classes, num_classes)
+
+
+class ConfusionMatrixMetrics(Metric):
+    """
+    Accumulates the confusion matrix of a stage and derives all the given metrics from it in :meth:`compute`.
+    :meth:`compute` (and therefore also ``forward``) returns a dictionary with the values of the metrics.
+
+    To support the boundary rule of :class:`HisDBIoU` the boundary pixels (``mask``) that are predicted as
+    background (class 0) are counted per target class as well.
+
+    Use :func:`share_confusion_matrix` to replace the metrics of a collection that can be derived from the matrix.
+
+    :param num_classes: number of classes
+    :type num_classes: int
+    :param reducers: name of the metric and the function to compute it from the confusion matrix
+    :type reducers: Dict[str, Reducer]
+    :param ignore_index: class of the target that is ignored
+    :type ignore_index: Optional[int]
+    :param dist_sync_on_step: Synchronize metric state across processes at each ``forward()``
+        before returning the value at the step. default: False
+    :type dist_sync_on_step: bool
+    :param process_group: Specify the process group on which synchronization is called. default: None (which selects the entire world)
+    :type process_group: Optional[Any]
+    """
+    full_state_update = False
+
+    def __init__(self, num_classes: int, reducers: Dict[str, Reducer], ignore_index: Optional[int] = None,
+                 dist_sync_on_step: bool = False, process_group: Optional[Any] = None,
+                 dist_sync_fn: Callable = None) -> None:
+        super().__init__(dist_sync_on_step=dist_sync_on_step, process_group=process_group,
+                         dist_sync_fn=dist_sync_fn)
+        self.num_classes = num_classes
+        self.reducers = reducers
+        self.ignore_index = ignore_index
+
+        self.add_state("confmat", default=torch.zeros(num_classes, num_classes, dtype=torch.long),
+                       dist_reduce_fx="sum")
+        self.add_state("boundary_bg_predicted", default=torch.zeros(num_classes, dtype=torch.long),
+                       dist_reduce_fx="sum")
+
+    @property
+    def metric_names(self) -> Tuple[str, ...]:
+        return tuple(self.reducers.keys())
+
+    def update(self, preds: Tensor, target: Tensor, mask: Optional[Tensor] = None) -> None:
+        preds, target = _format_input(preds=preds, target=target)
+        valid = _get_valid(target=target, num_classes=self.num_classes, ignore_index=self.ignore_index)
+        target = target[valid]
+        preds = preds[valid]
+        self.confmat += torch.bincount(self.num_classes * target + preds,
+                                       minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+
+        if mask is not None:
+            mask_and_bg_predicted = torch.logical_and(mask.flatten()[valid], torch.eq(preds, 0))
+            self.boundary_bg_predicted += torch.bincount(target[mask_and_bg_predicted], minlength=self.num_classes)
+
+    def compute(self) -> Dict[str, Tensor]:
+        return {name: reducer(self.confmat, self.boundary_bg_predicted) for name, reducer in self.reducers.items()}
+
+
+def share_confusion_matrix(metrics: Dict[str, Metric]) -> Dict[str, Metric]:
+    """
+    Replaces all the metrics that can be derived from the confusion matrix by :class:`ConfusionMatrixMetrics`
+    (one per number of classes and ignore index). The other metrics are returned unchanged.
+
+    :param metrics: name and metric
+    :type metrics: Dict[str, Metric]
+    :return: the metrics where the derivable ones are replaced
+    :rtype: Dict[str, Metric]
+    """
+    shared_reducers = {}
+    result = {}
+    for name, metric in metrics.items():
+        reducer = get_reducer(metric)
+        if reducer is None:
+            result[name] = metric
+            continue
+        key = (metric.num_classes, getattr(metric, 'ignore_index', None))
+        shared_reducers.setdefault(key, {})[name] = reducer
+
+    for i, ((num_classes, ignore_index), reducers) in enumerate(shared_reducers.items()):
+        name = 'confusion_matrix_metrics' if i == 0 else f'confusion_matrix_metrics_{i}'
+        log.info(f'Derive the metrics {list(reducers.keys())} from one confusion matrix')
+        result[name] = ConfusionMatrixMetrics(num_classes=num_classes, reducers=reducers, ignore_index=ignore_index)
+    return result
+
+
+def get_reducer(metric: Metric) -> Optional[Reducer]:
+    """
+    Returns the function to compute the given metric from the confusion matrix. The reduction is the same as in
+    torchmetrics.
+
+    :param metric: the metric
+    :type metric: Metric
+    :return: the function or None if the metric can not be derived from the confusion matrix
+    :rtype: Optional[Reducer]
+    """
+    if isinstance(metric, HisDBIoU):
+        return partial(hisdb_iou, mask_modifies_prediction=metric.mask_modifies_prediction)
+
+    if isinstance(metric, MulticlassJaccardIndex):
+        if metric.ignore_index is not None or metric.normalize is not None or metric.average not in AVERAGES:
+            return None
+        return partial(_reduce_confmat, function=jaccard_index, average=metric.average)
+
+    stat_functions = {MulticlassF1Score: _f1_score, MulticlassPrecision: _precision, MulticlassRecall: _recall,
+                      MulticlassAccuracy: _recall}
+    for metric_type, stat_function in stat_functions.items():
+        if type(metric) is metric_type:
+            if metric.ignore_index is not None or metric.top_k != 1 or metric.multidim_average != 'global' \
+                    or metric.average not in AVERAGES:
+                return None
+            return partial(_reduce_confmat, function=partial(_reduce_stat_scores, stat_function=stat_function),
+                           average=metric.average)
+
+    return None
+
+
+def hisdb_iou(confmat: Tensor, boundary_bg_predicted: Tensor, mask_modifies_prediction: bool = True) -> Tensor:
+    """
+    Mean IoU like :class:`HisDBIoU`. The boundary pixels that are predicted as background count as correct if
+    ``mask_modifies_prediction`` is True, otherwise their target is set to background.
+
+    :param confmat: confusion matrix (rows target, columns prediction)
+    :type confmat: Tensor
+    :param boundary_bg_predicted: number of boundary pixels predicted as background per target class
+    :type boundary_bg_predicted: Tensor
+    :param mask_modifies_prediction: if True, the mask is used to modify the prediction, otherwise the target
+    :type mask_modifies_prediction: bool
+    :return: the mean IoU over the classes that occur
+    :rtype: Tensor
+    """
+    confmat = confmat.clone()
+    confmat[:, 0] -= boundary_bg_predicted
+    if mask_modifies_prediction:
+        confmat += torch.diag(boundary_bg_predicted)
+    else:
+        confmat[0, 0] += boundary_bg_predicted.sum()
+
+    tps = torch.diag(confmat)
+    res = tps.float() / (confmat.sum(dim=0) + confmat.sum(dim=1) - tps)
+    return res[~res.isnan()].mean()
+
+
+def jaccard_index(confmat: Tensor, average: Optional[str] = 'macro') -> Tensor:
+    """
+    Same reduction as :class:`torchmetrics.classification.MulticlassJaccardIndex`.
+
+    :param confmat: confusion matrix (rows target, columns prediction)
+    :type confmat: Tensor
+    :param average: one of 'micro', 'macro', 'weighted', 'none' or None
+    :type average: Optional[str]
+    :return: the jaccard index
+    :rtype: Tensor
+    """
+    confmat = confmat.float()
+    num = torch.diag(confmat)
+    denom = confmat.sum(dim=0) + confmat.sum(dim=1) - num
+    if average == 'micro':
+        num = num.sum()
+        denom = denom.sum()
+    jaccard = _safe_divide(num, denom)
+    if average is None or average == 'none' or average == 'micro':
+        return jaccard
+    weights = confmat.sum(dim=1) if average == 'weighted' else torch.ones_like(jaccard)
+    return ((weights * jaccard) / weights.sum()).sum()
+
+
+def _reduce_confmat(confmat: Tensor, boundary_bg_predicted: Tensor, function: Callable,
+                    average: Optional[str]) -> Tensor:
+    # the boundary pixels are only used by the HisDB IoU
+    return function(confmat, average=average)
+
+
+def _reduce_stat_scores(confmat: Tensor, stat_function: Callable, average: Optional[str]) -> Tensor:
+    numerator, denominator, weights = stat_function(confmat)
+    if average == 'micro':
+        return _safe_divide(numerator.sum(), denominator.sum())
+    score = _safe_divide(numerator, denominator)
+    if average is None or average == 'none':
+        return score
+    if average != 'weighted':
+        weights = torch.ones_like(score)
+    return _safe_divide(weights * score, weights.sum()).sum()
+
+
+def _stat_scores(confmat: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+    confmat = confmat.float()
+    tp = torch.diag(confmat)
+    return tp, confmat.sum(dim=0) - tp, confmat.sum(dim=1) - tp
+
+
+def _precision(confmat: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+    tp, fp, fn = _stat_scores(confmat)
+    return tp, tp + fp, tp + fn
+
+
+def _recall(confmat: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+    tp, fp, fn = _stat_scores(confmat)
+    return tp, tp + fn, tp + fn
+
+
+def _f1_score(confmat: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+    tp, fp, fn = _stat_scores(confmat)
+    return 2 * tp, 2 * tp + fp + fn, tp + fn
+
+
+def _safe_divide(num: Tensor, denom: Tensor) -> Tensor:
+    return num / torch.where(denom == 0, torch.ones_like(denom), denom)
+
+
+def _format_input(preds: Tensor, target: Tensor) -> Tuple[Tensor, Tensor]:
+    if preds.dim() == target.dim() + 1:
+        preds = torch.argmax(preds, dim=1)
+    return preds.flatten().long(), target.flatten().long()
+
+
+def _get_valid(target: Tensor, num_classes: int, ignore_index: Optional[int]) -> Tensor:
+    valid = torch.logical_and(torch.ge(target, 0), torch.lt(target, num_classes))
+    if ignore_index is not None:
+        valid = torch.logical_and(valid, torch.ne(target, ignore_index))
+    return valid
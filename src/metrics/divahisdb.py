@@ -1,6 +1,5 @@
-from typing import Any, Optional, Callable
+from typing import Any, Optional, Callable, Union, Sequence
 
-import numpy as np
 import torch
 from torch import Tensor
 from torchmetrics import Metric
@@ -15,6 +14,8 @@ class HisDBIoU(Metric):
     :type num_classes: int
     :param mask_modifies_prediction: if True, the mask is used to modify the prediction, otherwise the prediction is used to modify the mask
     :type mask_modifies_prediction: bool
+    :param ignore_index: class of the target that is not counted
+    :type ignore_index: Optional[int]
     :param compute_on_step: Forward only calls ``update()`` and return None if this is set to False. default: True
     :type compute_on_step: bool
     :param dist_sync_on_step: Synchronize metric state across processes at each ``forward()``
@@ -25,52 +26,61 @@ class HisDBIoU(Metric):
 
     """
 
-    def __init__(self, num_classes: int = None, mask_modifies_prediction: bool = True, compute_on_step: bool = True,
-                 dist_sync_on_step: bool = False, process_group: Optional[Any] = None, dist_sync_fn: Callable = None,
+    def __init__(self, num_classes: int = None, mask_modifies_prediction: bool = True,
+                 ignore_index: Optional[int] = None, compute_on_step: bool = True, dist_sync_on_step: bool = False,
+                 process_group: Optional[Any] = None, dist_sync_fn: Callable = None,
                  ) -> None:
         super().__init__(compute_on_step=compute_on_step, dist_sync_on_step=dist_sync_on_step,
                          process_group=process_group, dist_sync_fn=dist_sync_fn)
+        if num_classes is None:
+            raise ValueError('HisDBIoU needs the number of classes (num_classes)')
         self.num_classes = num_classes
         self.mask_modifies_prediction = mask_modifies_prediction
+        self.ignore_index = ignore_index
         # use state save
-        self.add_state("tps", default=torch.tensor(0), dist_reduce_fx="sum")
-        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
+        self.add_state("tps", default=torch.zeros(num_classes, dtype=torch.long), dist_reduce_fx="sum")
+        self.add_state("total", default=torch.zeros(num_classes, dtype=torch.long), dist_reduce_fx="sum")
+
+    def update(self, pred: Union[Tensor, Sequence[Tensor]], target: Union[Tensor, Sequence[Tensor]],
+               mask: Union[Tensor, Sequence[Tensor]] = None, **kwargs) -> None:
+        """
+        Updates the state with a batch. If the images of the batch have different sizes, they can be passed as
+        sequences of tensors.
+
+        :param pred: predicted classes of size [N x H x W]
+        :type pred: Union[Tensor, Sequence[Tensor]]
+        :param target: gt classes of size [N x H x W]
+        :type target: Union[Tensor, Sequence[Tensor]]
+        :param mask: boundary pixels of size [N x H x W]
+        :type mask: Union[Tensor, Sequence[Tensor]]
+        """
+        pred = _flatten(pred)
+        target = _flatten(target)
 
-    def update(self, pred: torch.Tensor, target: torch.Tensor, mask: torch.Tensor = None, **kwargs) -> None:
         # take into account the boundary pixels like done in the offical evaluator
         # https://github.com/DIVA-DIA/DIVA_Layout_Analysis_Evaluator/blob/87a11ede232f8fb490401a382b8764697b65ea8d/src/main/java/ch/unifr/LayoutAnalysisEvaluator.java#L225
         if mask is not None:
-            mask_and_bg_predicted = torch.logical_and(mask, torch.eq(pred, 0))
+            mask_and_bg_predicted = torch.logical_and(_flatten(mask), torch.eq(pred, 0))
             if self.mask_modifies_prediction:
-                pred = pred.clone()
-                pred[mask_and_bg_predicted] = target[mask_and_bg_predicted]
+                pred = torch.where(mask_and_bg_predicted, target, pred)
             else:
-                target = target.clone()
-                target[mask_and_bg_predicted] = pred[mask_and_bg_predicted]
-
-        hist = torch.zeros((self.num_classes, self.num_classes)).type_as(target)
-        for lt, lp in zip(target, pred):
-            try:
-                # the images all have the same size
-                hist = torch.add(hist, self._fast_hist(lt.flatten(), lp.flatten(), self.num_classes))
-            except ValueError:
-                # the images have different sizes
-                hist = torch.add(hist, self._fast_hist([l.flatten() for l in lt].flatten(),
-                                                       [l.flatten() for l in lp].flatten(), self.num_classes))
-
-        with np.errstate(divide='ignore', invalid='ignore'):
-            self.tps = torch.add(self.tps, torch.diag(hist))
-            self.total = torch.add(self.total, hist.sum(axis=1) + hist.sum(axis=0) - torch.diag(hist))
+                target = torch.where(mask_and_bg_predicted, pred, target)
+
+        hist = self._fast_hist(target, pred, self.num_classes, ignore_index=self.ignore_index)
+        tps = torch.diag(hist)
+        self.tps += tps
+        self.total += hist.sum(dim=1) + hist.sum(dim=0) - tps
 
     def compute(self) -> Any:
         res = torch.div(self.tps.float(), self.total)
         return res[~res.isnan()].mean()
 
     @staticmethod
-    def _fast_hist(label_true: Tensor, label_pred: Tensor, n_class: int):
+    def _fast_hist(label_true: Tensor, label_pred: Tensor, n_class: int, ignore_index: Optional[int] = None):
         """
-        Creates a Historgram in a fash fashion taken adventage of the hardware.
-        Inspired from `https://github.com/wkentaro/pytorch-fcn`_.
+        Creates a histogram of all pixels at once. The histogram has a fixed size and pixels with a target outside
+        of [0, n_class) or equal to the ignore index are added to an extra bin, so there is no synchronisation with
+        the host. Inspired from `https://github.com/wkentaro/pytorch-fcn`_.
 
         :param label_true: matrix (batch size x H x W)
             contains the true class labels for each pixel
@@ -81,12 +91,25 @@ class HisDBIoU(Metric):
         :param n_class: int
             number possible classes
         :type n_class: int
+        :param ignore_index: class of the target that is not counted
+        :type ignore_index: Optional[int]
         :return histogram
         :rtype: torch.Tensor
 
         """
-        mask = torch.bitwise_and(torch.ge(label_true, 0), torch.lt(label_true, n_class))
-        hist = torch.bincount(
-            torch.add(torch.mul(n_class, label_true[mask]), label_pred[mask]), minlength=n_class ** 2).reshape(n_class,
-                                                                                                               n_class)
-        return hist
+        label_true = label_true.flatten().long()
+        label_pred = label_pred.flatten().long()
+        valid = torch.logical_and(torch.ge(label_true, 0), torch.lt(label_true, n_class))
+        if ignore_index is not None:
+            valid = torch.logical_and(valid, torch.ne(label_true, ignore_index))
+
+        index = torch.where(valid, n_class * label_true + label_pred, torch.full_like(label_true, n_class ** 2))
+        hist = torch.zeros(n_class ** 2 + 1, dtype=torch.long, device=label_true.device)
+        hist.scatter_add_(0, index, torch.ones_like(index))
+        return hist[:-1].reshape(n_class, n_class)
+
+
+def _flatten(x: Union[Tensor, Sequence[Tensor]]) -> Tensor:
+    if torch.is_tensor(x):
+        return x.flatten()
+    return torch.cat([t.flatten() for t in x])
@@ -0,0 +1,172 @@
+"""
+NumPy implementation of the metrics of the `DIVA Layout Analysis Evaluator
+<https://github.com/DIVA-DIA/DIVA_Layout_Analysis_Evaluator>`_ for the DIVA-HisDB format.
+
+The classes are encoded as bits in the blue channel (background 0x1, comment 0x2, decoration 0x4, main text 0x8) and
+a pixel can belong to several classes. Boundary pixels are marked in the red channel of the gt (0x80) and count as
+correct if they are predicted as background.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+CLASS_NAMES = ('background', 'comment', 'decoration', 'main text')
+NUM_CLASS_BITS = len(CLASS_NAMES)
+NUM_LABEL_SETS = 2 ** NUM_CLASS_BITS
+BACKGROUND = 0x1
+
+# _LABEL_SET_CLASSES[s, c] is True if the label set s contains the class c
+_LABEL_SET_CLASSES = ((np.arange(NUM_LABEL_SETS)[:, None] >> np.arange(NUM_CLASS_BITS)[None, :]) & 1).astype(bool)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    return _LABEL_SET_CLASSES[x].sum(axis=-1)
+
+
+# Hamming score (|intersection| / |union|) of all combinations of gt and predicted label sets
+_GT_SETS, _PRED_SETS = np.meshgrid(np.arange(NUM_LABEL_SETS), np.arange(NUM_LABEL_SETS), indexing='ij')
+with np.errstate(divide='ignore', invalid='ignore'):
+    _HAMMING_SCORES = np.where((_GT_SETS | _PRED_SETS) == 0, 1.,
+                               _popcount(_GT_SETS & _PRED_SETS) / _popcount(_GT_SETS | _PRED_SETS))
+
+
+def get_layout_confusion_matrix(gt: np.ndarray, prediction: np.ndarray) -> np.ndarray:
+    """
+    Counts how often each gt label set is predicted as each label set. A label set is the combination of the class
+    bits of a pixel, so the matrix has the size 16 x 16.
+
+    :param gt: gt image of size [H x W x 3] (RGB) in the DIVA-HisDB format
+    :type gt: np.ndarray
+    :param prediction: prediction image of size [H x W x 3] (RGB) in the DIVA-HisDB format
+    :type prediction: np.ndarray
+    :return: matrix of size [16 x 16] with the pixel counts (rows gt, columns prediction)
+    :rtype: np.ndarray
+    """
+    if gt.shape != prediction.shape:
+        raise ValueError(f'The gt ({gt.shape}) and the prediction ({prediction.shape}) do not have the same size')
+
+    gt_labels = gt[:, :, 2].astype(np.int64) & (NUM_LABEL_SETS - 1)
+    pred_labels = prediction[:, :, 2].astype(np.int64) & (NUM_LABEL_SETS - 1)
+
+    # boundary pixels predicted as background are counted as correct
+    boundary_and_bg_predicted = np.logical_and(gt[:, :, 0] != 0, pred_labels == BACKGROUND)
+    pred_labels[boundary_and_bg_predicted] = gt_labels[boundary_and_bg_predicted]
+
+    hist = np.bincount((gt_labels * NUM_LABEL_SETS + pred_labels).ravel(), minlength=NUM_LABEL_SETS ** 2)
+    return hist.reshape(NUM_LABEL_SETS, NUM_LABEL_SETS)
+
+
+@dataclass
+class LayoutAnalysisScores:
+    """
+    Scores of the layout analysis evaluator. The per class scores are in the order of :data:`CLASS_NAMES`.
+
+    :param exact_match: ratio of pixels where all classes are predicted correctly
+    :type exact_match: float
+    :param hamming_score: mean over all pixels of \\|gt ∩ prediction\\| / \\|gt ∪ prediction\\|
+    :type hamming_score: float
+    :param iu: intersection over union per class
+    :type iu: np.ndarray
+    :param f1: F1 score per class
+    :type f1: np.ndarray
+    :param precision: precision per class
+    :type precision: np.ndarray
+    :param recall: recall per class
+    :type recall: np.ndarray
+    :param freq: frequency of the classes in the gt
+    :type freq: np.ndarray
+    """
+    exact_match: float
+    hamming_score: float
+    iu: np.ndarray
+    f1: np.ndarray
+    precision: np.ndarray
+    recall: np.ndarray
+    freq: np.ndarray
+
+    @classmethod
+    def from_confusion_matrix(cls, confusion_matrix: np.ndarray) -> 'LayoutAnalysisScores':
+        """
+        Computes the scores from a confusion matrix of :func:`get_layout_confusion_matrix`. The confusion matrices of
+        several pages can be summed up before.
+
+        :param confusion_matrix: matrix of size [16 x 16]
+        :type confusion_matrix: np.ndarray
+        :return: the scores
+        :rtype: LayoutAnalysisScores
+        """
+        hist = confusion_matrix.astype(np.float64)
+        total = hist.sum()
+        gt_has = _LABEL_SET_CLASSES.astype(np.float64)
+
+        tp = np.einsum('gc,gp,pc->c', gt_has, hist, gt_has)
+        fp = np.einsum('gc,gp,pc->c', 1 - gt_has, hist, gt_has)
+        fn = np.einsum('gc,gp,pc->c', gt_has, hist, 1 - gt_has)
+        gt_count = tp + fn
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cls(exact_match=np.trace(hist) / total,
+                       hamming_score=(hist * _HAMMING_SCORES).sum() / total,
+                       iu=tp / (tp + fp + fn),
+                       f1=2 * tp / (2 * tp + fp + fn),
+                       precision=tp / (tp + fp),
+                       recall=tp / (tp + fn),
+                       freq=gt_count / gt_count.sum())
+
+    @property
+    def mean_iu(self) -> float:
+        return _mean(self.iu)
+
+    def to_stats_string(self) -> str:
+        """
+        Formats the scores like the summary line of the Java evaluator, e.g.
+        ``EM=1.00 HS=1.00 IU=0.98,1.00[1.00|0.99|0.94|0.99] F1=... P=... R=... Freq:[0.84|0.06|0.01|0.09]``.
+        The first value is the mean over the classes, the second one the mean weighted by the class frequency.
+
+        :return: the formatted scores
+        :rtype: str
+        """
+        metrics = ' '.join(f'{name}={_format(_mean(values))},{_format(_weighted_mean(values, self.freq))}'
+                           f'[{_format_list(values)}]'
+                           for name, values in [('IU', self.iu), ('F1', self.f1), ('P', self.precision),
+                                                ('R', self.recall)])
+        return f'EM={_format(self.exact_match)} HS={_format(self.hamming_score)} {metrics} ' \
+               f'Freq:[{_format_list(self.freq)}]'
+
+
+def evaluate_page(gt_path: Union[str, Path], prediction_path: Union[str, Path]) -> LayoutAnalysisScores:
+    """
+    Evaluates the prediction of one page.
+
+    :param gt_path: path to the gt image
+    :type gt_path: Union[str, Path]
+    :param prediction_path: path to the prediction image
+    :type prediction_path: Union[str, Path]
+    :return: the scores of the page
+    :rtype: LayoutAnalysisScores
+    """
+    with Image.open(gt_path) as gt_img, Image.open(prediction_path) as pred_img:
+        gt = np.asarray(gt_img.convert('RGB'))
+        prediction = np.asarray(pred_img.convert('RGB'))
+    return LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=prediction))
+
+
+def _mean(values: np.ndarray) -> float:
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if values.size else float('nan')
+
+
+def _weighted_mean(values: np.ndarray, weights: np.ndarray) -> float:
+    valid = ~np.isnan(values)
+    return float((values[valid] * weights[valid]).sum())
+
+
+def _format(value: float) -> str:
+    return 'NaN' if np.isnan(value) else f'{value:.2f}'
+
+
+def _format_list(values: np.ndarray) -> str:
+    return '|'.join(_format(v) for v in values)
@@ -0,0 +1,122 @@
+"""
+Receptive field and alignment of fully convolutional models.
+
+A pixel of the output of a fully convolutional model only depends on the input pixels within its receptive field.
+So a page can be predicted piece by piece as long as every piece contains the receptive field of its output pixels
+and the pieces start on the grid of the pooling layers. :func:`get_receptive_field` computes both with a forward
+pass of a small probe through the model.
+"""
+import math
+from dataclasses import dataclass
+from functools import reduce
+from typing import List
+
+import torch
+from torch import nn
+
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+# layers that combine all pixels of the input, the model is then not fully convolutional
+GLOBAL_LAYERS = (nn.AdaptiveAvgPool2d, nn.AdaptiveMaxPool2d, nn.Linear)
+
+
+@dataclass
+class ReceptiveField:
+    """
+    Dataclass with the receptive field of a model along the height of the input
+
+    :param radius: number of input rows above and below an output pixel that can change its value
+    :type radius: int
+    :param alignment: the downsampling factor of the model, pieces of the input have to start at a multiple of it to
+        see the same pooling grid as the whole input
+    :type alignment: int
+    """
+    radius: int
+    alignment: int
+
+    @property
+    def halo(self) -> int:
+        """
+        Number of rows that have to be added above and below a piece of the input, rounded up to the alignment.
+        """
+        return math.ceil(self.radius / self.alignment) * self.alignment
+
+
+def get_receptive_field(model: nn.Module, input_channels: int = 3, probe_size: int = 256) -> ReceptiveField:
+    """
+    Computes the receptive field and the alignment of a fully convolutional model (e.g. the UNets of
+    ``src/models/backbones``). The layers of the model are found with forward hooks during a pass of a zero probe.
+    The radius is an upper bound: the contributions of all the convolution, pooling and upsampling layers are summed
+    up, weighted by their downsampling factor.
+
+    Layers that are called as functions within the forward method of a module (e.g. ``F.interpolate``) are not seen.
+
+    :param model: the model
+    :type model: nn.Module
+    :param input_channels: number of channels of the input of the model
+    :type input_channels: int
+    :param probe_size: height and width of the probe, has to be divisible by the downsampling factor of the model
+    :type probe_size: int
+    :return: the receptive field of the model
+    :rtype: ReceptiveField
+    :raises ValueError: if the model is not fully convolutional or not translation equivariant
+    """
+    radius = 0.
+    jumps: List[float] = []
+    errors: List[str] = []
+
+    def hook(module: nn.Module, inputs, output) -> None:
+        nonlocal radius
+        if isinstance(module, GLOBAL_LAYERS):
+            errors.append(f'{type(module).__name__} combines all the pixels of its input')
+            return
+        jump_in = probe_size / inputs[0].shape[-2]
+        jumps.append(probe_size / output.shape[-2])
+        if isinstance(module, nn.Upsample):
+            if module.align_corners:
+                errors.append('Upsample with align_corners=True depends on the size of its input')
+            radius += jump_in
+        elif isinstance(module, nn.ConvTranspose2d):
+            extent = max(module.padding[0], module.dilation[0] * (module.kernel_size[0] - 1) - module.padding[0])
+            radius += math.ceil(extent / module.stride[0] + 1) * jump_in
+        else:
+            kernel_size, padding, dilation = (_first(getattr(module, name, 1))
+                                              for name in ('kernel_size', 'padding', 'dilation'))
+            radius += max(padding, dilation * (kernel_size - 1) - padding) * jump_in
+
+    layer_types = (nn.Conv2d, nn.ConvTranspose2d, nn.MaxPool2d, nn.AvgPool2d, nn.Upsample) + GLOBAL_LAYERS
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, layer_types)]
+    # the probe must not change the statistics of the batch norm layers
+    training = {m: m.training for m in model.modules()}
+    model.eval()
+    try:
+        parameter = next(model.parameters(), None)
+        probe = torch.zeros(1, input_channels, probe_size, probe_size,
+                            device=parameter.device if parameter is not None else None)
+        with torch.no_grad():
+            model(probe)
+    finally:
+        for handle in handles:
+            handle.remove()
+        for module, mode in training.items():
+            module.training = mode
+
+    if errors:
+        msg = f'The receptive field of {type(model).__name__} is not local: {"; ".join(dict.fromkeys(errors))}'
+        log.error(msg)
+        raise ValueError(msg)
+    if any(jump != int(jump) for jump in jumps if jump >= 1):
+        msg = f'Parameter "probe_size" ({probe_size}) is not divisible by the downsampling of ' \
+              f'{type(model).__name__}'
+        log.error(msg)
+        raise ValueError(msg)
+
+    # math.lcm needs Python 3.9
+    alignment = reduce(lambda a, b: a * b // math.gcd(a, b), (int(jump) for jump in jumps if jump >= 1), 1)
+    return ReceptiveField(radius=math.ceil(radius), alignment=alignment)
+
+
+def _first(value) -> int:
+    return value[0] if isinstance(value, tuple) else value
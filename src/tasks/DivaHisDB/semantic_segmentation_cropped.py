@@ -1,14 +1,17 @@
 from pathlib import Path
 from typing import Optional, Callable, Union
 
+import numpy as np
 import torch.nn as nn
 import torch.optim
 import torchmetrics
 
+from src.datamodules.DivaHisDB.utils.output_tools import save_output_page_image
 from src.datamodules.utils.misc import _get_argmax
 from src.tasks.base_task import AbstractTask
 from src.utils import utils
-from src.tasks.utils.outputs import OutputKeys, reduce_dict, save_numpy_files
+from src.tasks.utils.outputs import OutputKeys, reduce_dict, save_numpy_files, PatchMerger, \
+    add_patches_to_merger
 from src.tasks.utils.task_utils import print_merge_tool_info
 
 log = utils.get_logger(__name__)
@@ -40,6 +43,13 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
     :type confusion_matrix_log_every_n_epoch: int
     :param lr: The learning rate.
     :type lr: float
+    :param output_writer_workers: Number of threads that write the test and predict output, 0 writes synchronously
+    :type output_writer_workers: int
+    :param output_writer_max_pending: Maximal number of outputs that wait to be written before the step blocks
+    :type output_writer_max_pending: int
+    :param merge_test_patches: If True, the test patches are merged into full pages in memory and the merged
+        predictions are written to ``test_output_path/result/pred`` instead of saving every patch (single process only)
+    :type merge_test_patches: bool
 
     """
 
@@ -55,7 +65,10 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
                  confusion_matrix_val: Optional[bool] = False,
                  confusion_matrix_test: Optional[bool] = False,
                  confusion_matrix_log_every_n_epoch: Optional[int] = 1,
-                 lr: float = 1e-3
+                 lr: float = 1e-3,
+                 output_writer_workers: int = 2,
+                 output_writer_max_pending: int = 16,
+                 merge_test_patches: bool = False,
                  ) -> None:
         """
         Constructor for the SemanticSegmentationCroppedHisDB task
@@ -73,7 +86,11 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
             confusion_matrix_val=confusion_matrix_val,
             confusion_matrix_test=confusion_matrix_test,
             confusion_matrix_log_every_n_epoch=confusion_matrix_log_every_n_epoch,
+            output_writer_workers=output_writer_workers,
+            output_writer_max_pending=output_writer_max_pending,
         )
+        self.merge_test_patches = merge_test_patches
+        self.patch_merger: Optional[PatchMerger] = None
         # self.save_hyperparameters()
 
     def setup(self, stage: str) -> None:
@@ -93,7 +110,7 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
     #############################################################################################
     def training_step(self, batch, batch_idx, **kwargs):
         input_batch, target_batch, mask_batch = batch
-        metric_kwargs = {'hisdbiou': {'mask': mask_batch}}
+        metric_kwargs = {'hisdb_miou': {'mask': mask_batch}}
         output = super().training_step(batch=(input_batch, target_batch), batch_idx=batch_idx,
                                        metric_kwargs=metric_kwargs)
         return reduce_dict(input_dict=output, key_list=[OutputKeys.LOSS])
@@ -104,7 +121,7 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
 
     def validation_step(self, batch, batch_idx, **kwargs):
         input_batch, target_batch, mask_batch = batch
-        metric_kwargs = {'hisdbiou': {'mask': mask_batch}}
+        metric_kwargs = {'hisdb_miou': {'mask': mask_batch}}
         output = super().validation_step(batch=(input_batch, target_batch), batch_idx=batch_idx,
                                          metric_kwargs=metric_kwargs)
         return reduce_dict(input_dict=output, key_list=[])
@@ -113,14 +130,42 @@ class SemanticSegmentationCroppedHisDB(AbstractTask):
     ########################################### TEST ############################################
     #############################################################################################
 
+    def on_test_start(self) -> None:
+        self.patch_merger = None
+        if not self.merge_test_patches:
+            return
+        if self.trainer.world_size > 1:
+            log.warning('merge_test_patches is not supported with more than one process. '
+                        'The patches are saved and have to be merged with the merge tool.')
+            return
+        self.patch_merger = PatchMerger.from_img_paths_per_page(
+            img_paths_per_page=self.trainer.datamodule.test.img_paths_per_page,
+            on_page_done=self._save_merged_page)
+
     def test_step(self, batch, batch_idx, **kwargs):
         input_batch, target_batch, mask_batch, input_idx = batch
-        metric_kwargs = {'hisdbiou': {'mask': mask_batch}}
+        metric_kwargs = {'hisdb_miou': {'mask': mask_batch}}
         output = super().test_step(batch=(input_batch, target_batch), batch_idx=batch_idx, metric_kwargs=metric_kwargs)
 
-        save_numpy_files(self.trainer, self.test_output_path, input_idx, output)
+        if self.patch_merger is not None:
+            add_patches_to_merger(self.trainer, self.patch_merger, input_idx, output)
+        else:
+            save_numpy_files(self.trainer, self.test_output_path, input_idx, output, self.output_writer)
 
         return reduce_dict(input_dict=output, key_list=[])
 
+    def _save_merged_page(self, img_name: str, prediction: np.ndarray) -> None:
+        self.output_writer.submit(save_output_page_image, image_name=f'{img_name}.png', output_image=prediction,
+                                  output_folder=self.test_output_path / 'result' / 'pred',
+                                  class_encoding=self.trainer.datamodule.class_encodings)
+
     def on_test_end(self) -> None:
-        print_merge_tool_info(self.trainer, self.test_output_path, 'HisDB')
+        if self.patch_merger is None:
+            super().on_test_end()
+            print_merge_tool_info(self.trainer, self.test_output_path, 'HisDB')
+            return
+
+        self.patch_merger.finish()
+        self.patch_merger = None
+        super().on_test_end()
+        log.info(f'Merged predictions saved in {(self.test_output_path / "result" / "pred").absolute()}')
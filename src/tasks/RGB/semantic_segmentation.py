@@ -1,7 +1,6 @@
 from pathlib import Path
 from typing import Optional, Callable, Union, Any, List
 
-import numpy as np
 import torch.nn as nn
 import torch.optim
 import torchmetrics
@@ -11,7 +10,8 @@ from src.datamodules.RGB.utils.output_tools import save_output_page_image
 from src.datamodules.utils.misc import _get_argmax
 from src.tasks.base_task import AbstractTask
 from src.utils import utils
-from src.tasks.utils.outputs import OutputKeys, reduce_dict
+from src.tasks.utils.outputs import OutputKeys, reduce_dict, save_numpy_file
+from src.tasks.utils.tiled_inference import SlidingWindowInference, StripInference, CascadeInference
 
 log = utils.get_logger(__name__)
 
@@ -41,6 +41,19 @@ class SemanticSegmentationRGB(AbstractTask):
     :type confusion_matrix_log_every_n_epoch: int
     :param lr: The learning rate.
     :type lr: float
+    :param output_writer_workers: Number of threads that write the test and predict output, 0 writes synchronously
+    :type output_writer_workers: int
+    :param output_writer_max_pending: Maximal number of outputs that wait to be written before the step blocks
+    :type output_writer_max_pending: int
+    :param sliding_window: Predicts the pages with overlapping windows of the model input size, so pages of any size
+        can be predicted (use it with ``predict_any_size`` of the datamodule)
+    :type sliding_window: Optional[SlidingWindowInference]
+    :param strip_inference: Predicts the pages in horizontal strips with the same result as the whole page at once,
+        but with the memory for the activations of one strip
+    :type strip_inference: Optional[StripInference]
+    :param cascade_inference: Predicts the pages downscaled first and refines only the uncertain windows and the
+        windows at class boundaries at full resolution (see :func:`src.tasks.utils.tiled_inference.evaluate_cascade`)
+    :type cascade_inference: Optional[CascadeInference]
     """
 
     def __init__(self,
@@ -55,7 +68,12 @@ class SemanticSegmentationRGB(AbstractTask):
                  confusion_matrix_val: Optional[bool] = False,
                  confusion_matrix_test: Optional[bool] = False,
                  confusion_matrix_log_every_n_epoch: Optional[int] = 1,
-                 lr: float = 1e-3
+                 lr: float = 1e-3,
+                 output_writer_workers: int = 2,
+                 output_writer_max_pending: int = 16,
+                 sliding_window: Optional[SlidingWindowInference] = None,
+                 strip_inference: Optional[StripInference] = None,
+                 cascade_inference: Optional[CascadeInference] = None,
                  ) -> None:
         """
         Construction method for the SemanticSegmentationRGB task
@@ -73,6 +91,11 @@ class SemanticSegmentationRGB(AbstractTask):
             confusion_matrix_val=confusion_matrix_val,
             confusion_matrix_test=confusion_matrix_test,
             confusion_matrix_log_every_n_epoch=confusion_matrix_log_every_n_epoch,
+            output_writer_workers=output_writer_workers,
+            output_writer_max_pending=output_writer_max_pending,
+            sliding_window=sliding_window,
+            strip_inference=strip_inference,
+            cascade_inference=cascade_inference,
         )
         # self.save_hyperparameters()
 
@@ -134,21 +157,16 @@ class SemanticSegmentationRGB(AbstractTask):
         for pred_raw, idx in zip(output[OutputKeys.PREDICTION].detach().cpu().numpy(),
                                  input_idx.detach().cpu().numpy()):
             img_name = self.trainer.datamodule.get_output_filename_test(idx)
-            dest_folder = self.test_output_path / 'pred_raw'
-            dest_folder.mkdir(parents=True, exist_ok=True)
-            dest_filename = dest_folder / f'{img_name}.npy'
-            np.save(file=str(dest_filename), arr=pred_raw)
+            dest_filename = self.test_output_path / 'pred_raw' / f'{img_name}.npy'
+            self.output_writer.submit(save_numpy_file, dest_filename=dest_filename, arr=pred_raw)
 
             dest_folder = self.test_output_path / 'pred'
-            dest_folder.mkdir(parents=True, exist_ok=True)
-            save_output_page_image(image_name=f'{img_name}.gif', output_image=pred_raw,
-                                   output_folder=dest_folder, class_encoding=self.trainer.datamodule.class_encodings)
+            self.output_writer.submit(save_output_page_image, image_name=f'{img_name}.gif', output_image=pred_raw,
+                                      output_folder=dest_folder,
+                                      class_encoding=self.trainer.datamodule.class_encodings)
 
         return reduce_dict(input_dict=output, key_list=[])
 
-    def on_test_end(self) -> None:
-        pass
-
     #############################################################################################
     ######################################### PREDICT ###########################################
     #############################################################################################
@@ -166,24 +184,26 @@ class SemanticSegmentationRGB(AbstractTask):
                                 info_filename=info_filename)
 
     def predict_step(self, batch: Any, batch_idx: int, dataloader_idx: Optional[int] = None) -> Any:
-        input_batch, input_idx = batch
+        # the size bucketed batches contain the original size of the padded pages
+        input_batch, input_idx, *input_sizes = batch
         output = super().predict_step(batch=input_batch, batch_idx=batch_idx, dataloader_idx=dataloader_idx)
 
         if not hasattr(self.trainer.datamodule, 'get_output_filename_predict'):
             raise NotImplementedError('Datamodule does not provide output info for predict')
 
-        for pred_raw, idx in zip(output[OutputKeys.PREDICTION].detach().cpu().numpy(),
-                                 input_idx.detach().cpu().numpy()):
+        for i, (pred_raw, idx) in enumerate(zip(output[OutputKeys.PREDICTION], input_idx.detach().cpu().numpy())):
+            if input_sizes:
+                height, width = input_sizes[0][i].tolist()
+                pred_raw = pred_raw[:, :height, :width]
+            pred_raw = pred_raw.detach().cpu().numpy()
             img_name = self.trainer.datamodule.get_output_filename_predict(idx)
-            dest_folder = self.predict_output_path / 'pred_raw'
-            dest_folder.mkdir(parents=True, exist_ok=True)
-            dest_filename = dest_folder / f'{img_name}.npy'
-            np.save(file=str(dest_filename), arr=pred_raw)
+            dest_filename = self.predict_output_path / 'pred_raw' / f'{img_name}.npy'
+            self.output_writer.submit(save_numpy_file, dest_filename=dest_filename, arr=pred_raw)
 
             dest_folder = self.predict_output_path / 'pred'
-            dest_folder.mkdir(parents=True, exist_ok=True)
-            save_output_page_image(image_name=f'{img_name}.gif', output_image=pred_raw,
-                                   output_folder=dest_folder, class_encoding=self.trainer.datamodule.class_encodings)
+            self.output_writer.submit(save_output_page_image, image_name=f'{img_name}.gif', output_image=pred_raw,
+                                      output_folder=dest_folder,
+                                      class_encoding=self.trainer.datamodule.class_encodings)
 
         return reduce_dict(input_dict=output, key_list=[])
 
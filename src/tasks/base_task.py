@@ -21,8 +21,10 @@ from torch.optim import Optimizer
 from torch.optim.lr_scheduler import _LRScheduler
 
 from src.callbacks.wandb_callbacks import get_wandb_logger
-from src.tasks.utils.outputs import OutputKeys
+from src.metrics.confusion_matrix import ConfusionMatrixMetrics
+from src.tasks.utils.outputs import OutputKeys, OutputWriter
 from src.tasks.utils.task_utils import get_callable_dict
+from src.tasks.utils.tiled_inference import SlidingWindowInference, StripInference, CascadeInference
 from src.utils import utils
 
 log = utils.get_logger(__name__)
@@ -72,6 +74,19 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
     :type test_output_path: Union[str, Path]
     :param predict_output_path: Path relative to the normal output folder where to save the predict output
     :type predict_output_path: Union[str, Path]
+    :param output_writer_workers: Number of threads that write the test and predict output, 0 writes synchronously
+    :type output_writer_workers: int
+    :param output_writer_max_pending: Maximal number of outputs that wait to be written before the step blocks
+    :type output_writer_max_pending: int
+    :param sliding_window: Predicts the pages with overlapping windows of the model input size instead of the whole
+        page at once, so pages of any size can be predicted
+    :type sliding_window: Optional[SlidingWindowInference]
+    :param strip_inference: Predicts the pages in horizontal strips with the same result as the whole page at once,
+        so the memory of the activations is bounded by the strip height
+    :type strip_inference: Optional[StripInference]
+    :param cascade_inference: Predicts the pages at a lower resolution and only the uncertain windows and the windows
+        at class boundaries at full resolution
+    :type cascade_inference: Optional[CascadeInference]
     """
 
     def __init__(
@@ -90,8 +105,12 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
             confusion_matrix_log_every_n_epoch: Optional[int] = 1,
             lr: float = 1e-3,
             test_output_path: Optional[Union[str, Path]] = 'test_output',
-            predict_output_path: Optional[Union[str, Path]] = 'predict_output'
-
+            predict_output_path: Optional[Union[str, Path]] = 'predict_output',
+            output_writer_workers: int = 2,
+            output_writer_max_pending: int = 16,
+            sliding_window: Optional[SlidingWindowInference] = None,
+            strip_inference: Optional[StripInference] = None,
+            cascade_inference: Optional[CascadeInference] = None,
     ):
         super().__init__()
 
@@ -121,6 +140,14 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
         self.lr = lr
         self.test_output_path = Path(test_output_path)
         self.predict_output_path = Path(predict_output_path)
+        self.output_writer = OutputWriter(num_workers=output_writer_workers, max_pending=output_writer_max_pending)
+        if sum(inference is not None for inference in [sliding_window, strip_inference, cascade_inference]) > 1:
+            msg = 'Only one of the parameters "sliding_window", "strip_inference" and "cascade_inference" can be used'
+            log.error(msg)
+            raise ValueError(msg)
+        self.sliding_window = sliding_window
+        self.strip_inference = strip_inference
+        self.cascade_inference = cascade_inference
         # self.save_hyperparameters()
 
     def setup(self, stage: str):
@@ -183,7 +210,12 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
         current_metric = self._get_current_metric()
 
         for name, metric in current_metric.items():
-            if name in metric_kwargs:
+            if isinstance(metric, ConfusionMatrixMetrics):
+                # one update for all the metrics derived from the confusion matrix
+                kwargs = {key: value for metric_name in metric.metric_names
+                          for key, value in metric_kwargs.get(metric_name, {}).items()}
+                logs.update(metric(y_hat, y, **kwargs))
+            elif name in metric_kwargs:
                 logs[name] = metric(y_hat, y, **metric_kwargs[name])
             else:
                 logs[name] = metric(y_hat, y)
@@ -237,6 +269,12 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
             raise NotImplementedError(f"Unsupported network output type: {type(x)}")
         return out
 
+    def on_train_epoch_start(self) -> None:
+        # the streaming datasets shuffle their shards differently in every epoch
+        dataset = getattr(self.trainer.datamodule, 'train', None)
+        if callable(getattr(dataset, 'set_epoch', None)):
+            dataset.set_epoch(self.current_epoch)
+
     def training_step(self, batch: Any, batch_idx: int, **kwargs) -> Any:
         """
         The training step. Calls the step method and logs the metrics and loss.
@@ -307,10 +345,38 @@ class AbstractTask(LightningModule, metaclass=ABCMeta):
 
         self.metric_conf_mat_test.reset()
 
+    def on_test_end(self) -> None:
+        # make sure all the outputs are on the disk
+        self.output_writer.close()
+
     def predict_step(self, batch: Any, batch_idx: int, dataloader_idx: Optional[int] = None) -> Any:
-        y_hat = self(batch)
+        if self.sliding_window is not None:
+            # a list with the prediction of every page, the pages can have different sizes
+            y_hat = self.sliding_window(self, batch)
+        elif self.strip_inference is not None:
+            y_hat = self.strip_inference(self, batch)
+        elif self.cascade_inference is not None:
+            y_hat = self.cascade_inference(self, batch)
+        else:
+            y_hat = self(batch)
         return {OutputKeys.PREDICTION: y_hat}
 
+    def on_predict_epoch_start(self) -> None:
+        if self.sliding_window is not None:
+            self.sliding_window.reset_statistics()
+        if self.cascade_inference is not None:
+            self.cascade_inference.reset_statistics()
+
+    def on_predict_end(self) -> None:
+        # make sure all the outputs are on the disk
+        self.output_writer.close()
+        if self.sliding_window is not None and self.sliding_window.skip_threshold is not None:
+            log.info(f'Skipped {self.sliding_window.num_skipped} of {self.sliding_window.num_windows} windows '
+                     f'({self.sliding_window.skip_ratio:.1%}) as background')
+        if self.cascade_inference is not None:
+            log.info(f'Refined {self.cascade_inference.num_refined} of {self.cascade_inference.num_windows} windows '
+                     f'({self.cascade_inference.refine_ratio:.1%}) at full resolution')
+
     def configure_optimizers(self) -> Union[Optimizer, Tuple[List[Optimizer], List[_LRScheduler]]]:
         optimizer = self.optimizer
         if not isinstance(self.optimizer, Optimizer):
@@ -1,9 +1,18 @@
-from typing import Dict, List
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Dict, List, Callable, Optional, Tuple, Iterable
 
 import numpy
 import numpy as np
 from pytorch_lightning.utilities import LightningEnum
 
+from src.datamodules.utils.output_merger import PageAccumulator, get_patch_coordinates
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
 
 class OutputKeys(LightningEnum):
     """
@@ -32,7 +41,120 @@ def reduce_dict(input_dict: Dict, key_list: List) -> Dict:
     return {key: input_dict[key] for key in key_list if key in input_dict}
 
 
-def save_numpy_files(trainer, test_output_path, input_idx, output):
+class OutputWriter:
+    """
+    Writes the test and prediction outputs in background threads, so the model does not have to wait for the disk.
+    The number of pending jobs is bounded: :meth:`submit` blocks as soon as ``max_pending`` jobs are waiting, so the
+    memory usage stays constant no matter how many pages are processed. Exceptions raised in a job are re-raised by
+    the next call of :meth:`submit` or :meth:`flush`.
+
+    :param num_workers: number of writer threads, 0 executes the jobs synchronously in :meth:`submit`
+    :type num_workers: int
+    :param max_pending: maximal number of submitted jobs that are not finished yet
+    :type max_pending: int
+    """
+
+    def __init__(self, num_workers: int = 2, max_pending: int = 16):
+        if num_workers < 0:
+            raise ValueError(f'num_workers has to be >= 0 (got {num_workers})')
+        if max_pending < 1:
+            raise ValueError(f'max_pending has to be >= 1 (got {max_pending})')
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+        self._errors: List[BaseException] = []
+
+    def __getstate__(self):
+        # thread pools, locks and futures can not be pickled (e.g. when the task is sent to the ddp processes)
+        return {'num_workers': self.num_workers, 'max_pending': self.max_pending}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        """
+        Hands a writing job to the writer threads. Blocks if there are already ``max_pending`` jobs waiting.
+
+        :param fn: function that writes the output (e.g. :func:`numpy.save`)
+        :type fn: Callable
+        :param args: positional arguments for ``fn``
+        :param kwargs: keyword arguments for ``fn``
+        """
+        self._raise_errors()
+        if self.num_workers == 0:
+            fn(*args, **kwargs)
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='output_writer')
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.append(future)
+        future.add_done_callback(self._job_done)
+
+    def flush(self) -> None:
+        """
+        Waits until all submitted jobs are written and re-raises the first exception of a failed job.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            # the exception is collected in _job_done
+            future.exception()
+        self._raise_errors()
+
+    def close(self) -> None:
+        """
+        Flushes the pending jobs and shuts the writer threads down.
+        """
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _job_done(self, future: Future) -> None:
+        with self._lock:
+            self._pending.remove(future)
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+        self._slots.release()
+
+    def _raise_errors(self) -> None:
+        with self._lock:
+            if not self._errors:
+                return
+            error = self._errors[0]
+            self._errors = []
+        log.error(f'Writing the output failed: {error}')
+        raise error
+
+
+def save_numpy_file(dest_filename: Path, arr: np.ndarray) -> None:
+    """
+    Saves the array as .npy file and creates the parent folder if needed.
+
+    :param dest_filename: path of the .npy file
+    :type dest_filename: Path
+    :param arr: array to save
+    :type arr: np.ndarray
+    """
+    dest_filename.parent.mkdir(parents=True, exist_ok=True)
+    np.save(file=str(dest_filename), arr=arr)
+
+
+def save_numpy_files(trainer, test_output_path, input_idx, output, output_writer: Optional[OutputWriter] = None):
     if not hasattr(trainer.datamodule, 'get_img_name_coordinates'):
         raise NotImplementedError('Datamodule does not provide detailed information of the crop')
     for patch, idx in zip(output[OutputKeys.PREDICTION].detach().cpu().numpy(),
@@ -40,8 +162,113 @@ def save_numpy_files(trainer, test_output_path, input_idx, output):
         patch_info = trainer.datamodule.get_img_name_coordinates(idx)
         img_name = patch_info[0]
         patch_name = patch_info[1]
-        dest_folder = test_output_path / 'patches' / img_name
-        dest_folder.mkdir(parents=True, exist_ok=True)
-        dest_filename = dest_folder / f'{patch_name}.npy'
+        dest_filename = test_output_path / 'patches' / img_name / f'{patch_name}.npy'
+
+        if output_writer is None:
+            save_numpy_file(dest_filename=dest_filename, arr=patch)
+        else:
+            output_writer.submit(save_numpy_file, dest_filename=dest_filename, arr=patch)
+
+
+def add_patches_to_merger(trainer, patch_merger: 'PatchMerger', input_idx, output):
+    if not hasattr(trainer.datamodule, 'get_img_name_coordinates'):
+        raise NotImplementedError('Datamodule does not provide detailed information of the crop')
+    for patch, idx in zip(output[OutputKeys.PREDICTION].detach().cpu().numpy(),
+                          input_idx.detach().cpu().numpy()):
+        img_name, patch_name = trainer.datamodule.get_img_name_coordinates(idx)
+        patch_merger.add_patch(img_name=img_name, patch_name=patch_name, patch=patch)
+
+
+class PatchMerger:
+    """
+    Merges the predicted patches of the cropped test set into full page predictions while the test is running.
+    For each page a running-max accumulator is kept in memory, as soon as the last patch of a page has been added,
+    the page is handed to ``on_page_done`` and the accumulator is released.
+    Overlapping values are combined with the ``reducer`` of :class:`PageAccumulator` (max by default).
+
+    :param patch_names_per_page: names of all patches of a page (with the coordinates, e.g. ``page_x0128_y0256``)
+    :type patch_names_per_page: Dict[str, List[str]]
+    :param on_page_done: function that is called with the page name and the merged prediction [#C x H x W]
+    :type on_page_done: Callable[[str, np.ndarray], None]
+    :param reducer: how overlapping predictions are combined (max, mean, distance)
+    :type reducer: str
+    """
+
+    def __init__(self, patch_names_per_page: Dict[str, List[str]], on_page_done: Callable[[str, np.ndarray], None],
+                 reducer: str = 'max'):
+        self.on_page_done = on_page_done
+        self.reducer = reducer
+
+        self.coordinates_per_page = {img_name: {get_patch_coordinates(patch_name) for patch_name in patch_names}
+                                     for img_name, patch_names in patch_names_per_page.items()}
+        self._accumulators: Dict[str, PageAccumulator] = {}
+        self._missing: Dict[str, set] = {img_name: set(coordinates)
+                                         for img_name, coordinates in self.coordinates_per_page.items()}
+
+    @classmethod
+    def from_img_paths_per_page(cls, img_paths_per_page: Iterable[Tuple], on_page_done: Callable) -> 'PatchMerger':
+        """
+        Creates the merger from the ``img_paths_per_page`` list of a cropped dataset, which contains the tuples
+        (data path, gt path, page name, crop name).
+
+        :param img_paths_per_page: the list of the dataset
+        :type img_paths_per_page: Iterable[Tuple]
+        :param on_page_done: function that is called with the page name and the merged prediction [#C x H x W]
+        :type on_page_done: Callable[[str, np.ndarray], None]
+        :return: the merger
+        :rtype: PatchMerger
+        """
+        patch_names_per_page = defaultdict(list)
+        for _, _, img_name, patch_name in img_paths_per_page:
+            patch_names_per_page[img_name].append(patch_name)
+        return cls(patch_names_per_page=patch_names_per_page, on_page_done=on_page_done)
+
+    @property
+    def unfinished_pages(self) -> List[str]:
+        return sorted(img_name for img_name, missing in self._missing.items() if missing)
+
+    def add_patch(self, img_name: str, patch_name: str, patch: np.ndarray) -> None:
+        """
+        Adds the patch to the accumulator of its page. Calls ``on_page_done`` if it was the last patch of the page.
+
+        :param img_name: name of the page
+        :type img_name: str
+        :param patch_name: name of the patch (with the coordinates)
+        :type patch_name: str
+        :param patch: prediction of the patch [#C x crop_size x crop_size]
+        :type patch: np.ndarray
+        """
+        x, y = get_patch_coordinates(patch_name)
+        missing = self._missing[img_name]
+        if (x, y) not in missing:
+            if (x, y) in self.coordinates_per_page[img_name]:
+                log.warning(f'Patch {patch_name} has already been merged, skipping it')
+                return
+            raise ValueError(f'Patch {patch_name} is not part of page {img_name}')
+
+        if img_name not in self._accumulators:
+            coordinates = self.coordinates_per_page[img_name]
+            height = max(c[1] for c in coordinates) + patch.shape[1]
+            width = max(c[0] for c in coordinates) + patch.shape[2]
+            self._accumulators[img_name] = PageAccumulator(num_classes=patch.shape[0], height=height, width=width,
+                                                           reducer=self.reducer, dtype=patch.dtype)
+
+        self._accumulators[img_name].add_patch(patch=patch, coordinates=(x, y))
+
+        missing.remove((x, y))
+        if not missing:
+            self.on_page_done(img_name, self._accumulators.pop(img_name).get_result())
+
+    def finish(self) -> List[str]:
+        """
+        Drops the accumulators of the pages that did not receive all their patches.
 
-        np.save(file=str(dest_filename), arr=patch)
+        :return: names of the pages that were not complete
+        :rtype: List[str]
+        """
+        unfinished_pages = self.unfinished_pages
+        if unfinished_pages:
+            log.warning(f'The following pages did not receive all their patches and were not written: '
+                        f'{unfinished_pages}')
+        self._accumulators = {}
+        return unfinished_pages
@@ -0,0 +1,558 @@
+"""
+Inference on full pages piece by piece.
+
+The models are trained on crops or on pages of one size, but the pages to predict come in all sizes.
+:class:`SlidingWindowInference` cuts the pages into overlapping windows of the training size, runs the windows in
+batches through the model and blends the logits of the windows into the full page prediction as soon as a batch is
+done. Nothing is written to the disk and the memory usage only depends on the pages of the current batch.
+
+:class:`StripInference` predicts a page in horizontal strips for models that can process the whole page, but not
+with the memory at hand. The strips overlap by the receptive field of the model, so the result is the same as the
+prediction of the whole page at once.
+
+:class:`CascadeInference` predicts a downscaled page first and only predicts the windows at full resolution where the
+coarse prediction is uncertain or close to a class boundary. :func:`evaluate_cascade` compares it with the full
+resolution prediction.
+"""
+import math
+import time
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple, Union, Iterator, Dict
+
+import torch
+from torch import Tensor
+from torch.nn import functional as F
+
+from src.models.receptive_field import ReceptiveField, get_receptive_field
+from src.utils import utils
+
+log = utils.get_logger(__name__)
+
+BLEND_MODES = ('max', 'mean', 'gaussian')
+
+
+def get_window_positions(length: int, window: int, stride: int) -> List[int]:
+    """
+    Start positions of the windows along one axis. The last window is aligned with the end of the axis, so every
+    pixel is covered. The axis has to be at least as long as the window.
+
+    :param length: length of the axis
+    :type length: int
+    :param window: length of the window
+    :type window: int
+    :param stride: distance between the start of two neighbouring windows
+    :type stride: int
+    :return: start positions of the windows
+    :rtype: List[int]
+    """
+    positions = list(range(0, length - window + 1, stride))
+    if positions[-1] != length - window:
+        positions.append(length - window)
+    return positions
+
+
+@lru_cache(maxsize=8)
+def _get_gaussian_weights(height: int, width: int, sigma_scale: float) -> Tensor:
+    """
+    Weight of each pixel of a window for the gaussian blending. The weights are 1 in the center of the window and
+    decrease towards the borders, where the receptive field of the network is cut off.
+
+    :param height: height of the window
+    :type height: int
+    :param width: width of the window
+    :type width: int
+    :param sigma_scale: standard deviation of the gaussian relative to the size of the window
+    :type sigma_scale: float
+    :return: weights of size [H x W]
+    :rtype: Tensor
+    """
+    y = torch.arange(height, dtype=torch.float32) - (height - 1) / 2
+    x = torch.arange(width, dtype=torch.float32) - (width - 1) / 2
+    y = torch.exp(-y ** 2 / (2 * (sigma_scale * height) ** 2))
+    x = torch.exp(-x ** 2 / (2 * (sigma_scale * width) ** 2))
+    # the border pixels of a page are only covered by the border of a window
+    return (y[:, None] * x[None, :]).clamp_(min=1e-4)
+
+
+class SlidingWindowInference:
+    """
+    Predicts full pages of any size with a model that works on windows of a fixed size.
+
+    The windows of all the pages of a batch are run through the model in batches of ``batch_size`` windows. Pages that
+    are smaller than the window are zero padded. Overlapping windows are blended:
+        - ``max``: maximum of the logits
+        - ``mean``: mean of the logits
+        - ``gaussian``: mean of the logits weighted by a gaussian centered on the window
+
+    With a ``skip_threshold``, windows without content (blank parchment, margins) are not run through the model but
+    filled with the background logits. The share of skipped windows is counted in :attr:`skip_ratio`.
+
+    :param window_size: size of the windows (height, width) or one value for square windows, usually the input size
+        of the model during training
+    :type window_size: Union[int, Sequence[int]]
+    :param stride: distance between two neighbouring windows (height, width) or one value, None for half the window
+    :type stride: Optional[Union[int, Sequence[int]]]
+    :param batch_size: number of windows that are run through the model at once
+    :type batch_size: int
+    :param blend: how the logits of overlapping windows are combined (max, mean, gaussian)
+    :type blend: str
+    :param sigma_scale: standard deviation of the gaussian blending relative to the window size
+    :type sigma_scale: float
+    :param skip_threshold: windows whose downsampled grayscale has a standard deviation below this threshold (in
+        the units of the normalized input) are empty, the model is not run on them and they get the background
+        logits, None to run the model on all the windows
+    :type skip_threshold: Optional[float]
+    :param skip_downsample: the grayscale of the page is average pooled by this factor for the statistic
+    :type skip_downsample: int
+    :param background_logits: logits of the empty windows, None to use the mean logits of the model on the first
+        empty window
+    :type background_logits: Optional[Sequence[float]]
+    """
+
+    def __init__(self, window_size: Union[int, Sequence[int]], stride: Optional[Union[int, Sequence[int]]] = None,
+                 batch_size: int = 8, blend: str = 'gaussian', sigma_scale: float = 0.125,
+                 skip_threshold: Optional[float] = None, skip_downsample: int = 8,
+                 background_logits: Optional[Sequence[float]] = None):
+        self.window_size = self._to_pair(window_size, name='window_size')
+        if stride is None:
+            stride = tuple(max(1, size // 2) for size in self.window_size)
+        self.stride = self._to_pair(stride, name='stride')
+
+        if any(s > w for s, w in zip(self.stride, self.window_size)):
+            msg = f'Parameter "stride" {self.stride} is larger than the window {self.window_size}, ' \
+                  f'some pixels would not be predicted'
+            log.error(msg)
+            raise ValueError(msg)
+        if batch_size < 1:
+            msg = f'Parameter "batch_size" has to be at least 1 (got {batch_size})'
+            log.error(msg)
+            raise ValueError(msg)
+        if blend not in BLEND_MODES:
+            msg = f'Unknown blend mode "{blend}" (available: {", ".join(BLEND_MODES)})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        if skip_downsample < 1:
+            msg = f'Parameter "skip_downsample" has to be at least 1 (got {skip_downsample})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.batch_size = batch_size
+        self.blend = blend
+        self.sigma_scale = sigma_scale
+        self.skip_threshold = skip_threshold
+        self.skip_downsample = skip_downsample
+        self.background_logits = None if background_logits is None else torch.tensor(background_logits,
+                                                                                       dtype=torch.float32)
+        self.num_windows = 0
+        self.num_skipped = 0
+
+    @property
+    def skip_ratio(self) -> float:
+        """
+        Share of the windows that were skipped since the last :meth:`reset_statistics`.
+        """
+        return self.num_skipped / self.num_windows if self.num_windows else 0.
+
+    def reset_statistics(self) -> None:
+        self.num_windows = 0
+        self.num_skipped = 0
+
+    @staticmethod
+    def _to_pair(value: Union[int, Sequence[int]], name: str) -> Tuple[int, int]:
+        pair = (value, value) if isinstance(value, int) else tuple(value)
+        if len(pair) != 2 or any(v < 1 for v in pair):
+            msg = f'Parameter "{name}" has to be a positive integer or a pair of them (got {value})'
+            log.error(msg)
+            raise ValueError(msg)
+        return int(pair[0]), int(pair[1])
+
+    @torch.no_grad()
+    def __call__(self, model: Callable[[Tensor], Tensor], pages: Union[Tensor, Sequence[Tensor]]) -> List[Tensor]:
+        """
+        Predicts the pages.
+
+        :param model: the model, takes a batch of windows [B x C x h x w] and returns the logits [B x #C x h x w]
+        :type model: Callable[[Tensor], Tensor]
+        :param pages: the pages [C x H x W], as a batch or a list of pages of different sizes
+        :type pages: Union[Tensor, Sequence[Tensor]]
+        :return: the logits of every page [#C x H x W]
+        :rtype: List[Tensor]
+        """
+        return [logits for logits, _ in self.predict_windows(model, pages)]
+
+    @torch.no_grad()
+    def predict_windows(self, model: Callable[[Tensor], Tensor], pages: Union[Tensor, Sequence[Tensor]],
+                        select: Optional[Sequence[Callable[[int, int], bool]]] = None) \
+            -> List[Tuple[Optional[Tensor], Optional[Tensor]]]:
+        """
+        Predicts the selected windows of the pages.
+
+        :param model: the model, takes a batch of windows [B x C x h x w] and returns the logits [B x #C x h x w]
+        :type model: Callable[[Tensor], Tensor]
+        :param pages: the pages [C x H x W], as a batch or a list of pages of different sizes
+        :type pages: Union[Tensor, Sequence[Tensor]]
+        :param select: one function per page that gets the top left corner (y, x) of a window and returns whether the
+            window is predicted, None to predict all windows
+        :type select: Optional[Sequence[Callable[[int, int], bool]]]
+        :return: the logits of every page [#C x H x W] and the mask [H x W] of the pixels covered by the predicted
+            windows, None for both if no window of the page was predicted
+        :rtype: List[Tuple[Optional[Tensor], Optional[Tensor]]]
+        """
+        sizes = [tuple(page.shape[-2:]) for page in pages]
+        pages = [self._pad(page) for page in pages]
+        values: List[Optional[Tensor]] = [None] * len(pages)
+        weights: List[Optional[Tensor]] = [None] * len(pages)
+
+        skipped: List[Tuple[int, int, int]] = []
+        for windows, locations in self._get_batches(pages, skipped=skipped, select=select):
+            logits = model(torch.stack(windows)).float()
+            for (page_index, y, x), window_logits in zip(locations, logits):
+                if values[page_index] is None:
+                    values[page_index], weights[page_index] = self._get_accumulator(pages[page_index], window_logits)
+                self._add_window(values[page_index], weights[page_index], window_logits, y=y, x=x)
+
+        if skipped:
+            background = self._get_background_logits(model, pages, location=skipped[0])
+            window_logits = background[:, None, None].expand(-1, *self.window_size)
+            for page_index, y, x in skipped:
+                if values[page_index] is None:
+                    values[page_index], weights[page_index] = self._get_accumulator(pages[page_index], window_logits)
+                self._add_window(values[page_index], weights[page_index], window_logits, y=y, x=x)
+
+        outputs = []
+        for (height, width), page_values, page_weights in zip(sizes, values, weights):
+            if page_values is None:
+                outputs.append((None, None))
+                continue
+            if page_weights is not None:
+                coverage = page_weights > 0
+                page_values /= page_weights[None]
+            else:
+                coverage = torch.isfinite(page_values[0])
+            outputs.append((page_values[:, :height, :width], coverage[:height, :width]))
+        return outputs
+
+    def _pad(self, page: Tensor) -> Tensor:
+        height, width = page.shape[-2:]
+        pad_height = max(0, self.window_size[0] - height)
+        pad_width = max(0, self.window_size[1] - width)
+        if pad_height or pad_width:
+            page = F.pad(page, [0, pad_width, 0, pad_height])
+        return page
+
+    def _get_batches(self, pages: List[Tensor], skipped: List[Tuple[int, int, int]],
+                     select: Optional[Sequence[Callable[[int, int], bool]]] = None) \
+            -> Iterator[Tuple[List[Tensor], List[Tuple[int, int, int]]]]:
+        window_height, window_width = self.window_size
+        windows, locations = [], []
+        for page_index, page in enumerate(pages):
+            is_empty = self._get_empty_windows(page)
+            for y in get_window_positions(page.shape[-2], window=window_height, stride=self.stride[0]):
+                for x in get_window_positions(page.shape[-1], window=window_width, stride=self.stride[1]):
+                    if select is not None and not select[page_index](y, x):
+                        continue
+                    self.num_windows += 1
+                    if is_empty is not None and is_empty(y, x):
+                        self.num_skipped += 1
+                        skipped.append((page_index, y, x))
+                        continue
+                    windows.append(page[:, y:y + window_height, x:x + window_width])
+                    locations.append((page_index, y, x))
+                    if len(windows) == self.batch_size:
+                        yield windows, locations
+                        windows, locations = [], []
+        if windows:
+            yield windows, locations
+
+    def _get_empty_windows(self, page: Tensor) -> Optional[Callable[[int, int], bool]]:
+        if self.skip_threshold is None:
+            return None
+        # the statistic of every window is computed on the downsampled grayscale of the whole page
+        factor = self.skip_downsample
+        gray = F.avg_pool2d(page.float().mean(dim=0)[None, None], kernel_size=factor, ceil_mode=True)[0, 0]
+        window_height, window_width = (max(1, size // factor) for size in self.window_size)
+
+        def is_empty(y: int, x: int) -> bool:
+            window = gray[y // factor:y // factor + window_height, x // factor:x // factor + window_width]
+            return window.std(unbiased=False).item() < self.skip_threshold
+
+        return is_empty
+
+    def _get_background_logits(self, model: Callable[[Tensor], Tensor], pages: List[Tensor],
+                               location: Tuple[int, int, int]) -> Tensor:
+        if self.background_logits is None:
+            # the logits of an empty window are nearly constant, so the mean is a good fill for all empty windows
+            page_index, y, x = location
+            window = pages[page_index][:, y:y + self.window_size[0], x:x + self.window_size[1]]
+            self.background_logits = model(window[None]).float()[0].mean(dim=(1, 2)).cpu()
+        return self.background_logits.to(pages[location[0]].device)
+
+    def _get_accumulator(self, page: Tensor, window_logits: Tensor) -> Tuple[Tensor, Optional[Tensor]]:
+        shape = (window_logits.shape[0], page.shape[-2], page.shape[-1])
+        if self.blend == 'max':
+            return torch.full(shape, fill_value=-float('inf'), device=window_logits.device), None
+        return torch.zeros(shape, device=window_logits.device), torch.zeros(shape[1:], device=window_logits.device)
+
+    def _add_window(self, values: Tensor, weights: Optional[Tensor], window_logits: Tensor, y: int, x: int) -> None:
+        height, width = window_logits.shape[-2:]
+        page_values = values[:, y:y + height, x:x + width]
+        if self.blend == 'max':
+            torch.maximum(page_values, window_logits, out=page_values)
+        elif self.blend == 'mean':
+            page_values += window_logits
+            weights[y:y + height, x:x + width] += 1
+        else:
+            window_weights = _get_gaussian_weights(height, width, self.sigma_scale).to(window_logits.device)
+            page_values += window_logits * window_weights
+            weights[y:y + height, x:x + width] += window_weights
+
+
+class StripInference:
+    """
+    Predicts full pages in horizontal strips with a fully convolutional model (e.g. the UNets of
+    ``src/models/backbones``). Every strip is extended by a halo of rows above and below that covers the receptive
+    field of the model (see :func:`src.models.receptive_field.get_receptive_field`) and the strips start on the
+    pooling grid of the model. The stitched prediction is therefore the same as the prediction of the whole page
+    (up to the rounding of the convolution algorithms), while the activations only need memory for one strip.
+
+    :param strip_height: number of output rows predicted per forward pass, rounded up to the alignment of the model
+    :type strip_height: int
+    :param input_channels: number of channels of the input of the model
+    :type input_channels: int
+    :param probe_size: size of the probe to compute the receptive field, has to be divisible by the downsampling
+        factor of the model
+    :type probe_size: int
+    """
+
+    def __init__(self, strip_height: int = 256, input_channels: int = 3, probe_size: int = 256):
+        if strip_height < 1:
+            msg = f'Parameter "strip_height" has to be at least 1 (got {strip_height})'
+            log.error(msg)
+            raise ValueError(msg)
+        self.strip_height = strip_height
+        self.input_channels = input_channels
+        self.probe_size = probe_size
+        self.receptive_field: Optional[ReceptiveField] = None
+
+    def get_strips(self, height: int) -> List[Tuple[int, int, int, int]]:
+        """
+        The strips of a page. The input rows of a strip contain its output rows and the halo.
+
+        :param height: height of the page
+        :type height: int
+        :return: first and last (exclusive) input row and first and last (exclusive) output row of every strip
+        :rtype: List[Tuple[int, int, int, int]]
+        """
+        halo, alignment = self.receptive_field.halo, self.receptive_field.alignment
+        strip_height = math.ceil(self.strip_height / alignment) * alignment
+        strips = []
+        for start in range(0, height, strip_height):
+            end = min(start + strip_height, height)
+            # the strips start on the pooling grid, the last one ends with the page as the prediction of the page
+            input_end = end + halo if end + halo < height else height
+            strips.append((max(0, start - halo), input_end, start, end))
+        return strips
+
+    @torch.no_grad()
+    def __call__(self, model: Callable[[Tensor], Tensor], pages: Union[Tensor, Sequence[Tensor]]) -> List[Tensor]:
+        """
+        Predicts the pages.
+
+        :param model: the model, takes a batch of pages [B x C x H x W] and returns the logits [B x #C x H x W]
+        :type model: Callable[[Tensor], Tensor]
+        :param pages: the pages [C x H x W], as a batch or a list of pages of different sizes
+        :type pages: Union[Tensor, Sequence[Tensor]]
+        :return: the logits of every page [#C x H x W]
+        :rtype: List[Tensor]
+        """
+        if self.receptive_field is None:
+            self.receptive_field = get_receptive_field(model, input_channels=self.input_channels,
+                                                       probe_size=self.probe_size)
+            log.info(f'Strip inference with a halo of {self.receptive_field.halo} rows '
+                     f'({self.receptive_field})')
+        if torch.is_tensor(pages):
+            return list(self._predict(model, pages))
+        return [self._predict(model, page[None])[0] for page in pages]
+
+    def _predict(self, model: Callable[[Tensor], Tensor], batch: Tensor) -> Tensor:
+        output = None
+        for input_start, input_end, start, end in self.get_strips(batch.shape[-2]):
+            logits = model(batch[:, :, input_start:input_end])
+            if output is None:
+                output = logits.new_empty((*logits.shape[:2], *batch.shape[-2:]))
+            output[:, :, start:end] = logits[:, :, start - input_start:end - input_start]
+        return output
+
+
+class CascadeInference:
+    """
+    Coarse-to-fine prediction of full pages. The page is downscaled by ``scale_factor`` and predicted with a sliding
+    window, the logits are upsampled to the size of the page. A pixel of the coarse prediction is refined if the
+    margin between the probabilities of its two most likely classes is below ``margin_threshold`` or if it is within
+    ``boundary_width`` pixels of another class. The windows of the full resolution page that contain such a pixel are
+    predicted with the same sliding window and replace the coarse logits of the pixels they cover.
+
+    Most of a page is background or the inside of large regions, so only a part of the windows is run at full
+    resolution. The share of refined windows is counted in :attr:`refine_ratio`.
+
+    :param window_size: size of the windows (height, width) or one value for square windows, usually the input size
+        of the model during training
+    :type window_size: Union[int, Sequence[int]]
+    :param stride: distance between two neighbouring windows (height, width) or one value, None for half the window
+    :type stride: Optional[Union[int, Sequence[int]]]
+    :param batch_size: number of windows that are run through the model at once
+    :type batch_size: int
+    :param blend: how the logits of overlapping windows are combined (max, mean, gaussian)
+    :type blend: str
+    :param scale_factor: the page is resized by this factor for the coarse prediction
+    :type scale_factor: float
+    :param margin_threshold: pixels whose top-2 class probabilities differ by less than this are refined
+    :type margin_threshold: float
+    :param boundary_width: pixels within this distance of a class boundary of the coarse prediction are refined,
+        0 to only refine the uncertain pixels
+    :type boundary_width: int
+    """
+
+    def __init__(self, window_size: Union[int, Sequence[int]], stride: Optional[Union[int, Sequence[int]]] = None,
+                 batch_size: int = 8, blend: str = 'gaussian', scale_factor: float = 0.5,
+                 margin_threshold: float = 0.5, boundary_width: int = 2):
+        if not 0 < scale_factor <= 1:
+            msg = f'Parameter "scale_factor" has to be in (0, 1] (got {scale_factor})'
+            log.error(msg)
+            raise ValueError(msg)
+        if not 0 <= margin_threshold <= 1:
+            msg = f'Parameter "margin_threshold" has to be in [0, 1] (got {margin_threshold})'
+            log.error(msg)
+            raise ValueError(msg)
+        if boundary_width < 0:
+            msg = f'Parameter "boundary_width" has to be at least 0 (got {boundary_width})'
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.sliding_window = SlidingWindowInference(window_size=window_size, stride=stride, batch_size=batch_size,
+                                                     blend=blend)
+        self.scale_factor = scale_factor
+        self.margin_threshold = margin_threshold
+        self.boundary_width = boundary_width
+        self.num_windows = 0
+        self.num_refined = 0
+
+    @property
+    def refine_ratio(self) -> float:
+        """
+        Share of the full resolution windows that were predicted since the last :meth:`reset_statistics`.
+        """
+        return self.num_refined / self.num_windows if self.num_windows else 0.
+
+    def reset_statistics(self) -> None:
+        self.num_windows = 0
+        self.num_refined = 0
+
+    @torch.no_grad()
+    def __call__(self, model: Callable[[Tensor], Tensor], pages: Union[Tensor, Sequence[Tensor]]) -> List[Tensor]:
+        """
+        Predicts the pages.
+
+        :param model: the model, takes a batch of windows [B x C x h x w] and returns the logits [B x #C x h x w]
+        :type model: Callable[[Tensor], Tensor]
+        :param pages: the pages [C x H x W], as a batch or a list of pages of different sizes
+        :type pages: Union[Tensor, Sequence[Tensor]]
+        :return: the logits of every page [#C x H x W]
+        :rtype: List[Tensor]
+        """
+        coarse_pages = [F.interpolate(page[None].float(), scale_factor=self.scale_factor, mode='bilinear',
+                                      align_corners=False, recompute_scale_factor=False)[0] for page in pages]
+        coarse = [F.interpolate(logits[None], size=page.shape[-2:], mode='bilinear', align_corners=False)[0]
+                  for logits, page in zip(self.sliding_window(model, coarse_pages), pages)]
+
+        refine_masks = [self.get_refine_mask(logits) for logits in coarse]
+        select = [self._get_selection(mask) for mask in refine_masks]
+        num_windows = self.sliding_window.num_windows
+        refined = self.sliding_window.predict_windows(model, pages, select=select)
+        self.num_refined += self.sliding_window.num_windows - num_windows
+        self.num_windows += sum(self._count_windows(page) for page in pages)
+
+        outputs = []
+        for coarse_logits, (refined_logits, coverage) in zip(coarse, refined):
+            if refined_logits is not None:
+                coarse_logits = torch.where(coverage[None], refined_logits, coarse_logits)
+            outputs.append(coarse_logits)
+        return outputs
+
+    def get_refine_mask(self, logits: Tensor) -> Tensor:
+        """
+        The pixels of a coarse prediction that are predicted again at full resolution.
+
+        :param logits: the upsampled coarse logits of a page [#C x H x W]
+        :type logits: Tensor
+        :return: mask of the uncertain pixels and the pixels close to a class boundary [H x W]
+        :rtype: Tensor
+        """
+        top_2 = logits.softmax(dim=0).topk(k=min(2, logits.shape[0]), dim=0).values
+        margin = top_2[0] - top_2[1] if top_2.shape[0] == 2 else torch.ones_like(top_2[0])
+        mask = margin < self.margin_threshold
+        if self.boundary_width:
+            # a pixel is close to a boundary if the labels in its neighbourhood are not all the same
+            labels = logits.argmax(dim=0)[None, None].float()
+            kernel_size = 2 * self.boundary_width + 1
+            label_max = F.max_pool2d(labels, kernel_size=kernel_size, stride=1, padding=self.boundary_width)
+            label_min = -F.max_pool2d(-labels, kernel_size=kernel_size, stride=1, padding=self.boundary_width)
+            mask |= (label_max != label_min)[0, 0]
+        return mask
+
+    def _get_selection(self, mask: Tensor) -> Callable[[int, int], bool]:
+        # pages smaller than the window are padded, their only window covers the whole mask
+        window_height, window_width = self.sliding_window.window_size
+
+        def select(y: int, x: int) -> bool:
+            return bool(mask[y:y + window_height, x:x + window_width].any())
+
+        return select
+
+    def _count_windows(self, page: Tensor) -> int:
+        height, width = (max(size, window) for size, window in zip(page.shape[-2:], self.sliding_window.window_size))
+        return len(get_window_positions(height, window=self.sliding_window.window_size[0],
+                                        stride=self.sliding_window.stride[0])) * \
+            len(get_window_positions(width, window=self.sliding_window.window_size[1],
+                                     stride=self.sliding_window.stride[1]))
+
+
+def evaluate_cascade(model: Callable[[Tensor], Tensor], pages: Union[Tensor, Sequence[Tensor]],
+                     cascade: CascadeInference) -> Dict[str, float]:
+    """
+    Compares the cascade with the full resolution sliding window prediction (same window, stride and blending) on the
+    given pages. Use a few representative pages of the test set to choose the scale factor and the margin threshold.
+
+    :param model: the model, takes a batch of windows [B x C x h x w] and returns the logits [B x #C x h x w]
+    :type model: Callable[[Tensor], Tensor]
+    :param pages: the pages [C x H x W], as a batch or a list of pages of different sizes
+    :type pages: Union[Tensor, Sequence[Tensor]]
+    :param cascade: the cascade to evaluate
+    :type cascade: CascadeInference
+    :return: share of the pixels with the same class as the full resolution prediction (pixel_agreement), time of the
+        full resolution prediction and of the cascade in seconds (time_full, time_cascade), their ratio (speedup) and
+        the share of the refined windows (refine_ratio)
+    :rtype: Dict[str, float]
+    """
+    window = cascade.sliding_window
+    full_resolution = SlidingWindowInference(window_size=window.window_size, stride=window.stride,
+                                             batch_size=window.batch_size, blend=window.blend,
+                                             sigma_scale=window.sigma_scale)
+    start = time.perf_counter()
+    full_logits = full_resolution(model, pages)
+    time_full = time.perf_counter() - start
+
+    cascade.reset_statistics()
+    start = time.perf_counter()
+    cascade_logits = cascade(model, pages)
+    time_cascade = time.perf_counter() - start
+
+    num_equal = sum((full.argmax(dim=0) == coarse.argmax(dim=0)).sum().item()
+                    for full, coarse in zip(full_logits, cascade_logits))
+    num_pixels = sum(full[0].numel() for full in full_logits)
+    return {'pixel_agreement': num_equal / num_pixels,
+            'time_full': time_full,
+            'time_cascade': time_cascade,
+            'speedup': time_full / time_cascade if time_cascade else float('inf'),
+            'refine_ratio': cascade.refine_ratio}
@@ -0,0 +1,11 @@
+import pytest
+
+from src.datamodules.utils.image_analytics import ANALYTICS_CACHE_DIR_ENV
+
+
+@pytest.fixture(autouse=True)
+def analytics_cache_dir(tmp_path, monkeypatch):
+    # the analytics cache of the tests must not end up in the home directory of the developer
+    cache_dir = tmp_path / 'analytics_cache'
+    monkeypatch.setenv(ANALYTICS_CACHE_DIR_ENV, str(cache_dir))
+    return cache_dir
@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from src.datamodules.DivaHisDB.datasets.virtual_cropped_dataset import VirtualCroppedHisDBDataset
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir
+
+PAGE_NAME = 'e-codices_fmb-cb-0055_0098v_max'
+
+
+@pytest.fixture
+def dataset_train(data_dir):
+    return VirtualCroppedHisDBDataset(path=data_dir / 'train', data_folder_name='data', gt_folder_name='gt',
+                                      crop_size=300)
+
+
+@pytest.fixture
+def dataset_test(data_dir):
+    return VirtualCroppedHisDBDataset(path=data_dir / 'test', data_folder_name='data', gt_folder_name='gt',
+                                      crop_size=256, is_test=True)
+
+
+def test__get_train_val_items_train(dataset_train):
+    img, gt, boundary_mask = dataset_train._get_train_val_items(index=0)
+    assert img.shape == torch.Size([3, 300, 300])
+    assert gt.shape == torch.Size([3, 300, 300])
+    assert boundary_mask.shape == torch.Size([300, 300])
+
+
+def test__get_test_items(dataset_test):
+    img, gt, boundary_mask, index = dataset_test[3]
+    assert img.shape == torch.Size([3, 256, 256])
+    assert gt.shape == torch.Size([3, 256, 256])
+    assert boundary_mask.shape == torch.Size([256, 256])
+    assert index == 3
+    assert dataset_test.img_paths_per_page[3][2:] == (PAGE_NAME, f'{PAGE_NAME}_x0000_y0384')
@@ -1,8 +1,13 @@
+import json
+
+import numpy as np
 import pytest
 import torch
 from omegaconf import OmegaConf
+from pytorch_lightning import Trainer
 
 from src.datamodules.DivaHisDB.datamodule_cropped import DivaHisDBDataModuleCropped
+from src.datamodules.utils.crop_container import write_crop_container
 from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
 from tests.datamodules.DivaHisDB.datasets.test_cropped_hisdb_dataset import dataset_test
 
@@ -25,8 +30,8 @@ def test_init_datamodule(data_module_cropped_hisdb):
     assert torch.equal(data_module_cropped_hisdb.class_weights,
                        torch.tensor(
                            [0.004952207651647859, 0.07424270397485577, 0.8964025044572563, 0.02440258391624002]))
-    assert data_module_cropped_hisdb.mean == [0.7050454974582426, 0.6503181590413943, 0.5567698583877997]
-    assert data_module_cropped_hisdb.std == [0.3104060859619883, 0.3053311838884032, 0.28919611393432726]
+    assert data_module_cropped_hisdb.mean == [0.7050454974582425, 0.6503181590413943, 0.5567698583877996]
+    assert data_module_cropped_hisdb.std == [0.31040608596198827, 0.30533118388840325, 0.2891961139343273]
     with pytest.raises(AttributeError):
         getattr(data_module_cropped_hisdb, 'train')
         getattr(data_module_cropped_hisdb, 'val')
@@ -47,3 +52,66 @@ def test__create_dataset_parameters_cropped(data_module_cropped_hisdb):
     parameters = data_module_cropped_hisdb._create_dataset_parameters()
     assert 'train' in str(parameters['path'])
     assert not parameters['is_test']
+
+
+def test_init_datamodule_analytics_estimation(data_dir_cropped):
+    OmegaConf.clear_resolvers()
+    data_module = DivaHisDBDataModuleCropped(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                             num_workers=NUM_WORKERS,
+                                             analytics_estimation={'tolerance': 0.05, 'min_pages': 4,
+                                                                   'pixels_per_page': 1000})
+    assert data_module.class_encodings == [1, 2, 4, 8]
+    assert np.allclose(data_module.mean, [0.7050454974582425, 0.6503181590413943, 0.5567698583877996], atol=0.05)
+    with (data_dir_cropped / 'analytics.data.data.json').open() as f:
+        analytics_data = json.load(f)
+    assert analytics_data['estimate']['num_pages_total'] == 12
+    assert len(analytics_data['estimate']['std_error']) == 3
+
+    # estimated analytics are computed exactly if no estimation is requested
+    OmegaConf.clear_resolvers()
+    data_module = DivaHisDBDataModuleCropped(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                             num_workers=NUM_WORKERS)
+    assert data_module.mean == [0.7050454974582425, 0.6503181590413943, 0.5567698583877996]
+    with (data_dir_cropped / 'analytics.gt.hisDB.gt.json').open() as f:
+        assert 'estimate' not in json.load(f)
+
+
+def test_setup_cache_labels(data_dir_cropped, monkeypatch):
+    OmegaConf.clear_resolvers()
+    data_module = DivaHisDBDataModuleCropped(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                             num_workers=NUM_WORKERS, cache_labels=True)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module, 'trainer', trainer)
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    data_module.setup('test')
+    assert data_module.test.label_cache is not None
+    assert (data_dir_cropped / 'labels.gt.test.json').exists()
+    img, gt, boundary_mask, index = data_module.test[0]
+    assert gt.dtype == torch.long
+    assert gt.shape == torch.Size([256, 256])
+    assert boundary_mask.dtype == torch.bool
+    assert set(gt.unique().tolist()) <= {0, 1, 2, 3}
+
+
+def test_setup_crop_container(data_dir_cropped, monkeypatch):
+    OmegaConf.clear_resolvers()
+    write_crop_container(data_dir_cropped / 'test', data_folder_name='data', gt_folder_name='gt')
+    data_module = DivaHisDBDataModuleCropped(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                             num_workers=NUM_WORKERS, crop_container=True)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module, 'trainer', trainer)
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    data_module.setup('test')
+    assert data_module.test.crop_container is not None
+    assert data_module.get_img_name_coordinates(1) == \
+           ('e-codices_fmb-cb-0055_0098v_max', 'e-codices_fmb-cb-0055_0098v_max_x0000_y0128')
+    img, gt, boundary_mask, index = data_module.test[1]
+    assert img.shape == torch.Size([3, 256, 256])
+    assert gt.shape == torch.Size([256, 256])
+
+
+def test_crop_container_virtual_crops(data_dir_cropped):
+    OmegaConf.clear_resolvers()
+    with pytest.raises(ValueError):
+        DivaHisDBDataModuleCropped(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                   virtual_crops=True, crop_container=True)
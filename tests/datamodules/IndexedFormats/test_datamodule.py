@@ -1,4 +1,5 @@
 import pytest
+import torch
 from omegaconf import OmegaConf
 from pytorch_lightning import Trainer
 
@@ -74,3 +75,17 @@ def test_setup_predict_error(data_dir, monkeypatch):
     with pytest.raises(RuntimeError):
         datamodule_indexed.setup(stage)
 
+
+
+def test_setup_test_cache_labels(data_dir, monkeypatch):
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    datamodule_indexed = DataModuleIndexed(data_dir, data_folder_name='data', gt_folder_name='gt', num_workers=4)
+    datamodule_cached = DataModuleIndexed(data_dir, data_folder_name='data', gt_folder_name='gt', num_workers=4,
+                                          cache_labels=True)
+    for datamodule in [datamodule_indexed, datamodule_cached]:
+        monkeypatch.setattr(datamodule, 'trainer', trainer)
+        datamodule.setup('test')
+    assert (data_dir / 'labels.gt.test.json').exists()
+    _, gt, _ = datamodule_indexed.test[0]
+    _, gt_cached, _ = datamodule_cached.test[0]
+    assert torch.equal(gt, gt_cached)
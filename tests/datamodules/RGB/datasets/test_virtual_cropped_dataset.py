@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import torch
+from torchvision.datasets.folder import pil_loader
+
+from src.datamodules.RGB.datasets.virtual_cropped_dataset import VirtualCroppedDatasetRGB
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir
+
+DATA_FOLDER_NAME = 'data'
+GT_FOLDER_NAME = 'gt'
+PAGE_NAME = 'e-codices_fmb-cb-0055_0098v_max'
+
+
+@pytest.fixture
+def dataset_train(data_dir):
+    return VirtualCroppedDatasetRGB(path=data_dir / 'train', data_folder_name=DATA_FOLDER_NAME,
+                                    gt_folder_name=GT_FOLDER_NAME, crop_size=300)
+
+
+@pytest.fixture
+def dataset_test(data_dir):
+    return VirtualCroppedDatasetRGB(path=data_dir / 'test', data_folder_name=DATA_FOLDER_NAME,
+                                    gt_folder_name=GT_FOLDER_NAME, crop_size=256, is_test=True)
+
+
+def test___len__(dataset_train, dataset_test):
+    # page size 487x649
+    assert len(dataset_train) == 3 * 4
+    assert len(dataset_test) == 2 * 3 * 5
+
+
+def test_img_paths_per_page(dataset_train, data_dir):
+    assert dataset_train.img_paths_per_page[0] == (data_dir / 'train' / DATA_FOLDER_NAME / f'{PAGE_NAME}.jpg',
+                                                   data_dir / 'train' / GT_FOLDER_NAME / f'{PAGE_NAME}.png',
+                                                   PAGE_NAME, f'{PAGE_NAME}_x0000_y0000')
+    assert [p[3] for p in dataset_train.img_paths_per_page[:5]] == [f'{PAGE_NAME}_x0000_y0000',
+                                                                     f'{PAGE_NAME}_x0000_y0150',
+                                                                     f'{PAGE_NAME}_x0000_y0300',
+                                                                     f'{PAGE_NAME}_x0000_y0349',
+                                                                     f'{PAGE_NAME}_x0150_y0000']
+    assert dataset_train.img_paths_per_page[-1][3] == f'{PAGE_NAME}_x0187_y0349'
+
+
+def test__load_data_and_gt(dataset_train, data_dir):
+    data_img, gt_img = dataset_train._load_data_and_gt(5)
+    assert data_img.size == (300, 300)
+    assert gt_img.size == (300, 300)
+    # crop 5 is at x=150, y=150
+    page = pil_loader(data_dir / 'train' / DATA_FOLDER_NAME / f'{PAGE_NAME}.jpg')
+    assert np.array_equal(np.array(data_img), np.array(page)[150:450, 150:450])
+
+
+def test__load_page_cache(data_dir):
+    dataset = VirtualCroppedDatasetRGB(path=data_dir / 'test', data_folder_name=DATA_FOLDER_NAME,
+                                       gt_folder_name=GT_FOLDER_NAME, crop_size=256, max_cached_pages=1)
+    first_page = dataset._load_page(0)
+    assert dataset._load_page(0) is first_page
+    dataset._load_page(1)
+    assert list(dataset._page_cache.keys()) == [1]
+
+
+def test__get_train_val_items_train(dataset_train):
+    img, gt = dataset_train._get_train_val_items(index=0)
+    assert img.shape == torch.Size([3, 300, 300])
+    assert gt.shape == torch.Size([3, 300, 300])
+
+
+def test__get_test_items(dataset_test):
+    img, gt, index = dataset_test[16]
+    assert img.shape == torch.Size([3, 256, 256])
+    assert gt.shape == torch.Size([3, 256, 256])
+    assert index == 16
+    assert dataset_test.img_paths_per_page[16][2:] == (f'{PAGE_NAME}_2', f'{PAGE_NAME}_2_x0000_y0128')
+
+
+def test_selection(data_dir):
+    dataset = VirtualCroppedDatasetRGB(path=data_dir / 'test', data_folder_name=DATA_FOLDER_NAME,
+                                       gt_folder_name=GT_FOLDER_NAME, crop_size=256, selection=[f'{PAGE_NAME}_2'])
+    assert len(dataset) == 15
+    assert all(p[2] == f'{PAGE_NAME}_2' for p in dataset.img_paths_per_page)
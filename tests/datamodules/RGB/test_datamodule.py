@@ -1,4 +1,5 @@
 import pytest
+import torch
 from omegaconf import OmegaConf
 from pytorch_lightning import Trainer
 
@@ -75,3 +76,21 @@ def test_setup_predict_error(data_dir, monkeypatch):
     monkeypatch.setattr(trainer, 'datamodule', data_module_rgb)
     with pytest.raises(RuntimeError):
         data_module_rgb.setup(stage)
+
+
+def test_setup_test_store_pages(data_dir, monkeypatch):
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    OmegaConf.clear_resolvers()
+    data_module_rgb = DataModuleRGB(data_dir, data_folder_name='data', gt_folder_name='gt', num_workers=NUM_WORKERS)
+    data_module_stored = DataModuleRGB(data_dir, data_folder_name='data', gt_folder_name='gt',
+                                       num_workers=NUM_WORKERS, store_pages=True)
+    for data_module in [data_module_rgb, data_module_stored]:
+        monkeypatch.setattr(data_module, 'trainer', trainer)
+        data_module.setup('test')
+    assert (data_dir / 'pages.data.test.json').exists()
+    assert (data_dir / 'labels.gt.test.json').exists()
+    img, gt, index = data_module_rgb.test[1]
+    img_stored, gt_stored, index_stored = data_module_stored.test[1]
+    assert torch.equal(img, img_stored)
+    assert torch.equal(gt, gt_stored)
+    assert index == index_stored
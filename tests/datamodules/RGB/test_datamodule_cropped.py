@@ -5,7 +5,11 @@ from omegaconf import OmegaConf
 from pytorch_lightning import Trainer
 
 from src.datamodules.RGB.datamodule_cropped import DataModuleCroppedRGB
-from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.RGB.datasets.virtual_cropped_dataset import VirtualCroppedDatasetRGB
+from src.datamodules.utils.shards import write_shards, ShardDataset
+from src.datamodules.utils import staging
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped, data_dir
 from tests.datamodules.DivaHisDB.datasets.test_cropped_hisdb_dataset import dataset_test
 
 NUM_WORKERS = 4
@@ -57,8 +61,8 @@ def test_init_datamodule(data_module_cropped_rgb, class_encodings):
                        torch.tensor([1.1816224514404894e-06, 2.8860862585133873e-05, 0.0003646973054856062,
                                      8.845096090226434e-06, 0.0015267175622284412, 4.577706567943096e-05,
                                      0.0005162622546777129, 1.7000731531879865e-05]))
-    assert data_module_cropped_rgb.mean == [0.7050454974582426, 0.6503181590413943, 0.5567698583877997]
-    assert data_module_cropped_rgb.std == [0.3104060859619883, 0.3053311838884032, 0.28919611393432726]
+    assert data_module_cropped_rgb.mean == [0.7050454974582425, 0.6503181590413943, 0.5567698583877996]
+    assert data_module_cropped_rgb.std == [0.31040608596198827, 0.30533118388840325, 0.2891961139343273]
     with pytest.raises(AttributeError):
         getattr(data_module_cropped_rgb, 'train')
         getattr(data_module_cropped_rgb, 'val')
@@ -79,3 +83,60 @@ def test__create_dataset_parameters_cropped(data_module_cropped_rgb, class_encod
     parameters = data_module_cropped_rgb._create_dataset_parameters()
     assert 'train' in str(parameters['path'])
     assert not parameters['is_test']
+
+
+@pytest.fixture
+def data_module_virtual_cropped_rgb(data_dir):
+    OmegaConf.clear_resolvers()
+    datamodules = DataModuleCroppedRGB(data_dir, data_folder_name='data', gt_folder_name='gt',
+                                       num_workers=NUM_WORKERS, virtual_crops=True, virtual_crop_size=300)
+    return datamodules
+
+
+def test_setup_virtual_crops(data_module_virtual_cropped_rgb, monkeypatch):
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module_virtual_cropped_rgb, 'trainer', trainer)
+    monkeypatch.setattr(trainer, 'datamodule', data_module_virtual_cropped_rgb)
+    data_module_virtual_cropped_rgb.setup('fit')
+    data_module_virtual_cropped_rgb.setup('test')
+    assert isinstance(data_module_virtual_cropped_rgb.train, VirtualCroppedDatasetRGB)
+    assert data_module_virtual_cropped_rgb.train.crop_size == 300
+    assert data_module_virtual_cropped_rgb.test.crop_size == 256
+    assert data_module_virtual_cropped_rgb.get_img_name_coordinates(1) == \
+           ('e-codices_fmb-cb-0055_0098v_max', 'e-codices_fmb-cb-0055_0098v_max_x0000_y0128')
+    img, gt, idx = data_module_virtual_cropped_rgb.test[1]
+    assert img.shape == torch.Size([3, 256, 256])
+    assert gt.shape == torch.Size([256, 256])
+
+
+def test_setup_fit_train_shards(data_dir_cropped, tmp_path, monkeypatch):
+    OmegaConf.clear_resolvers()
+    paths = CroppedDatasetRGB.get_gt_data_paths(data_dir_cropped / 'train', data_folder_name='data',
+                                                gt_folder_name='gt')
+    index_path = write_shards([{'data': data, 'gt': gt} for data, gt, _, _ in paths],
+                              output_path=tmp_path / 'shards', name='train', layout='cropped', samples_per_shard=4)
+    data_module = DataModuleCroppedRGB(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                       num_workers=0, batch_size=2, train_shards=str(index_path))
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module, 'trainer', trainer)
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    data_module.setup('fit')
+    assert isinstance(data_module.train, ShardDataset)
+    assert len(data_module.train) == 12
+    img, gt = next(iter(data_module.train_dataloader()))
+    assert img.shape == torch.Size([2, 3, 256, 256])
+    assert gt.shape == torch.Size([2, 256, 256])
+
+
+def test_setup_fit_scratch_dir(data_dir_cropped, tmp_path, monkeypatch):
+    OmegaConf.clear_resolvers()
+    monkeypatch.setattr(staging, '_IN_USE', {})
+    data_module = DataModuleCroppedRGB(data_dir_cropped, data_folder_name='data', gt_folder_name='gt',
+                                       num_workers=NUM_WORKERS, scratch_dir=str(tmp_path / 'scratch'))
+    assert data_module.data_dir.parent == tmp_path / 'scratch'
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module, 'trainer', trainer)
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    data_module.setup('fit')
+    assert len(data_module.train) == 12
+    assert str(data_module.train.img_paths_per_page[0][0]).startswith(str(tmp_path / 'scratch'))
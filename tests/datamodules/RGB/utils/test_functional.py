@@ -1,7 +1,7 @@
 import pytest
 import torch
 
-from src.datamodules.RGB.utils.functional import gt_to_int_encoding, gt_to_one_hot
+from src.datamodules.RGB.utils.functional import gt_to_int_encoding, gt_to_one_hot, pack_rgb
 
 
 @pytest.fixture()
@@ -35,3 +35,30 @@ def test_gt_to_one_hot(input_matrix, class_encodings):
                                              [[1, 0, 0],
                                               [0, 0, 0],
                                               [0, 0, 1]]]))
+
+
+def test_gt_to_int_encoding_float(input_matrix, class_encodings):
+    output = gt_to_int_encoding(matrix=input_matrix / 255, class_encodings=class_encodings / 255)
+    assert torch.equal(output, torch.tensor([[3, 2, 1], [2, 1, 0], [1, 0, 3]]))
+
+
+def test_gt_to_int_encoding_uint8_unknown_color(input_matrix, class_encodings):
+    output = gt_to_int_encoding(matrix=input_matrix.to(torch.uint8), class_encodings=class_encodings[1:])
+    assert output.dtype == torch.long
+    assert torch.equal(output, torch.tensor([[2, 1, 0], [1, 0, -1], [0, -1, 2]]))
+
+
+def test_gt_to_int_encoding_same_as_loop(class_encodings):
+    matrix = class_encodings[torch.randint(0, 4, size=(64, 64))].permute(2, 0, 1).to(torch.uint8)
+    matrix[:, 0, 0] = torch.tensor([1, 2, 3])
+    expected = torch.full(size=(64, 64), fill_value=-1, dtype=torch.long)
+    for index, encoding in enumerate(class_encodings):
+        expected[(matrix == encoding.to(torch.uint8)[:, None, None]).all(dim=0)] = index
+    output = gt_to_int_encoding(matrix=matrix, class_encodings=class_encodings)
+    assert torch.equal(output, expected)
+
+
+def test_pack_rgb(class_encodings):
+    assert torch.equal(pack_rgb(class_encodings, dim=-1),
+                       torch.tensor([0, 255 << 16, (255 << 16) + (255 << 8), (255 << 16) + (255 << 8) + 255],
+                                    dtype=torch.int32))
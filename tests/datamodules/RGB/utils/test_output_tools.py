@@ -3,7 +3,8 @@ import pytest
 import torch
 from PIL import Image
 
-from src.datamodules.RGB.utils.output_tools import output_to_class_encodings, save_output_page_image
+from src.datamodules.RGB.utils.output_tools import output_to_class_encodings, save_output_page_image, \
+    output_to_class_index, get_palette
 
 
 @pytest.fixture()
@@ -25,7 +26,34 @@ def test_save_output_page_image(tmp_path, input_image, class_encodings):
     img_output_path = tmp_path / img_name
     loaded_img = Image.open(img_output_path)
     assert img_output_path.exists()
-    assert np.array_equal(output_to_class_encodings(input_image, class_encodings), np.array(loaded_img))
+    assert loaded_img.mode == 'P'
+    assert np.array_equal(output_to_class_encodings(input_image, class_encodings), np.array(loaded_img.convert('RGB')))
+
+
+def test_save_output_page_image_gif(tmp_path, input_image, class_encodings):
+    img_name = 'test.gif'
+    save_output_page_image(img_name, input_image, tmp_path, class_encodings)
+    loaded_img = Image.open(tmp_path / img_name)
+    assert loaded_img.mode == 'P'
+    assert np.array_equal(output_to_class_encodings(input_image, class_encodings), np.array(loaded_img.convert('RGB')))
+
+
+def test_save_output_page_image_too_many_classes(tmp_path, input_image):
+    with pytest.raises(ValueError):
+        save_output_page_image('test.png', input_image, tmp_path, [(0, 0, 0)] * 257)
+
+
+def test_output_to_class_index(input_image):
+    class_index = output_to_class_index(input_image)
+    assert class_index.dtype == np.uint8
+    assert np.array_equal(class_index, [[2, 3], [2, 0]])
+
+
+def test_get_palette(class_encodings):
+    palette = get_palette(class_encodings)
+    assert len(palette) == 768
+    assert palette[:12] == [0, 0, 0, 255, 0, 0, 255, 255, 0, 255, 255, 255]
+    assert not any(palette[12:])
 
 
 def test_output_to_class_encodings(input_image, class_encodings):
@@ -1,4 +1,5 @@
 import pytest
+import torch
 from omegaconf import OmegaConf
 from pytorch_lightning import Trainer
 
@@ -96,3 +97,21 @@ def test_setup_predict_error(data_dir, monkeypatch):
     monkeypatch.setattr(trainer, 'datamodule', datamodules)
     with pytest.raises(RuntimeError):
         datamodules.setup(stage)
+
+
+def test_setup_test_store_pages(data_dir, monkeypatch):
+    specs_test = _get_dataspecs(data_root=data_dir, train=False).__dict__
+    del specs_test['data_root']
+    specs_train = _get_dataspecs(data_root=data_dir, train=True).__dict__
+    del specs_train['data_root']
+    OmegaConf.clear_resolvers()
+    data_module = DataModuleRolfFormat(data_dir, train_specs={'a': specs_train}, test_specs={'a': specs_test},
+                                       num_workers=NUM_WORKERS, store_pages=True)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module, 'trainer', trainer)
+    data_module.setup('test')
+    assert (data_dir / 'pages.test.json').exists()
+    assert (data_dir / 'labels.test.json').exists()
+    img, gt, _ = data_module.test[0]
+    assert img.shape[1:] == gt.shape
+    assert gt.dtype == torch.long
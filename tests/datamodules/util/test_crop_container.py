@@ -0,0 +1,63 @@
+import pickle
+
+import pytest
+import torch
+
+from src.datamodules.DivaHisDB.datasets.cropped_dataset import CroppedHisDBDataset
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.utils.crop_container import write_crop_container, CropContainer, get_container_path
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
+
+
+@pytest.fixture
+def container(data_dir_cropped):
+    return CropContainer(write_crop_container(data_dir_cropped / 'test', data_folder_name='data',
+                                              gt_folder_name='gt'))
+
+
+def test_write_crop_container(data_dir_cropped, container):
+    assert container.path == get_container_path(data_dir_cropped / 'test', data_folder_name='data',
+                                                gt_folder_name='gt')
+    paths = CroppedDatasetRGB.get_gt_data_paths(data_dir_cropped / 'test', data_folder_name='data',
+                                                gt_folder_name='gt')
+    assert len(container) == len(paths)
+    assert [container.get_paths(i) for i in range(len(container))] == paths
+    for i in [0, len(paths) - 1, 5]:
+        data, gt = container.read(i)
+        assert data == paths[i][0].read_bytes()
+        assert gt == paths[i][1].read_bytes()
+
+    # the dataloader workers open the file themselves
+    copy = pickle.loads(pickle.dumps(container))
+    assert copy.read(5) == container.read(5)
+
+
+def test_crop_container_select(container):
+    pages = container.page_names
+    assert container.select(None) == list(range(len(container)))
+    assert [container.pages[i] for i in container.select(1)] == [pages[0]] * container.pages.count(pages[0])
+    assert {container.pages[i] for i in container.select([pages[-1]])} == {pages[-1]}
+    with pytest.raises(ValueError):
+        container.select(-1)
+    with pytest.raises(ValueError):
+        container.select(['not_a_page'])
+
+
+def test_crop_container_missing(data_dir_cropped):
+    with pytest.raises(ValueError):
+        CropContainer(get_container_path(data_dir_cropped / 'val', data_folder_name='data', gt_folder_name='gt'))
+
+
+@pytest.mark.parametrize('dataset_class', [CroppedDatasetRGB, CroppedHisDBDataset])
+def test_dataset_crop_container(data_dir_cropped, container, dataset_class):
+    kwargs = {'path': data_dir_cropped / 'test', 'data_folder_name': 'data', 'gt_folder_name': 'gt',
+              'is_test': True}
+    dataset = dataset_class(**kwargs)
+    dataset_container = dataset_class(**kwargs, crop_container=container)
+    assert dataset_container.img_paths_per_page == dataset.img_paths_per_page
+    for index in [0, 3, len(dataset) - 1]:
+        for expected, value in zip(dataset[index], dataset_container[index]):
+            if torch.is_tensor(expected):
+                assert torch.equal(expected, value)
+            else:
+                assert expected == value
@@ -1,6 +1,14 @@
+import os
+import shutil
+import time
+
 import numpy as np
+import pytest
+from PIL import Image
 
-from src.datamodules.utils.image_analytics import compute_mean_std, _return_mean, _return_std
+from src.datamodules.utils import image_analytics
+from src.datamodules.utils.image_analytics import compute_mean_std, compute_statistics, get_image_statistics, \
+    unpack_rgb, AnalyticsCache, ImageStatistics, estimate_statistics, get_statistics
 from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped, data_dir
 
 
@@ -20,16 +28,201 @@ def test_compute_mean_std_not_inmem(data_dir_cropped):
     assert np.isclose(std, [0.3104060859619883, 0.30533118388840325, 0.28919611393432726]).any()
 
 
-def test__return_mean(data_dir):
+def test_get_image_statistics(data_dir):
     path_to_files = data_dir / 'train' / 'data'
     path_file = list(path_to_files.iterdir())[0]
-    mean = _return_mean(image_path=path_file)
-    assert np.allclose(mean, [0.6613600924561268, 0.6080705925283078, 0.5188177611400755], rtol=2e-02)
+    statistics = get_image_statistics(data_path=str(path_file), gt_path=None)
+    assert statistics.pixel_count == 316063
+    assert (statistics.width, statistics.height) == (487, 649)
+    assert np.allclose(statistics.mean, [0.6613600924561268, 0.6080705925283078, 0.5188177611400755], rtol=2e-02)
+    assert statistics.class_counts == {}
 
 
-def test__return_std(data_dir):
-    path_to_files = data_dir / 'train' / 'data'
-    path_file = list(path_to_files.iterdir())[0]
-    std_class, std_glob = _return_std(image_path=path_file, mean=_return_mean(path_file))
-    assert std_glob == 316063.0
-    assert np.allclose(std_class, [38926.12389586361, 36001.38344827261, 30250.40256187894], rtol=2e-02)
+def test_get_image_statistics_gt_formats(tmp_path):
+    gt = np.zeros((20, 20, 3), dtype=np.uint8)
+    # more than 256 colours
+    gt[:, :, 0] = np.arange(400).reshape(20, 20) % 256
+    gt[:, :, 1] = np.arange(400).reshape(20, 20) // 256
+    gt[:10, :, 2] = 8
+    Image.fromarray(gt).save(tmp_path / 'gt.png')
+    Image.fromarray(gt[:, :, 0]).convert('P').save(tmp_path / 'gt.gif')
+
+    statistics_rgb = get_image_statistics(data_path=None, gt_path=str(tmp_path / 'gt.png'), gt_format='rgb')
+    assert len(statistics_rgb.class_counts) == 400
+    assert (143, 1, 0) in [unpack_rgb(key) for key in statistics_rgb.classes]
+
+    statistics_hisdb = get_image_statistics(data_path=None, gt_path=str(tmp_path / 'gt.png'), gt_format='hisdb')
+    assert statistics_hisdb.class_counts == {0: 200, 8: 200}
+
+    statistics_index = get_image_statistics(data_path=None, gt_path=str(tmp_path / 'gt.gif'), gt_format='index')
+    assert sum(statistics_index.class_counts.values()) == 400
+    assert statistics_index.palette_num_colors == len(statistics_index.class_counts)
+
+
+def test_compute_statistics_same_as_numpy(data_dir_cropped):
+    path_to_files = data_dir_cropped / 'train' / 'data' / 'e-codices_fmb-cb-0055_0098v_max'
+    path_list = sorted(path_to_files.iterdir())
+    gt_list = [data_dir_cropped / 'train' / 'gt' / 'e-codices_fmb-cb-0055_0098v_max' / p.name for p in path_list]
+    statistics = compute_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb', workers=1)
+
+    imgs = np.stack([np.asarray(Image.open(p).convert('RGB')) for p in path_list]) / 255.0
+    assert np.allclose(statistics.mean, imgs.mean(axis=(0, 1, 2)))
+    assert np.allclose(statistics.std, imgs.std(axis=(0, 1, 2)))
+    assert (statistics.width, statistics.height) == Image.open(path_list[0]).size
+    assert statistics.classes == [1, 2, 4, 8]
+    assert statistics.num_samples_per_class.sum() == statistics.pixel_count
+
+
+def test_compute_statistics_parallel(data_dir_cropped):
+    path_to_files = data_dir_cropped / 'train' / 'data' / 'e-codices_fmb-cb-0055_0098v_max'
+    path_list = sorted(path_to_files.iterdir())
+    serial = compute_statistics(data_paths=path_list, workers=1, use_cache=False)
+    parallel = compute_statistics(data_paths=path_list, workers=3, use_cache=False)
+    assert np.array_equal(serial.channel_sum, parallel.channel_sum)
+    assert np.array_equal(serial.channel_square_sum, parallel.channel_square_sum)
+    assert (serial.width, serial.height) == (parallel.width, parallel.height)
+
+
+def test_compute_statistics_errors(data_dir_cropped):
+    with pytest.raises(ValueError):
+        compute_statistics(data_paths=['a.png'], gt_format='unknown')
+    with pytest.raises(ValueError):
+        compute_statistics(data_paths=['a.png'], gt_paths=['a.png', 'b.png'])
+
+
+def test_image_statistics_to_dict(data_dir_cropped):
+    path_to_files = data_dir_cropped / 'train' / 'data' / 'e-codices_fmb-cb-0055_0098v_max'
+    path_file = sorted(path_to_files.iterdir())[0]
+    gt_file = data_dir_cropped / 'train' / 'gt' / 'e-codices_fmb-cb-0055_0098v_max' / path_file.name
+    statistics = get_image_statistics(data_path=str(path_file), gt_path=str(gt_file), gt_format='index')
+    restored = ImageStatistics.from_dict(statistics.to_dict())
+    assert restored.pixel_count == statistics.pixel_count
+    assert np.array_equal(restored.channel_square_sum, statistics.channel_square_sum)
+    assert restored.class_counts == statistics.class_counts
+    assert restored.palette == statistics.palette
+    assert ImageStatistics.from_dict(ImageStatistics().to_dict()).pixel_count == 0
+
+
+def test_compute_statistics_cache(data_dir_cropped, analytics_cache_dir, monkeypatch):
+    path_to_files = data_dir_cropped / 'train' / 'data' / 'e-codices_fmb-cb-0055_0098v_max'
+    path_list = sorted(path_to_files.iterdir())
+    gt_list = [data_dir_cropped / 'train' / 'gt' / 'e-codices_fmb-cb-0055_0098v_max' / p.name for p in path_list]
+    expected = compute_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb', workers=1,
+                                  use_cache=False)
+    assert not analytics_cache_dir.exists()
+
+    # fill the cache with the first part of the files
+    compute_statistics(data_paths=path_list[:3], gt_paths=gt_list[:3], gt_format='hisdb', workers=1)
+    assert len(list(analytics_cache_dir.glob('*.json'))) == 2
+
+    decoded = []
+    get_data_statistics = image_analytics._get_data_statistics
+    monkeypatch.setattr(image_analytics, '_get_data_statistics',
+                        lambda path: decoded.append(path) or get_data_statistics(path))
+    statistics = compute_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb', workers=1)
+    assert decoded == [str(p) for p in path_list[3:]]
+    assert np.array_equal(statistics.channel_sum, expected.channel_sum)
+    assert np.array_equal(statistics.channel_square_sum, expected.channel_square_sum)
+    assert statistics.class_counts == expected.class_counts
+    assert (statistics.width, statistics.height) == (expected.width, expected.height)
+
+    # everything is cached now
+    decoded.clear()
+    compute_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb', workers=1)
+    assert decoded == []
+
+    # a changed file gets decoded again
+    Image.new('RGB', (10, 10), color=(255, 255, 255)).save(path_list[1])
+    statistics = compute_statistics(data_paths=path_list, workers=1)
+    assert decoded == [str(path_list[1])]
+    assert statistics.pixel_count == expected.pixel_count - expected.width * expected.height + 100
+
+
+def test_analytics_cache_resolves_symlinks(data_dir_cropped, tmp_path):
+    path_file = sorted((data_dir_cropped / 'train' / 'data' / 'e-codices_fmb-cb-0055_0098v_max').iterdir())[0]
+    link = tmp_path / 'link.png'
+    link.symlink_to(path_file)
+    cache = AnalyticsCache(cache_dir=tmp_path / 'cache')
+    statistics = get_image_statistics(data_path=str(path_file), gt_path=None)
+    cache.put(path_file, kind='data', statistics=statistics)
+    cache.save()
+
+    cache = AnalyticsCache(cache_dir=tmp_path / 'cache')
+    assert cache.get(link, kind='data').pixel_count == statistics.pixel_count
+    assert cache.get(link, kind='gt.rgb') is None
+
+
+def test_analytics_cache_prune(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    statistics = ImageStatistics()
+    for name in ['a', 'b', 'c']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'img.png').write_bytes(b'png')
+        cache = AnalyticsCache(cache_dir=cache_dir)
+        cache.put(tmp_path / name / 'img.png', kind='data', statistics=statistics)
+        cache.save()
+    # a sidecar of an older version of the cache
+    (cache_dir / 'old.json').write_text('{}')
+    shutil.rmtree(tmp_path / 'a')
+    shutil.rmtree(tmp_path / 'c')
+
+    # saving does not prune, recently used sidecars are kept even if their directory is missing
+    assert len(list(cache_dir.glob('*.json'))) == 4
+    assert cache.prune() == 0
+
+    # the sidecars of a and c and the old sidecar have not been used for a long time
+    an_hour_ago = time.time() - 60 * 60
+    for path in cache_dir.iterdir():
+        os.utime(path, (an_hour_ago, an_hour_ago))
+    # reading the sidecar of c marks it as used
+    AnalyticsCache(cache_dir=cache_dir).get(tmp_path / 'b' / 'img.png', kind='data')
+    AnalyticsCache(cache_dir=cache_dir)._get_sidecar((tmp_path / 'c').resolve())
+    assert cache.prune(min_age_days=1 / 24 / 2) == 2
+    assert len(list(cache_dir.glob('*.json'))) == 2
+    assert AnalyticsCache(cache_dir=cache_dir).get(tmp_path / 'b' / 'img.png', kind='data') is not None
+
+
+def test_estimate_statistics(data_dir_cropped):
+    path_list = sorted((data_dir_cropped / 'train' / 'data').glob('*/*.png'))
+    gt_list = [data_dir_cropped / 'train' / 'gt' / p.parent.name / p.name for p in path_list]
+    exact = compute_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb', workers=1, use_cache=False)
+    statistics, estimate = estimate_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb',
+                                               tolerance=0.05, min_pages=4, pixels_per_page=2000, workers=1)
+    assert 4 <= estimate.num_pages < estimate.num_pages_total == len(path_list)
+    assert estimate.max_error <= 0.05
+    assert np.all(np.abs(statistics.mean - exact.mean) <= estimate.mean_error)
+    assert np.all(np.abs(statistics.std - exact.std) <= estimate.std_error)
+    assert statistics.classes == exact.classes
+    assert (statistics.width, statistics.height) == (exact.width, exact.height)
+    # the class counts are scaled up to all the images
+    assert np.isclose(statistics.num_samples_per_class.sum(), exact.num_samples_per_class.sum(), rtol=0.1)
+    assert len(estimate.gt_analytics(statistics.classes)['class_frequency_error']) == 4
+
+    # the sample does not depend on the number of workers
+    parallel, parallel_estimate = estimate_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb',
+                                                      tolerance=0.05, min_pages=4, pixels_per_page=2000, workers=2)
+    assert parallel_estimate.num_pages % 2 == 0
+    statistics, _ = estimate_statistics(data_paths=path_list, gt_paths=gt_list, gt_format='hisdb',
+                                        tolerance=0.05, min_pages=parallel_estimate.num_pages,
+                                        pixels_per_page=2000, workers=1)
+    assert np.array_equal(statistics.channel_sum, parallel.channel_sum)
+
+
+def test_estimate_statistics_all_pages(data_dir_cropped):
+    path_list = sorted((data_dir_cropped / 'train' / 'data').glob('*/*.png'))[:5]
+    gt_list = [data_dir_cropped / 'train' / 'gt' / p.parent.name / p.name for p in path_list]
+    exact = compute_statistics(gt_paths=gt_list, gt_format='hisdb', workers=1, use_cache=False)
+    statistics, estimate = estimate_statistics(gt_paths=gt_list, gt_format='hisdb', tolerance=0., workers=1)
+    assert estimate.num_pages == 5
+    assert estimate.mean_error is None
+    # all gt images are counted completely
+    assert statistics.class_counts == exact.class_counts
+    assert estimate.max_error == 0.
+
+
+def test_get_statistics(data_dir_cropped):
+    path_list = sorted((data_dir_cropped / 'train' / 'data').glob('*/*.png'))[:3]
+    statistics, estimate = get_statistics(data_paths=path_list, workers=1)
+    assert estimate is None
+    with pytest.raises(ValueError):
+        get_statistics(data_paths=path_list, workers=1, estimation={'confidence': 1.5})
@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision.transforms import ToTensor
+
+import src.datamodules.utils.label_cache as label_cache_module
+from src.datamodules.DivaHisDB.datasets.cropped_dataset import CroppedHisDBDataset
+from src.datamodules.DivaHisDB.datasets.virtual_cropped_dataset import VirtualCroppedHisDBDataset
+from src.datamodules.DivaHisDB.utils.functional import gt_to_int_encoding as hisdb_gt_to_int_encoding
+from src.datamodules.DivaHisDB.utils.single_transform import IntegerEncoding
+from src.datamodules.RGB.utils.functional import gt_to_int_encoding as rgb_gt_to_int_encoding
+from src.datamodules.utils.label_cache import LabelCache, encode_labels, decode_labels, decode_boundary_mask, \
+    IGNORE_LABEL, BOUNDARY_BIT
+from src.datamodules.utils.wrapper_transforms import OnlyTarget
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped, data_dir
+
+HISDB_CLASS_ENCODINGS = [1, 2, 4, 8]
+RGB_CLASS_ENCODINGS = [[0, 0, 1], [0, 0, 2], [0, 0, 4], [0, 0, 8], [128, 0, 1], [128, 0, 2], [128, 0, 4], [128, 0, 8]]
+
+
+@pytest.fixture
+def gt_path(data_dir_cropped):
+    return data_dir_cropped / 'train' / 'gt' / 'e-codices_fmb-cb-0055_0098v_max' / \
+           'e-codices_fmb-cb-0055_0098v_max_x0000_y0000.png'
+
+
+def test_encode_labels_rgb(gt_path):
+    gt = Image.open(gt_path).convert('RGB')
+    labels = torch.from_numpy(encode_labels(gt, gt_format='rgb', class_encodings=RGB_CLASS_ENCODINGS))
+    expected = rgb_gt_to_int_encoding(ToTensor()(gt), torch.tensor(RGB_CLASS_ENCODINGS) / 255)
+    assert labels.dtype == torch.uint8
+    assert torch.equal(decode_labels(labels), expected)
+    assert not decode_boundary_mask(labels).any()
+
+
+def test_encode_labels_hisdb(gt_path):
+    gt = Image.open(gt_path).convert('RGB')
+    labels = torch.from_numpy(encode_labels(gt, gt_format='hisdb', class_encodings=HISDB_CLASS_ENCODINGS))
+    gt_tensor = ToTensor()(gt)
+    assert torch.equal(decode_labels(labels), hisdb_gt_to_int_encoding(gt_tensor, HISDB_CLASS_ENCODINGS))
+    assert torch.equal(decode_boundary_mask(labels), gt_tensor[0] != 0)
+
+
+def test_encode_labels_unknown():
+    gt = Image.fromarray(np.array([[[0, 0, 1], [0, 0, 3]], [[128, 0, 2], [0, 0, 0]]], dtype=np.uint8))
+    labels = encode_labels(gt, gt_format='hisdb', class_encodings=HISDB_CLASS_ENCODINGS)
+    assert labels.tolist() == [[0, IGNORE_LABEL], [BOUNDARY_BIT, IGNORE_LABEL]]
+    assert decode_labels(torch.from_numpy(labels)).tolist() == [[0, -1], [0, -1]]
+
+
+def test_label_cache_invalid_parameters(tmp_path):
+    with pytest.raises(ValueError):
+        LabelCache(directory=tmp_path, name='gt.train', gt_format='jpg')
+    with pytest.raises(ValueError):
+        LabelCache(directory=tmp_path, name='gt.train', gt_format='index', class_encodings=list(range(200)))
+
+
+def test_label_cache(data_dir_cropped, gt_path, monkeypatch):
+    gt_paths = sorted((data_dir_cropped / 'train' / 'gt').rglob('*.png'))
+    cache = LabelCache(directory=data_dir_cropped, name='gt.train', gt_format='hisdb',
+                       class_encodings=HISDB_CLASS_ENCODINGS, workers=1)
+    cache.compile(gt_paths)
+    assert cache.index_path == data_dir_cropped / 'labels.gt.train.json'
+    assert cache.data_path.stat().st_size == 12 * 300 * 300
+    assert cache.size(gt_path) == (300, 300)
+
+    expected = encode_labels(Image.open(gt_path), gt_format='hisdb', class_encodings=HISDB_CLASS_ENCODINGS)
+    assert np.array_equal(cache.load(gt_path).numpy(), expected)
+    assert np.array_equal(cache.load(gt_path, box=(10, 20, 110, 70)).numpy(), expected[20:70, 10:110])
+
+    # a second cache with the same parameters reuses the compiled labels
+    compiled = []
+    original_task = label_cache_module._compile_labels_task
+    monkeypatch.setattr(label_cache_module, '_compile_labels_task',
+                        lambda task: compiled.append(task[0]) or original_task(task))
+    cache = LabelCache(directory=data_dir_cropped, name='gt.train', gt_format='hisdb',
+                       class_encodings=HISDB_CLASS_ENCODINGS, workers=1)
+    cache.compile(gt_paths)
+    assert compiled == []
+
+    # just the changed file is compiled again
+    stat = gt_path.stat()
+    os.utime(gt_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    cache.compile(gt_paths)
+    assert compiled == ['train/gt/e-codices_fmb-cb-0055_0098v_max/e-codices_fmb-cb-0055_0098v_max_x0000_y0000.png']
+    assert np.array_equal(cache.load(gt_path).numpy(), expected)
+    assert len(list(data_dir_cropped.glob('labels.gt.train.*.bin'))) == 1
+
+    # other class encodings compile everything again
+    compiled.clear()
+    cache = LabelCache(directory=data_dir_cropped, name='gt.train', gt_format='hisdb', class_encodings=[1, 2, 4],
+                       workers=1)
+    cache.compile(gt_paths)
+    assert len(compiled) == 12
+
+
+def test_cropped_hisdb_dataset_label_cache(data_dir_cropped):
+    kwargs = {'path': data_dir_cropped / 'test', 'data_folder_name': 'data', 'gt_folder_name': 'gt', 'is_test': True,
+              'target_transform': OnlyTarget(IntegerEncoding(class_encodings=HISDB_CLASS_ENCODINGS))}
+    dataset = CroppedHisDBDataset(**kwargs)
+    cache = LabelCache(directory=data_dir_cropped, name='gt.test', gt_format='hisdb',
+                       class_encodings=HISDB_CLASS_ENCODINGS)
+    dataset_cached = CroppedHisDBDataset(**kwargs, label_cache=cache)
+    assert (data_dir_cropped / 'labels.gt.test.json').exists()
+    for index in [0, len(dataset) - 1]:
+        img, gt, boundary_mask, _ = dataset[index]
+        img_cached, gt_cached, boundary_mask_cached, _ = dataset_cached[index]
+        assert torch.equal(img, img_cached)
+        assert torch.equal(gt, gt_cached)
+        assert torch.equal(boundary_mask, boundary_mask_cached)
+
+
+def test_virtual_cropped_hisdb_dataset_label_cache(data_dir):
+    kwargs = {'path': data_dir / 'test', 'data_folder_name': 'data', 'gt_folder_name': 'gt', 'is_test': True,
+              'crop_size': 256, 'target_transform': OnlyTarget(IntegerEncoding(class_encodings=HISDB_CLASS_ENCODINGS))}
+    dataset = VirtualCroppedHisDBDataset(**kwargs)
+    cache = LabelCache(directory=data_dir, name='gt.test', gt_format='hisdb', class_encodings=HISDB_CLASS_ENCODINGS)
+    dataset_cached = VirtualCroppedHisDBDataset(**kwargs, label_cache=cache)
+    for index in [0, 5, len(dataset) - 1]:
+        _, gt, boundary_mask, _ = dataset[index]
+        _, gt_cached, boundary_mask_cached, _ = dataset_cached[index]
+        assert torch.equal(gt, gt_cached)
+        assert torch.equal(boundary_mask, boundary_mask_cached)
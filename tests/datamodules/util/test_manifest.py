@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.RGB.datasets.full_page_dataset import DatasetRGB
+from src.datamodules.utils import manifest as manifest_module
+from src.datamodules.utils.manifest import get_manifest, get_manifest_path
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped, data_dir
+
+
+def test_get_manifest_cropped(data_dir_cropped):
+    directory = data_dir_cropped / 'train'
+    manifest = get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=True)
+    assert get_manifest_path(directory, 'data', 'gt').exists()
+    assert len(manifest) == 12
+    assert manifest.page_names == ['e-codices_fmb-cb-0055_0098v_max']
+    assert manifest.data_paths[0] == 'data/e-codices_fmb-cb-0055_0098v_max/e-codices_fmb-cb-0055_0098v_max_x0000_y0000.png'
+    assert manifest.gt_paths[0] == 'gt/e-codices_fmb-cb-0055_0098v_max/e-codices_fmb-cb-0055_0098v_max_x0000_y0000.png'
+    assert manifest.coordinates[1] == (0, 150)
+    assert manifest.sizes[0] == (300, 300)
+
+
+def test_get_manifest_is_reused(data_dir_cropped, monkeypatch):
+    directory = data_dir_cropped / 'train'
+    expected = CroppedDatasetRGB.get_gt_data_paths(directory, data_folder_name='data', gt_folder_name='gt')
+
+    def _fail(*args, **kwargs):
+        raise AssertionError('the manifest is built again')
+
+    monkeypatch.setattr(manifest_module, '_build_cropped_manifest', _fail)
+    assert CroppedDatasetRGB.get_gt_data_paths(directory, data_folder_name='data', gt_folder_name='gt') == expected
+
+
+def test_get_manifest_outdated(data_dir_cropped):
+    directory = data_dir_cropped / 'train'
+    manifest = get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=True)
+    data_file = directory / manifest.data_paths[-1]
+    gt_file = directory / manifest.gt_paths[-1]
+    for path in [data_file, gt_file]:
+        os.remove(path)
+        # make sure the mtime of the directory changes on file systems with a coarse resolution
+        stat = path.parent.stat()
+        os.utime(path.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    manifest = get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=True)
+    assert len(manifest) == 11
+
+
+def test_get_manifest_corrupt(data_dir_cropped):
+    directory = data_dir_cropped / 'train'
+    get_manifest_path(directory, 'data', 'gt').write_text('{"version": 1, "crop')
+    assert len(get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=True)) == 12
+    with get_manifest_path(directory, 'data', 'gt').open() as f:
+        assert len(json.load(f)['data']) == 12
+
+
+def test_get_manifest_full_page(data_dir):
+    directory = data_dir / 'test'
+    manifest = get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=False)
+    assert manifest.pages == ['e-codices_fmb-cb-0055_0098v_max', 'e-codices_fmb-cb-0055_0098v_max_2']
+    assert manifest.coordinates == [None, None]
+    assert manifest.sizes == [(487, 649), (487, 649)]
+    # the cropped manifest has a different structure and is not reused
+    assert manifest_module._load_manifest(directory, get_manifest_path(directory, 'data', 'gt'), cropped=True) is None
+
+
+def test_select(data_dir):
+    directory = data_dir / 'test'
+    manifest = get_manifest(directory, data_folder_name='data', gt_folder_name='gt', cropped=False)
+    assert manifest.select(None) == [0, 1]
+    assert manifest.select(1) == [0]
+    assert manifest.select(['e-codices_fmb-cb-0055_0098v_max_2']) == [1]
+    with pytest.raises(ValueError):
+        manifest.select(['unknown'])
+    with pytest.raises(ValueError):
+        manifest.select(3)
+    assert DatasetRGB.get_img_gt_path_list(directory, 'data', 'gt', selection=1) == \
+           [(directory / 'data' / 'e-codices_fmb-cb-0055_0098v_max.jpg',
+             directory / 'gt' / 'e-codices_fmb-cb-0055_0098v_max.png', 'e-codices_fmb-cb-0055_0098v_max')]
+
+
+def test_get_manifest_copied_dataset(data_dir, tmp_path):
+    get_manifest(data_dir / 'train', data_folder_name='data', gt_folder_name='gt', cropped=False)
+    copy = tmp_path / 'copy'
+    shutil.copytree(data_dir / 'train', copy)
+    # the paths are relative to the split folder
+    assert DatasetRGB.get_img_gt_path_list(copy, 'data', 'gt')[0][0] == \
+           copy / 'data' / 'e-codices_fmb-cb-0055_0098v_max.jpg'
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from src.datamodules.utils.memmap_store import MemmapStore, is_up_to_date
+
+
+class _LengthStore(MemmapStore):
+    # stores the length of every file as one int64
+    prefix = 'lengths'
+    suffix = '.bin'
+
+    def __init__(self, directory, name, unit=1):
+        super().__init__(directory=directory, name=name, workers=1)
+        self.unit = unit
+        self.written = []
+
+    def load(self, path):
+        return int(self._get_memmap()[self._entries[self._key(path)][0]])
+
+    def _get_settings(self):
+        return {'unit': self.unit}
+
+    def _open_memmap(self, data_path):
+        return np.memmap(data_path, dtype=np.int64, mode='r')
+
+    def _write_data(self, data_path, paths, reused, old_entries, old_data_path):
+        keys = sorted(paths)
+        old_data = np.memmap(old_data_path, dtype=np.int64, mode='r') if reused else None
+        values, entries = [], {}
+        for row, key in enumerate(keys):
+            stat = os.stat(paths[key])
+            if key in reused:
+                values.append(old_data[old_entries[key][0]])
+            else:
+                self.written.append(key)
+                values.append(stat.st_size // self.unit)
+            entries[key] = [row, stat.st_size, stat.st_mtime_ns]
+        np.asarray(values, dtype=np.int64).tofile(data_path)
+        return entries
+
+
+def test_memmap_store(tmp_path):
+    paths = [tmp_path / 'a.txt', tmp_path / 'b.txt']
+    paths[0].write_text('a' * 4)
+    paths[1].write_text('b' * 6)
+    store = _LengthStore(directory=tmp_path, name='test')
+    store.compile(paths)
+    assert [store.load(p) for p in paths] == [4, 6]
+    assert store.written == ['a.txt', 'b.txt']
+
+    # a changed file is compiled again, the old data file is replaced
+    old_data_path = store.data_path
+    paths[1].write_text('b' * 8)
+    store = _LengthStore(directory=tmp_path, name='test')
+    store.compile(paths)
+    assert store.written == ['b.txt']
+    assert [store.load(p) for p in paths] == [4, 8]
+    assert not old_data_path.exists()
+
+    # other settings discard the old index
+    store = _LengthStore(directory=tmp_path, name='test', unit=2)
+    store.compile(paths[:1])
+    assert store.written == ['a.txt']
+    assert store.load(paths[0]) == 2
+    assert len(list(tmp_path.glob('lengths.test.*.bin'))) == 1
+
+
+def test_is_up_to_date(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    stat = path.stat()
+    assert is_up_to_date([0, stat.st_size, stat.st_mtime_ns], path)
+    assert not is_up_to_date([0, stat.st_size + 1, stat.st_mtime_ns], path)
+    assert not is_up_to_date(None, path)
+    assert not is_up_to_date([0, stat.st_size, stat.st_mtime_ns], tmp_path / 'missing.txt')
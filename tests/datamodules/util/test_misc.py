@@ -3,10 +3,12 @@ from pathlib import Path
 import numpy as np
 import pytest
 import torch
+from filelock import FileLock, Timeout
 
 from src.datamodules.utils.exceptions import PathNone, PathNotDir, PathMissingSplitDir, PathMissingDirinSplitDir
 from src.datamodules.utils.misc import validate_path_for_segmentation, _get_argmax, get_output_file_list, \
-    find_new_filename, selection_validation, get_image_dims
+    find_new_filename, selection_validation, get_image_dims, get_crop_coordinates, ImageDimensions, save_json, \
+    check_missing_analytics, dataset_lock, get_global_rank
 from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped, data_dir
 
 
@@ -240,3 +242,67 @@ def test_get_image_dims_list_tuples(get_test_data_full_page):
     img_dims = get_image_dims([(get_test_data_full_page[0], get_test_data_full_page[0])])
     assert img_dims.width == 487
     assert img_dims.height == 649
+
+
+def test_get_crop_coordinates():
+    # same grid as the crops in dummy_dataset_cropped/train (generated with tools/generate_cropped_dataset.py)
+    coordinates = get_crop_coordinates(image_dims=ImageDimensions(width=649, height=487), crop_size=300, overlap=0.5)
+    assert coordinates == [(0, 0), (0, 150), (0, 187), (150, 0), (150, 150), (150, 187),
+                           (300, 0), (300, 150), (300, 187), (349, 0), (349, 150), (349, 187)]
+
+
+def test_get_crop_coordinates_exact_fit():
+    coordinates = get_crop_coordinates(image_dims=ImageDimensions(width=512, height=256), crop_size=256, overlap=0.5)
+    assert coordinates == [(0, 0), (128, 0), (256, 0)]
+
+
+def test_get_crop_coordinates_page_too_small():
+    with pytest.raises(ValueError):
+        get_crop_coordinates(image_dims=ImageDimensions(width=200, height=487), crop_size=300)
+
+
+def test_save_json(tmp_path):
+    analytics_path = tmp_path / 'analytics.json'
+    save_json({'mean': [0.5, 0.5, 0.5]}, analytics_path)
+    analytics, missing = check_missing_analytics(analytics_path, ['mean', 'std'])
+    assert analytics == {'mean': [0.5, 0.5, 0.5]}
+    assert missing
+    assert [p.name for p in tmp_path.iterdir()] == ['analytics.json']
+
+
+def test_check_missing_analytics_estimate(tmp_path):
+    analytics_path = tmp_path / 'analytics.json'
+    save_json({'mean': [0.5, 0.5, 0.5], 'estimate': {'num_pages': 1}}, analytics_path)
+    assert not check_missing_analytics(analytics_path, ['mean'])[1]
+    assert check_missing_analytics(analytics_path, ['mean'], allow_estimate=False)[1]
+
+
+def test_get_global_rank(monkeypatch):
+    for env_variable in ['RANK', 'SLURM_PROCID', 'LOCAL_RANK']:
+        monkeypatch.delenv(env_variable, raising=False)
+    assert get_global_rank() == 0
+    monkeypatch.setenv('LOCAL_RANK', '1')
+    assert get_global_rank() == 1
+    monkeypatch.setenv('RANK', '3')
+    assert get_global_rank() == 3
+
+
+def test_dataset_lock(tmp_path):
+    with dataset_lock(tmp_path):
+        with pytest.raises(Timeout):
+            FileLock(str(tmp_path / '.analytics.lock')).acquire(timeout=0.1)
+    lock = FileLock(str(tmp_path / '.analytics.lock'))
+    lock.acquire(timeout=0.1)
+    lock.release()
+
+
+def test_dataset_lock_not_writable(tmp_path, monkeypatch, caplog):
+    def _acquire(*args, **kwargs):
+        raise PermissionError
+
+    monkeypatch.setattr(FileLock, 'acquire', _acquire)
+    entered = False
+    with dataset_lock(tmp_path):
+        entered = True
+    assert entered
+    assert 'continue without lock' in caplog.text
@@ -0,0 +1,162 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.datamodules.DivaHisDB.datasets.cropped_dataset import CroppedHisDBDataset
+from src.datamodules.DivaHisDB.utils.output_tools import save_output_page_image
+from src.datamodules.utils.output_merger import PageAccumulator, CroppedOutputMerger, get_patch_coordinates
+from src.datamodules.utils.output_tools import merge_patches
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
+
+CLASS_ENCODINGS = [1, 2, 4, 8]
+FULL_PAGE_PATH = Path(__file__).parents[2] / 'test_data' / 'dummy_data_hisdb' / 'dummy_dataset' / 'test'
+
+
+@pytest.fixture
+def patches():
+    rng = np.random.default_rng(42)
+    coordinates = [(0, 0), (0, 2), (2, 0), (2, 2), (3, 0), (3, 2)]
+    return {c: rng.random((3, 4, 4), dtype=np.float32) for c in coordinates}
+
+
+@pytest.fixture
+def cropped_predictions(data_dir_cropped):
+    img_paths_per_page = CroppedHisDBDataset.get_gt_data_paths(directory=data_dir_cropped / 'test',
+                                                               data_folder_name='data', gt_folder_name='gt')
+    rng = np.random.default_rng(42)
+    prediction_path = data_dir_cropped / 'patches'
+    for _, _, img_name, crop_name in img_paths_per_page:
+        (prediction_path / img_name).mkdir(parents=True, exist_ok=True)
+        np.save(str(prediction_path / img_name / f'{crop_name}.npy'),
+                rng.random((len(CLASS_ENCODINGS), 256, 256), dtype=np.float32))
+    return img_paths_per_page, prediction_path
+
+
+def test_get_patch_coordinates():
+    assert get_patch_coordinates('page_1_x0128_y0064') == (128, 64)
+    with pytest.raises(ValueError):
+        get_patch_coordinates('page_1')
+
+
+def test_page_accumulator_max(patches):
+    accumulator = PageAccumulator(num_classes=3, height=6, width=7)
+    expected = np.full((3, 6, 7), np.nan)
+    for coordinates, patch in patches.items():
+        assert not accumulator.is_complete
+        accumulator.add_patch(patch=patch, coordinates=coordinates)
+        expected = merge_patches(patch, coordinates, expected)
+    assert accumulator.is_complete
+    assert accumulator.get_result().dtype == np.float32
+    assert np.array_equal(accumulator.get_result(), expected.astype(np.float32))
+
+
+def test_page_accumulator_float16(patches):
+    accumulator = PageAccumulator(num_classes=3, height=6, width=7, dtype=np.float16)
+    for coordinates, patch in patches.items():
+        accumulator.add_patch(patch=patch, coordinates=coordinates)
+    assert accumulator.get_result().dtype == np.float16
+    assert np.isclose(accumulator.get_result()[0, 0, 0], patches[(0, 0)][0, 0, 0], rtol=1e-3)
+
+
+def test_page_accumulator_mean(patches):
+    accumulator = PageAccumulator(num_classes=3, height=6, width=7, reducer='mean')
+    for coordinates, patch in patches.items():
+        accumulator.add_patch(patch=patch, coordinates=coordinates)
+    result = accumulator.get_result()
+    assert np.isclose(result[1, 0, 0], patches[(0, 0)][1, 0, 0])
+    assert np.isclose(result[1, 2, 2], np.mean([patch[1, 2 - y, 2 - x] for (x, y), patch in patches.items()
+                                                if x <= 2 and y <= 2]))
+
+
+def test_page_accumulator_distance(patches):
+    accumulator = PageAccumulator(num_classes=3, height=6, width=7, reducer='distance')
+    accumulator.add_patch(patch=patches[(0, 0)], coordinates=(0, 0))
+    accumulator.add_patch(patch=patches[(2, 0)], coordinates=(2, 0))
+    result = accumulator.get_result()
+    # pixel (x=2, y=1) has weight 2 in the first patch (distance 2 from the right border) and 1 in the second
+    expected = (2 * patches[(0, 0)][0, 1, 2] + patches[(2, 0)][0, 1, 0]) / 3
+    assert np.isclose(result[0, 1, 2], expected)
+    assert np.isnan(result[0, 5, 0])
+    assert not accumulator.is_complete
+
+
+def test_page_accumulator_errors(patches):
+    with pytest.raises(ValueError):
+        PageAccumulator(num_classes=3, height=6, width=7, reducer='median')
+    accumulator = PageAccumulator(num_classes=3, height=6, width=7)
+    with pytest.raises(ValueError):
+        accumulator.add_patch(patch=patches[(0, 0)], coordinates=(4, 0))
+
+
+@pytest.mark.parametrize('num_processes', [1, 2])
+def test_cropped_output_merger(cropped_predictions, tmp_path, num_processes):
+    img_paths_per_page, prediction_path = cropped_predictions
+    output_path = tmp_path / 'result'
+    merger = CroppedOutputMerger(img_paths_per_page=img_paths_per_page, prediction_path=prediction_path,
+                                 output_path=output_path, class_encodings=CLASS_ENCODINGS,
+                                 save_output_page_image=save_output_page_image, num_processes=num_processes)
+    assert merger.merge_all() == []
+
+    img_name = 'e-codices_fmb-cb-0055_0098v_max'
+    expected = None
+    for pred_path in sorted((prediction_path / img_name).iterdir()):
+        if expected is None:
+            expected = np.full((len(CLASS_ENCODINGS), 487, 649), np.nan)
+        expected = merge_patches(np.load(str(pred_path)), get_patch_coordinates(pred_path.stem), expected)
+
+    pred_img = np.array(Image.open(output_path / 'pred' / f'{img_name}.png'))
+    expected_img = np.array(Image.open(_save_expected(expected, tmp_path / 'expected', img_name)))
+    assert np.array_equal(pred_img, expected_img)
+
+    assert Image.open(output_path / 'img' / f'{img_name}.png').size == (649, 487)
+    assert Image.open(output_path / 'gt' / f'{img_name}.png').size == (649, 487)
+    assert (output_path / 'info_merge_cropped_output.txt').exists()
+
+
+def test_cropped_output_merger_worker(cropped_predictions, tmp_path):
+    img_paths_per_page, prediction_path = cropped_predictions
+    merger = CroppedOutputMerger(img_paths_per_page=img_paths_per_page, prediction_path=prediction_path,
+                                 output_path=tmp_path / 'result', class_encodings=CLASS_ENCODINGS,
+                                 save_output_page_image=save_output_page_image, num_processes=2)
+    # the processes only get the settings, the crops are sent with the page
+    worker_merger = merger._get_worker_merger()
+    assert worker_merger.crops_per_page == {}
+    assert len(merger.crops_per_page) == merger.num_pages
+    img_name = merger.img_name_list[0]
+    assert worker_merger.merge_page(img_name=img_name, crop_list=merger.crops_per_page[img_name]) == (img_name, True)
+    assert (tmp_path / 'result' / 'pred' / f'{img_name}.png').exists()
+
+
+def test_cropped_output_merger_full_page(cropped_predictions, tmp_path):
+    img_paths_per_page, prediction_path = cropped_predictions
+    output_path = tmp_path / 'result'
+    saved_pages = []
+    merger = CroppedOutputMerger(img_paths_per_page=img_paths_per_page, prediction_path=prediction_path,
+                                 output_path=output_path, class_encodings=CLASS_ENCODINGS,
+                                 save_output_page_image=save_output_page_image, num_processes=1,
+                                 full_page_path=FULL_PAGE_PATH,
+                                 on_page_saved=lambda img_name, path: saved_pages.append(img_name))
+    merger.merge_all()
+
+    img_name = 'e-codices_fmb-cb-0055_0098v_max'
+    assert saved_pages == [img_name]
+    assert (output_path / 'gt' / f'{img_name}.png').read_bytes() == \
+           (FULL_PAGE_PATH / 'gt' / f'{img_name}.png').read_bytes()
+    assert np.array_equal(np.array(Image.open(output_path / 'img' / f'{img_name}.png')),
+                          np.array(Image.open(FULL_PAGE_PATH / 'data' / f'{img_name}.jpg').convert('RGB')))
+
+
+def test_cropped_output_merger_missing_page(cropped_predictions, tmp_path):
+    img_paths_per_page, prediction_path = cropped_predictions
+    with pytest.raises(ValueError):
+        CroppedOutputMerger(img_paths_per_page=[], prediction_path=prediction_path,
+                            output_path=tmp_path / 'result', class_encodings=CLASS_ENCODINGS,
+                            save_output_page_image=save_output_page_image)
+
+
+def _save_expected(expected: np.ndarray, output_folder: Path, img_name: str) -> Path:
+    save_output_page_image(image_name=f'{img_name}.png', output_image=expected, output_folder=output_folder,
+                           class_encoding=CLASS_ENCODINGS)
+    return output_folder / f'{img_name}.png'
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from torchvision.datasets.folder import pil_loader
+from torchvision.transforms import ToTensor
+
+import src.datamodules.utils.page_store as page_store_module
+from src.datamodules.utils.misc import ImageDimensions
+from src.datamodules.utils.page_store import PageStore
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir
+
+IMAGE_DIMS = ImageDimensions(width=487, height=649)
+
+
+@pytest.fixture
+def data_paths(data_dir):
+    return sorted((data_dir / 'test' / 'data').iterdir())
+
+
+def test_page_store(data_dir, data_paths, monkeypatch):
+    store = PageStore(directory=data_dir, name='data.test', image_dims=IMAGE_DIMS, workers=1)
+    store.compile(data_paths)
+    assert store.index_path == data_dir / 'pages.data.test.json'
+    assert np.load(store.data_path, mmap_mode='r').shape == (2, 649, 487, 3)
+
+    for data_path in data_paths:
+        page = store.load(data_path)
+        expected = pil_loader(data_path)
+        assert np.array_equal(page, np.asarray(expected))
+        assert torch.equal(ToTensor()(page), ToTensor()(expected))
+
+    # a second store with the same parameters reuses the decoded pages
+    decoded = []
+    original_task = page_store_module._decode_page_task
+    monkeypatch.setattr(page_store_module, '_decode_page_task',
+                        lambda task: decoded.append(task[1]) or original_task(task))
+    store = PageStore(directory=data_dir, name='data.test', image_dims=IMAGE_DIMS, workers=1)
+    store.compile(data_paths[:1])
+    assert decoded == []
+
+    # just the changed page is decoded again
+    stat = data_paths[1].stat()
+    os.utime(data_paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    store.compile(data_paths)
+    assert decoded == [str(data_paths[1])]
+    assert np.array_equal(store.load(data_paths[0]), np.asarray(pil_loader(data_paths[0])))
+    assert len(list(data_dir.glob('pages.data.test.*.npy'))) == 1
+
+
+def test_page_store_wrong_size(data_dir, data_paths):
+    store = PageStore(directory=data_dir, name='data.test', image_dims=ImageDimensions(width=100, height=100),
+                      workers=1)
+    with pytest.raises(ValueError):
+        store.compile(data_paths)
@@ -2,7 +2,7 @@ import pytest
 import torch
 from torchvision.transforms import ToTensor
 
-from src.datamodules.utils.dataset_predict import DatasetPredict
+from src.datamodules.utils.dataset_predict import DatasetPredict, collate_pages
 from src.datamodules.utils.misc import ImageDimensions
 from tests.test_data.dummy_data_hisdb.dummy_data import data_dir
 
@@ -30,3 +30,14 @@ def test__apply_transformation(predict_dataset):
     img_tensor = predict_dataset._apply_transformation(img)
     assert torch.equal(img_tensor, predict_dataset[0][0])
     assert img_tensor.shape == torch.Size((3, 649, 487))
+
+
+def test_predict_dataset_any_size(file_path_list):
+    dataset = DatasetPredict(image_path_list=file_path_list, image_dims=None)
+    pages, indices = collate_pages([dataset[0], dataset[1]])
+    assert [page.shape for page in pages] == [torch.Size((3, 649, 487))] * 2
+    assert torch.equal(indices, torch.tensor([0, 1]))
+
+
+def test_get_image_sizes(predict_dataset):
+    assert predict_dataset.get_image_sizes() == [(649, 487)] * len(predict_dataset)
@@ -0,0 +1,92 @@
+from functools import partial
+
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+import src.datamodules.utils.shards as shards_module
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.utils.shards import write_shards, ShardDataset, iter_shard, segmentation_sample, \
+    read_shard_index
+from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
+
+
+def _get_key(record):
+    return record['key']
+
+
+@pytest.fixture
+def samples(data_dir_cropped):
+    paths = CroppedDatasetRGB.get_gt_data_paths(data_dir_cropped / 'train', data_folder_name='data',
+                                                gt_folder_name='gt')
+    return [{'data': data, 'gt': gt, 'meta': {'page': page, 'name': name}} for data, gt, page, name in paths]
+
+
+@pytest.fixture
+def index_path(samples, tmp_path):
+    return write_shards(samples, output_path=tmp_path / 'shards', name='train', layout='cropped',
+                        samples_per_shard=5)
+
+
+def test_write_shards(samples, index_path):
+    index = read_shard_index(index_path)
+    assert index['layout'] == 'cropped'
+    assert [shard['num_samples'] for shard in index['shards']] == [5, 5, 2]
+
+    records = [record for shard in index['shards'] for record in iter_shard(shard['path'])]
+    assert [record['key'] for record in records] == [f'{i:08d}' for i in range(12)]
+    for record, sample in zip(records, samples):
+        assert record['data'] == sample['data'].read_bytes()
+        assert record['gt'] == sample['gt'].read_bytes()
+        assert record['meta'] == sample['meta']
+
+
+def test_write_shards_unknown_layout(samples, tmp_path):
+    with pytest.raises(ValueError):
+        write_shards(samples, output_path=tmp_path, name='train', layout='unknown')
+
+
+def test_segmentation_sample(samples, index_path, data_dir_cropped):
+    dataset = CroppedDatasetRGB(path=data_dir_cropped / 'train', data_folder_name='data', gt_folder_name='gt')
+    shard_dataset = ShardDataset(index_path, process=segmentation_sample, shuffle=False)
+    assert len(shard_dataset) == 12
+    for (img, gt), (expected_img, expected_gt) in zip(shard_dataset, dataset):
+        assert torch.equal(img, expected_img)
+        assert torch.equal(gt, expected_gt)
+
+
+def test_shard_dataset_layouts(index_path):
+    with pytest.raises(ValueError):
+        ShardDataset(index_path, process=_get_key, layouts=('indexed',))
+
+
+def test_shard_dataset_shuffle(index_path):
+    dataset = ShardDataset(index_path, process=_get_key, buffer_size=4)
+    epoch_0 = list(dataset)
+    assert sorted(epoch_0) == [f'{i:08d}' for i in range(12)]
+    assert list(dataset) == epoch_0
+    dataset.set_epoch(1)
+    epoch_1 = list(dataset)
+    assert sorted(epoch_1) == sorted(epoch_0)
+    assert epoch_1 != epoch_0
+
+
+def test_shard_dataset_ranks(index_path, monkeypatch):
+    keys = []
+    for rank in range(2):
+        monkeypatch.setattr(shards_module, '_get_rank_and_world_size', partial(lambda r: (r, 2), rank))
+        dataset = ShardDataset(index_path, process=_get_key, batch_size=2)
+        keys.append(list(dataset))
+        assert len(dataset) == len(keys[rank])
+    # the shards of 5 and 2 samples are balanced against the other shard of 5 samples
+    assert len(keys[0]) == len(keys[1]) == 4
+    assert not set(keys[0]) & set(keys[1])
+
+
+def test_shard_dataset_workers(index_path):
+    dataset = ShardDataset(index_path, process=_get_key, shuffle=False, batch_size=2, num_workers=2)
+    batches = list(DataLoader(dataset, batch_size=2, num_workers=2))
+    keys = [key for batch in batches for key in batch]
+    # every worker yields full batches of its own shards
+    assert len(batches) == len(dataset) // 2
+    assert len(keys) == len(set(keys)) == len(dataset) == 10
@@ -0,0 +1,46 @@
+import pytest
+import torch
+
+from src.datamodules.utils.size_buckets import SizeBucketBatchSampler, collate_padded, get_padded_size
+
+SIZES = [(100, 60), (98, 64), (50, 50), (100, 61), (49, 52), (200, 100), (99, 57)]
+
+
+def test_get_padded_size():
+    assert get_padded_size((100, 60), stride=8) == (104, 64)
+    assert get_padded_size((100, 60), stride=1) == (100, 60)
+
+
+def test_size_bucket_batch_sampler():
+    sampler = SizeBucketBatchSampler(range(len(SIZES)), batch_size=2, drop_last=False, sizes=SIZES, stride=8)
+    batches = list(sampler)
+    assert len(sampler) == len(batches)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(SIZES)))
+    # the full batches contain pages of the same padded size, the leftovers are sorted by size
+    assert batches == [[2, 4], [0, 1], [3, 6], [5]]
+
+
+def test_size_bucket_batch_sampler_drop_last():
+    sampler = SizeBucketBatchSampler(range(len(SIZES)), batch_size=2, drop_last=True, sizes=SIZES, stride=8)
+    assert list(sampler) == [[2, 4], [0, 1], [3, 6]]
+
+
+def test_size_bucket_batch_sampler_subset():
+    # e.g. the indices of one process of a distributed sampler
+    sampler = SizeBucketBatchSampler([0, 2, 4, 6], batch_size=2, drop_last=False, sizes=SIZES, stride=8)
+    assert list(sampler) == [[2, 4], [0, 6]]
+
+
+def test_size_bucket_batch_sampler_invalid_stride():
+    with pytest.raises(ValueError):
+        SizeBucketBatchSampler(range(len(SIZES)), batch_size=2, drop_last=False, sizes=SIZES, stride=0)
+
+
+def test_collate_padded():
+    pages = [torch.rand(3, 20, 15), torch.rand(3, 17, 18)]
+    padded, indices, sizes = collate_padded([(pages[0], 4), (pages[1], 7)], stride=8)
+    assert padded.shape == (2, 3, 24, 24)
+    assert torch.equal(padded[0, :, :20, :15], pages[0])
+    assert padded[0, :, 20:].abs().sum() == 0
+    assert torch.equal(indices, torch.tensor([4, 7]))
+    assert torch.equal(sizes, torch.tensor([[20, 15], [17, 18]]))
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import src.datamodules.utils.staging as staging_module
+from src.datamodules.utils.staging import stage_directory
+
+
+@pytest.fixture(autouse=True)
+def in_use(monkeypatch):
+    # every test is a run of its own, the locks are released at the end of the test
+    locks = {}
+    monkeypatch.setattr(staging_module, '_IN_USE', locks)
+    yield locks
+    for fd in locks.values():
+        os.close(fd)
+
+
+@pytest.fixture
+def copied(monkeypatch):
+    copied = []
+    original_copy_file = staging_module._copy_file
+    monkeypatch.setattr(staging_module, '_copy_file',
+                        lambda source, target: copied.append(source.name) or original_copy_file(source, target))
+    return copied
+
+
+def _create_dataset(path, size=10):
+    for split in ['train', 'val']:
+        (path / split / 'data').mkdir(parents=True)
+        (path / split / 'data' / 'a.png').write_bytes(b'a' * size)
+        (path / split / 'data' / 'b.png').write_bytes(b'b' * size)
+    (path / '.analytics.lock').touch()
+    return path
+
+
+def test_stage_directory(tmp_path, copied):
+    source = _create_dataset(tmp_path / 'dataset')
+    target = stage_directory(source, scratch_dir=tmp_path / 'scratch')
+    assert target.parent == tmp_path / 'scratch'
+    assert sorted(p.relative_to(target).as_posix() for p in target.rglob('*') if p.is_file()) == \
+           ['train/data/a.png', 'train/data/b.png', 'val/data/a.png', 'val/data/b.png']
+    assert (target / 'train' / 'data' / 'a.png').read_bytes() == b'a' * 10
+    assert len(copied) == 4
+
+    # a second run reads the copy
+    copied.clear()
+    (target / 'analytics.json').write_text('{}')
+    assert stage_directory(source, scratch_dir=tmp_path / 'scratch') == target
+    assert copied == []
+
+    # changed files are copied again, removed files are removed, the files of the datamodules are kept
+    (source / 'train' / 'data' / 'a.png').write_bytes(b'c' * 12)
+    (source / 'val' / 'data' / 'b.png').unlink()
+    assert stage_directory(source, scratch_dir=tmp_path / 'scratch') == target
+    assert copied == ['a.png']
+    assert (target / 'train' / 'data' / 'a.png').read_bytes() == b'c' * 12
+    assert not (target / 'val' / 'data' / 'b.png').exists()
+    assert (target / 'analytics.json').exists()
+
+
+def test_stage_directory_budget(tmp_path, in_use):
+    scratch_dir = tmp_path / 'scratch'
+    source_1 = _create_dataset(tmp_path / 'dataset_1')
+    source_2 = _create_dataset(tmp_path / 'dataset_2')
+    target_1 = stage_directory(source_1, scratch_dir=scratch_dir, budget_bytes=50)
+
+    # the first copy is in use, so the second dataset does not fit
+    assert stage_directory(source_2, scratch_dir=scratch_dir, budget_bytes=50) == source_2.resolve()
+    assert target_1.exists()
+
+    # after the first run ended, the least recently used copy is removed
+    for fd in in_use.values():
+        os.close(fd)
+    in_use.clear()
+    target_2 = stage_directory(source_2, scratch_dir=scratch_dir, budget_bytes=50)
+    assert target_2.parent == scratch_dir
+    assert not target_1.exists()
+
+    # a dataset larger than the budget is read from the source
+    assert stage_directory(source_1, scratch_dir=scratch_dir, budget_bytes=10) == source_1.resolve()
+
+
+def test_stage_directory_budget_counts_caches(tmp_path, in_use):
+    scratch_dir = tmp_path / 'scratch'
+    source_1 = _create_dataset(tmp_path / 'dataset_1')
+    source_2 = _create_dataset(tmp_path / 'dataset_2')
+    target_1 = stage_directory(source_1, scratch_dir=scratch_dir, budget_bytes=100)
+    # a cache the datamodule writes into the copy
+    (target_1 / 'pages.data.train.npy').write_bytes(b'p' * 50)
+    for fd in in_use.values():
+        os.close(fd)
+    in_use.clear()
+
+    # the copy with its cache (90 bytes) and the second dataset (40 bytes) do not fit together
+    target_2 = stage_directory(source_2, scratch_dir=scratch_dir, budget_bytes=100)
+    assert target_2.parent == scratch_dir
+    assert not target_1.exists()
+
+
+def test_stage_directory_without_fcntl(tmp_path, in_use, monkeypatch):
+    monkeypatch.setattr(staging_module, 'fcntl', None)
+    scratch_dir = tmp_path / 'scratch'
+    target_1 = stage_directory(_create_dataset(tmp_path / 'dataset_1'), scratch_dir=scratch_dir, budget_bytes=50)
+    assert in_use == {}
+    # without the in use locks no copy is removed
+    source_2 = _create_dataset(tmp_path / 'dataset_2')
+    assert stage_directory(source_2, scratch_dir=scratch_dir, budget_bytes=50) == source_2.resolve()
+    assert target_1.exists()
@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 import torch
 
 from src.metrics.divahisdb import HisDBIoU
@@ -85,6 +86,45 @@ def test__fast_hist():
     assert torch.equal(expected_result, output)
 
 
+def test__fast_hist_ignore_index():
+    label_preds, label_trues, num_classes, _ = _get_test_data(identical=False)
+    output = HisDBIoU._fast_hist(label_trues, label_preds, num_classes, ignore_index=0)
+    expected_result = torch.tensor([[0, 0], [2, 4]])
+    assert torch.equal(expected_result, output)
+
+
+def test_iou_ignore_index():
+    label_preds, label_trues, num_classes, mask = _get_test_data(with_boundary=False, identical=False)
+    metric = HisDBIoU(num_classes=num_classes, ignore_index=1)
+    metric.update(pred=label_preds, target=label_trues, mask=mask)
+
+    # just the background pixels are counted, the two text pixels predicted as background are ignored
+    assert torch.equal(metric.tps, torch.tensor([12, 0]))
+    assert torch.equal(metric.total, torch.tensor([12, 0]))
+    assert metric.compute() == torch.tensor(1.)
+
+
+def test_iou_different_sizes():
+    label_preds, label_trues, num_classes, mask = _get_test_data(with_boundary=True, identical=False)
+    metric_batch = HisDBIoU(num_classes=num_classes)
+    metric_batch.update(pred=label_preds, target=label_trues, mask=mask)
+
+    metric_list = HisDBIoU(num_classes=num_classes)
+    metric_list.update(pred=[label_preds[0], label_preds[1:, 1:]], target=[label_trues[0], label_trues[1:, 1:]],
+                       mask=[mask[0], mask[1:, 1:]])
+    metric_list.update(pred=label_preds[1:, :1], target=label_trues[1:, :1], mask=mask[1:, :1])
+
+    assert metric_list.tps.dtype == torch.long
+    assert torch.equal(metric_batch.tps, metric_list.tps)
+    assert torch.equal(metric_batch.total, metric_list.total)
+    assert torch.isclose(metric_list.compute(), torch.tensor((12 / 13 + 5 / 6) / 2))
+
+
+def test_iou_no_num_classes():
+    with pytest.raises(ValueError):
+        HisDBIoU()
+
+
 def _get_test_data(with_boundary=True, identical=True):
     """
     Produces test data in the format [Batch size x W x H], where batch size is 2, W=3 and H=3.
@@ -0,0 +1,109 @@
+import copy
+import pickle
+
+import pytest
+import torch
+from torchmetrics import MetricCollection, MeanSquaredError
+from torchmetrics.classification import MulticlassAccuracy, MulticlassPrecision, MulticlassRecall, \
+    MulticlassF1Score, MulticlassJaccardIndex
+
+from src.metrics.confusion_matrix import ConfusionMatrixMetrics, get_confusion_matrix, share_confusion_matrix
+from src.metrics.divahisdb import HisDBIoU
+from tests.metrics.test_accuracy import _get_test_data
+
+NUM_CLASSES = 4
+METRIC_TYPES = [MulticlassAccuracy, MulticlassPrecision, MulticlassRecall, MulticlassF1Score, MulticlassJaccardIndex]
+
+
+def _get_batches(num_batches: int = 3):
+    generator = torch.Generator().manual_seed(0)
+    batches = []
+    for _ in range(num_batches):
+        target = torch.randint(0, NUM_CLASSES, (2, 8, 8), generator=generator)
+        # class 3 is never predicted
+        preds = torch.randn(2, NUM_CLASSES, 8, 8, generator=generator)
+        preds[:, 3] = -10
+        mask = torch.rand(2, 8, 8, generator=generator) > 0.7
+        batches.append((preds, target, mask))
+    return batches
+
+
+def test_get_confusion_matrix():
+    label_preds, label_trues, num_classes, _ = _get_test_data(identical=False)
+    confmat = get_confusion_matrix(preds=label_preds, target=label_trues, num_classes=num_classes)
+    assert torch.equal(confmat, torch.tensor([[12, 0], [2, 4]]))
+
+
+def test_get_confusion_matrix_ignore_index():
+    label_preds, label_trues, num_classes, _ = _get_test_data(identical=False)
+    confmat = get_confusion_matrix(preds=label_preds, target=label_trues, num_classes=num_classes, ignore_index=1)
+    assert torch.equal(confmat, torch.tensor([[12, 0], [0, 0]]))
+
+
+@pytest.mark.parametrize('metric_type', METRIC_TYPES)
+@pytest.mark.parametrize('average', ['micro', 'macro', 'weighted', 'none'])
+def test_same_as_torchmetrics(metric_type, average):
+    metrics = {'reference': metric_type(num_classes=NUM_CLASSES, average=average)}
+    shared = share_confusion_matrix({'shared': metric_type(num_classes=NUM_CLASSES, average=average)})
+    assert isinstance(shared['confusion_matrix_metrics'], ConfusionMatrixMetrics)
+
+    for preds, target, _ in _get_batches():
+        step_value = shared['confusion_matrix_metrics'](preds, target)['shared']
+        assert torch.allclose(step_value, metrics['reference'](preds, target))
+    assert torch.allclose(shared['confusion_matrix_metrics'].compute()['shared'], metrics['reference'].compute())
+
+
+@pytest.mark.parametrize('mask_modifies_prediction', [True, False])
+def test_same_as_hisdb_iou(mask_modifies_prediction):
+    reference = HisDBIoU(num_classes=NUM_CLASSES, mask_modifies_prediction=mask_modifies_prediction)
+    shared = share_confusion_matrix({'hisdb_miou': HisDBIoU(num_classes=NUM_CLASSES,
+                                                           mask_modifies_prediction=mask_modifies_prediction)})
+    metric = shared['confusion_matrix_metrics']
+
+    for preds, target, mask in _get_batches():
+        preds = preds.argmax(dim=1)
+        metric.update(preds, target, mask=mask)
+        reference.update(preds, target, mask=mask)
+    assert torch.isclose(metric.compute()['hisdb_miou'], reference.compute())
+
+
+def test_hisdb_iou_boundary():
+    label_preds, label_trues, num_classes, mask = _get_test_data(with_boundary=True, identical=False)
+    metric = share_confusion_matrix({'hisdb_miou': HisDBIoU(num_classes=num_classes)})['confusion_matrix_metrics']
+    metric.update(label_preds, label_trues, mask=mask)
+    assert torch.isclose(metric.compute()['hisdb_miou'], torch.tensor((12 / 13 + 5 / 6) / 2))
+
+
+def test_share_confusion_matrix():
+    metrics = share_confusion_matrix({
+        'accuracy': MulticlassAccuracy(num_classes=NUM_CLASSES, average='micro'),
+        'jaccard_index': MulticlassJaccardIndex(num_classes=NUM_CLASSES),
+        'hisdb_miou': HisDBIoU(num_classes=NUM_CLASSES),
+        'precision_other': MulticlassPrecision(num_classes=NUM_CLASSES + 1),
+        'recall_top_2': MulticlassRecall(num_classes=NUM_CLASSES, top_k=2),
+        'mse': MeanSquaredError(),
+    })
+    assert set(metrics.keys()) == {'recall_top_2', 'mse', 'confusion_matrix_metrics', 'confusion_matrix_metrics_1'}
+    assert metrics['confusion_matrix_metrics'].metric_names == ('accuracy', 'jaccard_index', 'hisdb_miou')
+    assert metrics['confusion_matrix_metrics_1'].metric_names == ('precision_other',)
+    assert metrics['confusion_matrix_metrics_1'].num_classes == NUM_CLASSES + 1
+
+
+def test_metric_collection():
+    collection = MetricCollection(share_confusion_matrix({
+        'accuracy': MulticlassAccuracy(num_classes=NUM_CLASSES, average='micro'),
+        'jaccard_index': MulticlassJaccardIndex(num_classes=NUM_CLASSES),
+    }))
+    preds, target, _ = _get_batches(num_batches=1)[0]
+    values = collection(preds, target)
+    assert set(values.keys()) == {'accuracy', 'jaccard_index'}
+    assert torch.isclose(values['accuracy'], (preds.argmax(dim=1) == target).float().mean())
+
+
+def test_copy_and_pickle():
+    metric = share_confusion_matrix({'f1': MulticlassF1Score(num_classes=NUM_CLASSES)})['confusion_matrix_metrics']
+    preds, target, _ = _get_batches(num_batches=1)[0]
+    metric.update(preds, target)
+    for other in [copy.deepcopy(metric), pickle.loads(pickle.dumps(metric))]:
+        assert torch.equal(other.confmat, metric.confmat)
+        assert torch.equal(other.compute()['f1'], metric.compute()['f1'])
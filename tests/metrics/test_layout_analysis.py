@@ -0,0 +1,107 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from src.metrics.divahisdb import HisDBIoU
+from src.metrics.layout_analysis import get_layout_confusion_matrix, LayoutAnalysisScores, evaluate_page
+
+GT_PATH = Path(__file__).parents[1] / 'test_data' / 'dummy_data_hisdb' / 'dummy_dataset' / 'test' / 'gt' / \
+          'e-codices_fmb-cb-0055_0098v_max.png'
+CLASS_ENCODINGS = [1, 2, 4, 8]
+
+
+@pytest.fixture
+def gt():
+    return np.asarray(Image.open(GT_PATH).convert('RGB'))
+
+
+def _to_img(blue: np.ndarray, red: np.ndarray = None) -> np.ndarray:
+    img = np.zeros((*blue.shape, 3), dtype=np.uint8)
+    img[:, :, 2] = blue
+    if red is not None:
+        img[:, :, 0] = red
+    return img
+
+
+def test_identical(gt):
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=gt))
+    assert scores.exact_match == 1.
+    assert scores.hamming_score == 1.
+    assert scores.mean_iu == 1.
+    assert np.all(scores.iu == 1.)
+    assert np.all(scores.f1 == 1.)
+    assert np.isclose(scores.freq.sum(), 1.)
+
+
+def test_boundary_predicted_as_background(gt):
+    prediction = gt.copy()
+    prediction[gt[:, :, 0] != 0] = [0, 0, 1]
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=prediction))
+    assert scores.mean_iu == 1.
+
+    # the boundary rule does not apply to non background predictions
+    prediction[gt[:, :, 0] != 0] = [0, 0, 2]
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=prediction))
+    assert scores.mean_iu < 1.
+
+
+def test_multi_label():
+    gt = _to_img(np.array([[1, 1, 10, 10],
+                           [2, 8, 8, 8]]))
+    prediction = _to_img(np.array([[1, 2, 8, 10],
+                                   [2, 8, 8, 1]]))
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=prediction))
+
+    assert scores.exact_match == 5 / 8
+    # the pixel (10 -> 8) has a hamming score of 1/2, (1 -> 2) and (8 -> 1) of 0
+    assert scores.hamming_score == 5.5 / 8
+    # background: tp 1, fp 1, fn 1 | comment: tp 2, fp 1, fn 1 | decoration: no pixels | main text: tp 4, fp 0, fn 1
+    assert np.allclose(scores.iu, [1 / 3, 2 / 4, np.nan, 4 / 5], equal_nan=True)
+    assert np.allclose(scores.precision, [1 / 2, 2 / 3, np.nan, 1.], equal_nan=True)
+    assert np.allclose(scores.recall, [1 / 2, 2 / 3, np.nan, 4 / 5], equal_nan=True)
+    assert np.allclose(scores.f1, [2 / 4, 4 / 6, np.nan, 8 / 9], equal_nan=True)
+    assert np.allclose(scores.freq, [2 / 10, 3 / 10, 0, 5 / 10])
+    assert np.isclose(scores.mean_iu, (1 / 3 + 2 / 4 + 4 / 5) / 3)
+
+
+def test_same_as_hisdb_iou(gt):
+    rng = np.random.default_rng(0)
+    prediction = gt.copy()
+    prediction[:, :, 0] = 0
+    prediction[rng.random(gt.shape[:2]) < 0.2, 2] = 1
+    prediction[100:200, 100:300, 2] = 8
+
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=prediction))
+
+    lut = np.zeros(256, dtype=np.int64)
+    lut[CLASS_ENCODINGS] = np.arange(len(CLASS_ENCODINGS))
+    metric = HisDBIoU(num_classes=len(CLASS_ENCODINGS))
+    metric.update(pred=torch.from_numpy(lut[prediction[:, :, 2]])[None],
+                  target=torch.from_numpy(lut[gt[:, :, 2]])[None],
+                  mask=torch.from_numpy(gt[:, :, 0] != 0)[None])
+    assert np.isclose(scores.mean_iu, metric.compute().item())
+
+
+def test_to_stats_string(gt):
+    scores = LayoutAnalysisScores.from_confusion_matrix(get_layout_confusion_matrix(gt=gt, prediction=gt))
+    stats = scores.to_stats_string()
+    assert re.fullmatch(r'EM=\d\.\d\d HS=\d\.\d\d( (IU|F1|P|R)=\d\.\d\d,\d\.\d\d\[(\d\.\d\d\|){3}\d\.\d\d\]){4} '
+                        r'Freq:\[(\d\.\d\d\|){3}\d\.\d\d\]', stats)
+    assert stats.startswith('EM=1.00 HS=1.00 IU=1.00,1.00[1.00|1.00|1.00|1.00]')
+
+
+def test_evaluate_page(tmp_path, gt):
+    prediction = gt.copy()
+    prediction[:, :, 0] = 0
+    Image.fromarray(prediction).save(tmp_path / 'pred.png')
+    scores = evaluate_page(gt_path=GT_PATH, prediction_path=tmp_path / 'pred.png')
+    assert scores.mean_iu == 1.
+
+
+def test_size_mismatch(gt):
+    with pytest.raises(ValueError):
+        get_layout_confusion_matrix(gt=gt, prediction=gt[1:])
@@ -0,0 +1,43 @@
+import pytest
+import torch
+from torch import nn
+
+from src.models.backbones.adaptive_unet import Adaptive_Unet
+from src.models.backbones.unet import UNet
+from src.models.receptive_field import get_receptive_field, ReceptiveField
+
+
+def test_get_receptive_field_conv():
+    model = nn.Sequential(nn.Conv2d(3, 4, kernel_size=3, padding=1), nn.MaxPool2d(kernel_size=2),
+                          nn.Conv2d(4, 4, kernel_size=3, padding=2, dilation=2))
+    # 1 row of the first conv, 1 of the pooling and 2 rows at the half resolution of the second conv
+    assert get_receptive_field(model) == ReceptiveField(radius=6, alignment=2)
+    assert ReceptiveField(radius=6, alignment=4).halo == 8
+
+
+def test_get_receptive_field_unet():
+    model = UNet(num_layers=3, features_start=8)
+    model.train()
+    running_mean = model.layers[0].net[1].running_mean.clone()
+    receptive_field = get_receptive_field(model)
+    assert receptive_field.alignment == 4
+    assert receptive_field.radius > 0
+    # the probe does not change the model
+    assert model.training
+    assert torch.equal(model.layers[0].net[1].running_mean, running_mean)
+
+
+def test_get_receptive_field_adaptive_unet():
+    assert get_receptive_field(Adaptive_Unet(features=[4, 8, 16, 32])).alignment == 16
+
+
+@pytest.mark.parametrize('model', [UNet(num_layers=2, features_start=8, bilinear=True),
+                                   nn.Sequential(nn.Conv2d(3, 4, kernel_size=3), nn.AdaptiveAvgPool2d(1))])
+def test_get_receptive_field_not_local(model):
+    with pytest.raises(ValueError):
+        get_receptive_field(model, probe_size=64)
+
+
+def test_get_receptive_field_probe_size():
+    with pytest.raises(ValueError):
+        get_receptive_field(UNet(num_layers=3, features_start=8), probe_size=30)
@@ -126,7 +126,36 @@ def test_test_step(monkeypatch, datamodule_and_dir, task, capsys, tmp_path):
     img, gt, mask, idx = data_module_cropped.test[0]
     idx_tensor = torch.as_tensor([idx])
     task.test_step(batch=(img[None, :], gt[None, :], mask[None, :], idx_tensor), batch_idx=0)
+    task.output_writer.flush()
     assert 'test/crossentropyloss 1.4' in capsys.readouterr().out
     assert (tmp_path / 'patches').exists()
     assert (tmp_path / 'patches' / 'e-codices_fmb-cb-0055_0098v_max').exists()
     assert len(list((tmp_path / 'patches' / 'e-codices_fmb-cb-0055_0098v_max').iterdir())) == 1
+
+
+def test_test_step_merge_patches(monkeypatch, datamodule_and_dir, model_backbone, model_header, tmp_path):
+    data_module_cropped, data_dir_cropped = datamodule_and_dir
+    task = SemanticSegmentationCroppedHisDB(model=BackboneHeaderModel(backbone=model_backbone, header=model_header),
+                                            optimizer=torch.optim.Adam(params=model_backbone.parameters()),
+                                            loss_fn=torch.nn.CrossEntropyLoss(),
+                                            test_output_path=tmp_path,
+                                            merge_test_patches=True)
+    trainer = Trainer()
+    monkeypatch.setattr(data_module_cropped, 'trainer', trainer)
+    task.trainer = trainer
+    monkeypatch.setattr(trainer, 'datamodule', data_module_cropped)
+    monkeypatch.setattr(task, 'log', fake_log)
+    data_module_cropped.setup('test')
+
+    task.on_test_start()
+    dataset = data_module_cropped.test
+    page_name = dataset.img_paths_per_page[0][2]
+    page_indices = [i for i, info in enumerate(dataset.img_paths_per_page) if info[2] == page_name]
+    for idx in page_indices:
+        img, gt, mask, _ = dataset[idx]
+        task.test_step(batch=(img[None, :], gt[None, :], mask[None, :], torch.as_tensor([idx])), batch_idx=idx)
+    task.on_test_end()
+
+    assert not (tmp_path / 'patches').exists()
+    assert (tmp_path / 'result' / 'pred' / f'{page_name}.png').exists()
+    assert len(list((tmp_path / 'result' / 'pred').iterdir())) == 1
@@ -14,6 +14,7 @@ from tests.datamodules.RolfFormat.datasets.test_full_page_dataset import _get_da
 from src.datamodules.RolfFormat.datamodule import DataModuleRolfFormat
 from src.tasks.RGB.semantic_segmentation import SemanticSegmentationRGB
 from src.tasks.utils.outputs import OutputKeys
+from src.tasks.utils.tiled_inference import SlidingWindowInference
 from tests.tasks.test_base_task import fake_log
 from tests.test_data.dummy_data_rolf.dummy_data import data_dir
 
@@ -132,6 +133,7 @@ def test_test_step(monkeypatch, datamodule_and_dir, task, capsys, tmp_path):
     img, gt, idx = data_module.test[0]
     idx_tensor = torch.as_tensor([idx])
     task.test_step(batch=(img[None, :], gt[None, :], idx_tensor), batch_idx=0)
+    task.output_writer.flush()
     assert 'test/crossentropyloss 1.8' in capsys.readouterr().out
     assert (tmp_path / 'pred').exists()
     assert (tmp_path / 'pred' / 'D1-LC-Car-folio-1000.gif').exists()
@@ -156,9 +158,54 @@ def test_predict_step(monkeypatch, datamodule_and_dir, task, capsys, tmp_path):
     img, idx = data_module.predict[0]
     idx_tensor = torch.as_tensor([idx])
     task.predict_step(batch=(img[None, :], idx_tensor), batch_idx=0)
+    task.output_writer.flush()
     assert (tmp_path / 'pred').exists()
     assert (tmp_path / 'pred' / 'D1-LC-Car-folio-1001.gif').exists()
     assert len(list((tmp_path / 'pred').iterdir())) == 1
     assert (tmp_path / 'pred_raw').exists()
     assert (tmp_path / 'pred_raw' / 'D1-LC-Car-folio-1001.npy').exists()
     assert len(list((tmp_path / 'pred_raw').iterdir())) == 1
+
+
+def test_predict_step_sliding_window(monkeypatch, data_dir, task, tmp_path):
+    specs_train = _get_dataspecs(data_root=data_dir, train=True).__dict__
+    del specs_train['data_root']
+    OmegaConf.clear_resolvers()
+    data_module = DataModuleRolfFormat(data_dir, train_specs={'a': specs_train}, num_workers=0,
+                                       pred_file_path_list=[str(data_dir / 'codex' / 'D1-LC-Car-folio-1001.jpg')],
+                                       predict_any_size=True)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    task.trainer = trainer
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    monkeypatch.setattr(task, 'predict_output_path', tmp_path)
+    monkeypatch.setattr(task, 'sliding_window', SlidingWindowInference(window_size=32, batch_size=4))
+    data_module.setup('predict')
+
+    batch = next(iter(data_module.predict_dataloader()))
+    assert isinstance(batch[0], list)
+    task.predict_step(batch=batch, batch_idx=0)
+    task.output_writer.flush()
+    pred_raw = np.load(tmp_path / 'pred_raw' / 'D1-LC-Car-folio-1001.npy')
+    assert pred_raw.shape == (6, *batch[0][0].shape[1:])
+    assert (tmp_path / 'pred' / 'D1-LC-Car-folio-1001.gif').exists()
+
+
+def test_predict_step_size_buckets(monkeypatch, data_dir, task, tmp_path):
+    specs_train = _get_dataspecs(data_root=data_dir, train=True).__dict__
+    del specs_train['data_root']
+    OmegaConf.clear_resolvers()
+    data_module = DataModuleRolfFormat(data_dir, train_specs={'a': specs_train}, num_workers=0,
+                                       pred_file_path_list=[str(data_dir / 'codex' / 'D1-LC-Car-folio-1001.jpg')],
+                                       predict_bucket_stride=8)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    task.trainer = trainer
+    monkeypatch.setattr(trainer, 'datamodule', data_module)
+    monkeypatch.setattr(task, 'predict_output_path', tmp_path)
+    data_module.setup('predict')
+
+    pages, indices, sizes = next(iter(data_module.predict_dataloader()))
+    assert pages.shape[-2] % 8 == 0 and pages.shape[-1] % 8 == 0
+    task.predict_step(batch=(pages, indices, sizes), batch_idx=0)
+    task.output_writer.flush()
+    pred_raw = np.load(tmp_path / 'pred_raw' / 'D1-LC-Car-folio-1001.npy')
+    assert pred_raw.shape == (6, *sizes[0].tolist())
@@ -11,11 +11,14 @@ from torch.nn import Identity, CrossEntropyLoss
 from torchmetrics import MetricCollection
 from torchmetrics.classification import MulticlassPrecision
 
+from src.metrics.confusion_matrix import share_confusion_matrix
+from src.metrics.divahisdb import HisDBIoU
 from src.models.backbone_header_model import BackboneHeaderModel
 from src.models.backbones.unet import UNet
 from src.models.headers.unet import UNetFCNHead
 from src.tasks.base_task import AbstractTask
 from src.tasks.utils.outputs import OutputKeys
+from src.tasks.utils.tiled_inference import SlidingWindowInference, StripInference, CascadeInference
 from tests.test_data.dummy_data_hisdb.dummy_data import data_dir_cropped
 from tests.datamodules.DivaHisDB.test_hisDBDataModule import data_module_cropped_hisdb
 
@@ -158,6 +161,24 @@ def test_step(monkeypatch, data_module_cropped_hisdb, model_backbone, model_head
     assert output[OutputKeys.PREDICTION].shape == torch.Size([1, 4, 256, 256])
 
 
+def test_step_shared_confusion_matrix(monkeypatch, data_module_cropped_hisdb, model_backbone, model_header):
+    metric = MetricCollection(share_confusion_matrix({'precision': MulticlassPrecision(num_classes=4),
+                                                      'hisdb_miou': HisDBIoU(num_classes=4)}))
+    task = AbstractTask(model=BackboneHeaderModel(backbone=model_backbone, header=model_header),
+                        loss_fn=CrossEntropyLoss(), metric_train=metric)
+    trainer = Trainer(accelerator='cpu', strategy='ddp')
+    monkeypatch.setattr(data_module_cropped_hisdb, 'trainer', trainer)
+    task.trainer = trainer
+    monkeypatch.setattr(trainer, 'datamodule', data_module_cropped_hisdb)
+    monkeypatch.setattr(trainer, 'state', TrainerState(stage=RunningStage.TRAINING))
+    data_module_cropped_hisdb.setup('fit')
+
+    img, gt, mask = data_module_cropped_hisdb.train[0]
+    output = task.step(batch=(img[None, :], gt[None, :]), metric_kwargs={'hisdb_miou': {'mask': mask[None, :]}})
+    assert set(output[OutputKeys.LOG].keys()) == {'precision', 'hisdb_miou', 'crossentropyloss'}
+    assert metric['confusion_matrix_metrics'].confmat.sum() == 256 * 256
+
+
 def test__create_conf_mat_test_error(monkeypatch, data_module_cropped_hisdb, model_backbone, model_header, tmp_path):
     # setup
     task = AbstractTask(model=BackboneHeaderModel(backbone=model_backbone, header=model_header),
@@ -339,3 +360,39 @@ def test_predict_step(monkeypatch, model_backbone, model_header, data_module_cro
 
 def fake_log(name, value, on_epoch=True, on_step=True, sync_dist=True, rank_zero_only=True):
     print(name, value.item())
+
+
+def test_predict_step_strip_inference():
+    model = BackboneHeaderModel(backbone=UNet(num_layers=2, features_start=8),
+                                header=UNetFCNHead(num_classes=4, features=8))
+    pages = torch.rand(2, 3, 70, 40)
+    task = AbstractTask(model=model, strip_inference=StripInference(strip_height=16))
+    task.eval()
+    with torch.no_grad():
+        strips = task.predict_step(batch=pages, batch_idx=0)[OutputKeys.PREDICTION]
+        task.strip_inference = None
+        full_page = task.predict_step(batch=pages, batch_idx=0)[OutputKeys.PREDICTION]
+    assert torch.allclose(torch.stack(strips), full_page, atol=1e-5)
+
+
+def test_predict_step_cascade_inference():
+    model = BackboneHeaderModel(backbone=UNet(num_layers=2, features_start=8),
+                                header=UNetFCNHead(num_classes=4, features=8))
+    pages = [torch.rand(3, 70, 40), torch.rand(3, 32, 48)]
+    task = AbstractTask(model=model, cascade_inference=CascadeInference(window_size=32, margin_threshold=1.))
+    task.eval()
+    task.on_predict_epoch_start()
+    with torch.no_grad():
+        cascade = task.predict_step(batch=pages, batch_idx=0)[OutputKeys.PREDICTION]
+    # every pixel is uncertain, so all windows are refined at full resolution
+    expected = SlidingWindowInference(window_size=32)(task, pages)
+    for output, page_expected in zip(cascade, expected):
+        assert torch.allclose(output, page_expected, atol=1e-5)
+    assert task.cascade_inference.refine_ratio == 1
+
+
+@pytest.mark.parametrize('inference', [{'strip_inference': StripInference()},
+                                       {'cascade_inference': CascadeInference(window_size=16)}])
+def test_init_multiple_inference_modes(inference):
+    with pytest.raises(ValueError):
+        AbstractTask(sliding_window=SlidingWindowInference(window_size=16), **inference)
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import torch
 
@@ -32,3 +33,24 @@ def test_gt_to_one_hot_crash(get_input_tensor):
     with pytest.raises(KeyError):
         gt_to_one_hot(get_input_tensor, class_encodings)
 
+
+
+def test_gt_to_one_hot_same_as_dict_lookup():
+    class_encodings = [1, 2, 4, 8]
+    blue = torch.tensor(class_encodings + [0])[torch.randint(0, 5, size=(32, 48))]
+    red = torch.zeros(32, 48, dtype=torch.long)
+    red[0, :] = 128
+    matrix = torch.stack([red, torch.zeros_like(red), blue]).float() / 255
+
+    im_np = blue.numpy().astype(np.uint8)
+    im_np[red.numpy() != 0] = 1
+    im_np[im_np == 0] = 1
+    eye = np.eye(len(class_encodings), dtype=np.uint8)
+    replace_dict = {k: v for k, v in zip(class_encodings, eye)}
+    expected = np.asanyarray([[replace_dict[im_np[i, j]] for j in range(im_np.shape[1])]
+                              for i in range(im_np.shape[0])])
+    expected = torch.LongTensor(expected.transpose((2, 0, 1)))
+
+    result = gt_to_one_hot(matrix, class_encodings)
+    assert result.dtype == torch.long
+    assert torch.equal(result, expected)
@@ -1,6 +1,11 @@
+import pickle
+import threading
+
+import numpy as np
 import pytest
 
-from src.tasks.utils.outputs import OutputKeys, reduce_dict
+from src.datamodules.utils.output_tools import merge_patches
+from src.tasks.utils.outputs import OutputKeys, reduce_dict, OutputWriter, save_numpy_file, PatchMerger
 
 
 @pytest.fixture
@@ -43,3 +48,83 @@ def test_reduce_dict_empty_list(get_dict):
     assert OutputKeys.TARGET not in result
     assert OutputKeys.LOSS not in result
     assert OutputKeys.LOG not in result
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_output_writer(tmp_path, num_workers):
+    writer = OutputWriter(num_workers=num_workers, max_pending=2)
+    for i in range(10):
+        writer.submit(save_numpy_file, dest_filename=tmp_path / 'sub' / f'{i}.npy', arr=np.full(3, i))
+    writer.close()
+    assert len(list((tmp_path / 'sub').iterdir())) == 10
+    assert np.array_equal(np.load(str(tmp_path / 'sub' / '7.npy')), [7, 7, 7])
+
+
+def test_output_writer_error_propagation():
+    def fail():
+        raise IOError('disk full')
+
+    writer = OutputWriter(num_workers=1)
+    writer.submit(fail)
+    with pytest.raises(IOError):
+        writer.flush()
+    # the error is only raised once
+    writer.flush()
+    writer.close()
+
+
+def test_output_writer_backpressure():
+    release = threading.Event()
+    writer = OutputWriter(num_workers=1, max_pending=1)
+    writer.submit(release.wait)
+    blocked = threading.Thread(target=writer.submit, args=(lambda: None,))
+    blocked.start()
+    blocked.join(timeout=0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(timeout=5)
+    assert not blocked.is_alive()
+    writer.close()
+
+
+def test_output_writer_pickle():
+    writer = OutputWriter(num_workers=3, max_pending=5)
+    writer.submit(lambda: None)
+    copied = pickle.loads(pickle.dumps(writer))
+    assert copied.num_workers == 3
+    assert copied.max_pending == 5
+    writer.close()
+
+
+def test_patch_merger():
+    rng = np.random.default_rng(0)
+    coordinates = [(0, 0), (0, 2), (2, 0), (2, 2), (3, 0), (3, 2)]
+    patches = {c: rng.random((3, 4, 4), dtype=np.float32) for c in coordinates}
+    merged = {}
+    merger = PatchMerger(patch_names_per_page={'page': [f'page_x{x:04d}_y{y:04d}' for x, y in coordinates]},
+                         on_page_done=lambda name, pred: merged.update({name: pred}))
+
+    expected = np.full((3, 6, 7), np.nan)
+    for (x, y), patch in patches.items():
+        assert 'page' not in merged
+        merger.add_patch(img_name='page', patch_name=f'page_x{x:04d}_y{y:04d}', patch=patch)
+        expected = merge_patches(patch, (x, y), expected)
+
+    assert merged['page'].dtype == np.float32
+    assert np.array_equal(merged['page'], expected.astype(np.float32))
+    assert merger.finish() == []
+
+
+def test_patch_merger_unfinished_page():
+    merged = {}
+    merger = PatchMerger.from_img_paths_per_page(
+        img_paths_per_page=[('d', 'g', 'page_a', 'page_a_x0000_y0000'), ('d', 'g', 'page_a', 'page_a_x0002_y0000'),
+                            ('d', 'g', 'page_b', 'page_b_x0000_y0000')],
+        on_page_done=lambda name, pred: merged.update({name: pred}))
+    merger.add_patch(img_name='page_b', patch_name='page_b_x0000_y0000', patch=np.ones((2, 4, 4)))
+    merger.add_patch(img_name='page_a', patch_name='page_a_x0000_y0000', patch=np.ones((2, 4, 4)))
+    assert list(merged) == ['page_b']
+    assert merged['page_b'].shape == (2, 4, 4)
+    with pytest.raises(ValueError):
+        merger.add_patch(img_name='page_a', patch_name='page_a_x0001_y0000', patch=np.ones((2, 4, 4)))
+    assert merger.finish() == ['page_a']
@@ -0,0 +1,170 @@
+import pytest
+import torch
+from torch import nn
+
+from src.models.backbones.adaptive_unet import Adaptive_Unet
+from src.models.backbones.unet import UNet
+from src.models.receptive_field import ReceptiveField
+from src.tasks.utils.tiled_inference import SlidingWindowInference, get_window_positions, StripInference, \
+    CascadeInference, evaluate_cascade
+
+
+class _CountingModel(nn.Module):
+    # a fully convolutional "model" with two classes: the input and the negated input
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+
+    def forward(self, x):
+        self.batch_sizes.append(x.shape[0])
+        return torch.cat([x[:, :1], -x[:, :1]], dim=1)
+
+
+def test_get_window_positions():
+    assert get_window_positions(10, window=4, stride=2) == [0, 2, 4, 6]
+    assert get_window_positions(11, window=4, stride=3) == [0, 3, 6, 7]
+    assert get_window_positions(4, window=4, stride=2) == [0]
+
+
+@pytest.mark.parametrize('blend', ['max', 'mean', 'gaussian'])
+def test_sliding_window_inference(blend):
+    model = _CountingModel()
+    pages = [torch.rand(3, 37, 53), torch.rand(3, 20, 16), torch.rand(3, 64, 64)]
+    inference = SlidingWindowInference(window_size=(24, 32), stride=(12, 16), batch_size=5, blend=blend)
+    outputs = inference(model, pages)
+    # the model is pixel wise, so the blending of any windows gives the prediction of the whole page
+    for page, output in zip(pages, outputs):
+        assert output.shape == (2, *page.shape[1:])
+        assert torch.allclose(output[0], page[0], atol=1e-6)
+        assert torch.allclose(output[1], -page[0], atol=1e-6)
+    # the windows of all pages are batched together
+    assert set(model.batch_sizes[:-1]) == {5}
+
+
+def test_sliding_window_inference_batch():
+    pages = torch.rand(2, 3, 40, 40)
+    outputs = SlidingWindowInference(window_size=16)(_CountingModel(), pages)
+    assert len(outputs) == 2
+    assert torch.allclose(outputs[1][0], pages[1][0], atol=1e-6)
+
+
+@pytest.mark.parametrize('kwargs', [{'window_size': 0}, {'window_size': 16, 'stride': 17},
+                                    {'window_size': (16, 16, 3)}, {'window_size': 16, 'batch_size': 0},
+                                    {'window_size': 16, 'blend': 'median'}])
+def test_sliding_window_inference_invalid(kwargs):
+    with pytest.raises(ValueError):
+        SlidingWindowInference(**kwargs)
+
+
+def test_strip_inference_get_strips():
+    inference = StripInference(strip_height=30)
+    inference.receptive_field = ReceptiveField(radius=5, alignment=4)
+    # the strip height is rounded up to 32 and the halo to 8
+    assert inference.get_strips(100) == [(0, 40, 0, 32), (24, 72, 32, 64), (56, 100, 64, 96), (88, 100, 96, 100)]
+    assert inference.get_strips(20) == [(0, 20, 0, 20)]
+
+
+@pytest.mark.parametrize('model, height, width', [(UNet(num_layers=3, features_start=8), 203, 45),
+                                                  (Adaptive_Unet(features=[4, 8, 16, 32]), 208, 48)])
+def test_strip_inference(model, height, width):
+    model.eval()
+    pages = torch.rand(2, 3, height, width)
+    with torch.no_grad():
+        expected = model(pages)
+    outputs = StripInference(strip_height=32)(model, pages)
+    assert len(outputs) == 2
+    for output, page_expected in zip(outputs, expected):
+        assert output.shape == page_expected.shape
+        assert torch.allclose(output, page_expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('blend', ['max', 'mean', 'gaussian'])
+def test_sliding_window_inference_skip_background(blend):
+    model = _CountingModel()
+    page = torch.zeros(3, 64, 96)
+    page[:, 40:60, 70:90] = torch.rand(3, 20, 20)
+    inference = SlidingWindowInference(window_size=32, stride=16, batch_size=4, blend=blend, skip_threshold=0.01,
+                                       skip_downsample=4)
+    output = inference(model, [page])[0]
+    assert inference.num_windows == 15
+    # only the windows that contain a part of the content are predicted
+    assert 0 < inference.num_skipped < inference.num_windows
+    assert sum(model.batch_sizes) == inference.num_windows - inference.num_skipped + 1
+    assert torch.allclose(output[0], page[0], atol=1e-6)
+    assert inference.skip_ratio == inference.num_skipped / 15
+
+    inference.reset_statistics()
+    assert inference.skip_ratio == 0
+
+
+def test_sliding_window_inference_background_logits():
+    model = _CountingModel()
+    inference = SlidingWindowInference(window_size=16, skip_threshold=0.01, background_logits=[2., -1.])
+    output = inference(model, [torch.zeros(3, 32, 32)])[0]
+    assert model.batch_sizes == []
+    assert torch.equal(output[:, 5, 5], torch.tensor([2., -1.]))
+
+
+def _two_region_page():
+    # the left part of the page is class 0, the right part class 1, the margin of both classes is large
+    page = torch.full((3, 64, 128), fill_value=2.)
+    page[:, :, 80:] = -2.
+    return page
+
+
+def test_cascade_inference():
+    model = _CountingModel()
+    page = _two_region_page()
+    cascade = CascadeInference(window_size=32, stride=32, batch_size=4, blend='mean', scale_factor=0.5,
+                               margin_threshold=0.5, boundary_width=2)
+    output = cascade(model, [page])[0]
+    assert output.shape == (2, 64, 128)
+    assert torch.equal(output.argmax(dim=0), (page[0] < 0).long())
+    # only the windows that contain the boundary at x=80 are predicted at full resolution
+    assert cascade.num_windows == 8
+    assert cascade.num_refined == 2
+    assert cascade.refine_ratio == 0.25
+    assert torch.allclose(output[:, :, 64:96], torch.stack([page[0], -page[0]])[:, :, 64:96])
+
+    cascade.reset_statistics()
+    assert cascade.refine_ratio == 0
+
+
+def test_cascade_inference_refine_mask():
+    cascade = CascadeInference(window_size=16, margin_threshold=0.3, boundary_width=1)
+    logits = torch.zeros(2, 8, 8)
+    logits[0, :, :4] = 5.
+    logits[1, :, 4:] = 5.
+    logits[:, 6:] = 0.
+    logits[1, 6:] = 0.1
+    mask = cascade.get_refine_mask(logits)
+    # boundary of the labels at x=4 and uncertain pixels in the last rows
+    assert mask[0, 3] and mask[0, 4] and not mask[0, 2] and not mask[0, 5]
+    assert mask[7, 7] and not mask[2, 7]
+
+
+def test_cascade_inference_all_windows():
+    # with a threshold of 1, every pixel is uncertain and the cascade gives the full resolution prediction
+    pages = [torch.rand(3, 40, 50), torch.rand(3, 20, 24)]
+    cascade = CascadeInference(window_size=16, margin_threshold=1.)
+    outputs = cascade(_CountingModel(), pages)
+    expected = SlidingWindowInference(window_size=16)(_CountingModel(), pages)
+    for output, page_expected in zip(outputs, expected):
+        assert torch.allclose(output, page_expected, atol=1e-6)
+    assert cascade.refine_ratio == 1
+
+
+def test_evaluate_cascade():
+    cascade = CascadeInference(window_size=32, stride=32, blend='mean', boundary_width=2)
+    results = evaluate_cascade(_CountingModel(), [_two_region_page()], cascade)
+    assert results['pixel_agreement'] == 1
+    assert results['refine_ratio'] == 0.25
+    assert results['time_full'] > 0 and results['time_cascade'] > 0
+    assert results['speedup'] == pytest.approx(results['time_full'] / results['time_cascade'])
+
+
+@pytest.mark.parametrize('kwargs', [{'scale_factor': 0}, {'scale_factor': 2}, {'margin_threshold': 1.5},
+                                    {'boundary_width': -1}])
+def test_cascade_inference_invalid(kwargs):
+    with pytest.raises(ValueError):
+        CascadeInference(window_size=16, **kwargs)
@@ -0,0 +1,38 @@
+import argparse
+from pathlib import Path
+from typing import List
+
+from src.datamodules.utils.crop_container import write_crop_container
+
+
+def main(input_path: Path, splits: List[str], data_folder_name: str, gt_folder_name: str):
+    for split in splits:
+        if not (input_path / split).is_dir():
+            print(f'Skipping the missing split {input_path / split}')
+            continue
+        container_path = write_crop_container(input_path / split, data_folder_name=data_folder_name,
+                                              gt_folder_name=gt_folder_name)
+        print(f'Wrote {container_path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input_path',
+                        help='Path to the root folder of the cropped dataset (contains train/val/test)',
+                        type=Path,
+                        required=True)
+    parser.add_argument('-s', '--splits',
+                        help='Names of the splits to convert',
+                        type=str,
+                        nargs='+',
+                        default=['train', 'val', 'test'])
+    parser.add_argument('-d', '--data_folder_name',
+                        help='Name of the folder with the crops of the images',
+                        type=str,
+                        default='data')
+    parser.add_argument('-g', '--gt_folder_name',
+                        help='Name of the folder with the crops of the gt',
+                        type=str,
+                        default='gt')
+    args = parser.parse_args()
+    main(**args.__dict__)
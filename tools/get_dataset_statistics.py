@@ -1,26 +1,43 @@
+import argparse
 import json
 from pathlib import Path
 
-from PIL import Image
-import numpy as np
+from src.datamodules.utils.image_analytics import compute_statistics
 
-if __name__ == '__main__':
-    root_path = Path("/net/research-hisdoc/datasets/semantic_segmentation/datasets/CB55-splits/AB1_3class")
-    test_gt_path = root_path / "test" / "gt"
 
-    class_occurrences = []
+def main(root_path: Path, split: str, gt_folder_name: str, workers: int):
+    gt_path = root_path / split / gt_folder_name
 
-    for img in test_gt_path.iterdir():
-        img = Image.open(img)
-        img_array = np.asarray(img)
-        if len(class_occurrences) == 0:
-            class_occurrences = np.bincount(img_array.flatten())
-        else:
-            class_occurrences += np.bincount(img_array.flatten())
+    # the gt images are read as palette images, the palette index is the class
+    statistics = compute_statistics(gt_paths=sorted(gt_path.iterdir()), gt_format='index', workers=workers)
+    class_occurrences = [statistics.class_counts.get(i, 0) for i in range(max(statistics.classes) + 1)]
+    amount_of_pxls = sum(class_occurrences)
 
-    stats = {"pxl_per_class": class_occurrences.tolist(),
-             "relative_per_class": (class_occurrences / class_occurrences.sum()).tolist(),
-             "amount_of_pxls": class_occurrences.sum().tolist()}
+    stats = {"pxl_per_class": class_occurrences,
+             "relative_per_class": [c / amount_of_pxls for c in class_occurrences],
+             "amount_of_pxls": amount_of_pxls}
 
     with (root_path / 'stats.json').open('w') as f:
         json.dump(stats, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--root_path',
+                        help='Path to the root folder of the dataset',
+                        type=Path,
+                        default=Path("/net/research-hisdoc/datasets/semantic_segmentation/datasets/CB55-splits/AB1_3class"))
+    parser.add_argument('-s', '--split',
+                        help='Name of the split to analyse',
+                        type=str,
+                        default='test')
+    parser.add_argument('-g', '--gt_folder_name',
+                        help='Name of the folder with the gt images',
+                        type=str,
+                        default='gt')
+    parser.add_argument('-w', '--workers',
+                        help='Number of processes to read the images',
+                        type=int,
+                        default=8)
+    args = parser.parse_args()
+    main(**args.__dict__)
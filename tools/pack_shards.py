@@ -0,0 +1,104 @@
+import argparse
+import random
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional
+
+from omegaconf import OmegaConf
+from torchvision.datasets import ImageFolder
+
+from src.datamodules.IndexedFormats.datasets.full_page_dataset import DatasetIndexed
+from src.datamodules.RGB.datasets.cropped_dataset import CroppedDatasetRGB
+from src.datamodules.RGB.datasets.full_page_dataset import DatasetRGB
+from src.datamodules.RolfFormat.datasets.dataset import DatasetRolfFormat, DatasetSpecs
+from src.datamodules.utils.shards import write_shards, SHARD_LAYOUTS
+
+
+def get_samples(input_path: Path, layout: str, split: str, data_folder_name: str, gt_folder_name: str,
+                specs: Optional[Path]) -> Tuple[List[Dict[str, Any]], Optional[List[str]]]:
+    """
+    Lists the samples of a split with the listing of the dataset of the layout.
+
+    :param input_path: root folder of the dataset (the data root for the rolf layout)
+    :param layout: layout of the dataset
+    :param split: name of the split
+    :param data_folder_name: name of the data folder
+    :param gt_folder_name: name of the gt folder
+    :param specs: yaml file with the specs of the split for the rolf layout (like ``train_specs`` of the datamodule)
+    :return: the samples for :func:`write_shards` and the classes of a classification split
+    """
+    if layout == 'cropped':
+        paths = CroppedDatasetRGB.get_gt_data_paths(input_path / split, data_folder_name=data_folder_name,
+                                                    gt_folder_name=gt_folder_name)
+        return [{'data': data, 'gt': gt, 'meta': {'page': page, 'name': name}}
+                for data, gt, page, name in paths], None
+    if layout == 'full_page':
+        paths = DatasetRGB.get_img_gt_path_list(input_path / split, data_folder_name=data_folder_name,
+                                                gt_folder_name=gt_folder_name)
+        return [{'data': data, 'gt': gt, 'meta': {'page': page}} for data, gt, page in paths], None
+    if layout == 'indexed':
+        paths = DatasetIndexed.get_img_gt_path_list(input_path / split, data_folder_name=data_folder_name,
+                                                    gt_folder_name=gt_folder_name)
+        return [{'data': data, 'gt': gt, 'meta': {'page': data.stem}} for data, gt in paths], None
+    if layout == 'rolf':
+        if specs is None:
+            raise ValueError('The rolf layout needs the specs of the split (--specs)')
+        list_specs = [DatasetSpecs(data_root=str(input_path), **v) for v in OmegaConf.load(specs).values()]
+        paths = DatasetRolfFormat.get_img_gt_path_list(list_specs=list_specs)
+        return [{'data': data, 'gt': gt, 'meta': {'page': data.stem}} for data, gt in paths], None
+    if layout == 'classification':
+        dataset = ImageFolder(root=str(input_path / split))
+        return [{'data': path, 'meta': {'target': target}} for path, target in dataset.samples], dataset.classes
+    raise ValueError(f'Unknown layout "{layout}" (expected one of {SHARD_LAYOUTS})')
+
+
+def main(input_path: Path, output_path: Path, layout: str, split: str, data_folder_name: str, gt_folder_name: str,
+         specs: Optional[Path], samples_per_shard: int, seed: int):
+    samples, classes = get_samples(input_path=input_path, layout=layout, split=split,
+                                   data_folder_name=data_folder_name, gt_folder_name=gt_folder_name, specs=specs)
+    # mix the pages and classes over the shards, the dataset just shuffles the shards and a buffer of samples
+    random.Random(seed).shuffle(samples)
+    index_path = write_shards(samples, output_path=output_path, name=split, layout=layout,
+                              samples_per_shard=samples_per_shard, classes=classes)
+    print(f'Wrote {len(samples)} samples, use the index {index_path} as train_shards of the datamodule')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input_path',
+                        help='Path to the root folder of the dataset (contains train/val/test)',
+                        type=Path,
+                        required=True)
+    parser.add_argument('-o', '--output_path',
+                        help='Path to the output folder',
+                        type=Path,
+                        required=True)
+    parser.add_argument('-l', '--layout',
+                        help='Layout of the dataset',
+                        choices=SHARD_LAYOUTS,
+                        required=True)
+    parser.add_argument('-s', '--split',
+                        help='Name of the split to pack',
+                        type=str,
+                        default='train')
+    parser.add_argument('-d', '--data_folder_name',
+                        help='Name of the folder with the images',
+                        type=str,
+                        default='data')
+    parser.add_argument('-g', '--gt_folder_name',
+                        help='Name of the folder with the gt images',
+                        type=str,
+                        default='gt')
+    parser.add_argument('--specs',
+                        help='Yaml file with the specs of the split (rolf layout)',
+                        type=Path,
+                        default=None)
+    parser.add_argument('-n', '--samples_per_shard',
+                        help='Number of samples in a shard',
+                        type=int,
+                        default=1000)
+    parser.add_argument('--seed',
+                        help='Seed of the order of the samples',
+                        type=int,
+                        default=0)
+    args = parser.parse_args()
+    main(**args.__dict__)
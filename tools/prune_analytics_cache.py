@@ -0,0 +1,26 @@
+import argparse
+from pathlib import Path
+
+from src.datamodules.utils.image_analytics import AnalyticsCache
+
+
+def main(cache_dir: Path, min_age_days: float):
+    cache = AnalyticsCache(cache_dir=cache_dir)
+    num_removed = cache.prune(min_age_days=min_age_days)
+    print(f'Removed {num_removed} sidecar files from {cache.cache_dir}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Removes the analytics cache entries of image directories that no '
+                                                 'longer exist on this machine.')
+    parser.add_argument('-c', '--cache_dir',
+                        help='Path to the analytics cache, default is $DIVA_DAF_ANALYTICS_CACHE or '
+                             '~/.cache/diva_daf/analytics',
+                        type=Path,
+                        default=None)
+    parser.add_argument('-a', '--min_age_days',
+                        help='Only entries that have not been used for this number of days are removed',
+                        type=float,
+                        default=30.)
+    args = parser.parse_args()
+    main(**args.__dict__)